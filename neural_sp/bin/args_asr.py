@@ -92,13 +92,42 @@ def build_parser():
                         help='corpus name')
     parser.add_argument('--n_gpus', type=int, default=1,
                         help='number of GPUs (0 indicates CPU)')
+    parser.add_argument('--distributed', type=strtobool, default=False,
+                        help='use DistributedDataParallel with one process per GPU')
+    parser.add_argument('--n_procs', type=int, default=0,
+                        help='number of processes in distributed training on a single node '
+                             '(0 indicates n_gpus). This is ignored when launched by torchrun.')
+    parser.add_argument('--dist_backend', type=str, default=None, choices=['nccl', 'gloo'],
+                        help='backend for distributed training (nccl on GPU and gloo on CPU by default)')
     parser.add_argument('--cudnn_benchmark', type=strtobool, default=True,
                         help='use CuDNN benchmark mode')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='random seed for parameter initialization and shuffling mini-batches')
     parser.add_argument("--train_dtype", default="float32",
-                        choices=["float16", "float32", "float64", "O0", "O1", "O2", "O3"],
-                        help="Data type for training")
+                        choices=["float32", "fp32", "float16", "fp16", "bfloat16", "bf16",
+                                 "float64", "O0", "O1", "O2", "O3"],
+                        help="Data type for training (autocast). O0-O3 are deprecated aliases, "
+                             "and float64 is trained in float32.")
+    parser.add_argument('--profile', type=str, default='none',
+                        choices=['none', 'sampling', 'torch', 'cprofile'],
+                        help='profiler for training (sampling: low-overhead stack sampling, '
+                             'torch: torch.profiler trace over a window of steps, '
+                             'cprofile: deterministic profiling of Python function calls)')
+    parser.add_argument('--profile_timing', type=strtobool, default=False,
+                        help='log time breakdown of data loading, forward, backward, optimizer step '
+                             'and evaluation every print_step steps')
+    parser.add_argument('--profile_start_step', type=int, default=10,
+                        help='first step to record with --profile torch')
+    parser.add_argument('--profile_n_steps', type=int, default=5,
+                        help='number of steps to record with --profile torch')
+    parser.add_argument('--profile_sampling_interval', type=float, default=0.005,
+                        help='sampling interval [sec] with --profile sampling')
     parser.add_argument('--model_save_dir', type=str, default=False,
                         help='directory to save a model')
+    parser.add_argument('--async_checkpoint', type=strtobool, default=True,
+                        help='save checkpoints on a background thread')
+    parser.add_argument('--sharded_checkpoint', type=strtobool, default=False,
+                        help='save each parameter in a checkpoint as a separate file')
     parser.add_argument('--resume', type=str, default=False, nargs='?',
                         help='model path to resume training')
     parser.add_argument('--job_name', type=str, default=False,
@@ -200,6 +229,10 @@ def build_parser():
                         help='number of decoder RNN layers')
     parser.add_argument('--tie_embedding', type=strtobool, default=False, nargs='?',
                         help='tie weights between an embedding matrix and a linear layer before the softmax layer')
+    parser.add_argument('--adaptive_softmax', type=strtobool, default=False, nargs='?',
+                        help='use adaptive softmax for the output layer of the attention-based decoder')
+    parser.add_argument('--adaptive_softmax_cutoffs', type=str, default='', nargs='?',
+                        help='boundaries of frequency clusters for adaptive softmax delimited by "_" (vocab/25 and vocab/5 if empty)')
     parser.add_argument('--ctc_fc_list', type=str, default="", nargs='?',
                         help='')
     parser.add_argument('--ctc_fc_list_sub1', type=str, default="", nargs='?',
@@ -280,6 +313,9 @@ def build_parser():
                         help='probability of label smoothing')
     parser.add_argument('--ctc_lsm_prob', type=float, default=0.0,
                         help='probability of label smoothing for CTC')
+    parser.add_argument('--loss_vocab_chunk_size', type=int, default=0,
+                        help='chunk size over the vocabulary to compute CTC label smoothing and distillation losses '
+                             'without materializing [B, L, vocab] intermediates (0 disables chunking)')
     # SpecAugment
     parser.add_argument('--freq_width', type=int, default=27,
                         help='width of frequency mask for SpecAugment')
@@ -297,6 +333,8 @@ def build_parser():
                         help='adaptive size ratio for time masking')
     parser.add_argument('--max_n_time_masks', type=int, default=20,
                         help='maximum number of time masking')
+    parser.add_argument('--time_warp_width', type=int, default=0,
+                        help='width of time warping for SpecAugment (disabled when 0)')
     # MTL
     parser.add_argument('--ctc_weight', type=float, default=0.0,
                         help='CTC loss weight for the main task')
@@ -347,6 +385,11 @@ def build_parser():
                         help='Teacher LM for knowledge distillation')
     parser.add_argument('--distillation_weight', type=float, default=0.1,
                         help='soft label weight for knowledge distillation')
+    parser.add_argument('--teacher_logit_dir', type=str, default=False, nargs='?',
+                        help='directory of top-k logits of the teacher cached by bin/asr/cache_teacher_logits.py. '
+                             'The teacher is not loaded during training if this is set.')
+    parser.add_argument('--teacher_logit_topk', type=int, default=32,
+                        help='number of classes of the teacher cached per output position')
     # special label
     parser.add_argument('--replace_sos', type=strtobool, default=False,
                         help='')
@@ -403,7 +446,13 @@ def build_parser():
     parser.add_argument('--recog_ctc_weight', type=float, default=0.0,
                         help='weight of CTC score')
     parser.add_argument('--recog_lm', type=str, default=False, nargs='?',
-                        help='path to first path LM for shallow fusion')
+                        help='path to first path LM for shallow fusion. \
+                                  An n-gram LM is loaded from ARPA files (*.arpa or *.arpa.gz).')
+    parser.add_argument('--recog_lm_shortlist_size', type=int, default=0,
+                        help='number of the most frequent tokens in the training set of the RNNLM given by --recog_lm '
+                             'over which the log-normalizer is approximated in LM fusion (0 for the whole vocabulary)')
+    parser.add_argument('--recog_ngram_n_bits', type=int, default=8,
+                        help='number of bits to quantize probabilities of the n-gram LM (0 for float32)')
     parser.add_argument('--recog_lm_second', type=str, default=False, nargs='?',
                         help='path to second path LM for rescoring')
     parser.add_argument('--recog_lm_bwd', type=str, default=False, nargs='?',
@@ -423,7 +472,9 @@ def build_parser():
     parser.add_argument('--recog_softmax_smoothing', type=float, default=1.0,
                         help='softmax smoothing (beta) for diverse hypothesis generation')
     parser.add_argument('--recog_wordlm', type=strtobool, default=False,
-                        help='')
+                        help='fuse the word-level LM given by --recog_lm into char/wp decoding with look-ahead scores')
+    parser.add_argument('--recog_wordlm_oov_penalty', type=float, default=-10.0,
+                        help='log-scale penalty added to <unk> of the word-level LM for OOV words')
     parser.add_argument('--recog_n_average', type=int, default=1,
                         help='number of models for the model averaging of Transformer')
     parser.add_argument('--recog_streaming', type=strtobool, default=False,
@@ -443,5 +494,7 @@ def build_parser():
     parser.add_argument('--recog_mma_delay_threshold', type=int, default=-1,
                         help='delay threshold for MMA decoder')
     parser.add_argument('--recog_mem_len', type=int, default=0,
-                        help='number of tokens for memory in TransformerXL decoder during evaluation')
+                        help='number of tokens for memory in TransformerXL decoder during evaluation. '
+                             'This also bounds past tokens whose TransformerLM/TransformerXL LM states '
+                             'are carried over with --recog_lm_state_carry_over')
     return parser
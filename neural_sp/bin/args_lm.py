@@ -69,13 +69,42 @@ def build_parser():
                         help='corpus name')
     parser.add_argument('--n_gpus', type=int, default=1,
                         help='number of GPUs (0 indicates CPU)')
+    parser.add_argument('--distributed', type=strtobool, default=False,
+                        help='use DistributedDataParallel with one process per GPU')
+    parser.add_argument('--n_procs', type=int, default=0,
+                        help='number of processes in distributed training on a single node '
+                             '(0 indicates n_gpus). This is ignored when launched by torchrun.')
+    parser.add_argument('--dist_backend', type=str, default=None, choices=['nccl', 'gloo'],
+                        help='backend for distributed training (nccl on GPU and gloo on CPU by default)')
     parser.add_argument('--cudnn_benchmark', type=strtobool, default=True,
                         help='use CuDNN benchmark mode')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='random seed for parameter initialization and shuffling mini-batches')
     parser.add_argument("--train_dtype", default="float32",
-                        choices=["float16", "float32", "float64", "O0", "O1", "O2", "O3"],
-                        help="Data type for training")
+                        choices=["float32", "fp32", "float16", "fp16", "bfloat16", "bf16",
+                                 "float64", "O0", "O1", "O2", "O3"],
+                        help="Data type for training (autocast). O0-O3 are deprecated aliases, "
+                             "and float64 is trained in float32.")
+    parser.add_argument('--profile', type=str, default='none',
+                        choices=['none', 'sampling', 'torch', 'cprofile'],
+                        help='profiler for training (sampling: low-overhead stack sampling, '
+                             'torch: torch.profiler trace over a window of steps, '
+                             'cprofile: deterministic profiling of Python function calls)')
+    parser.add_argument('--profile_timing', type=strtobool, default=False,
+                        help='log time breakdown of data loading, forward, backward, optimizer step '
+                             'and evaluation every print_step steps')
+    parser.add_argument('--profile_start_step', type=int, default=10,
+                        help='first step to record with --profile torch')
+    parser.add_argument('--profile_n_steps', type=int, default=5,
+                        help='number of steps to record with --profile torch')
+    parser.add_argument('--profile_sampling_interval', type=float, default=0.005,
+                        help='sampling interval [sec] with --profile sampling')
     parser.add_argument('--model_save_dir', type=str, default=False,
                         help='directory to save a model')
+    parser.add_argument('--async_checkpoint', type=strtobool, default=True,
+                        help='save checkpoints on a background thread')
+    parser.add_argument('--sharded_checkpoint', type=strtobool, default=False,
+                        help='save each parameter in a checkpoint as a separate file')
     parser.add_argument('--resume', type=str, default=False, nargs='?',
                         help='model path to resume training')
     parser.add_argument('--job_name', type=str, default=False,
@@ -87,6 +116,13 @@ def build_parser():
     # dataset
     parser.add_argument('--train_set', type=str,
                         help='tsv file path for the training set')
+    parser.add_argument('--train_shards', type=str, default=False, nargs='?',
+                        help='directory of token shards of the training set (see utils/make_lm_shards.py). \
+                        The training set is streamed from the shards instead of the tsv file if given.')
+    parser.add_argument('--shard_block_size', type=int, default=10000,
+                        help='number of tokens in a block shuffled in each shard')
+    parser.add_argument('--n_workers', type=int, default=0,
+                        help='number of worker processes to read mini-batches from shards')
     parser.add_argument('--dev_set', type=str,
                         help='tsv file path for the development set')
     parser.add_argument('--eval_sets', type=str, default=[], nargs='+',
@@ -125,6 +161,9 @@ def build_parser():
                         help='mini-batch size')
     parser.add_argument('--bptt', type=int, default=200,
                         help='BPTT length')
+    parser.add_argument('--eval_batch_size', type=int, default=32,
+                        help='number of segments (or windows for Transformer LM without memory) '
+                             'scored in parallel in evaluation. Contexts are reset at segment boundaries.')
     parser.add_argument('--optimizer', type=str, default='adam',
                         choices=['adam', 'adadelta', 'adagrad', 'sgd', 'momentum', 'nesterov', 'noam'],
                         help='type of optimizer')
@@ -134,6 +173,9 @@ def build_parser():
                         help='epoch to converto to SGD fine-tuning')
     parser.add_argument('--print_step', type=int, default=100,
                         help='print log per this value')
+    parser.add_argument('--checkpoint_step', type=int, default=0,
+                        help='save the latest checkpoint (model.latest) per this value to resume training \
+                        from the middle of an epoch (only with --train_shards). Disabled if 0.')
     parser.add_argument('--lr', type=float, default=1e-3,
                         help='initial learning rate')
     parser.add_argument('--lr_factor', type=float, default=10.0,
@@ -203,6 +245,10 @@ def build_parser():
                         help='size of mini-batch in evaluation')
     parser.add_argument('--recog_n_average', type=int, default=5,
                         help='number of models for the model averaging of Transformer')
+    parser.add_argument('--recog_stride', type=int, default=0,
+                        help='stride of the sliding window for Transformer LM without memory '
+                             '(BPTT length - 1 if 0). Tokens in each window after the first '
+                             'BPTT length - stride tokens are scored.')
     parser.add_argument('--recog_n_caches', type=int, default=0,
                         help='number of tokens for cache')
     parser.add_argument('--recog_cache_theta', type=float, default=0.2,
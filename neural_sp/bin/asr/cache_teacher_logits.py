@@ -0,0 +1,126 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Cache top-k logits of the teacher over the training set for knowledge distillation.
+
+The same arguments as bin/asr/train.py are used. The teacher given by --teacher
+(ASR) or --teacher_lm (LM) is run once over --train_set, and the top-k
+log-probabilities of each output position are saved to --teacher_logit_dir.
+Pass --teacher_logit_dir to bin/asr/train.py to train without the teacher.
+"""
+
+import argparse
+import copy
+import logging
+import numpy as np
+import os
+import sys
+import torch
+from tqdm import tqdm
+
+from neural_sp.bin.args_asr import parse_args_train
+from neural_sp.bin.train_utils import (
+    compute_susampling_factor,
+    load_checkpoint,
+    load_config,
+    set_logger
+)
+from neural_sp.datasets.asr import build_dataloader
+from neural_sp.datasets.teacher_logits import TopKLogitWriter
+from neural_sp.models.lm.build import build_lm
+from neural_sp.models.seq2seq.speech2text import Speech2Text
+from neural_sp.models.torch_utils import np2tensor
+from neural_sp.models.torch_utils import pad_list
+
+logger = logging.getLogger(__name__)
+
+
+def generate_lm_logits(lm, ys):
+    """Logits of the teacher LM for reference labels (see Speech2Text.generate_lm_logits).
+
+    Args:
+        lm (RNNLM):
+        ys (list): length `B`, each of which contains a list of size `[L]`
+    Returns:
+        logits (FloatTensor): `[B, L + 1, vocab]`
+
+    """
+    device = next(lm.parameters()).device
+    eos = torch.full((1,), lm.eos, dtype=torch.int64, device=device)
+    ys = [np2tensor(np.fromiter(y, dtype=np.int64), device) for y in ys]
+    ys_in = pad_list([torch.cat([eos, y], dim=0) for y in ys], lm.pad)
+    logits, _, _ = lm.decode(ys_in, None)
+    return logits
+
+
+def main():
+
+    args = parse_args_train(sys.argv[1:])
+    args_teacher = copy.deepcopy(args)
+    args = compute_susampling_factor(args)
+    assert args.teacher_logit_dir, 'Set --teacher_logit_dir.'
+    assert args.teacher or args.teacher_lm, 'Set --teacher or --teacher_lm.'
+
+    os.makedirs(args.teacher_logit_dir, exist_ok=True)
+    set_logger(os.path.join(args.teacher_logit_dir, 'cache.log'), stdout=args.stdout)
+
+    # Load dataloader
+    dataloader = build_dataloader(args=args,
+                                  tsv_path=args.train_set,
+                                  tsv_path_sub1=args.train_set_sub1,
+                                  batch_size=args.batch_size,
+                                  sort_by='input')
+
+    # Load the teacher
+    teacher, teacher_lm = None, None
+    if args.teacher:
+        conf_teacher = load_config(os.path.join(os.path.dirname(args.teacher), 'conf.yml'))
+        for k, v in conf_teacher.items():
+            setattr(args_teacher, k, v)
+        args_teacher.ss_prob = 0
+        teacher = Speech2Text(args_teacher)
+        load_checkpoint(args.teacher, teacher)
+        teacher.eval()
+    else:
+        conf_lm = load_config(os.path.join(os.path.dirname(args.teacher_lm), 'conf.yml'))
+        args_lm = argparse.Namespace()
+        for k, v in conf_lm.items():
+            setattr(args_lm, k, v)
+        teacher_lm = build_lm(args_lm)
+        load_checkpoint(args.teacher_lm, teacher_lm)
+        teacher_lm.eval()
+
+    # GPU setting
+    if args.n_gpus >= 1:
+        if teacher is not None:
+            teacher.cudnn_setting(deterministic=True, benchmark=False)
+            teacher.cuda()
+        else:
+            teacher_lm.cuda()
+
+    writer = TopKLogitWriter(args.teacher_logit_dir, topk=args.teacher_logit_topk,
+                             vocab=dataloader.vocab, teacher='asr' if teacher is not None else 'lm')
+    pbar = tqdm(total=len(dataloader))
+    with torch.no_grad():
+        while True:
+            batch, is_new_epoch = dataloader.next()
+            if teacher is not None:
+                logits = teacher.generate_logits(batch)
+            else:
+                logits = generate_lm_logits(teacher_lm, batch['ys'])
+            # NOTE: output positions include <eos>
+            writer.add(batch['utt_ids'], logits, [len(y) + 1 for y in batch['ys']])
+            pbar.update(len(batch['ys']))
+
+            if is_new_epoch:
+                break
+
+    pbar.close()
+    writer.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -12,6 +12,7 @@ import logging
 import os
 import sys
 import time
+import torch
 
 from neural_sp.bin.args_asr import parse_args_eval
 from neural_sp.bin.eval_utils import average_checkpoints
@@ -19,6 +20,7 @@ from neural_sp.bin.train_utils import load_checkpoint
 from neural_sp.bin.train_utils import load_config
 from neural_sp.bin.train_utils import set_logger
 from neural_sp.datasets.asr import build_dataloader
+from neural_sp.datasets.utils import count_frequent_tokens
 from neural_sp.evaluators.accuracy import eval_accuracy
 from neural_sp.evaluators.character import eval_char
 from neural_sp.evaluators.phone import eval_phone
@@ -27,6 +29,10 @@ from neural_sp.evaluators.word import eval_word
 from neural_sp.evaluators.wordpiece import eval_wordpiece
 from neural_sp.evaluators.wordpiece_bleu import eval_wordpiece_bleu
 from neural_sp.models.lm.build import build_lm
+from neural_sp.models.lm.lookahead_wordlm import LookAheadWordLM
+from neural_sp.models.lm.ngram import is_arpa
+from neural_sp.models.lm.rnnlm import RNNLM
+from neural_sp.models.lm.transformerlm import TransformerLM
 from neural_sp.models.seq2seq.speech2text import Speech2Text
 
 logger = logging.getLogger(__name__)
@@ -85,15 +91,29 @@ def main():
             if not args.lm_fusion:
                 # first path
                 if args.recog_lm is not None and args.recog_lm_weight > 0:
-                    conf_lm = load_config(os.path.join(os.path.dirname(args.recog_lm), 'conf.yml'))
-                    args_lm = argparse.Namespace()
-                    for k, v in conf_lm.items():
-                        setattr(args_lm, k, v)
-                    args_lm.recog_mem_len = args.recog_mem_len
-                    lm = build_lm(args_lm, wordlm=args.recog_wordlm,
-                                  lm_dict_path=os.path.join(os.path.dirname(args.recog_lm), 'dict.txt'),
-                                  asr_dict_path=os.path.join(dir_name, 'dict.txt'))
-                    load_checkpoint(args.recog_lm, lm)
+                    if is_arpa(args.recog_lm):
+                        args_lm = argparse.Namespace(lm_type='ngram', arpa=args.recog_lm,
+                                                     n_bits=args.recog_ngram_n_bits, backward=False)
+                        lm = build_lm(args_lm, asr_dict_path=os.path.join(dir_name, 'dict.txt'))
+                    else:
+                        conf_lm = load_config(os.path.join(os.path.dirname(args.recog_lm), 'conf.yml'))
+                        args_lm = argparse.Namespace()
+                        for k, v in conf_lm.items():
+                            setattr(args_lm, k, v)
+                        args_lm.recog_mem_len = args.recog_mem_len
+                        lm = build_lm(args_lm)
+                        load_checkpoint(args.recog_lm, lm)
+                        if args.recog_wordlm:
+                            lm = LookAheadWordLM(lm,
+                                                 lm_dict_path=os.path.join(os.path.dirname(args.recog_lm), 'dict.txt'),
+                                                 asr_dict_path=os.path.join(dir_name, 'dict.txt'),
+                                                 unit=args.unit,
+                                                 oov_penalty=args.recog_wordlm_oov_penalty)
+                        elif args.recog_lm_state_carry_over and isinstance(lm, TransformerLM) and lm.mem_len == 0:
+                            logger.warning('TransformerLM states are not carried over without --recog_mem_len.')
+                        if args.recog_lm_shortlist_size > 0 and isinstance(lm, RNNLM):
+                            lm.set_shortlist(torch.from_numpy(count_frequent_tokens(
+                                args_lm.train_set, args.recog_lm_shortlist_size, lm.vocab)))
                     if args_lm.backward:
                         model.lm_bwd = lm
                     else:
@@ -143,6 +163,7 @@ def main():
             logger.info('LM weight (first-pass): %.3f' % args.recog_lm_weight)
             logger.info('LM weight (second-pass): %.3f' % args.recog_lm_second_weight)
             logger.info('LM weight (backward): %.3f' % args.recog_lm_bwd_weight)
+            logger.info('LM shortlist size: %d' % args.recog_lm_shortlist_size)
             logger.info('GNMT: %s' % args.recog_gnmt_decoding)
             logger.info('forward-backward attention: %s' % args.recog_fwd_bwd_attention)
             logger.info('resolving UNK: %s' % args.recog_resolving_unk)
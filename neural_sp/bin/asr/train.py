@@ -8,7 +8,6 @@
 
 import argparse
 import copy
-import cProfile
 import logging
 import os
 from setproctitle import setproctitle
@@ -29,12 +28,28 @@ from neural_sp.bin.train_utils import (
     set_save_path
 )
 from neural_sp.datasets.asr import build_dataloader
+from neural_sp.datasets.teacher_logits import TopKLogitStore
 from neural_sp.models.data_parallel import CustomDataParallel
+from neural_sp.models.data_parallel import CustomDistributedDataParallel
 from neural_sp.models.data_parallel import CPUWrapperASR
 from neural_sp.models.lm.build import build_lm
 from neural_sp.models.seq2seq.speech2text import Speech2Text
+from neural_sp.trainers.checkpoint import CheckpointManager
+from neural_sp.trainers.distributed import (
+    broadcast_object,
+    cleanup,
+    init_process_group,
+    is_main_process,
+    launch,
+    maybe_no_sync,
+    ObservationBuffer
+)
 from neural_sp.trainers.lr_scheduler import LRScheduler
 from neural_sp.trainers.optimizer import set_optimizer
+from neural_sp.trainers.precision import MixedPrecision
+from neural_sp.trainers.profiler import Profiler
+from neural_sp.trainers.profiler import scope
+from neural_sp.trainers.profiler import timed_iter
 from neural_sp.trainers.reporter import Reporter
 from neural_sp.utils import mkdir_join
 
@@ -56,12 +71,19 @@ def main():
         for k, v in conf.items():
             if k != 'resume':
                 setattr(args, k, v)
+    torch.manual_seed(args.seed)
+    torch.cuda.manual_seed_all(args.seed)
     recog_params = vars(args)
 
     args = compute_susampling_factor(args)
 
     # for multi-GPUs
-    if args.n_gpus >= 1:
+    rank, world_size, local_rank = 0, 1, 0
+    if args.distributed:
+        rank, world_size, local_rank = init_process_group(args.n_gpus, args.dist_backend)
+        batch_size = args.batch_size * world_size
+        accum_grad_n_steps = max(1, args.accum_grad_n_steps // world_size)
+    elif args.n_gpus >= 1:
         batch_size = args.batch_size * args.n_gpus
         accum_grad_n_steps = max(1, args.accum_grad_n_steps // args.n_gpus)
     else:
@@ -80,7 +102,9 @@ def main():
                                  sort_stop_epoch=args.sort_stop_epoch,
                                  num_workers=args.n_gpus,
                                  pin_memory=True,
-                                 alignment_dir=args.train_alignment)
+                                 alignment_dir=args.train_alignment,
+                                 rank=rank,
+                                 world_size=world_size)
     dev_set = build_dataloader(args=args,
                                tsv_path=args.dev_set,
                                tsv_path_sub1=args.dev_set_sub1,
@@ -105,16 +129,20 @@ def main():
         dir_name = os.path.basename(save_path)
     else:
         dir_name = set_asr_model_name(args)
-        if args.mbr_training:
-            assert args.asr_init
-            save_path = mkdir_join(os.path.dirname(args.asr_init), dir_name)
-        else:
-            save_path = mkdir_join(args.model_save_dir, '_'.join(
-                os.path.basename(args.train_set).split('.')[:-1]), dir_name)
-        save_path = set_save_path(save_path)  # avoid overwriting
+        save_path = None
+        if is_main_process():
+            if args.mbr_training:
+                assert args.asr_init
+                save_path = mkdir_join(os.path.dirname(args.asr_init), dir_name)
+            else:
+                save_path = mkdir_join(args.model_save_dir, '_'.join(
+                    os.path.basename(args.train_set).split('.')[:-1]), dir_name)
+            save_path = set_save_path(save_path)  # avoid overwriting
+        save_path = broadcast_object(save_path)
 
     # Set logger
-    set_logger(os.path.join(save_path, 'train.log'), stdout=args.stdout)
+    if is_main_process():
+        set_logger(os.path.join(save_path, 'train.log'), stdout=args.stdout)
 
     # Load a LM conf file for LM fusion & LM initialization
     if not args.resume and args.external_lm:
@@ -128,7 +156,8 @@ def main():
     # Model setting
     model = Speech2Text(args, save_path, train_set.idx2token[0])
 
-    if not args.resume:
+    # NOTE: parameters are broadcast from the main process in distributed training
+    if not args.resume and is_main_process():
         # Save the conf file as a yaml file
         save_config(vars(args), os.path.join(save_path, 'conf.yml'))
         if args.external_lm:
@@ -198,7 +227,9 @@ def main():
                                                getattr(args, 'transformer_dec_d_model', 0)),
                             factor=args.lr_factor,
                             noam=args.optimizer == 'noam',
-                            save_checkpoints_topk=10 if is_transformer else 1)
+                            save_checkpoints_topk=10 if is_transformer else 1,
+                            checkpoint_manager=CheckpointManager(async_save=args.async_checkpoint,
+                                                                 sharded=args.sharded_checkpoint))
 
     if args.resume:
         # Restore the last saved model
@@ -209,10 +240,19 @@ def main():
             scheduler.convert_to_sgd(model, args.lr, args.weight_decay,
                                      decay_type='always', decay_rate=0.5)
 
+    # Load top-k logits of the teacher cached in advance
+    teacher_store = None
+    if args.teacher_logit_dir:
+        teacher_store = TopKLogitStore(args.teacher_logit_dir)
+        if teacher_store.teacher == 'asr':
+            args.lsm_prob = 0
+        logger.info('Load top-%d logits of the %s teacher for %d utterances' % (
+            teacher_store.topk, teacher_store.teacher, len(teacher_store)))
+
     # Load the teacher ASR model
     teacher = None
-    if args.teacher:
-        assert os.path.isfile(args.teacher), 'There is no checkpoint.'
+    if args.teacher and teacher_store is None:
+        assert os.path.exists(args.teacher), 'There is no checkpoint.'
         conf_teacher = load_config(os.path.join(os.path.dirname(args.teacher), 'conf.yml'))
         for k, v in conf_teacher.items():
             setattr(args_teacher, k, v)
@@ -224,8 +264,8 @@ def main():
 
     # Load the teacher LM
     teacher_lm = None
-    if args.teacher_lm:
-        assert os.path.isfile(args.teacher_lm), 'There is no checkpoint.'
+    if args.teacher_lm and teacher_store is None:
+        assert os.path.exists(args.teacher_lm), 'There is no checkpoint.'
         conf_lm = load_config(os.path.join(os.path.dirname(args.teacher_lm), 'conf.yml'))
         args_lm = argparse.Namespace()
         for k, v in conf_lm.items():
@@ -233,31 +273,27 @@ def main():
         teacher_lm = build_lm(args_lm)
         load_checkpoint(args.teacher_lm, teacher_lm)
 
+    # Mixed precision training setting
+    amp = MixedPrecision(args.train_dtype, 'cuda' if args.n_gpus >= 1 else 'cpu')
+    if args.resume:
+        load_checkpoint(args.resume, amp=amp)
+
     # GPU setting
-    use_apex = args.train_dtype in ["O0", "O1", "O2", "O3"]
-    amp = None
     if args.n_gpus >= 1:
         model.cudnn_setting(deterministic=not (is_transformer or args.cudnn_benchmark),
                             benchmark=not is_transformer and args.cudnn_benchmark)
         model.cuda()
-
-        # Mixed precision training setting
-        if use_apex:
-            from apex import amp
-            model, scheduler.optimizer = amp.initialize(model, scheduler.optimizer,
-                                                        opt_level=args.train_dtype)
-            from neural_sp.models.seq2seq.decoders.ctc import CTC
-            amp.register_float_function(CTC, "loss_fn")
-            # NOTE: see https://github.com/espnet/espnet/pull/1779
-            amp.init()
-            if args.resume:
-                load_checkpoint(args.resume, amp=amp)
-        model = CustomDataParallel(model, device_ids=list(range(0, args.n_gpus)))
+        if args.distributed:
+            model = CustomDistributedDataParallel(model, device_id=local_rank)
+        else:
+            model = CustomDataParallel(model, device_ids=list(range(0, args.n_gpus)))
 
         if teacher is not None:
             teacher.cuda()
         if teacher_lm is not None:
             teacher_lm.cuda()
+    elif args.distributed:
+        model = CustomDistributedDataParallel(model)
     else:
         model = CPUWrapperASR(model)
 
@@ -268,7 +304,19 @@ def main():
     setproctitle(args.job_name if args.job_name else dir_name)
 
     # Set reporter
-    reporter = Reporter(save_path)
+    reporter = Reporter(save_path, enabled=is_main_process(), flush_steps=args.print_step)
+    # NOTE: training observations are averaged over processes only when reported
+    obsv_buffer = ObservationBuffer() if args.distributed else None
+
+    # Set profiler (only in the main process)
+    profiler = Profiler(args.profile if is_main_process() else 'none', save_path,
+                        timing=args.profile_timing and is_main_process(),
+                        start_step=args.profile_start_step, n_steps=args.profile_n_steps,
+                        sampling_interval=args.profile_sampling_interval)
+    profiler.add_module_scopes(model.module, ['enc', 'dec_fwd', 'dec_fwd.ctc', 'dec_bwd',
+                                              'dec_fwd_sub1', 'dec_fwd_sub1.ctc',
+                                              'dec_fwd_sub2', 'dec_fwd_sub2.ctc'])
+    profiler.start()
 
     if args.mtl_per_batch:
         # NOTE: from easier to harder tasks
@@ -302,10 +350,10 @@ def main():
     n_steps = scheduler.n_steps * accum_grad_n_steps
     epoch_detail_prev = 0
     for ep in range(resume_epoch, args.n_epochs):
-        pbar_epoch = tqdm(total=len(train_set))
+        pbar_epoch = tqdm(total=len(train_set), disable=not is_main_process())
         session_prev = None
 
-        for batch_train, is_new_epoch in train_set:
+        for batch_train, is_new_epoch in timed_iter(train_set, 'data'):
             # Compute loss in the training set
             if args.discourse_aware and batch_train['sessions'][0] != session_prev:
                 model.module.reset_session()
@@ -315,45 +363,60 @@ def main():
             # Change mini-batch depending on task
             if accum_n_steps == 1:
                 loss_train = 0  # average over gradient accumulation
-            for task in tasks:
-                loss, observation = model(batch_train, task=task,
-                                          teacher=teacher, teacher_lm=teacher_lm)
-                loss = loss / accum_grad_n_steps
-                reporter.add(observation)
-                if use_apex:
-                    with amp.scale_loss(loss, scheduler.optimizer) as scaled_loss:
-                        scaled_loss.backward()
-                else:
-                    loss.backward()
-                loss.detach()  # Trancate the graph
-                if accum_n_steps >= accum_grad_n_steps or is_new_epoch:
+            is_update_step = accum_n_steps >= accum_grad_n_steps or is_new_epoch
+            for i_task, task in enumerate(tasks):
+                # NOTE: gradients are all-reduced over processes only in the backward pass
+                # of the last task before parameter update
+                with maybe_no_sync(model, is_update_step and i_task == len(tasks) - 1):
+                    with scope('forward'), amp.autocast():
+                        loss, observation = model(batch_train, task=task,
+                                                  teacher=teacher, teacher_lm=teacher_lm,
+                                                  teacher_store=teacher_store)
+                    loss = loss / accum_grad_n_steps
+                    if obsv_buffer is not None:
+                        obsv_buffer.add(observation)
+                    else:
+                        reporter.add(observation)
+                    with scope('backward'):
+                        amp.backward(loss)
+                # NOTE: accumulated on the device to avoid synchronization per step
+                loss_train += loss.detach()
+                del loss
+            if is_update_step:
+                # NOTE: gradients of all tasks are accumulated before parameter update
+                with scope('optimizer'):
                     if args.clip_grad_norm > 0:
+                        amp.unscale_(scheduler.optimizer)
                         total_norm = torch.nn.utils.clip_grad_norm_(
                             model.module.parameters(), args.clip_grad_norm)
                         reporter.add_tensorboard_scalar('total_norm', total_norm)
-                    scheduler.step()
+                    amp.step(scheduler)
                     scheduler.zero_grad()
-                    accum_n_steps = 0
-                    # NOTE: parameters are forcibly updated at the end of every epoch
-                loss_train += loss.item()
-                del loss
+                accum_n_steps = 0
+                # NOTE: parameters are forcibly updated at the end of every epoch
 
-            pbar_epoch.update(len(batch_train['utt_ids']))
+            pbar_epoch.update(len(batch_train['utt_ids']) * world_size)
             reporter.add_tensorboard_scalar('learning_rate', scheduler.lr)
             # NOTE: loss/acc/ppl are already added in the model
             reporter.step()
+            profiler.step()
             n_steps += 1
             # NOTE: n_steps is different from the step counter in Noam Optimizer
+            if obsv_buffer is not None and n_steps % args.print_step == 0:
+                reporter.add(obsv_buffer.reduce())
 
-            if n_steps % args.print_step == 0:
+            if n_steps % args.print_step == 0 and is_main_process():
                 # Compute loss in the dev set
-                batch_dev = iter(dev_set).next(batch_size=1 if 'transducer' in args.dec_type else None)[0]
-                # Change mini-batch depending on task
-                for task in tasks:
-                    loss, observation = model(batch_dev, task=task, is_eval=True)
-                    reporter.add(observation, is_eval=True)
-                    loss_dev = loss.item()
-                    del loss
+                with scope('eval'):
+                    batch_dev = iter(dev_set).next(batch_size=1 if 'transducer' in args.dec_type else None)[0]
+                    # Change mini-batch depending on task
+                    for task in tasks:
+                        # NOTE: skip synchronization in DistributedDataParallel
+                        loss, observation = (model.module if args.distributed else model)(
+                            batch_dev, task=task, is_eval=True)
+                        reporter.add(observation, is_eval=True)
+                        loss_dev = loss.item()
+                        del loss
                 reporter.step(is_eval=True)
 
                 duration_step = time.time() - start_time_step
@@ -365,20 +428,21 @@ def main():
                     ylen = max(len(y) for y in batch_train['ys_sub1'])
                 logger.info("step:%d(ep:%.2f) loss:%.3f(%.3f)/lr:%.7f/bs:%d/xlen:%d/ylen:%d (%.2f min)" %
                             (n_steps, scheduler.n_epochs + train_set.epoch_detail,
-                             loss_train, loss_dev,
+                             float(loss_train), loss_dev,
                              scheduler.lr, len(batch_train['utt_ids']),
                              xlen, ylen, duration_step / 60))
+                profiler.report()
                 start_time_step = time.time()
 
             # Save fugures of loss and accuracy
-            if n_steps % (args.print_step * 10) == 0:
+            if n_steps % (args.print_step * 10) == 0 and is_main_process():
                 reporter.snapshot()
                 model.module.plot_attention()
                 model.module.plot_ctc()
 
             # Ealuate model every 0.1 epoch during MBR training
             if args.mbr_training:
-                if int(train_set.epoch_detail * 10) != int(epoch_detail_prev * 10):
+                if int(train_set.epoch_detail * 10) != int(epoch_detail_prev * 10) and is_main_process():
                     # dev
                     evaluate([model.module], dev_set, recog_params, args,
                              int(train_set.epoch_detail * 10) / 10, logger)
@@ -401,17 +465,22 @@ def main():
             reporter.epoch()  # plot
 
             # Save the model
-            scheduler.save_checkpoint(
-                model, save_path, remove_old=not is_transformer and args.remove_old_checkpoints, amp=amp)
+            if is_main_process():
+                scheduler.save_checkpoint(
+                    model, save_path, remove_old=not is_transformer and args.remove_old_checkpoints, amp=amp)
         else:
             start_time_eval = time.time()
             # dev
-            metric_dev = evaluate([model.module], dev_set, recog_params, args,
-                                  scheduler.n_epochs + 1, logger)
+            metric_dev = None
+            if is_main_process():
+                with scope('eval'):
+                    metric_dev = evaluate([model.module], dev_set, recog_params, args,
+                                          scheduler.n_epochs + 1, logger)
+            metric_dev = broadcast_object(metric_dev)
             scheduler.epoch(metric_dev)  # lr decay
             reporter.epoch(metric_dev, name=args.metric)  # plot
 
-            if scheduler.is_topk or is_transformer:
+            if (scheduler.is_topk or is_transformer) and is_main_process():
                 # Save the model
                 scheduler.save_checkpoint(
                     model, save_path, remove_old=not is_transformer and args.remove_old_checkpoints, amp=amp)
@@ -444,10 +513,12 @@ def main():
         start_time_step = time.time()
         start_time_epoch = time.time()
 
+    profiler.stop()
+    scheduler.checkpoint_manager.wait()
     duration_train = time.time() - start_time_train
     logger.info('Total time: %.2f hour' % (duration_train / 3600))
 
-    reporter.tf_writer.close()
+    reporter.close()
     pbar_epoch.close()
 
     return save_path
@@ -508,8 +579,11 @@ def evaluate(models, dataloader, recog_params, args, epoch, logger):
     return metric
 
 
+def run():
+    main()
+    cleanup()
+
+
 if __name__ == '__main__':
-    # Setting for profiling
-    pr = cProfile.Profile()
-    save_path = pr.runcall(main)
-    pr.dump_stats(os.path.join(save_path, 'train.profile'))
+    args = parse_args_train(sys.argv[1:])
+    launch(run, n_procs=(args.n_procs or args.n_gpus) if args.distributed else 1)
@@ -0,0 +1,61 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Average checkpoints before evaluation.
+
+The averaged checkpoint (model-avg*) is reused by bin/asr/eval.py
+(and the other evaluation scripts) only if they select exactly the same
+checkpoints, i.e., the latest --recog_n_average ones without --use_topk.
+Otherwise it is averaged again and overwritten.
+"""
+
+import argparse
+from distutils.util import strtobool
+from glob import glob
+import logging
+import os
+import sys
+
+from neural_sp.bin.eval_utils import average_model_states
+from neural_sp.bin.eval_utils import select_checkpoints
+from neural_sp.trainers.checkpoint import load_checkpoint_meta
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args(input_args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--recog_model', type=str, required=True,
+                        help='path to the best checkpoint (model.epoch-*)')
+    parser.add_argument('--recog_n_average', type=int, default=10,
+                        help='number of checkpoints to average')
+    parser.add_argument('--use_topk', type=strtobool, default=False,
+                        help='average the top-k checkpoints recorded in the learning rate scheduler '
+                             'instead of the latest ones')
+    return parser.parse_args(input_args)
+
+
+def main(input_args):
+
+    args = parse_args(input_args)
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(name)s line:%(lineno)d %(levelname)s: %(message)s')
+
+    topk_list = []
+    if args.use_topk:
+        # NOTE: the latest checkpoint has the final top-k list
+        save_dir = os.path.dirname(args.recog_model)
+        latest_path = max(glob(os.path.join(save_dir, 'model.epoch-*')),
+                          key=lambda path: float(path.split('-')[-1]))
+        topk_list = load_checkpoint_meta(latest_path)['optimizer_state_dict']['topk_list']
+    checkpoint_paths = select_checkpoints(args.recog_model, args.recog_n_average, topk_list)
+    checkpoint_avg_path = args.recog_model.split('model.epoch-')[0] + 'model-avg' + str(args.recog_n_average)
+    average_model_states(checkpoint_paths, checkpoint_avg_path)
+    return checkpoint_avg_path
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
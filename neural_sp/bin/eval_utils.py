@@ -6,48 +6,134 @@
 
 """Utility functions for evaluation."""
 
+from collections import OrderedDict
 import logging
 import os
 import torch
 
+from neural_sp.trainers.checkpoint import is_lazy_loadable
+from neural_sp.trainers.checkpoint import iterate_model_state
+from neural_sp.trainers.checkpoint import load_checkpoint_meta
+from neural_sp.trainers.checkpoint import save_model_state_stream
+
 logger = logging.getLogger(__name__)
 
 
 def average_checkpoints(model, best_model_path, n_average, topk_list=[]):
+    """Load the average of the latest (or top-k) checkpoints into `model`.
+
+    The averaged checkpoint is saved as model-avg* next to `best_model_path`
+    together with the names of the averaged checkpoints. If it has already been
+    made from exactly the selected checkpoints (e.g., by bin/average_checkpoints.py),
+    it is loaded without averaging again.
+
+    Args:
+        model (torch.nn.Module):
+        best_model_path (str): path to the best checkpoint (model.epoch-*)
+        n_average (int): number of checkpoints to average
+        topk_list (list): list of (epoch, metric) saved in LRScheduler.
+            If empty, the latest `n_average` checkpoints until `best_model_path` are averaged.
+    Returns:
+        model (torch.nn.Module):
+
+    """
     if n_average == 1:
         return model
 
-    n_models = 0
-    checkpoint_avg = {'model_state_dict': None}
+    checkpoint_paths = select_checkpoints(best_model_path, n_average, topk_list)
+    checkpoint_avg_path = best_model_path.split('model.epoch-')[0] + 'model-avg' + str(n_average)
+    if not _is_averaged(checkpoint_avg_path, checkpoint_paths):
+        average_model_states(checkpoint_paths, checkpoint_avg_path)
+    else:
+        logger.info("=> Loading averaged checkpoint: %s" % checkpoint_avg_path)
+    model.load_state_dict(OrderedDict(iterate_model_state(checkpoint_avg_path)))
+    return model
+
+
+def select_checkpoints(best_model_path, n_average, topk_list=[]):
+    """Select checkpoints to average.
+
+    Args:
+        best_model_path (str): path to the best checkpoint (model.epoch-*)
+        n_average (int): number of checkpoints to average
+        topk_list (list): list of (epoch, metric)
+    Returns:
+        checkpoint_paths (list): paths to existing checkpoints
+
+    """
+    checkpoint_paths = []
     if len(topk_list) == 0:
         epoch = int(best_model_path.split('model.epoch-')[1])
         topk_list = [(i, 0) for i in range(epoch, epoch - n_average - 1, -1)]
     for ep, _ in topk_list:
-        if n_models == n_average:
+        if len(checkpoint_paths) == n_average:
             break
         checkpoint_path = best_model_path.split('model.epoch-')[0] + 'model.epoch-' + str(ep)
-        if os.path.isfile(checkpoint_path):
-            logger.info("=> Loading checkpoint (epoch:%d): %s" % (ep, checkpoint_path))
-            checkpoint = torch.load(checkpoint_path, map_location=lambda storage, loc: storage)
-            if checkpoint_avg['model_state_dict'] is None:
-                # first checkpoint
-                checkpoint_avg['model_state_dict'] = checkpoint['model_state_dict']
-                n_models += 1
-                continue
-            for k, v in checkpoint['model_state_dict'].items():
-                checkpoint_avg['model_state_dict'][k] += v
-            n_models += 1
+        # NOTE: sharded checkpoints are directories
+        if os.path.exists(checkpoint_path):
+            logger.info("=> Loading checkpoint (epoch:%s): %s" % (str(ep), checkpoint_path))
+            checkpoint_paths.append(checkpoint_path)
+    return checkpoint_paths
 
-    # take an average
+
+def average_model_states(checkpoint_paths, checkpoint_avg_path):
+    """Average parameters in checkpoints and save the result.
+
+    If all checkpoints can be read lazily (see `is_lazy_loadable`), parameters
+    are read one by one from all checkpoints and averaged in float64, and each
+    averaged parameter is written to `checkpoint_avg_path` (sharded layout)
+    immediately. Only a few copies of a single parameter are kept in memory.
+    Otherwise, checkpoints are loaded one at a time and accumulated into
+    the sum in float64. Non-floating point buffers (e.g., num_batches_tracked)
+    are copied from the first checkpoint.
+
+    Args:
+        checkpoint_paths (list): paths to checkpoints
+        checkpoint_avg_path (str): path to the averaged checkpoint
+
+    """
+    n_models = len(checkpoint_paths)
+    assert n_models > 0, 'There is no checkpoint to average.'
     logger.info('Take average for %d models' % n_models)
-    for k, v in checkpoint_avg['model_state_dict'].items():
-        checkpoint_avg['model_state_dict'][k] /= n_models
-    model.load_state_dict(checkpoint_avg['model_state_dict'])
 
-    # save as a new checkpoint
-    checkpoint_avg_path = best_model_path.split('model.epoch-')[0] + 'model-avg' + str(n_average)
-    if os.path.isfile(checkpoint_avg_path):
-        os.remove(checkpoint_avg_path)
-    torch.save(checkpoint_avg, checkpoint_avg_path)
+    def average():
+        for params in zip(*[iterate_model_state(path) for path in checkpoint_paths]):
+            k, v = params[0]
+            assert all(k_other == k for k_other, _ in params[1:]), 'Parameter names do not match.'
+            if not v.is_floating_point():
+                yield k, v.clone()
+                continue
+            v_avg = v.to(torch.float64, copy=True)
+            for _, v_other in params[1:]:
+                v_avg += v_other
+            v_avg /= n_models
+            yield k, v_avg.to(v.dtype)
 
-    return model
+    def accumulate():
+        state_sum, dtypes = OrderedDict(), {}
+        for path in checkpoint_paths:
+            keys = []
+            for k, v in iterate_model_state(path):
+                keys.append(k)
+                if k not in dtypes:
+                    dtypes[k] = v.dtype
+                    state_sum[k] = v.to(torch.float64, copy=True) if v.is_floating_point() else v.clone()
+                elif v.is_floating_point():
+                    state_sum[k] += v
+            assert keys == list(state_sum.keys()), 'Parameter names do not match.'
+        for k, v in state_sum.items():
+            yield k, v.div_(n_models).to(dtypes[k]) if v.is_floating_point() else v
+
+    lazy = all(is_lazy_loadable(path) for path in checkpoint_paths)
+    save_model_state_stream(average() if lazy else accumulate(), checkpoint_avg_path,
+                            meta={'averaged_checkpoints': [os.path.basename(path)
+                                                           for path in checkpoint_paths]})
+    logger.info("=> Saved averaged checkpoint: %s" % checkpoint_avg_path)
+
+
+def _is_averaged(checkpoint_avg_path, checkpoint_paths):
+    if not os.path.exists(checkpoint_avg_path):
+        return False
+    # NOTE: checkpoints are in the same directory as the averaged one
+    averaged = load_checkpoint_meta(checkpoint_avg_path).get('averaged_checkpoints', [])
+    return sorted(averaged) == sorted(os.path.basename(path) for path in checkpoint_paths)
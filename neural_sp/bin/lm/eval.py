@@ -41,7 +41,7 @@ def main():
                           dict_path=os.path.join(dir_name, 'dict.txt'),
                           wp_model=os.path.join(dir_name, 'wp.model'),
                           unit=args.unit,
-                          batch_size=args.recog_batch_size,
+                          batch_size=1,
                           bptt=args.bptt,
                           backward=args.backward,
                           serialize=args.serialize,
@@ -57,6 +57,7 @@ def main():
             logger.info('epoch: %d' % epoch)
             logger.info('batch size: %d' % args.recog_batch_size)
             logger.info('BPTT: %d' % (args.bptt))
+            logger.info('stride: %d' % (args.recog_stride))
             logger.info('cache size: %d' % (args.recog_n_caches))
             logger.info('cache theta: %.3f' % (args.recog_cache_theta))
             logger.info('cache lambda: %.3f' % (args.recog_cache_lambda))
@@ -70,7 +71,8 @@ def main():
 
         start_time = time.time()
 
-        ppl, _ = eval_ppl([model], dataset, batch_size=1, bptt=args.bptt,
+        ppl, _ = eval_ppl([model], dataset, batch_size=args.recog_batch_size,
+                          bptt=args.bptt, stride=args.recog_stride,
                           n_caches=args.recog_n_caches, progressbar=True)
         ppl_avg += ppl
         print('PPL (%s): %.2f' % (dataset.set, ppl))
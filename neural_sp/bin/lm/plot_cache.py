@@ -4,7 +4,7 @@
 # Copyright 2019 Kyoto University (Hirofumi Inaguma)
 #  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
 
-"""Plot cache distributions of RNNLM."""
+"""Plot cache distributions of LMs."""
 
 import logging
 import numpy as np
@@ -85,39 +85,26 @@ def main():
 
         hidden = None
         fig_count = 0
-        toknen_count = 0
-        n_tokens = args.recog_n_caches
+        model.reset_cache()
         while True:
             ys, is_new_epoch = dataset.next()
-
-            for t in range(ys.shape[1] - 1):
-                loss, hidden = model(ys[:, t:t + 2], hidden, is_eval=True, n_caches=args.recog_n_caches)[:2]
-
-                if len(model.cache_attn) > 0:
-                    if toknen_count == n_tokens:
-                        tokens_keys = dataset.idx2token[0](model.cache_ids[:args.recog_n_caches], return_list=True)
-                        tokens_query = dataset.idx2token[0](model.cache_ids[-n_tokens:], return_list=True)
-
-                        # Slide attention matrix
-                        n_keys = len(tokens_keys)
-                        n_queries = len(tokens_query)
-                        cache_probs = np.zeros((n_keys, n_queries))  # `[n_keys, n_queries]`
-                        mask = np.zeros((n_keys, n_queries))
-                        for i, aw in enumerate(model.cache_attn[-n_tokens:]):
-                            cache_probs[:(n_keys - n_queries + i + 1), i] = aw[0, -(n_keys - n_queries + i + 1):]
-                            mask[(n_keys - n_queries + i + 1):, i] = 1
-
-                        plot_cache_weights(
-                            cache_probs,
-                            keys=tokens_keys,
-                            queries=tokens_query,
-                            save_path=mkdir_join(save_path, str(fig_count) + '.png'),
-                            figsize=(40, 16),
-                            mask=mask)
-                        toknen_count = 0
-                        fig_count += 1
-                    else:
-                        toknen_count += 1
+            loss, hidden = model(ys, hidden, is_eval=True, n_caches=args.recog_n_caches)[:2]
+
+            # Plot the first stream after the cache is filled
+            if model.cache.offset - ys.shape[1] + 1 >= args.recog_n_caches:
+                attn, key_ids = model.cache.history(b=0)
+                cache_probs = attn.T  # `[n_keys, n_queries]`
+                tokens_keys = dataset.idx2token[0](key_ids.tolist(), return_list=True)
+                tokens_query = dataset.idx2token[0](ys[0, 1:].tolist(), return_list=True)
+
+                plot_cache_weights(
+                    cache_probs,
+                    keys=tokens_keys,
+                    queries=tokens_query,
+                    save_path=mkdir_join(save_path, str(fig_count) + '.png'),
+                    figsize=(40, 16),
+                    mask=(cache_probs == 0).astype(np.float32))
+                fig_count += 1
 
             if is_new_epoch:
                 break
@@ -6,7 +6,6 @@
 
 """Train the LM."""
 
-import cProfile
 import logging
 import os
 from setproctitle import setproctitle
@@ -26,12 +25,29 @@ from neural_sp.bin.train_utils import (
     set_save_path
 )
 from neural_sp.datasets.lm import Dataset
+from neural_sp.datasets.lm_shard import ShardedDataset
 from neural_sp.evaluators.ppl import eval_ppl
 from neural_sp.models.data_parallel import CustomDataParallel
+from neural_sp.models.data_parallel import CustomDistributedDataParallel
 from neural_sp.models.data_parallel import CPUWrapperLM
 from neural_sp.models.lm.build import build_lm
+from neural_sp.trainers.checkpoint import CheckpointManager
+from neural_sp.trainers.checkpoint import load_checkpoint_meta
+from neural_sp.trainers.distributed import (
+    broadcast_object,
+    cleanup,
+    init_process_group,
+    is_main_process,
+    launch,
+    maybe_no_sync,
+    ObservationBuffer
+)
 from neural_sp.trainers.lr_scheduler import LRScheduler
 from neural_sp.trainers.optimizer import set_optimizer
+from neural_sp.trainers.precision import MixedPrecision
+from neural_sp.trainers.profiler import Profiler
+from neural_sp.trainers.profiler import scope
+from neural_sp.trainers.profiler import timed_iter
 from neural_sp.trainers.reporter import Reporter
 from neural_sp.utils import mkdir_join
 
@@ -51,9 +67,16 @@ def main():
         for k, v in conf.items():
             if k != 'resume':
                 setattr(args, k, v)
+    torch.manual_seed(args.seed)
+    torch.cuda.manual_seed_all(args.seed)
 
     # for multi-GPUs
-    if args.n_gpus >= 1:
+    rank, world_size, local_rank = 0, 1, 0
+    if args.distributed:
+        rank, world_size, local_rank = init_process_group(args.n_gpus, args.dist_backend)
+        batch_size = args.batch_size * world_size
+        accum_grad_n_steps = max(1, args.accum_grad_n_steps // world_size)
+    elif args.n_gpus >= 1:
         batch_size = args.batch_size * args.n_gpus
         accum_grad_n_steps = max(1, args.accum_grad_n_steps // args.n_gpus)
     else:
@@ -61,19 +84,39 @@ def main():
         accum_grad_n_steps = args.accum_grad_n_steps
 
     # Load dataset
-    train_set = Dataset(corpus=args.corpus,
-                        tsv_path=args.train_set,
-                        dict_path=args.dict,
-                        nlsyms=args.nlsyms,
-                        unit=args.unit,
-                        wp_model=args.wp_model,
-                        batch_size=batch_size,
-                        n_epochs=args.n_epochs,
-                        min_n_tokens=args.min_n_tokens,
-                        bptt=args.bptt,
-                        shuffle=args.shuffle,
-                        backward=args.backward,
-                        serialize=args.serialize)
+    if args.train_shards:
+        assert not (args.backward or args.serialize)
+        train_set = ShardedDataset(shard_dir=args.train_shards,
+                                   dict_path=args.dict,
+                                   nlsyms=args.nlsyms,
+                                   unit=args.unit,
+                                   wp_model=args.wp_model,
+                                   batch_size=batch_size,
+                                   n_epochs=args.n_epochs,
+                                   bptt=args.bptt,
+                                   shuffle=args.shuffle,
+                                   block_size=args.shard_block_size,
+                                   n_workers=args.n_workers,
+                                   rank=rank,
+                                   world_size=world_size,
+                                   seed=args.seed)
+    else:
+        train_set = Dataset(corpus=args.corpus,
+                            tsv_path=args.train_set,
+                            dict_path=args.dict,
+                            nlsyms=args.nlsyms,
+                            unit=args.unit,
+                            wp_model=args.wp_model,
+                            batch_size=batch_size,
+                            n_epochs=args.n_epochs,
+                            min_n_tokens=args.min_n_tokens,
+                            bptt=args.bptt,
+                            shuffle=args.shuffle,
+                            backward=args.backward,
+                            serialize=args.serialize,
+                            rank=rank,
+                            world_size=world_size,
+                            seed=args.seed)
     dev_set = Dataset(corpus=args.corpus,
                       tsv_path=args.dev_set,
                       dict_path=args.dict,
@@ -103,17 +146,21 @@ def main():
         dir_name = os.path.basename(save_path)
     else:
         dir_name = set_lm_name(args)
-        save_path = mkdir_join(args.model_save_dir, '_'.join(
-            os.path.basename(args.train_set).split('.')[:-1]), dir_name)
-        save_path = set_save_path(save_path)  # avoid overwriting
+        save_path = None
+        if is_main_process():
+            save_path = mkdir_join(args.model_save_dir, '_'.join(
+                os.path.basename(args.train_set).split('.')[:-1]), dir_name)
+            save_path = set_save_path(save_path)  # avoid overwriting
+        save_path = broadcast_object(save_path)
 
     # Set logger
-    set_logger(os.path.join(save_path, 'train.log'), stdout=args.stdout)
+    if is_main_process():
+        set_logger(os.path.join(save_path, 'train.log'), stdout=args.stdout)
 
     # Model setting
     model = build_lm(args, save_path)
 
-    if not args.resume:
+    if not args.resume and is_main_process():
         # Save the conf file as a yaml file
         save_config(vars(args), os.path.join(save_path, 'conf.yml'))
 
@@ -137,7 +184,11 @@ def main():
 
     # Set optimizer
     if args.resume:
-        resume_epoch = int(args.resume.split('-')[-1])
+        if 'model.epoch-' in args.resume:
+            resume_epoch = int(args.resume.split('-')[-1])
+        else:
+            # NOTE: resume from the middle of the epoch (model.latest)
+            resume_epoch = load_checkpoint_meta(args.resume)['optimizer_state_dict']['_epoch']
         optimizer = set_optimizer(model, 'sgd' if resume_epoch > args.convert_to_sgd_epoch else args.optimizer,
                                   args.lr, args.weight_decay)
     else:
@@ -157,7 +208,9 @@ def main():
                             model_size=getattr(args, 'transformer_d_model', 0),
                             factor=args.lr_factor,
                             noam=args.optimizer == 'noam',
-                            save_checkpoints_topk=10 if is_transformer else 1)
+                            save_checkpoints_topk=10 if is_transformer else 1,
+                            checkpoint_manager=CheckpointManager(async_save=args.async_checkpoint,
+                                                                 sharded=args.sharded_checkpoint))
 
     if args.resume:
         # Restore the last saved model
@@ -168,23 +221,23 @@ def main():
             scheduler.convert_to_sgd(model, args.lr, args.weight_decay,
                                      decay_type='always', decay_rate=0.5)
 
+    # Mixed precision training setting
+    amp = MixedPrecision(args.train_dtype, 'cuda' if args.n_gpus >= 1 else 'cpu')
+    if args.resume:
+        load_checkpoint(args.resume, amp=amp,
+                        dataset=train_set if args.train_shards else None)
+
     # GPU setting
-    use_apex = args.train_dtype in ["O0", "O1", "O2", "O3"]
-    amp = None
     if args.n_gpus >= 1:
         model.cudnn_setting(deterministic=not (is_transformer or args.cudnn_benchmark),
                             benchmark=not is_transformer and args.cudnn_benchmark)
         model.cuda()
-
-        # Mix precision training setting
-        if use_apex:
-            from apex import amp
-            model, scheduler.optimizer = amp.initialize(model, scheduler.optimizer,
-                                                        opt_level=args.train_dtype)
-            amp.init()
-            if args.resume:
-                load_checkpoint(args.resume, amp=amp)
-        model = CustomDataParallel(model, device_ids=list(range(0, args.n_gpus)))
+        if args.distributed:
+            model = CustomDistributedDataParallel(model, device_id=local_rank)
+        else:
+            model = CustomDataParallel(model, device_ids=list(range(0, args.n_gpus)))
+    elif args.distributed:
+        model = CustomDistributedDataParallel(model)
     else:
         model = CPUWrapperLM(model)
 
@@ -195,7 +248,16 @@ def main():
     setproctitle(args.job_name if args.job_name else dir_name)
 
     # Set reporter
-    reporter = Reporter(save_path)
+    reporter = Reporter(save_path, enabled=is_main_process(), flush_steps=args.print_step)
+    # NOTE: training observations are averaged over processes only when reported
+    obsv_buffer = ObservationBuffer() if args.distributed else None
+
+    # Set profiler (only in the main process)
+    profiler = Profiler(args.profile if is_main_process() else 'none', save_path,
+                        timing=args.profile_timing and is_main_process(),
+                        start_step=args.profile_start_step, n_steps=args.profile_n_steps,
+                        sampling_interval=args.profile_sampling_interval)
+    profiler.start()
 
     hidden = None
     start_time_train = time.time()
@@ -204,64 +266,84 @@ def main():
     accum_n_steps = 0
     n_steps = scheduler.n_steps * accum_grad_n_steps
     for ep in range(resume_epoch, args.n_epochs):
-        pbar_epoch = tqdm(total=len(train_set))
+        pbar_epoch = tqdm(total=len(train_set), disable=not is_main_process())
 
-        for ys_train, is_new_epoch in train_set:
+        for ys_train, is_new_epoch in timed_iter(train_set, 'data'):
             # Compute loss in the training set
             accum_n_steps += 1
 
             if accum_n_steps == 1:
                 loss_train = 0  # moving average over gradient accumulation
-            loss, hidden, observation = model(ys_train, state=hidden)
-            loss = loss / accum_grad_n_steps
-            reporter.add(observation)
-            if use_apex:
-                with amp.scale_loss(loss, scheduler.optimizer) as scaled_loss:
-                    scaled_loss.backward()
-            else:
-                loss.backward()
+            is_update_step = accum_n_steps >= accum_grad_n_steps or is_new_epoch
+            # NOTE: gradients are all-reduced over processes only before parameter update
+            with maybe_no_sync(model, is_update_step):
+                with scope('forward'), amp.autocast():
+                    loss, hidden, observation = model(ys_train, state=hidden)
+                loss = loss / accum_grad_n_steps
+                if obsv_buffer is not None:
+                    obsv_buffer.add(observation)
+                else:
+                    reporter.add(observation)
+                with scope('backward'):
+                    amp.backward(loss)
             loss.detach()  # Trancate the graph
-            if accum_n_steps >= accum_grad_n_steps or is_new_epoch:
-                if args.clip_grad_norm > 0:
-                    total_norm = torch.nn.utils.clip_grad_norm_(
-                        model.module.parameters(), args.clip_grad_norm)
-                    reporter.add_tensorboard_scalar('total_norm', total_norm)
-                scheduler.step()
-                scheduler.zero_grad()
+            if is_update_step:
+                with scope('optimizer'):
+                    if args.clip_grad_norm > 0:
+                        amp.unscale_(scheduler.optimizer)
+                        total_norm = torch.nn.utils.clip_grad_norm_(
+                            model.module.parameters(), args.clip_grad_norm)
+                        reporter.add_tensorboard_scalar('total_norm', total_norm)
+                    amp.step(scheduler)
+                    scheduler.zero_grad()
                 accum_n_steps = 0
                 # NOTE: parameters are forcibly updated at the end of every epoch
-            loss_train += loss.item()
+            # NOTE: accumulated on the device to avoid synchronization per step
+            loss_train += loss.detach()
             del loss
             hidden = model.module.repackage_state(hidden)
 
-            pbar_epoch.update(ys_train.shape[0] * (ys_train.shape[1] - 1))
+            pbar_epoch.update(ys_train.shape[0] * (ys_train.shape[1] - 1) * world_size)
             reporter.add_tensorboard_scalar('learning_rate', scheduler.lr)
             # NOTE: loss/acc/ppl are already added in the model
             reporter.step()
+            profiler.step()
             n_steps += 1
             # NOTE: n_steps is different from the step counter in Noam Optimizer
+            if obsv_buffer is not None and n_steps % args.print_step == 0:
+                reporter.add(obsv_buffer.reduce())
 
-            if n_steps % args.print_step == 0:
+            if n_steps % args.print_step == 0 and is_main_process():
                 # Compute loss in the dev set
-                ys_dev = iter(dev_set).next(bptt=args.bptt)[0]
-                loss, _, observation = model(ys_dev, state=None, is_eval=True)
-                reporter.add(observation, is_eval=True)
-                loss_dev = loss.item()
-                del loss
+                with scope('eval'):
+                    ys_dev = iter(dev_set).next(bptt=args.bptt)[0]
+                    # NOTE: skip synchronization in DistributedDataParallel
+                    loss, _, observation = (model.module if args.distributed else model)(
+                        ys_dev, state=None, is_eval=True)
+                    reporter.add(observation, is_eval=True)
+                    loss_dev = loss.item()
+                    del loss
                 reporter.step(is_eval=True)
 
                 duration_step = time.time() - start_time_step
                 logger.info("step:%d(ep:%.2f) loss:%.3f(%.3f)/lr:%.5f/bs:%d (%.2f min)" %
                             (n_steps, scheduler.n_epochs + train_set.epoch_detail,
-                             loss_train, loss_dev,
+                             float(loss_train), loss_dev,
                              scheduler.lr, ys_train.shape[0], duration_step / 60))
+                profiler.report()
                 start_time_step = time.time()
 
             # Save fugures of loss and accuracy
-            if n_steps % (args.print_step * 10) == 0:
+            if n_steps % (args.print_step * 10) == 0 and is_main_process():
                 reporter.snapshot()
                 model.module.plot_attention()
 
+            # Save the latest checkpoint to resume from the middle of the epoch
+            if args.train_shards and args.checkpoint_step > 0 and n_steps % args.checkpoint_step == 0 \
+                    and not is_new_epoch and is_main_process():
+                scheduler.save_checkpoint(model, save_path, remove_old=False, amp=amp,
+                                          dataset=train_set, model_name='model.latest')
+
             if is_new_epoch:
                 break
 
@@ -275,31 +357,38 @@ def main():
             reporter.epoch()  # plot
 
             # Save the model
-            scheduler.save_checkpoint(
-                model, save_path, remove_old=not is_transformer, amp=amp)
+            if is_main_process():
+                scheduler.save_checkpoint(
+                    model, save_path, remove_old=not is_transformer, amp=amp,
+                    dataset=train_set if args.train_shards else None)
         else:
             start_time_eval = time.time()
             # dev
-            model.module.reset_length(args.bptt)
-            ppl_dev, _ = eval_ppl([model.module], dev_set,
-                                  batch_size=1, bptt=args.bptt)
-            model.module.reset_length(args.bptt)
+            ppl_dev = None
+            if is_main_process():
+                model.module.reset_length(args.bptt)
+                with scope('eval'):
+                    ppl_dev, _ = eval_ppl([model.module], dev_set,
+                                          batch_size=args.eval_batch_size, bptt=args.bptt)
+                model.module.reset_length(args.bptt)
+            ppl_dev = broadcast_object(ppl_dev)
             scheduler.epoch(ppl_dev)  # lr decay
             reporter.epoch(ppl_dev, name='perplexity')  # plot
             logger.info('PPL (%s, ep:%d): %.2f' %
                         (dev_set.set, scheduler.n_epochs, ppl_dev))
 
-            if scheduler.is_topk or is_transformer:
+            if (scheduler.is_topk or is_transformer) and is_main_process():
                 # Save the model
                 scheduler.save_checkpoint(
-                    model, save_path, remove_old=not is_transformer, amp=amp)
+                    model, save_path, remove_old=not is_transformer, amp=amp,
+                    dataset=train_set if args.train_shards else None)
 
                 # test
                 ppl_test_avg = 0.
                 for eval_set in eval_sets:
                     model.module.reset_length(args.bptt)
                     ppl_test, _ = eval_ppl([model.module], eval_set,
-                                           batch_size=1, bptt=args.bptt)
+                                           batch_size=args.eval_batch_size, bptt=args.bptt)
                     model.module.reset_length(args.bptt)
                     logger.info('PPL (%s, ep:%d): %.2f' %
                                 (eval_set.set, scheduler.n_epochs, ppl_test))
@@ -326,17 +415,22 @@ def main():
         start_time_step = time.time()
         start_time_epoch = time.time()
 
+    profiler.stop()
+    scheduler.checkpoint_manager.wait()
     duration_train = time.time() - start_time_train
     logger.info('Total time: %.2f hour' % (duration_train / 3600))
 
-    reporter.tf_writer.close()
+    reporter.close()
     pbar_epoch.close()
 
     return save_path
 
 
+def run():
+    main()
+    cleanup()
+
+
 if __name__ == '__main__':
-    # Setting for profiling
-    pr = cProfile.Profile()
-    save_path = pr.runcall(main)
-    pr.dump_stats(os.path.join(save_path, 'train.profile'))
+    args = parse_args_train(sys.argv[1:])
+    launch(run, n_procs=(args.n_procs or args.n_gpus) if args.distributed else 1)
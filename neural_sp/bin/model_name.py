@@ -6,6 +6,7 @@
 import os
 
 from neural_sp.bin.train_utils import load_config
+from neural_sp.trainers.precision import train_dtype_suffix
 
 
 def _define_encoder_name(dir_name, args):
@@ -83,8 +84,7 @@ def set_asr_model_name(args):
     else:
         dir_name += '_lr' + str(args.lr)
     dir_name += '_bs' + str(args.batch_size)
-    if args.train_dtype in ["O0", "O1", "O2", "O3"]:
-        dir_name += '_' + args.train_dtype
+    dir_name += train_dtype_suffix(args.train_dtype)
     # if args.shuffle_bucket:
     #     dir_name += '_bucket'
     # if 'transformer' in args.enc_type or 'transformer' in args.dec_type:
@@ -131,6 +131,8 @@ def set_asr_model_name(args):
         dir_name += '_tsl'
 
     # SpecAugment
+    if args.time_warp_width > 0:
+        dir_name += '_TW' + str(args.time_warp_width)
     if args.n_freq_masks > 0:
         dir_name += '_' + str(args.freq_width) + 'FM' + str(args.n_freq_masks)
     if args.n_time_masks > 0:
@@ -154,7 +156,7 @@ def set_asr_model_name(args):
         dir_name += '_bptt' + str(args.bptt)
 
     # Pre-training
-    if args.asr_init and os.path.isfile(args.asr_init):
+    if args.asr_init and os.path.exists(args.asr_init):
         conf_init = load_config(os.path.join(os.path.dirname(args.asr_init), 'conf.yml'))
         dir_name += '_' + conf_init['unit'] + 'pt'
     if args.freeze_encoder:
@@ -189,8 +191,7 @@ def set_lm_name(args):
     else:
         dir_name += '_lr' + str(args.lr)
     dir_name += '_bs' + str(args.batch_size)
-    if args.train_dtype in ["O0", "O1", "O2", "O3"]:
-        dir_name += '_' + args.train_dtype
+    dir_name += train_dtype_suffix(args.train_dtype)
 
     dir_name += '_bptt' + str(args.bptt)
 
@@ -12,9 +12,10 @@ import logging
 import numpy as np
 import os
 import time
-import torch
 import yaml
 
+from neural_sp.trainers.checkpoint import load_checkpoint_file
+
 logger = logging.getLogger(__name__)
 
 
@@ -130,25 +131,26 @@ def set_save_path(save_path):
     return save_path_new
 
 
-def load_checkpoint(checkpoint_path, model=None, optimizer=None, amp=None):
+def load_checkpoint(checkpoint_path, model=None, optimizer=None, amp=None, dataset=None):
     """Load checkpoint.
 
     Args:
-        checkpoint_path (str): path to the saved model (model..epoch-*)
+        checkpoint_path (str): path to the saved model (model.epoch-* or model.latest)
         model (torch.nn.Module):
         optimizer (LRScheduler): optimizer wrapped by LRScheduler class
-        amp ():
+        amp (MixedPrecision): precision policy holding the gradient scaler
+        dataset (ShardedDataset): training set to resume from the saved position
     Returns:
         topk_list (list): list of (epoch, metric)
 
     """
-    if os.path.isfile(checkpoint_path):
-        checkpoint = torch.load(checkpoint_path, map_location=lambda storage, loc: storage)
+    if os.path.exists(checkpoint_path):
+        checkpoint = load_checkpoint_file(checkpoint_path)
     else:
         raise ValueError("No checkpoint found at %s" % checkpoint_path)
 
     # Restore parameters
-    if 'avg' not in checkpoint_path:
+    if 'avg' not in checkpoint_path and 'model.epoch-' in checkpoint_path:
         epoch = int(os.path.basename(checkpoint_path).split('-')[-1]) - 1
         logger.info("=> Loading checkpoint (epoch:%d): %s" % (epoch + 1, checkpoint_path))
     else:
@@ -166,12 +168,16 @@ def load_checkpoint(checkpoint_path, model=None, optimizer=None, amp=None):
     else:
         logger.warning('Optimizer is not loaded.')
 
-    # Restore apex
-    if amp is not None:
+    # Restore the gradient scaler
+    if amp is not None and 'amp_state_dict' in checkpoint.keys():
         amp.load_state_dict(checkpoint['amp_state_dict'])
     else:
         logger.warning('amp is not loaded.')
 
+    # Restore the epoch of the training set
+    if dataset is not None and 'dataset_state_dict' in checkpoint.keys():
+        dataset.load_state_dict(checkpoint['dataset_state_dict'])
+
     if 'optimizer_state_dict' in checkpoint.keys() and 'topk_list' in checkpoint['optimizer_state_dict'].keys():
         topk_list = checkpoint['optimizer_state_dict']['topk_list']
     else:
@@ -39,7 +39,8 @@ def build_dataloader(args, tsv_path, batch_size, n_epochs=1e10, is_test=False,
                      sort_by='utt_id', short2long=False, sort_stop_epoch=1e10,
                      tsv_path_sub1=False, tsv_path_sub2=False,
                      num_workers=1, pin_memory=False,
-                     first_n_utterances=-1, alignment_dir=None):
+                     first_n_utterances=-1, alignment_dir=None,
+                     rank=0, world_size=1):
 
     dataset = CustomDataset(corpus=args.corpus,
                             tsv_path=tsv_path,
@@ -71,11 +72,17 @@ def build_dataloader(args, tsv_path, batch_size, n_epochs=1e10, is_test=False,
     batch_sampler = CustomBatchSampler(df=dataset.df,  # filtered
                                        df_sub1=dataset.df_sub1,  # filtered
                                        df_sub2=dataset.df_sub2,  # filtered
-                                       batch_size=args.batch_size,
+                                       # NOTE: batch_size is the global mini-batch size sharded over
+                                       # processes in distributed training. Otherwise, args.batch_size
+                                       # is used as before (also for DataParallel).
+                                       batch_size=batch_size if world_size > 1 else args.batch_size,
                                        dynamic_batching=args.dynamic_batching,
                                        shuffle_bucket=args.shuffle_bucket and not is_test,
                                        sort_stop_epoch=args.sort_stop_epoch,
-                                       discourse_aware=args.discourse_aware)
+                                       discourse_aware=args.discourse_aware,
+                                       rank=rank,
+                                       world_size=world_size,
+                                       seed=args.seed)
 
     dataloader = CustomDataLoader(dataset=dataset,
                                   batch_sampler=batch_sampler,
@@ -148,8 +155,9 @@ class CustomDataLoader(DataLoader):
         if self.is_new_epoch:
             # shuffle the whole data per epoch
             if self.epoch + 1 == self.batch_sampler.sort_stop_epoch:
+                df_index = list(self.batch_sampler.df.index)
                 self.batch_sampler.df = self.batch_sampler.df.reindex(
-                    np.random.permutation(self.batch_sampler.df.index))
+                    self.batch_sampler.rng.sample(df_index, len(df_index)))
                 for i in range(1, 3):
                     if getattr(self.batch_sampler, 'df_sub' + str(i)) is not None:
                         setattr(self.batch_sampler, 'df_sub' + str(i),
@@ -500,9 +508,13 @@ class CustomBatchSampler(BatchSampler):
 
     def __init__(self, df, batch_size, dynamic_batching,
                  shuffle_bucket, discourse_aware, sort_stop_epoch,
-                 df_sub1=None, df_sub2=None):
+                 df_sub1=None, df_sub2=None, rank=0, world_size=1, seed=1):
         """Custom BatchSampler.
 
+        In distributed training, every process samples the same mini-batch
+        of size `batch_size` and takes its own shard of it, so that all
+        processes have the same number of steps per epoch.
+
         Args:
 
             df (pandas.DataFrame): dataframe for the main task
@@ -514,6 +526,9 @@ class CustomBatchSampler(BatchSampler):
                 back to a random order
             df_sub1 (pandas.DataFrame): dataframe for the first sub task
             df_sub2 (pandas.DataFrame): dataframe for the second sub task
+            rank (int): rank of the current process in distributed training
+            world_size (int): number of processes in distributed training
+            seed (int): random seed for shuffling (must be the same over processes)
 
         """
         self.df = df
@@ -526,13 +541,19 @@ class CustomBatchSampler(BatchSampler):
         self.sort_stop_epoch = sort_stop_epoch
         self.discourse_aware = discourse_aware
 
+        self.rank = rank
+        self.world_size = world_size
+        # NOTE: the global random module is not used so that shuffling is
+        # synchronized over processes regardless of the other random operations
+        self.rng = random.Random(seed)
+
         self._offset = 0
 
         if discourse_aware:
             self.indices_buckets = discourse_bucketing(self.df, batch_size)
             self._iteration = len(self.indices_buckets)
         elif shuffle_bucket:
-            self.indices_buckets = shuffle_bucketing(self.df, batch_size, self.dynamic_batching)
+            self.indices_buckets = shuffle_bucketing(self.df, batch_size, self.dynamic_batching, self.rng)
             self._iteration = len(self.indices_buckets)
         else:
             self.indices = list(self.df.index)
@@ -563,7 +584,7 @@ class CustomBatchSampler(BatchSampler):
         if self.discourse_aware:
             self.indices_buckets = discourse_bucketing(self.df, batch_size)
         elif self.shuffle_bucket:
-            self.indices_buckets = shuffle_bucketing(self.df, batch_size, self.dynamic_batching)
+            self.indices_buckets = shuffle_bucketing(self.df, batch_size, self.dynamic_batching, self.rng)
         else:
             self.indices = list(self.df.index)
         self._offset = 0
@@ -591,7 +612,7 @@ class CustomBatchSampler(BatchSampler):
             is_new_epoch = (len(self.indices_buckets) == 0)
 
             # Shuffle uttrances in mini-batch
-            indices = random.sample(indices, len(indices))
+            indices = self.rng.sample(indices, len(indices))
 
         else:
             if batch_size is None:
@@ -613,9 +634,26 @@ class CustomBatchSampler(BatchSampler):
                 is_new_epoch = True
 
             # Shuffle uttrances in mini-batch
-            indices = random.sample(indices, len(indices))
+            indices = self.rng.sample(indices, len(indices))
 
             for i in indices:
                 self.indices.remove(i)
 
+        if self.world_size > 1:
+            indices = self._shard(indices)
+
         return indices, is_new_epoch
+
+    def _shard(self, indices):
+        """Take a shard of the mini-batch for the current process.
+
+        Args:
+            indices (list): indices of dataframe in the mini-batch
+        Returns:
+            indices (list): indices of dataframe for the current process
+
+        """
+        if len(indices) < self.world_size:
+            # NOTE: repeat utterances so that no process has an empty mini-batch
+            indices = (indices * self.world_size)[:self.world_size]
+        return indices[self.rank::self.world_size]
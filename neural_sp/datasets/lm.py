@@ -31,15 +31,43 @@ np.random.seed(1)
 logger = logging.getLogger(__name__)
 
 
+def set_token_converter(unit, dict_path, nlsyms=False, wp_model=None):
+    """Build index converters for the token unit.
+
+    Args:
+        unit (str): word or wp or char or phone or word_char
+        dict_path (str): path to the dictionary
+        nlsyms (str): path to the non-linguistic symbols file
+        wp_model (): path to the word-piece model for sentencepiece
+    Returns:
+        idx2token: converter from indices to tokens
+        token2idx: converter from tokens to indices
+
+    """
+    if unit in ['word', 'word_char']:
+        return Idx2word(dict_path), Word2idx(dict_path, word_char_mix=(unit == 'word_char'))
+    elif unit == 'wp':
+        return Idx2wp(dict_path, wp_model), Wp2idx(dict_path, wp_model)
+    elif unit == 'char':
+        return Idx2char(dict_path), Char2idx(dict_path, nlsyms=nlsyms)
+    elif 'phone' in unit:
+        return Idx2phone(dict_path), Phone2idx(dict_path)
+    else:
+        raise ValueError(unit)
+
+
 class Dataset(object):
 
     def __init__(self, tsv_path, dict_path,
                  unit, batch_size, nlsyms=False, n_epochs=1e10,
                  is_test=False, min_n_tokens=1,
                  bptt=2, shuffle=False, backward=False, serialize=False,
-                 wp_model=None, corpus=''):
+                 wp_model=None, corpus='', rank=0, world_size=1, seed=1):
         """A class for loading dataset.
 
+        In distributed training, the corpus is reshaped into `batch_size` rows
+        in every process, and each process takes its own subset of the rows.
+
         Args:
             tsv_path (str): path to the dataset tsv file
             dict_path (str): path to the dictionary
@@ -55,6 +83,9 @@ class Dataset(object):
             serialize (bool): serialize text according to contexts in dialogue
             wp_model (): path to the word-piece model for sentencepiece
             corpus (str): name of corpus
+            rank (int): rank of the current process in distributed training
+            world_size (int): number of processes in distributed training
+            seed (int): random seed for shuffling (must be the same over processes)
 
         """
         super(Dataset, self).__init__()
@@ -75,25 +106,17 @@ class Dataset(object):
         self.backward = backward
         self.vocab = count_vocab_size(dict_path)
         assert bptt >= 2
-
-        self.idx2token = []
-        self.token2idx = []
+        self.rank = rank
+        self.world_size = world_size
+        assert batch_size >= world_size
+        # NOTE: the global random state is not used so that shuffling is
+        # synchronized over processes regardless of the other random operations
+        self.rng = np.random.RandomState(seed)
 
         # Set index converter
-        if unit in ['word', 'word_char']:
-            self.idx2token += [Idx2word(dict_path)]
-            self.token2idx += [Word2idx(dict_path, word_char_mix=(unit == 'word_char'))]
-        elif unit == 'wp':
-            self.idx2token += [Idx2wp(dict_path, wp_model)]
-            self.token2idx += [Wp2idx(dict_path, wp_model)]
-        elif unit == 'char':
-            self.idx2token += [Idx2char(dict_path)]
-            self.token2idx += [Char2idx(dict_path, nlsyms=nlsyms)]
-        elif 'phone' in unit:
-            self.idx2token += [Idx2phone(dict_path)]
-            self.token2idx += [Phone2idx(dict_path)]
-        else:
-            raise ValueError(unit)
+        idx2token, token2idx = set_token_converter(unit, dict_path, nlsyms, wp_model)
+        self.idx2token = [idx2token]
+        self.token2idx = [token2idx]
 
         # Load dataset tsv file
         self.df = pd.read_csv(tsv_path, encoding='utf-8', delimiter='\t')
@@ -115,7 +138,7 @@ class Dataset(object):
         # Sort tsv records
         if shuffle:
             assert not serialize
-            self.df = self.df.reindex(np.random.permutation(self.df.index))
+            self.df = self.df.reindex(self.rng.permutation(self.df.index))
         elif serialize:
             assert not shuffle
             assert corpus == 'swbd'
@@ -155,7 +178,7 @@ class Dataset(object):
     def reset(self):
         """Reset data counter and offset."""
         if self.shuffle:
-            self.df = self.df.reindex(np.random.permutation(self.df.index))
+            self.df = self.df.reindex(self.rng.permutation(self.df.index))
             self.concat_ids = self.concat_utterances(self.df)
         self.offset = 0
 
@@ -191,7 +214,7 @@ class Dataset(object):
         if self.epoch >= self.max_epoch:
             raise StopIteration
 
-        ys = self.concat_ids[:, self.offset:self.offset + bptt]
+        ys = self.concat_ids[self.rank::self.world_size, self.offset:self.offset + bptt]
         self.offset += bptt - 1
         # ys = self.concat_ids[:, self.offset:self.offset + (bptt + 1)]
         # self.offset += (bptt + 1) - 1
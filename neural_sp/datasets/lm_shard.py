@@ -0,0 +1,356 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Streaming dataset over memory-mapped token shards for language model.
+   Token IDs of the corpus are stored in shards in advance (see make_shards),
+   and only BPTT windows of each mini-batch are read from them.
+"""
+
+import json
+import logging
+import numpy as np
+import os
+import pandas as pd
+from torch.utils.data import DataLoader
+
+try:
+    from torch.utils.data import get_worker_info
+    from torch.utils.data import IterableDataset
+except ImportError:
+    # NOTE: for torch<1.2, mini-batches are read in the main process
+    get_worker_info = None
+    IterableDataset = object
+
+from neural_sp.datasets.lm import set_token_converter
+from neural_sp.datasets.utils import count_vocab_size
+
+logger = logging.getLogger(__name__)
+
+INDEX = 'index.json'
+
+
+def make_shards(tsv_path, dict_path, save_dir, shard_size=10000000,
+                min_n_tokens=1, chunksize=100000):
+    """Split token IDs in a dataset tsv file into shards.
+
+    Each utterance is preceded by <eos> as in Dataset.concat_utterances, and
+    utterances are kept in the order of the tsv file. Shards are saved as .npy
+    files so that they can be memory-mapped, together with the start positions
+    of utterances in each shard and an index file.
+
+    Args:
+        tsv_path (str): path to the dataset tsv file
+        dict_path (str): path to the dictionary
+        save_dir (str): directory to save shards
+        shard_size (int): number of tokens per shard
+        min_n_tokens (int): exclude utterances shorter than this value
+        chunksize (int): number of tsv records read at once
+    Returns:
+        index (dict): contents of the index file
+
+    """
+    vocab = count_vocab_size(dict_path)
+    dtype = np.uint16 if vocab <= np.iinfo(np.uint16).max else np.int32
+    eos = 2
+    os.makedirs(save_dir, exist_ok=True)
+
+    shards = []
+    buffer, starts, n_tokens = [], [], 0
+
+    def flush(final=False):
+        if final:
+            buffer.append(np.array([eos], dtype=dtype))  # for the last sentence
+        name = 'shard-%05d' % len(shards)
+        np.save(os.path.join(save_dir, name + '.npy'), np.concatenate(buffer))
+        np.save(os.path.join(save_dir, name + '.offsets.npy'), np.array(starts, dtype=np.int64))
+        shards.append({'name': name, 'n_tokens': n_tokens + int(final), 'n_utts': len(starts)})
+
+    for df in pd.read_csv(tsv_path, encoding='utf-8', delimiter='\t',
+                          usecols=['token_id', 'ylen'], dtype={'token_id': str},
+                          chunksize=chunksize):
+        df = df[df['ylen'] >= max(1, min_n_tokens)]
+        for token_id in df['token_id']:
+            ids = np.array([eos] + list(map(int, token_id.split())), dtype=np.int64)
+            if n_tokens > 0 and n_tokens + len(ids) > shard_size:
+                flush()
+                buffer, starts, n_tokens = [], [], 0
+            starts.append(n_tokens)
+            buffer.append(ids.astype(dtype))
+            n_tokens += len(ids)
+    if n_tokens > 0:
+        flush(final=True)
+
+    index = {'vocab': vocab, 'eos': eos, 'dtype': np.dtype(dtype).name, 'shards': shards}
+    with open(os.path.join(save_dir, INDEX), 'w') as f:
+        json.dump(index, f, indent=2)
+    logger.info('Saved %d tokens in %d shards to %s' % (
+        sum(s['n_tokens'] for s in shards), len(shards), save_dir))
+    return index
+
+
+class ShardedDataset(object):
+
+    def __init__(self, shard_dir, dict_path,
+                 unit, batch_size, nlsyms=False, n_epochs=1e10,
+                 bptt=2, shuffle=False, block_size=10000, seed=1,
+                 n_workers=0, wp_model=None, rank=0, world_size=1):
+        """A class for streaming a sharded corpus.
+
+        The token stream in an epoch is a concatenation of shards, and it is
+        split into `batch_size` rows as in Dataset. Each mini-batch is read
+        from memory-mapped shards, so the corpus is never loaded into memory.
+        With shuffling, the order of shards and that of blocks of consecutive
+        utterances (about `block_size` tokens) in each shard are permuted per
+        epoch. The permutation depends only on `seed` and the epoch, so it is
+        synchronized over processes and restored on resumption.
+
+        Args:
+            shard_dir (str): directory of shards made by make_shards
+            dict_path (str): path to the dictionary
+            unit (str): word or wp or char or phone or word_char
+            batch_size (int): size of mini-batch
+            nlsyms (str): path to the non-linguistic symbols file
+            n_epochs (int): total epochs for training
+            bptt (int): BPTT length
+            shuffle (bool): shuffle shards and blocks per epoch
+            block_size (int): number of tokens in a block for shuffling
+            seed (int): seed for shuffling
+            n_workers (int): number of worker processes to read mini-batches.
+                Mini-batches are read in the main process if 0 (or torch<1.2).
+            wp_model (): path to the word-piece model for sentencepiece
+            rank (int): rank of the current process in distributed training
+            world_size (int): number of processes in distributed training
+
+        """
+        super(ShardedDataset, self).__init__()
+
+        self.epoch = 0
+        self.iteration = 0
+        self.offset = 0
+
+        self.set = os.path.basename(shard_dir.rstrip('/'))
+        self.unit = unit
+        self.batch_size = batch_size
+        self.bptt = bptt
+        self.max_epoch = n_epochs
+        self.shuffle = shuffle
+        self.block_size = block_size
+        self.seed = seed
+        if n_workers > 0 and get_worker_info is None:
+            logger.warning('--n_workers is ignored since torch<1.2 does not support IterableDataset.')
+            n_workers = 0
+        self.n_workers = n_workers
+        assert bptt >= 2
+        self.rank = rank
+        self.world_size = world_size
+        assert batch_size >= world_size
+
+        with open(os.path.join(shard_dir, INDEX)) as f:
+            index = json.load(f)
+        self.shard_dir = shard_dir
+        self.shards = index['shards']
+        self.sos = index['eos']
+        self.eos = index['eos']
+        self.vocab = count_vocab_size(dict_path)
+        assert self.vocab == index['vocab'], 'The dictionary does not match shards.'
+        self._mmaps = {}
+
+        # Set index converter
+        idx2token, token2idx = set_token_converter(unit, dict_path, nlsyms, wp_model)
+        self.idx2token = [idx2token]
+        self.token2idx = [token2idx]
+
+        # Split shards into blocks at utterance boundaries
+        self.blocks = []  # list of `[n_blocks, 2]` (start and end positions)
+        for shard in self.shards:
+            starts = np.load(os.path.join(shard_dir, shard['name'] + '.offsets.npy'))
+            # NOTE: each block starts at the last utterance boundary before multiples of block_size
+            bounds = starts[np.searchsorted(starts, np.arange(0, shard['n_tokens'], block_size), side='right') - 1]
+            bounds = np.unique(bounds)
+            bounds = np.append(bounds, shard['n_tokens'])
+            self.blocks.append(np.stack([bounds[:-1], bounds[1:]], axis=1))
+        self.n_tokens = sum(s['n_tokens'] for s in self.shards)
+        logger.info('Loaded %d shards (%d tokens, %d blocks) from %s' % (
+            len(self.shards), self.n_tokens, sum(len(b) for b in self.blocks), shard_dir))
+
+        self._loader = None
+        self.reset()
+
+    def _shard(self, i):
+        # NOTE: opened lazily in each process
+        if i not in self._mmaps:
+            self._mmaps[i] = np.load(os.path.join(self.shard_dir, self.shards[i]['name'] + '.npy'),
+                                     mmap_mode='r')
+        return self._mmaps[i]
+
+    def __getstate__(self):
+        # NOTE: memory maps are not copied to worker processes
+        state = self.__dict__.copy()
+        state['_mmaps'] = {}
+        state['_loader'] = None
+        return state
+
+    def _layout(self, epoch):
+        """Order of blocks in the token stream of the epoch.
+
+        Returns:
+            shard_ids (np.ndarray): `[n_blocks]`
+            block_starts (np.ndarray): `[n_blocks]`, start positions in shards
+            stream_starts (np.ndarray): `[n_blocks + 1]`, start positions in the stream
+
+        """
+        shard_order = np.arange(len(self.shards))
+        block_orders = [np.arange(len(b)) for b in self.blocks]
+        if self.shuffle:
+            rng = np.random.RandomState([self.seed, epoch])
+            shard_order = rng.permutation(shard_order)
+            block_orders = [rng.permutation(o) for o in block_orders]
+        shard_ids = np.concatenate([np.full(len(self.blocks[i]), i) for i in shard_order])
+        blocks = np.concatenate([self.blocks[i][block_orders[i]] for i in shard_order])
+        stream_starts = np.concatenate([[0], np.cumsum(blocks[:, 1] - blocks[:, 0])])
+        return shard_ids, blocks[:, 0], stream_starts
+
+    def read(self, start, length):
+        """Read tokens in the token stream of the current epoch.
+
+        Args:
+            start (int): start position in the stream
+            length (int): number of tokens
+        Returns:
+            ys (np.ndarray): `[length]`
+
+        """
+        shard_ids, block_starts, stream_starts = self.layout
+        ys = np.empty(length, dtype=np.int64)
+        i = np.searchsorted(stream_starts, start, side='right') - 1
+        n = 0
+        while n < length:
+            begin = block_starts[i] + (start + n - stream_starts[i])
+            m = min(length - n, stream_starts[i + 1] - (start + n))
+            ys[n:n + m] = self._shard(shard_ids[i])[begin:begin + m]
+            n += m
+            i += 1
+        return ys
+
+    def window(self, offset, bptt):
+        """Read a mini-batch of BPTT windows starting at `offset` in each row.
+
+        Returns:
+            ys (np.ndarray): `[B // world_size, bptt]`
+
+        """
+        length = min(bptt, self.row_len - offset)
+        rows = range(self.rank, self.batch_size, self.world_size)
+        return np.stack([self.read(b * self.row_len + offset, length) for b in rows])
+
+    @property
+    def row_len(self):
+        return self.n_tokens // self.batch_size
+
+    @property
+    def epoch_detail(self):
+        """Percentage of the current epoch."""
+        return float(self.offset * self.batch_size) / len(self)
+
+    def reset(self):
+        """Reset data counter and offset."""
+        self._stop_loader()
+        self.layout = self._layout(self.epoch)
+        self.offset = 0
+
+    def state_dict(self):
+        """Position in the corpus to resume from.
+
+        The layout of the epoch is determined by the seed and the epoch.
+
+        """
+        return {'epoch': self.epoch, 'offset': self.offset, 'seed': self.seed}
+
+    def load_state_dict(self, state_dict):
+        self.seed = state_dict['seed']
+        self.epoch = state_dict['epoch']
+        self.reset()
+        self.offset = state_dict.get('offset', 0)
+
+    def __len__(self):
+        return self.row_len * self.batch_size
+
+    def __iter__(self):
+        return self
+
+    def next(self, batch_size=None, bptt=None):
+        return self.__next__(batch_size, bptt)
+
+    def __next__(self, batch_size=None, bptt=None):
+        """Generate each mini-batch.
+
+        Args:
+            batch_size (int): size of mini-batch (only changed at the beginning of epochs)
+            bptt (int): BPTT length
+        Returns:
+            ys (np.ndarray): target labels in the main task of size `[B, bptt]`
+            is_new_epoch (bool): flag for the end of the current epoch
+
+        """
+        if batch_size is not None and batch_size != self.batch_size:
+            assert self.offset == 0
+            self.batch_size = batch_size
+            self._stop_loader()
+
+        if bptt is None:
+            bptt = self.bptt
+
+        if self.epoch >= self.max_epoch:
+            raise StopIteration
+
+        if self.n_workers > 0 and bptt == self.bptt:
+            if self._loader is None:
+                self._loader = iter(DataLoader(_WindowStream(self), batch_size=None,
+                                               num_workers=self.n_workers, collate_fn=_identity))
+            offset, ys = next(self._loader)
+            assert offset == self.offset
+        else:
+            self._stop_loader()
+            ys = self.window(self.offset, bptt)
+        self.offset += bptt - 1
+        # NOTE: the last token in ys must be feeded as inputs in the next mini-batch
+
+        is_new_epoch = False
+
+        # Last mini-batch
+        if self.offset + 1 >= self.row_len:
+            is_new_epoch = True
+            self.epoch += 1
+            self.reset()
+
+        return ys, is_new_epoch
+
+    def _stop_loader(self):
+        # NOTE: workers are shut down when the iterator is garbage-collected
+        self._loader = None
+
+
+def _identity(x):
+    return x
+
+
+class _WindowStream(IterableDataset):
+    """Mini-batches from the current offset to the end of the epoch.
+
+    Worker `i` reads every `n_workers`-th mini-batch, and the DataLoader
+    yields them in the original order.
+
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.offsets = range(dataset.offset, dataset.row_len - 1, dataset.bptt - 1)
+
+    def __iter__(self):
+        info = get_worker_info()
+        worker_id, n_workers = (0, 1) if info is None else (info.id, info.num_workers)
+        for offset in self.offsets[worker_id::n_workers]:
+            yield offset, self.dataset.window(offset, self.dataset.bptt)
@@ -0,0 +1,152 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Memory-mapped store of top-k teacher logits for knowledge distillation.
+   Top-k log-probabilities of the teacher at every output position are
+   computed once over the training set (see bin/asr/cache_teacher_logits.py)
+   and read by utterance ID during training, so that the teacher model is
+   not needed.
+"""
+
+import json
+import logging
+import numpy as np
+import os
+import torch
+
+from neural_sp.models.torch_utils import np2tensor
+from neural_sp.models.torch_utils import pad_list
+from neural_sp.models.torch_utils import tensor2np
+
+logger = logging.getLogger(__name__)
+
+INDEX = 'index.json'
+IDS = 'topk_ids.bin'
+LOG_PROBS = 'topk_log_probs.bin'
+
+
+class TopKLogitWriter(object):
+
+    def __init__(self, save_dir, topk, vocab, teacher='asr'):
+        """Write top-k log-probabilities of the teacher to a store.
+
+        Indices (uint16, or int32 for a large vocabulary) and float16
+        log-probabilities of each output position are appended to flat
+        binary files, and offsets of utterances are kept in an index file.
+
+        Args:
+            save_dir (str): directory to save the store
+            topk (int): number of classes kept per output position
+            vocab (int): vocabulary size
+            teacher (str): asr or lm
+
+        """
+        self.save_dir = save_dir
+        self.topk = min(topk, vocab)
+        self.vocab = vocab
+        self.teacher = teacher
+        self.dtype = np.uint16 if vocab <= np.iinfo(np.uint16).max else np.int32
+
+        os.makedirs(save_dir, exist_ok=True)
+        self.f_ids = open(os.path.join(save_dir, IDS), 'wb')
+        self.f_log_probs = open(os.path.join(save_dir, LOG_PROBS), 'wb')
+        self.utts = {}
+        self.n_tokens = 0
+
+    def add(self, utt_ids, logits, ylens):
+        """Add a mini-batch.
+
+        Args:
+            utt_ids (list): length `B`
+            logits (FloatTensor): `[B, L, vocab]`
+            ylens (list): number of output positions of each utterance (including <eos>)
+
+        """
+        log_probs = torch.log_softmax(logits.float(), dim=-1)
+        topk_log_probs, topk_ids = torch.topk(log_probs, k=self.topk, dim=-1)
+        topk_ids = tensor2np(topk_ids).astype(self.dtype)
+        topk_log_probs = tensor2np(topk_log_probs).astype(np.float16)
+        for b, utt_id in enumerate(utt_ids):
+            if utt_id in self.utts:
+                continue
+            ylen = int(ylens[b])
+            self.f_ids.write(topk_ids[b, :ylen].tobytes())
+            self.f_log_probs.write(topk_log_probs[b, :ylen].tobytes())
+            self.utts[utt_id] = [self.n_tokens, ylen]
+            self.n_tokens += ylen
+
+    def close(self):
+        """Flush the binary files and save the index file.
+
+        Returns:
+            index (dict): contents of the index file
+
+        """
+        self.f_ids.close()
+        self.f_log_probs.close()
+        index = {'topk': self.topk, 'vocab': self.vocab, 'teacher': self.teacher,
+                 'dtype': np.dtype(self.dtype).name, 'n_tokens': self.n_tokens,
+                 'utts': self.utts}
+        with open(os.path.join(self.save_dir, INDEX), 'w') as f:
+            json.dump(index, f)
+        logger.info('Saved top-%d logits of %d tokens in %d utterances to %s' % (
+            self.topk, self.n_tokens, len(self.utts), self.save_dir))
+        return index
+
+
+class TopKLogitStore(object):
+
+    def __init__(self, save_dir):
+        """Read top-k log-probabilities of the teacher from a store made by TopKLogitWriter.
+
+        Args:
+            save_dir (str): directory of the store
+
+        """
+        with open(os.path.join(save_dir, INDEX)) as f:
+            index = json.load(f)
+        self.topk = index['topk']
+        self.vocab = index['vocab']
+        self.teacher = index['teacher']
+        self.utts = index['utts']
+        shape = (index['n_tokens'], self.topk)
+        self.ids = np.memmap(os.path.join(save_dir, IDS), dtype=index['dtype'], mode='r', shape=shape)
+        self.log_probs = np.memmap(os.path.join(save_dir, LOG_PROBS), dtype=np.float16, mode='r', shape=shape)
+
+    def __len__(self):
+        return len(self.utts)
+
+    def __contains__(self, utt_id):
+        return utt_id in self.utts
+
+    def __getitem__(self, utt_id):
+        """Top-k classes of an utterance.
+
+        Args:
+            utt_id (str): utterance ID
+        Returns:
+            topk_ids (np.ndarray): `[L, k]`
+            topk_log_probs (np.ndarray): `[L, k]` (float16)
+
+        """
+        offset, ylen = self.utts[utt_id]
+        return self.ids[offset:offset + ylen], self.log_probs[offset:offset + ylen]
+
+    def batch(self, utt_ids, device):
+        """Top-k classes of a mini-batch padded to the longest utterance.
+
+        Args:
+            utt_ids (list): length `B`
+            device (torch.device):
+        Returns:
+            topk_ids (LongTensor): `[B, L, k]`
+            topk_log_probs (FloatTensor): `[B, L, k]`
+
+        """
+        topk_ids, topk_log_probs = zip(*[self[utt_id] for utt_id in utt_ids])
+        topk_ids = pad_list([np2tensor(x.astype(np.int64), device) for x in topk_ids], 0)
+        topk_log_probs = pad_list([np2tensor(x.astype(np.float32), device) for x in topk_log_probs], 0.)
+        return topk_ids, topk_log_probs
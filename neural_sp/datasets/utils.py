@@ -4,6 +4,8 @@
 """Utility functions for data loader."""
 
 import codecs
+import numpy as np
+import pandas as pd
 import random
 
 random.seed(1)
@@ -18,6 +20,26 @@ def count_vocab_size(dict_path):
     return vocab_count
 
 
+def count_frequent_tokens(tsv_path, n_tokens, vocab, chunksize=100000):
+    """Find the most frequent tokens in a dataset.
+
+    Args:
+        tsv_path (str): path to the dataset (tsv file)
+        n_tokens (int): number of tokens to return
+        vocab (int): vocabulary size
+        chunksize (int): number of utterances read at once
+    Returns:
+        token_ids (np.ndarray): `[n_tokens]`, token indices in descending order of frequency
+
+    """
+    counts = np.zeros(vocab, dtype=np.int64)
+    for df in pd.read_csv(tsv_path, encoding='utf-8', delimiter='\t', usecols=['token_id'],
+                          dtype={'token_id': str}, chunksize=chunksize):
+        ids = np.array(' '.join(df['token_id'].dropna()).split(), dtype=np.int64)
+        counts += np.bincount(ids, minlength=vocab)[:vocab]
+    return np.argsort(-counts, kind='stable')[:n_tokens]
+
+
 def set_batch_size(batch_size, min_xlen, min_ylen, dynamic_batching):
     if not dynamic_batching:
         return batch_size
@@ -32,7 +54,7 @@ def set_batch_size(batch_size, min_xlen, min_ylen, dynamic_batching):
     return max(1, batch_size)
 
 
-def shuffle_bucketing(df, batch_size, dynamic_batching):
+def shuffle_bucketing(df, batch_size, dynamic_batching, rng=random):
     indices_buckets = []  # list of list
     offset = 0
     while True:
@@ -47,7 +69,7 @@ def shuffle_bucketing(df, batch_size, dynamic_batching):
             break
 
     # shuffle buckets
-    random.shuffle(indices_buckets)
+    rng.shuffle(indices_buckets)
     return indices_buckets
 
 
@@ -6,11 +6,11 @@
 
 """Evaluate the character-level model by WER & CER."""
 
-import codecs
 import logging
-from tqdm import tqdm
+import os
 
-from neural_sp.evaluators.edit_distance import compute_wer
+from neural_sp.evaluators.pipeline import EvalPipeline
+from neural_sp.evaluators.streaming_latency import StreamingLatencyProfiler
 from neural_sp.utils import mkdir_join
 
 logger = logging.getLogger(__name__)
@@ -26,7 +26,8 @@ def eval_char(models, dataloader, recog_params, epoch,
         recog_params (dict):
         epoch (int):
         recog_dir (str):
-        streaming (bool): streaming decoding for the session-level evaluation
+        streaming (bool): streaming decoding for the session-level evaluation.
+            Latency statistics are written to latency.json/latency.csv next to hyp.trn
         progressbar (bool): visualize the progressbar
         task_idx (int): the index of the target task in interest
             0: main task
@@ -50,18 +51,9 @@ def eval_char(models, dataloader, recog_params, epoch,
         ref_trn_path = mkdir_join(recog_dir, 'ref.trn')
         hyp_trn_path = mkdir_join(recog_dir, 'hyp.trn')
 
-    wer, cer = 0, 0
-    n_sub_w, n_ins_w, n_del_w = 0, 0, 0
-    n_sub_c, n_ins_c, n_del_c = 0, 0, 0
-    n_word, n_char = 0, 0
     n_streamable, quantity_rate, n_utt = 0, 0, 0
     last_success_frame_ratio = 0
-
-    # Reset data counter
-    dataloader.reset(recog_params['recog_batch_size'])
-
-    if progressbar:
-        pbar = tqdm(total=len(dataloader))
+    profiler = StreamingLatencyProfiler() if streaming else None
 
     if task_idx == 0:
         task = 'ys'
@@ -72,14 +64,43 @@ def eval_char(models, dataloader, recog_params, epoch,
     elif task_idx == 3:
         task = 'ys_sub3'
 
-    with codecs.open(hyp_trn_path, 'w', encoding='utf-8') as f_hyp, \
-            codecs.open(ref_trn_path, 'w', encoding='utf-8') as f_ref:
-        while True:
-            batch, is_new_epoch = dataloader.next(recog_params['recog_batch_size'])
+    def postprocess(batch, best_hyps_id):
+        refs, hyps = [], []
+        for b in range(len(best_hyps_id)):
+            refs.append(batch['text'][b])
+            hyp = dataloader.idx2token[task_idx](best_hyps_id[b])
+
+            # Truncate the first and last spaces for the char_space unit
+            if len(hyp) > 0 and hyp[0] == ' ':
+                hyp = hyp[1:]
+            if len(hyp) > 0 and hyp[-1] == ' ':
+                hyp = hyp[:-1]
+            hyps.append(hyp)
+
+        if not streaming:
+            if ('char' in dataloader.unit and 'nowb' not in dataloader.unit) or (task_idx > 0 and dataloader.unit_sub1 == 'char'):
+                # Compute WER
+                pipeline.wer.add([ref.split(' ') for ref in refs],
+                                 [hyp.split(' ') for hyp in hyps])
+                # NOTE: sentence error rate for Chinese
+
+            # Compute CER
+            if dataloader.corpus == 'csj':
+                pipeline.cer.add([list(ref.replace(' ', '')) for ref in refs],
+                                 [list(hyp.replace(' ', '')) for hyp in hyps])
+            else:
+                pipeline.cer.add([list(ref) for ref in refs], [list(hyp) for hyp in hyps])
+        return refs, hyps
+
+    with EvalPipeline(dataloader, recog_params['recog_batch_size'], ref_trn_path, hyp_trn_path,
+                      streaming=streaming, progressbar=progressbar) as pipeline:
+        for batch in pipeline:
             if streaming or recog_params['recog_chunk_sync']:
                 best_hyps_id, _ = models[0].decode_streaming(
                     batch['xs'], recog_params, dataloader.idx2token[0],
-                    exclude_eos=True)
+                    exclude_eos=True,
+                    profiler=profiler,
+                    session_id=batch['utt_ids'][0])
             else:
                 best_hyps_id, _ = models[0].decode(
                     batch['xs'], recog_params,
@@ -91,87 +112,24 @@ def eval_char(models, dataloader, recog_params, epoch,
                     task=task,
                     ensemble_models=models[1:] if len(models) > 1 else [])
 
-            for b in range(len(batch['xs'])):
-                ref = batch['text'][b]
-                hyp = dataloader.idx2token[task_idx](best_hyps_id[b])
+            if not streaming:
+                bs = len(batch['xs'])
+                if models[0].streamable():
+                    n_streamable += bs
+                else:
+                    last_success_frame_ratio += models[0].last_success_frame_ratio() * bs
+                quantity_rate += models[0].quantity_rate() * bs
+                n_utt += bs
 
-                # Truncate the first and last spaces for the char_space unit
-                if len(hyp) > 0 and hyp[0] == ' ':
-                    hyp = hyp[1:]
-                if len(hyp) > 0 and hyp[-1] == ' ':
-                    hyp = hyp[:-1]
+            pipeline.submit(postprocess, batch, best_hyps_id)
 
-                # Write to trn
-                speaker = str(batch['speakers'][b]).replace('-', '_')
-                if streaming:
-                    utt_id = str(batch['utt_ids'][b]) + '_0000000_0000001'
-                else:
-                    utt_id = str(batch['utt_ids'][b])
-                f_ref.write(ref + ' (' + speaker + '-' + utt_id + ')\n')
-                f_hyp.write(hyp + ' (' + speaker + '-' + utt_id + ')\n')
-                logger.debug('utt-id: %s' % utt_id)
-                logger.debug('Ref: %s' % ref)
-                logger.debug('Hyp: %s' % hyp)
-                logger.debug('-' * 150)
-
-                if not streaming:
-                    if ('char' in dataloader.unit and 'nowb' not in dataloader.unit) or (task_idx > 0 and dataloader.unit_sub1 == 'char'):
-                        # Compute WER
-                        wer_b, sub_b, ins_b, del_b = compute_wer(ref=ref.split(' '),
-                                                                 hyp=hyp.split(' '),
-                                                                 normalize=False)
-                        wer += wer_b
-                        n_sub_w += sub_b
-                        n_ins_w += ins_b
-                        n_del_w += del_b
-                        n_word += len(ref.split(' '))
-                        # NOTE: sentence error rate for Chinese
-
-                    # Compute CER
-                    if dataloader.corpus == 'csj':
-                        ref = ref.replace(' ', '')
-                        hyp = hyp.replace(' ', '')
-                    cer_b, sub_b, ins_b, del_b = compute_wer(ref=list(ref),
-                                                             hyp=list(hyp),
-                                                             normalize=False)
-                    cer += cer_b
-                    n_sub_c += sub_b
-                    n_ins_c += ins_b
-                    n_del_c += del_b
-                    n_char += len(ref)
-                    if models[0].streamable():
-                        n_streamable += 1
-                    else:
-                        last_success_frame_ratio += models[0].last_success_frame_ratio()
-                    quantity_rate += models[0].quantity_rate()
-                    n_utt += 1
-
-                if progressbar:
-                    pbar.update(1)
-
-            if is_new_epoch:
-                break
-
-    if progressbar:
-        pbar.close()
-
-    # Reset data counters
-    dataloader.reset()
+    if profiler is not None:
+        profiler.save(os.path.dirname(hyp_trn_path))
 
+    # NOTE: WER is 0 for units without word boundaries
+    wer, n_sub_w, n_ins_w, n_del_w = pipeline.wer.rates()
+    cer, n_sub_c, n_ins_c, n_del_c = pipeline.cer.rates()
     if not streaming:
-        if ('char' in dataloader.unit and 'nowb' not in dataloader.unit) or (task_idx > 0 and dataloader.unit_sub1 == 'char'):
-            wer /= n_word
-            n_sub_w /= n_word
-            n_ins_w /= n_word
-            n_del_w /= n_word
-        else:
-            wer = n_sub_w = n_ins_w = n_del_w = 0
-
-        cer /= n_char
-        n_sub_c /= n_char
-        n_ins_c /= n_char
-        n_del_c /= n_char
-
         if n_utt - n_streamable > 0:
             last_success_frame_ratio /= (n_utt - n_streamable)
         n_streamable /= n_utt
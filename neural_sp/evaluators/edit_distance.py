@@ -72,77 +72,157 @@ def compute_wer(ref, hyp, normalize=False):
         n_del (int): the number of deletion
 
     """
-    # Initialisation
-    d = np.zeros((len(ref) + 1) * (len(hyp) + 1), dtype=np.uint16)
-    d = d.reshape((len(ref) + 1, len(hyp) + 1))
-    for i in range(len(ref) + 1):
-        for j in range(len(hyp) + 1):
-            if i == 0:
-                d[0][j] = j
-            elif j == 0:
-                d[i][0] = i
+    n_sub, n_ins, n_del = [int(n[0]) for n in edit_distance_batch([ref], [hyp])]
+    wer = n_sub + n_ins + n_del
+    if normalize:
+        wer /= len(ref)
+    return wer * 100, n_sub * 100, n_ins * 100, n_del * 100
 
-    # Computation
-    for i in range(1, len(ref) + 1):
-        for j in range(1, len(hyp) + 1):
-            if ref[i - 1] == hyp[j - 1]:
-                d[i][j] = d[i - 1][j - 1]
-            else:
-                sub_tmp = d[i - 1][j - 1] + 1
-                ins_tmp = d[i][j - 1] + 1
-                del_tmp = d[i - 1][j] + 1
-                d[i][j] = min(sub_tmp, ins_tmp, del_tmp)
 
-    wer = d[len(ref)][len(hyp)]
+def compute_wer_batch(refs, hyps):
+    """Compute Word Error Rate for ref/hyp pairs at once.
 
-    # Find out the manipulation steps
-    x = len(ref)
-    y = len(hyp)
-    error_list = []
-    while True:
-        if x == 0 and y == 0:
-            break
-        else:
-            if x > 0 and y > 0:
-                if d[x][y] == d[x - 1][y - 1] and ref[x - 1] == hyp[y - 1]:
-                    error_list.append("C")
-                    x = x - 1
-                    y = y - 1
-                elif d[x][y] == d[x][y - 1] + 1:
-                    error_list.append("I")
-                    y = y - 1
-                elif d[x][y] == d[x - 1][y - 1] + 1:
-                    error_list.append("S")
-                    x = x - 1
-                    y = y - 1
-                else:
-                    error_list.append("D")
-                    x = x - 1
-            elif x == 0 and y > 0:
-                if d[x][y] == d[x][y - 1] + 1:
-                    error_list.append("I")
-                    y = y - 1
-                else:
-                    error_list.append("D")
-                    x = x - 1
-            elif y == 0 and x > 0:
-                error_list.append("D")
-                x = x - 1
-            else:
-                raise ValueError
+    Args:
+        refs (list): references, each of which is a list of words (or characters)
+        hyps (list): hypotheses, each of which is a list of words (or characters)
+    Returns:
+        wer (np.ndarray): `[B]`, edit distance of each pair (x100 as in compute_wer)
+        n_sub (np.ndarray): `[B]`, the number of substitution (x100)
+        n_ins (np.ndarray): `[B]`, the number of insertion (x100)
+        n_del (np.ndarray): `[B]`, the number of deletion (x100)
 
-    n_sub = error_list.count("S")
-    n_ins = error_list.count("I")
-    n_del = error_list.count("D")
-    n_cor = error_list.count("C")
+    """
+    n_sub, n_ins, n_del = edit_distance_batch(refs, hyps)
+    return (n_sub + n_ins + n_del) * 100, n_sub * 100, n_ins * 100, n_del * 100
 
-    assert wer == (n_sub + n_ins + n_del)
-    assert n_cor == (len(ref) - n_sub - n_del)
 
-    if normalize:
-        wer /= len(ref)
+def edit_distance_batch(refs, hyps, max_cells=2 ** 24):
+    """Count edit operations between ref/hyp pairs.
 
-    return wer * 100, n_sub * 100, n_ins * 100, n_del * 100
+    Tokens are mapped to integer ids, and the DP table is filled row by row
+    for all pairs at once. A row depends on itself only through insertions,
+    which is resolved with a cumulative minimum:
+        d[i, j] = min_{k<=j} (t[k] + j - k),
+        t[j] = min(d[i-1, j-1] + (ref[i-1] != hyp[j-1]), d[i-1, j] + 1).
+    The alignment is then traced back for all pairs at once with the same
+    priority as before (correct > insertion > substitution > deletion), so
+    that the breakdown of errors is unchanged.
+
+    Args:
+        refs (list): references, each of which is a list of hashable tokens
+        hyps (list): hypotheses, each of which is a list of hashable tokens
+        max_cells (int): maximum number of DP cells processed at once
+    Returns:
+        n_sub (np.ndarray): `[B]`, the number of substitution
+        n_ins (np.ndarray): `[B]`, the number of insertion
+        n_del (np.ndarray): `[B]`, the number of deletion
+
+    """
+    assert len(refs) == len(hyps)
+    bs = len(refs)
+    n_ops = np.zeros((3, bs), dtype=np.int64)
+    if bs == 0:
+        return n_ops[0], n_ops[1], n_ops[2]
+
+    # group pairs of similar lengths so that padding is small
+    vocab = {}
+    order = sorted(range(bs), key=lambda b: (len(refs[b]), len(hyps[b])))
+    start = 0
+    while start < bs:
+        end = start + 1
+        max_ref, max_hyp = len(refs[order[start]]), len(hyps[order[start]])
+        while end < bs:
+            max_ref_next = max(max_ref, len(refs[order[end]]))
+            max_hyp_next = max(max_hyp, len(hyps[order[end]]))
+            if (end - start + 1) * (max_ref_next + 1) * (max_hyp_next + 1) > max_cells:
+                break
+            max_ref, max_hyp = max_ref_next, max_hyp_next
+            end += 1
+        idx = order[start:end]
+        n_ops[:, idx] = _edit_distance([refs[b] for b in idx], [hyps[b] for b in idx], vocab)
+        start = end
+    return n_ops[0], n_ops[1], n_ops[2]
+
+
+def _to_ids(seqs, vocab, pad):
+    lens = np.array([len(seq) for seq in seqs], dtype=np.int64)
+    ids = np.full((len(seqs), max(1, lens.max())), pad, dtype=np.int64)
+    for b, seq in enumerate(seqs):
+        ids[b, :len(seq)] = [vocab.setdefault(token, len(vocab)) for token in seq]
+    return ids, lens
+
+
+def _edit_distance(refs, hyps, vocab):
+    # NOTE: paddings of refs and hyps never match
+    ref_ids, ref_lens = _to_ids(refs, vocab, pad=-1)
+    hyp_ids, hyp_lens = _to_ids(hyps, vocab, pad=-2)
+    bs = len(refs)
+    n_ref, n_hyp = ref_lens.max(), hyp_lens.max()
+
+    # Computation
+    arange = np.arange(n_hyp + 1, dtype=np.int64)
+    d = np.empty((bs, n_ref + 1, n_hyp + 1), dtype=np.int64)
+    d[:, 0] = arange
+    t = np.empty((bs, n_hyp + 1), dtype=np.int64)
+    for i in range(1, n_ref + 1):
+        t[:, 0] = i
+        cost = ref_ids[:, i - 1:i] != hyp_ids[:, :n_hyp]
+        np.minimum(d[:, i - 1, :-1] + cost, d[:, i - 1, 1:] + 1, out=t[:, 1:])
+        d[:, i] = np.minimum.accumulate(t - arange, axis=1) + arange
+
+    # Find out the manipulation steps
+    if bs == 1:
+        return _backtrack_single(d[0].tolist(), ref_ids[0].tolist(), hyp_ids[0].tolist(),
+                                 ref_lens[0], hyp_lens[0])
+    n_sub = np.zeros(bs, dtype=np.int64)
+    n_ins = np.zeros(bs, dtype=np.int64)
+    n_del = np.zeros(bs, dtype=np.int64)
+    n_cor = np.zeros(bs, dtype=np.int64)
+    batch_idx = np.arange(bs)
+    x, y = ref_lens.copy(), hyp_lens.copy()
+    while True:
+        active = (x > 0) | (y > 0)
+        if not active.any():
+            break
+        x_prev, y_prev = np.maximum(x - 1, 0), np.maximum(y - 1, 0)
+        cur = d[batch_idx, x, y]
+        diag = d[batch_idx, x_prev, y_prev]
+        left = d[batch_idx, x, y_prev]
+        match = ref_ids[batch_idx, x_prev] == hyp_ids[batch_idx, y_prev]
+        both = (x > 0) & (y > 0)
+        is_cor = both & (cur == diag) & match
+        is_ins = (y > 0) & ~is_cor & (cur == left + 1)
+        is_sub = both & ~is_cor & ~is_ins & (cur == diag + 1)
+        is_del = active & ~is_cor & ~is_ins & ~is_sub
+        n_cor += is_cor
+        n_ins += is_ins
+        n_sub += is_sub
+        n_del += is_del
+        x -= is_cor | is_sub | is_del
+        y -= is_cor | is_ins | is_sub
+
+    assert (d[batch_idx, ref_lens, hyp_lens] == n_sub + n_ins + n_del).all()
+    assert (n_cor == ref_lens - n_sub - n_del).all()
+    return n_sub, n_ins, n_del
+
+
+def _backtrack_single(d, ref, hyp, x, y):
+    # NOTE: looping over Python lists is faster than numpy for a single pair
+    n_sub, n_ins, n_del = 0, 0, 0
+    while x > 0 or y > 0:
+        if x > 0 and y > 0 and d[x][y] == d[x - 1][y - 1] and ref[x - 1] == hyp[y - 1]:
+            x, y = x - 1, y - 1
+        elif y > 0 and d[x][y] == d[x][y - 1] + 1:
+            n_ins += 1
+            y -= 1
+        elif x > 0 and y > 0 and d[x][y] == d[x - 1][y - 1] + 1:
+            n_sub += 1
+            x, y = x - 1, y - 1
+        else:
+            n_del += 1
+            x -= 1
+    assert d[-1][-1] == n_sub + n_ins + n_del
+    return np.array([[n_sub], [n_ins], [n_del]], dtype=np.int64)
 
 
 def wer_align(ref, hyp, normalize=False, double_byte=False):
@@ -6,11 +6,11 @@
 
 """Evaluate a phene-level model by PER."""
 
-import codecs
 import logging
-from tqdm import tqdm
+import os
 
-from neural_sp.evaluators.edit_distance import compute_wer
+from neural_sp.evaluators.pipeline import EvalPipeline
+from neural_sp.evaluators.streaming_latency import StreamingLatencyProfiler
 from neural_sp.utils import mkdir_join
 
 logger = logging.getLogger(__name__)
@@ -26,7 +26,8 @@ def eval_phone(models, dataloader, recog_params, epoch,
         recog_params (dict):
         epoch (int):
         recog_dir (str):
-        streaming (bool): streaming decoding for the session-level evaluation
+        streaming (bool): streaming decoding for the session-level evaluation.
+            Latency statistics are written to latency.json/latency.csv next to hyp.trn
         progressbar (bool): visualize the progressbar
     Returns:
         per (float): Phone error rate
@@ -44,24 +45,26 @@ def eval_phone(models, dataloader, recog_params, epoch,
         ref_trn_path = mkdir_join(recog_dir, 'ref.trn')
         hyp_trn_path = mkdir_join(recog_dir, 'hyp.trn')
 
-    per = 0
-    n_sub, n_ins, n_del = 0, 0, 0
-    n_phone = 0
+    profiler = StreamingLatencyProfiler() if streaming else None
 
-    # Reset data counter
-    dataloader.reset()
+    def postprocess(batch, best_hyps_id):
+        refs = [batch['text'][b] for b in range(len(best_hyps_id))]
+        hyps = [dataloader.idx2token[0](best_hyps_id[b]) for b in range(len(best_hyps_id))]
+        if not streaming:
+            # Compute PER
+            pipeline.wer.add([ref.split(' ') for ref in refs],
+                             [hyp.split(' ') for hyp in hyps])
+        return refs, hyps
 
-    if progressbar:
-        pbar = tqdm(total=len(dataloader))
-
-    with codecs.open(hyp_trn_path, 'w', encoding='utf-8') as f_hyp, \
-            codecs.open(ref_trn_path, 'w', encoding='utf-8') as f_ref:
-        while True:
-            batch, is_new_epoch = dataloader.next(recog_params['recog_batch_size'])
+    with EvalPipeline(dataloader, recog_params['recog_batch_size'], ref_trn_path, hyp_trn_path,
+                      streaming=streaming, progressbar=progressbar) as pipeline:
+        for batch in pipeline:
             if streaming or recog_params['recog_chunk_sync']:
                 best_hyps_id, _ = models[0].decode_streaming(
                     batch['xs'], recog_params, dataloader.idx2token[0],
-                    exclude_eos=True)
+                    exclude_eos=True,
+                    profiler=profiler,
+                    session_id=batch['utt_ids'][0])
             else:
                 best_hyps_id, _ = models[0].decode(
                     batch['xs'], recog_params,
@@ -71,52 +74,12 @@ def eval_phone(models, dataloader, recog_params, epoch,
                     utt_ids=batch['utt_ids'],
                     speakers=batch['sessions' if dataloader.corpus == 'swbd' else 'speakers'],
                     ensemble_models=models[1:] if len(models) > 1 else [])
+            pipeline.submit(postprocess, batch, best_hyps_id)
+
+    if profiler is not None:
+        profiler.save(os.path.dirname(hyp_trn_path))
 
-            for b in range(len(batch['xs'])):
-                ref = batch['text'][b]
-                hyp = dataloader.idx2token[0](best_hyps_id[b])
-
-                # Write to trn
-                speaker = str(batch['speakers'][b]).replace('-', '_')
-                if streaming:
-                    utt_id = str(batch['utt_ids'][b]) + '_0000000_0000001'
-                else:
-                    utt_id = str(batch['utt_ids'][b])
-                f_ref.write(ref + ' (' + speaker + '-' + utt_id + ')\n')
-                f_hyp.write(hyp + ' (' + speaker + '-' + utt_id + ')\n')
-                logger.debug('utt-id: %s' % utt_id)
-                logger.debug('Ref: %s' % ref)
-                logger.debug('Hyp: %s' % hyp)
-                logger.debug('-' * 150)
-
-                if not streaming:
-                    # Compute PER
-                    per_b, sub_b, ins_b, del_b = compute_wer(ref=ref.split(' '),
-                                                             hyp=hyp.split(' '),
-                                                             normalize=False)
-                    per += per_b
-                    n_sub += sub_b
-                    n_ins += ins_b
-                    n_del += del_b
-                    n_phone += len(ref.split(' '))
-
-                if progressbar:
-                    pbar.update(1)
-
-            if is_new_epoch:
-                break
-
-    if progressbar:
-        pbar.close()
-
-    # Reset data counters
-    dataloader.reset()
-
-    if not streaming:
-        per /= n_phone
-        n_sub /= n_phone
-        n_ins /= n_phone
-        n_del /= n_phone
+    per, n_sub, n_ins, n_del = pipeline.wer.rates()
 
     logger.debug('PER (%s): %.2f %%' % (dataloader.set, per))
     logger.debug('SUB: %.2f / INS: %.2f / DEL: %.2f' % (n_sub, n_ins, n_del))
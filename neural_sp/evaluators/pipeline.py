@@ -0,0 +1,223 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Evaluation loop overlapping decoding with post-processing."""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import codecs
+import logging
+import queue
+import threading
+from tqdm import tqdm
+
+from neural_sp.evaluators.edit_distance import compute_wer_batch
+
+logger = logging.getLogger(__name__)
+
+
+class ErrorCounter(object):
+    """Accumulate edit errors of ref/hyp pairs."""
+
+    def __init__(self):
+        self.n_err, self.n_sub, self.n_ins, self.n_del = 0, 0, 0, 0
+        self.n_ref = 0
+
+    def add(self, refs, hyps):
+        """Score ref/hyp pairs.
+
+        Args:
+            refs (list): references, each of which is a list of tokens
+            hyps (list): hypotheses, each of which is a list of tokens
+        Returns:
+            err (np.ndarray): `[B]`, errors of each pair (x100 as in compute_wer)
+
+        """
+        err, n_sub, n_ins, n_del = compute_wer_batch(refs, hyps)
+        self.n_err += err.sum()
+        self.n_sub += n_sub.sum()
+        self.n_ins += n_ins.sum()
+        self.n_del += n_del.sum()
+        self.n_ref += sum(len(ref) for ref in refs)
+        return err
+
+    def rates(self):
+        """Error rates [%] normalized by the total length of references.
+
+        Returns:
+            err (float): error rate
+            n_sub (float): substitution rate
+            n_ins (float): insertion rate
+            n_del (float): deletion rate
+
+        """
+        if self.n_ref == 0:
+            return 0, 0, 0, 0
+        return (self.n_err / self.n_ref, self.n_sub / self.n_ref,
+                self.n_ins / self.n_ref, self.n_del / self.n_ref)
+
+
+class EvalPipeline(object):
+    """Evaluation loop overlapping decoding with post-processing.
+
+    The next mini-batch is loaded in a background thread while the current
+    one is decoded, and post-processing of decoded mini-batches
+    (detokenization, scoring and writing to trn files) runs in a worker
+    thread in the order of mini-batches. Error counters are updated only in
+    the worker thread.
+
+    Args:
+        dataloader (torch.utils.data.DataLoader): evaluation dataloader
+        batch_size (int): size of mini-batch
+        ref_trn_path (str): path to write references
+        hyp_trn_path (str): path to write hypotheses
+        streaming (bool): add a dummy segment to utterance IDs in trn files
+        progressbar (bool): visualize the progressbar
+        n_prefetch (int): number of mini-batches loaded in advance.
+            Everything runs on the calling thread if 0.
+        max_pending (int): maximum number of mini-batches waiting for post-processing
+
+    """
+
+    def __init__(self, dataloader, batch_size, ref_trn_path, hyp_trn_path,
+                 streaming=False, progressbar=False, n_prefetch=1, max_pending=4):
+        self.dataloader = dataloader
+        self.batch_size = batch_size
+        self.streaming = streaming
+        self.n_prefetch = n_prefetch
+        self.max_pending = max_pending
+
+        self.wer = ErrorCounter()
+        self.cer = ErrorCounter()
+
+        self.f_ref = codecs.open(ref_trn_path, 'w', encoding='utf-8')
+        self.f_hyp = codecs.open(hyp_trn_path, 'w', encoding='utf-8')
+        self.pbar = tqdm(total=len(dataloader)) if progressbar else None
+        self.executor = ThreadPoolExecutor(max_workers=1) if n_prefetch > 0 else None
+        self._futures = deque()
+        self._stop_event = threading.Event()
+        self._loader = None
+
+        # Reset data counter
+        dataloader.reset(batch_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(wait=exc_type is None)
+
+    def __iter__(self):
+        """Yield mini-batches until the end of the epoch."""
+        if self.n_prefetch == 0:
+            while True:
+                batch, is_new_epoch = self.dataloader.next(self.batch_size)
+                yield batch
+                if is_new_epoch:
+                    return
+
+        batches = queue.Queue(maxsize=self.n_prefetch)
+
+        def put(item):
+            while not self._stop_event.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def load():
+            try:
+                while True:
+                    batch, is_new_epoch = self.dataloader.next(self.batch_size)
+                    if not put((batch, None)) or is_new_epoch:
+                        break
+            except Exception as e:
+                put((None, e))
+                return
+            put((None, None))
+
+        self._loader = threading.Thread(target=load, daemon=True)
+        self._loader.start()
+        try:
+            while True:
+                batch, error = batches.get()
+                if error is not None:
+                    raise error
+                if batch is None:
+                    break
+                yield batch
+        finally:
+            self._stop_loader()
+
+    def _stop_loader(self):
+        # the dataloader is not touched after this
+        self._stop_event.set()
+        if self._loader is not None:
+            self._loader.join()
+            self._loader = None
+
+    def submit(self, postprocess, batch, *args):
+        """Post-process a decoded mini-batch in the worker thread.
+
+        Args:
+            postprocess (callable): called as `postprocess(batch, *args)` and
+                returns lists of references and hypotheses (str) to write to trn files.
+                Errors can be accumulated in `self.wer` and `self.cer` there.
+            batch (dict): mini-batch
+            args: decoding results of the mini-batch
+
+        """
+        if self.executor is None:
+            self._process(postprocess, batch, *args)
+            return
+        # propagate errors and bound the number of mini-batches in memory
+        while len(self._futures) > 0 and (self._futures[0].done() or len(self._futures) >= self.max_pending):
+            self._futures.popleft().result()
+        self._futures.append(self.executor.submit(self._process, postprocess, batch, *args))
+
+    def _process(self, postprocess, batch, *args):
+        refs, hyps = postprocess(batch, *args)
+        for b, (ref, hyp) in enumerate(zip(refs, hyps)):
+            speaker = str(batch['speakers'][b]).replace('-', '_')
+            if self.streaming:
+                utt_id = str(batch['utt_ids'][b]) + '_0000000_0000001'
+            else:
+                utt_id = str(batch['utt_ids'][b])
+            self.f_ref.write(ref + ' (' + speaker + '-' + utt_id + ')\n')
+            self.f_hyp.write(hyp + ' (' + speaker + '-' + utt_id + ')\n')
+            logger.debug('utt-id: %s' % utt_id)
+            logger.debug('Ref: %s' % ref)
+            logger.debug('Hyp: %s' % hyp)
+            logger.debug('-' * 150)
+        if self.pbar is not None:
+            self.pbar.update(len(refs))
+
+    def close(self, wait=True):
+        """Wait for post-processing of all mini-batches and close files.
+
+        Args:
+            wait (bool): if False, discard pending mini-batches (on errors)
+
+        """
+        self._stop_loader()
+        try:
+            while len(self._futures) > 0:
+                future = self._futures.popleft()
+                if wait:
+                    future.result()
+                else:
+                    future.cancel()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+            self.f_ref.close()
+            self.f_hyp.close()
+            if self.pbar is not None:
+                self.pbar.close()
+            # Reset data counters
+            self.dataloader.reset()
@@ -8,12 +8,15 @@
 
 import logging
 import numpy as np
+import time
+import torch
 from tqdm import tqdm
 
 from neural_sp.models.lm.gated_convlm import GatedConvLM
 from neural_sp.models.lm.rnnlm import RNNLM
 from neural_sp.models.lm.transformerlm import TransformerLM
 from neural_sp.models.lm.transformer_xl import TransformerXL
+from neural_sp.models.torch_utils import np2tensor
 
 logger = logging.getLogger(__name__)
 
@@ -31,26 +34,39 @@ def check_lm(model):
         return False
 
 
+def is_stateful(model):
+    """Whether states (or memory) of the LM are carried over mini-batches."""
+    if isinstance(model, (RNNLM, TransformerXL)):
+        return True
+    elif isinstance(model, TransformerLM):
+        return model.mem_len > 0
+    else:
+        return False
+
+
 def eval_ppl(models, dataloader, batch_size=1, bptt=None,
-             n_caches=0, progressbar=False):
+             n_caches=0, progressbar=False, stride=0):
     """Evaluate a Seq2seq or (RNN/GatedConv)LM by perprexity and loss.
 
     Args:
         models (list): models to evaluate
         dataloader (torch.utils.data.DataLoader): evaluation dataloader
-        batch_size (int): batch size
+        batch_size (int): batch size.
+            For LMs, number of segments (or windows) scored in parallel (see eval_ppl_parallel)
         bptt (int): BPTT length
-        n_caches (int):
+        n_caches (int): number of cached steps of the neural cache for LMs
         progressbar (bool): if True, visualize the progressbar
+        stride (int): stride of the sliding window for LMs without states
     Returns:
         ppl (float): Average perplexity
         loss (float): Average loss
 
     """
-    is_lm = check_lm(models[0])
+    if check_lm(models[0]):
+        return eval_ppl_parallel(models[0], dataloader, batch_size, bptt, stride,
+                                 n_caches, progressbar)
     total_loss = 0
     n_tokens = 0
-    hidden = None  # for RNNLM
 
     # Reset data counter
     dataloader.reset()
@@ -59,36 +75,15 @@ def eval_ppl(models, dataloader, batch_size=1, bptt=None,
         pbar = tqdm(total=len(dataloader))
 
     while True:
-        if is_lm:
-            ys, is_new_epoch = dataloader.next(batch_size, bptt)
-            bs, time = ys.shape[:2]
-            if n_caches > 0:
-                assert isinstance(models[0], RNNLM)
-                # NOTE: cache is not supported for GatedConvLM/TransformerLM now
-                for t in range(time - 1):
-                    loss, hidden = models[0](ys[:, t:t + 2], hidden, is_eval=True, n_caches=n_caches)[:2]
-                    total_loss += loss.item() * bs
-                    n_tokens += bs
-
-                    if progressbar:
-                        pbar.update(bs)
-            else:
-                loss, hidden = models[0](ys, hidden, is_eval=True)[:2]
-                total_loss += loss.item() * bs * (time - 1)
-                n_tokens += bs * (time - 1)
-
-                if progressbar:
-                    pbar.update(bs * (time - 1))
-        else:
-            batch, is_new_epoch = dataloader.next(batch_size)
-            bs = len(batch['ys'])
-            loss, _ = models[0](batch, task='all', is_eval=True)
-            total_loss += loss.item() * bs
-            n_tokens += sum([len(y) for y in batch['ys']])
-            # NOTE: loss is divided by batch size in the ASR model
+        batch, is_new_epoch = dataloader.next(batch_size)
+        bs = len(batch['ys'])
+        loss, _ = models[0](batch, task='all', is_eval=True)
+        total_loss += loss.item() * bs
+        n_tokens += sum([len(y) for y in batch['ys']])
+        # NOTE: loss is divided by batch size in the ASR model
 
-            if progressbar:
-                pbar.update(bs)
+        if progressbar:
+            pbar.update(bs)
 
         if is_new_epoch:
             break
@@ -106,3 +101,162 @@ def eval_ppl(models, dataloader, batch_size=1, bptt=None,
     logger.debug('Loss (%s): %.2f %%' % (dataloader.set, avg_loss))
 
     return ppl, avg_loss
+
+
+def eval_ppl_parallel(model, dataloader, batch_size=1, bptt=None, stride=0,
+                      n_caches=0, progressbar=False):
+    """Evaluate a LM by perplexity, scoring parts of the token stream in parallel.
+
+    The concatenated token stream in `dataloader` is evaluated as follows:
+        - LMs with states (RNNLM, TransformerXL and TransformerLM with memory):
+          The stream is split into `batch_size` contiguous segments, each of which
+          is evaluated by BPTT chunks with states (memory) carried over. This is
+          the same as the single-stream evaluation except that the context
+          is reset at the boundaries of segments.
+        - LMs without states (TransformerLM without memory and GatedConvLM):
+          A window of `bptt` tokens slides over the stream by `stride` tokens,
+          and only the last `stride` tokens in each window are scored, so that
+          every token is scored once with at least `bptt - stride - 1` preceding
+          tokens. `batch_size` windows are scored at once. The single-stream
+          evaluation corresponds to `stride = bptt - 1`.
+    With the neural cache (`n_caches > 0`), the stream is always split into
+    segments so that each segment has its own cache.
+
+    Args:
+        model (LMBase): LM to evaluate
+        dataloader (neural_sp.datasets.lm.Dataset): evaluation dataloader
+        batch_size (int): number of segments (or windows) in a mini-batch
+        bptt (int): BPTT length (window length)
+        stride (int): stride of the sliding window (`bptt - 1` if 0)
+        n_caches (int): number of cached steps of the neural cache
+        progressbar (bool): if True, visualize the progressbar
+    Returns:
+        ppl (float): Average perplexity
+        loss (float): Average loss
+
+    """
+    if bptt is None:
+        bptt = dataloader.bptt
+    if stride <= 0:
+        stride = bptt - 1
+    assert 1 <= stride <= bptt - 1
+    stream = dataloader.concat_ids.reshape((-1,))
+    n_tokens = len(stream) - 1
+
+    if is_stateful(model) or n_caches > 0:
+        batches = _split_segments(stream, batch_size, bptt, dataloader.eos)
+    else:
+        batches = _sliding_windows(stream, batch_size, bptt, stride, dataloader.eos)
+
+    if progressbar:
+        pbar = tqdm(total=n_tokens)
+
+    model.eval()
+    model.reset_cache()
+    total_loss = 0.
+    state = None
+    start_time = time.time()
+    with torch.no_grad():
+        for ys, mask in batches:
+            loss, state = _score_tokens(model, ys, mask, state, n_caches)
+            total_loss += loss
+            if progressbar:
+                pbar.update(int(mask.sum()))
+
+    if progressbar:
+        pbar.close()
+    model.reset_cache()
+
+    elapsed = time.time() - start_time
+    avg_loss = total_loss / n_tokens
+    ppl = np.exp(avg_loss)
+
+    logger.info('PPL (%s): %.2f (%d tokens, %.1f tokens/sec)' %
+                (dataloader.set, ppl, n_tokens, n_tokens / max(elapsed, 1e-9)))
+    logger.debug('Loss (%s): %.2f %%' % (dataloader.set, avg_loss))
+
+    return ppl, avg_loss
+
+
+def _score_tokens(model, ys, mask, state, n_caches=0):
+    """Sum negative log-likelihoods of targets.
+
+    Args:
+        model (LMBase):
+        ys (np.ndarray): `[B, L]`
+        mask (np.ndarray): `[B, L - 1]`, targets (ys[:, 1:]) to score
+        state: states (or memory) of the LM
+        n_caches (int): number of cached steps of the neural cache
+    Returns:
+        loss (float): sum of negative log-likelihoods of the targets
+        new_state: states (or memory) of the LM
+
+    """
+    ys = np2tensor(ys, model.device)
+    logits, out, new_state = model.decode(ys[:, :-1], state=state, mems=state)
+    log_probs = model.compute_log_probs(logits, out, ys[:, 1:], n_caches)
+    nll = -torch.gather(log_probs, 2, ys[:, 1:].unsqueeze(2)).squeeze(2)
+    mask = np2tensor(mask, model.device)
+    return nll.masked_select(mask).double().sum().item(), new_state
+
+
+def _split_segments(stream, n_segments, bptt, pad):
+    """Split a token stream into contiguous segments and iterate over BPTT chunks.
+
+    Adjacent segments share a token so that every target is scored once.
+
+    Args:
+        stream (np.ndarray): `[T]`
+        n_segments (int): number of segments
+        bptt (int): BPTT length
+        pad (int): index for padding
+    Yields:
+        ys (np.ndarray): `[n_segments, bptt]`
+        mask (np.ndarray): `[n_segments, bptt - 1]`
+
+    """
+    n_tokens = len(stream) - 1
+    n_segments = max(1, min(n_segments, n_tokens))
+    seg_len = -(-n_tokens // n_segments)  # ceil
+    ys = np.full((n_segments, seg_len + 1), pad, dtype=np.int64)
+    mask = np.zeros((n_segments, seg_len), dtype=bool)
+    for b in range(n_segments):
+        segment = stream[b * seg_len:(b + 1) * seg_len + 1]
+        ys[b, :len(segment)] = segment
+        mask[b, :max(0, len(segment) - 1)] = True
+    for offset in range(0, seg_len, bptt - 1):
+        yield ys[:, offset:offset + bptt], mask[:, offset:offset + bptt - 1]
+
+
+def _sliding_windows(stream, batch_size, bptt, stride, pad):
+    """Iterate over mini-batches of sliding windows.
+
+    Args:
+        stream (np.ndarray): `[T]`
+        batch_size (int): number of windows in a mini-batch
+        bptt (int): window length
+        stride (int): number of tokens scored in each window
+        pad (int): index for padding
+    Yields:
+        ys (np.ndarray): `[B, bptt]`
+        mask (np.ndarray): `[B, bptt - 1]`
+
+    """
+    # end of each window (exclusive)
+    ends = [min(bptt, len(stream))]
+    while ends[-1] < len(stream):
+        ends.append(min(ends[-1] + stride, len(stream)))
+    prev_ends = [1] + ends[:-1]  # targets in [prev_end, end) are scored
+    context = bptt - stride - 1
+
+    for i in range(0, len(ends), batch_size):
+        bs = min(batch_size, len(ends) - i)
+        ys = np.full((bs, bptt), pad, dtype=np.int64)
+        mask = np.zeros((bs, bptt - 1), dtype=bool)
+        for b, (prev_end, end) in enumerate(zip(prev_ends[i:i + bs], ends[i:i + bs])):
+            # NOTE: the last window is not extended to the left so that
+            # stride=bptt-1 is identical to the single-stream evaluation
+            start = max(0, prev_end - 1 - context)
+            ys[b, :end - start] = stream[start:end]
+            mask[b, prev_end - start - 1:end - start - 1] = True
+        yield ys, mask
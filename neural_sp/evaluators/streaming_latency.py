@@ -0,0 +1,223 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Latency profiler for streaming decoding."""
+
+import codecs
+from contextlib import contextmanager
+import json
+import logging
+import numpy as np
+import os
+import time
+import torch
+
+logger = logging.getLogger(__name__)
+
+PHASES = ['feature', 'encode', 'vad', 'decode']
+PERCENTILES = [50, 90, 99]
+
+
+class StreamingLatencyProfiler(object):
+    """Record per-chunk wall time and token emission timing in streaming decoding.
+
+    Input features are assumed to arrive in real time, i.e., the last frame of
+    each chunk (including the lookahead frames) becomes available at
+    `end_frame * frame_shift` [ms] after the start of the session. Processing of
+    a chunk starts when its input has arrived and the previous chunk is done.
+    When the decoder backs off to a boundary in the middle of a chunk, the
+    frames after the boundary are counted in the next chunk only.
+
+    Args:
+        frame_shift (float): frame shift [ms] of input features
+        enabled (bool): if False, all methods are no-ops
+
+    """
+
+    def __init__(self, frame_shift=10., enabled=True):
+        self.frame_shift = frame_shift
+        self.enabled = enabled
+        self.sessions = []
+        self._session = None
+        self._chunk = None
+
+    def start_session(self, session_id, n_frames):
+        """Start a new streaming session.
+
+        Args:
+            session_id (str): utterance or session ID
+            n_frames (int): number of input frames in the session
+
+        """
+        if not self.enabled:
+            return
+        self._session = {'session_id': str(session_id),
+                         'n_frames': int(n_frames),
+                         'chunks': [],
+                         'tokens': [],
+                         'n_emitted': 0,
+                         'clock': 0.}  # simulated real-time clock [ms]
+
+    def start_chunk(self, offset, n_frames_current, n_frames_lookahead):
+        """Start processing a new chunk.
+
+        Args:
+            offset (int): first input frame index of the current chunk
+            n_frames_current (int): number of frames in the current chunk
+            n_frames_lookahead (int): number of lookahead frames
+
+        """
+        if not self.enabled:
+            return
+        n_frames = self._session['n_frames']
+        end_frame = min(offset + n_frames_current + n_frames_lookahead, n_frames)
+        self._chunk = {'chunk_idx': len(self._session['chunks']),
+                       'offset': int(offset),
+                       'n_frames': int(max(0, min(n_frames_current, n_frames - offset))),
+                       'end_frame': int(end_frame),
+                       'n_rewound': 0}
+        for phase in PHASES:
+            self._chunk[phase] = 0.
+
+    @contextmanager
+    def timer(self, phase):
+        """Measure wall time [ms] of `phase` in the current chunk."""
+        if not self.enabled:
+            yield
+            return
+        _synchronize()
+        start = time.time()
+        yield
+        _synchronize()
+        self._chunk[phase] += (time.time() - start) * 1000
+
+    def emit(self, n_tokens, is_final=False):
+        """Register tokens visible to the user after the current chunk.
+
+        Args:
+            n_tokens (int): total number of tokens emitted so far in the session
+                (partial hypothesis length for chunk-synchronous decoding)
+            is_final (bool): tokens are finalized (segment-level decoding)
+
+        """
+        if not self.enabled:
+            return
+        for _ in range(self._session['n_emitted'], n_tokens):
+            self._session['tokens'].append({'token_idx': self._session['n_emitted'],
+                                            'chunk_idx': self._chunk['chunk_idx'],
+                                            'frame': self._chunk['end_frame'],
+                                            'is_final': is_final})
+            self._session['n_emitted'] += 1
+
+    def end_chunk(self, next_offset=None):
+        """Finish the current chunk and advance the simulated clock.
+
+        Args:
+            next_offset (int): first input frame index of the next chunk after
+                back-off (no rewind if None)
+
+        """
+        if not self.enabled:
+            return
+        c = self._chunk
+        s = self._session
+        if next_offset is not None and next_offset < c['offset'] + c['n_frames']:
+            # frames after the boundary are processed again in the next chunk
+            n_frames = max(0, next_offset - c['offset'])
+            c['n_rewound'] = c['n_frames'] - n_frames
+            c['n_frames'] = n_frames
+        compute = sum(c[phase] for phase in PHASES)
+        arrival = c['end_frame'] * self.frame_shift
+        c['arrival'] = arrival
+        c['emit_time'] = max(s['clock'], arrival) + compute
+        c['rtf'] = compute / (c['n_frames'] * self.frame_shift) if c['n_frames'] > 0 else 0.
+        s['clock'] = c['emit_time']
+        for token in s['tokens']:
+            if token['chunk_idx'] == c['chunk_idx']:
+                token['emit_time'] = c['emit_time']
+                # delay from the arrival of the first frame in the chunk
+                token['delay'] = c['emit_time'] - c['offset'] * self.frame_shift
+        s['chunks'].append(c)
+        self._chunk = None
+
+    def end_session(self):
+        """Finish the current session and compute session-level latencies."""
+        if not self.enabled:
+            return
+        s = self._session
+        audio_end = s['n_frames'] * self.frame_shift
+        s['first_token_latency'] = s['tokens'][0]['emit_time'] if len(s['tokens']) > 0 else None
+        s['final_token_latency'] = s['tokens'][-1]['emit_time'] - audio_end if len(s['tokens']) > 0 else None
+        s['rtf'] = sum(sum(c[phase] for phase in PHASES) for c in s['chunks']) / max(audio_end, 1e-8)
+        del s['n_emitted'], s['clock']
+        self.sessions.append(s)
+        self._session = None
+
+    def summary(self):
+        """Aggregate statistics over all sessions.
+
+        Returns:
+            summary (dict): latency [ms] and RTF statistics
+
+        """
+        chunks = [c for s in self.sessions for c in s['chunks']]
+        tokens = [t for s in self.sessions for t in s['tokens']]
+        first = [s['first_token_latency'] for s in self.sessions if s['first_token_latency'] is not None]
+        final = [s['final_token_latency'] for s in self.sessions if s['final_token_latency'] is not None]
+        summary = {'n_sessions': len(self.sessions),
+                   'n_chunks': len(chunks),
+                   'n_tokens': len(tokens),
+                   'rtf': _mean([s['rtf'] for s in self.sessions])}
+        summary.update(_percentiles('first_token_latency', first))
+        summary.update(_percentiles('final_token_latency', final))
+        summary.update(_percentiles('emission_delay', [t['delay'] for t in tokens]))
+        summary.update(_percentiles('chunk_rtf', [c['rtf'] for c in chunks]))
+        for phase in PHASES:
+            summary.update(_percentiles('chunk_%s_time' % phase, [c[phase] for c in chunks]))
+        return summary
+
+    def save(self, save_dir):
+        """Write `latency.json` (summary and per-session records) and
+            `latency.csv` (per-chunk records) to `save_dir`.
+
+        Args:
+            save_dir (str): directory containing hyp.trn
+
+        """
+        summary = self.summary()
+        with codecs.open(os.path.join(save_dir, 'latency.json'), 'w', encoding='utf-8') as f:
+            json.dump({'summary': summary, 'sessions': self.sessions}, f, indent=2)
+
+        keys = ['session_id', 'chunk_idx', 'offset', 'n_frames', 'n_rewound', 'end_frame'] + \
+            PHASES + ['arrival', 'emit_time', 'rtf']
+        with codecs.open(os.path.join(save_dir, 'latency.csv'), 'w', encoding='utf-8') as f:
+            f.write(','.join(keys) + '\n')
+            for s in self.sessions:
+                for c in s['chunks']:
+                    c = dict(c, session_id=s['session_id'])
+                    f.write(','.join([str(c[k]) if isinstance(c[k], (int, str)) else '%.3f' % c[k]
+                                      for k in keys]) + '\n')
+
+        for k in ['first_token_latency', 'final_token_latency', 'emission_delay', 'chunk_rtf']:
+            logger.info('%s (p50/p90/p99): %s' %
+                        (k, ' / '.join(['%.3f' % summary['%s_p%d' % (k, p)] for p in PERCENTILES])))
+        return summary
+
+
+def _synchronize():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+def _mean(values):
+    return float(np.mean(values)) if len(values) > 0 else 0.
+
+
+def _percentiles(name, values):
+    stats = {'%s_mean' % name: _mean(values)}
+    for p in PERCENTILES:
+        stats['%s_p%d' % (name, p)] = float(np.percentile(values, p)) if len(values) > 0 else 0.
+    return stats
@@ -6,14 +6,14 @@
 
 """Evaluate the word-level model by WER."""
 
-import codecs
 import copy
 import logging
 import numpy as np
-from tqdm import tqdm
+import os
 
-from neural_sp.evaluators.edit_distance import compute_wer
+from neural_sp.evaluators.pipeline import EvalPipeline
 from neural_sp.evaluators.resolving_unk import resolve_unk
+from neural_sp.evaluators.streaming_latency import StreamingLatencyProfiler
 from neural_sp.utils import mkdir_join
 
 logger = logging.getLogger(__name__)
@@ -29,7 +29,8 @@ def eval_word(models, dataloader, recog_params, epoch,
         recog_params (dict):
         epoch (int):
         recog_dir (str):
-        streaming (bool): streaming decoding for the session-level evaluation
+        streaming (bool): streaming decoding for the session-level evaluation.
+            Latency statistics are written to latency.json/latency.csv next to hyp.trn
         progressbar (bool): visualize the progressbar
     Returns:
         wer (float): Word error rate
@@ -50,26 +51,47 @@ def eval_word(models, dataloader, recog_params, epoch,
         ref_trn_path = mkdir_join(recog_dir, 'ref.trn')
         hyp_trn_path = mkdir_join(recog_dir, 'hyp.trn')
 
-    wer, cer = 0, 0
-    n_sub_w, n_ins_w, n_del_w = 0, 0, 0
-    n_sub_c, n_ins_c, n_del_c = 0, 0, 0
-    n_word, n_char = 0, 0
     n_oov_total = 0
-
-    # Reset data counter
-    dataloader.reset(recog_params['recog_batch_size'])
-
-    if progressbar:
-        pbar = tqdm(total=len(dataloader))
-
-    with codecs.open(hyp_trn_path, 'w', encoding='utf-8') as f_hyp, \
-            codecs.open(ref_trn_path, 'w', encoding='utf-8') as f_ref:
-        while True:
-            batch, is_new_epoch = dataloader.next(recog_params['recog_batch_size'])
+    profiler = StreamingLatencyProfiler() if streaming else None
+
+    def postprocess(batch, best_hyps_id, resolved_hyps):
+        nonlocal n_oov_total
+        refs, hyps = [], []
+        refs_c, hyps_c = [], []
+        for b in range(len(best_hyps_id)):
+            ref = batch['text'][b]
+            hyp = dataloader.idx2token[0](best_hyps_id[b])
+            n_oov_total += hyp.count('<unk>')
+
+            if b in resolved_hyps:
+                hyp = resolved_hyps[b]
+                # Compute CER
+                ref_char = ref
+                hyp_char = hyp
+                if dataloader.corpus == 'csj':
+                    ref_char = ref.replace(' ', '')
+                    hyp_char = hyp.replace(' ', '')
+                refs_c.append(list(ref_char))
+                hyps_c.append(list(hyp_char))
+            refs.append(ref)
+            hyps.append(hyp)
+
+        pipeline.cer.add(refs_c, hyps_c)
+        if not streaming:
+            # Compute WER
+            pipeline.wer.add([ref.split(' ') for ref in refs],
+                             [hyp.split(' ') for hyp in hyps])
+        return refs, hyps
+
+    with EvalPipeline(dataloader, recog_params['recog_batch_size'], ref_trn_path, hyp_trn_path,
+                      streaming=streaming, progressbar=progressbar) as pipeline:
+        for batch in pipeline:
             if streaming or recog_params['recog_chunk_sync']:
                 best_hyps_id, _ = models[0].decode_streaming(
                     batch['xs'], recog_params, dataloader.idx2token[0],
-                    exclude_eos=True)
+                    exclude_eos=True,
+                    profiler=profiler,
+                    session_id=batch['utt_ids'][0])
             else:
                 best_hyps_id, aws = models[0].decode(
                     batch['xs'], recog_params,
@@ -80,14 +102,13 @@ def eval_word(models, dataloader, recog_params, epoch,
                     speakers=batch['sessions' if dataloader.corpus == 'swbd' else 'speakers'],
                     ensemble_models=models[1:] if len(models) > 1 else [])
 
-            for b in range(len(batch['xs'])):
-                ref = batch['text'][b]
-                hyp = dataloader.idx2token[0](best_hyps_id[b])
-
-                n_oov_total += hyp.count('<unk>')
-
-                # Resolving UNK
-                if recog_params['recog_resolving_unk'] and '<unk>' in hyp:
+            # Resolving UNK (decoding by the character-level decoder)
+            resolved_hyps = {}
+            if recog_params['recog_resolving_unk']:
+                for b in range(len(batch['xs'])):
+                    hyp = dataloader.idx2token[0](best_hyps_id[b])
+                    if '<unk>' not in hyp:
+                        continue
                     recog_params_char = copy.deepcopy(recog_params)
                     recog_params_char['recog_lm_weight'] = 0
                     recog_params_char['recog_beam_width'] = 1
@@ -108,70 +129,15 @@ def eval_word(models, dataloader, recog_params, epoch,
                         subsample_factor_word=np.prod(models[0].subsample),
                         subsample_factor_char=np.prod(models[0].subsample[:models[0].enc_n_layers_sub1 - 1]))
                     logger.debug('Hyp (after OOV resolution): %s' % hyp)
-                    hyp = hyp.replace('*', '')
-
-                    # Compute CER
-                    ref_char = ref
-                    hyp_char = hyp
-                    if dataloader.corpus == 'csj':
-                        ref_char = ref.replace(' ', '')
-                        hyp_char = hyp.replace(' ', '')
-                    cer_b, sub_b, ins_b, del_b = compute_wer(ref=list(ref_char),
-                                                             hyp=list(hyp_char),
-                                                             normalize=False)
-                    cer += cer_b
-                    n_sub_c += sub_b
-                    n_ins_c += ins_b
-                    n_del_c += del_b
-                    n_char += len(ref_char)
-
-                # Write to trn
-                speaker = str(batch['speakers'][b]).replace('-', '_')
-                if streaming:
-                    utt_id = str(batch['utt_ids'][b]) + '_0000000_0000001'
-                else:
-                    utt_id = str(batch['utt_ids'][b])
-                f_ref.write(ref + ' (' + speaker + '-' + utt_id + ')\n')
-                f_hyp.write(hyp + ' (' + speaker + '-' + utt_id + ')\n')
-                logger.debug('utt-id: %s' % utt_id)
-                logger.debug('Ref: %s' % ref)
-                logger.debug('Hyp: %s' % hyp)
-                logger.debug('-' * 150)
-
-                if not streaming:
-                    # Compute WER
-                    wer_b, sub_b, ins_b, del_b = compute_wer(ref=ref.split(' '),
-                                                             hyp=hyp.split(' '),
-                                                             normalize=False)
-                    wer += wer_b
-                    n_sub_w += sub_b
-                    n_ins_w += ins_b
-                    n_del_w += del_b
-                    n_word += len(ref.split(' '))
-
-                if progressbar:
-                    pbar.update(1)
-
-            if is_new_epoch:
-                break
-
-    if progressbar:
-        pbar.close()
-
-    # Reset data counters
-    dataloader.reset()
-
-    if not streaming:
-        wer /= n_word
-        n_sub_w /= n_word
-        n_ins_w /= n_word
-        n_del_w /= n_word
-
-        if n_char > 0:
-            cer /= n_char
-            n_sub_c /= n_char
-            n_ins_c /= n_char
-            n_del_c /= n_char
+                    resolved_hyps[b] = hyp.replace('*', '')
+
+            pipeline.submit(postprocess, batch, best_hyps_id, resolved_hyps)
+
+    if profiler is not None:
+        profiler.save(os.path.dirname(hyp_trn_path))
+
+    wer, n_sub_w, n_ins_w, n_del_w = pipeline.wer.rates()
+    cer, n_sub_c, n_ins_c, n_del_c = pipeline.cer.rates()
 
     logger.debug('WER (%s): %.2f %%' % (dataloader.set, wer))
     logger.debug('SUB: %.2f / INS: %.2f / DEL: %.2f' % (n_sub_w, n_ins_w, n_del_w))
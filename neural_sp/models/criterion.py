@@ -15,6 +15,8 @@ import numpy as np
 import torch
 import torch.nn.functional as F
 
+from neural_sp.models.torch_utils import make_pad_mask
+
 
 class MBR(torch.autograd.Function):
     """Minimum Bayes Risk (MBR) training.
@@ -50,6 +52,92 @@ class MBR(torch.autograd.Function):
         return input, None, None, None
 
 
+class ChunkedTokenSum(torch.autograd.Function):
+    """Masked sum of element-wise losses over log-probabilities computed chunk by chunk
+        over the vocabulary.
+
+    Only the log-partition function of each token is saved in forward, and
+    each chunk is recomputed in backward, so that intermediate tensors of
+    size `[B, L, vocab]` are never kept for backward.
+
+    """
+    @staticmethod
+    def forward(ctx, loss_fn, vocab_chunk_size, mask, logits, *xs):
+        """Forward pass.
+
+        Args:
+            loss_fn (callable): see masked_token_sum
+            vocab_chunk_size (int): chunk size over the vocabulary dimension
+            mask (BoolTensor): `[B, L]`
+            logits (FloatTensor): `[B, L, vocab]`
+            xs (FloatTensor): `[B, L, vocab]` (not differentiated)
+        Returns:
+            loss_sum (FloatTensor): `[1]`
+
+        """
+        log_z = torch.logsumexp(logits, dim=-1, keepdim=True)
+        loss = 0.
+        for v in range(0, logits.size(-1), vocab_chunk_size):
+            loss = loss + loss_fn(logits[:, :, v:v + vocab_chunk_size] - log_z,
+                                  *[x[:, :, v:v + vocab_chunk_size] for x in xs]).sum(-1)
+        ctx.loss_fn = loss_fn
+        ctx.vocab_chunk_size = vocab_chunk_size
+        ctx.save_for_backward(mask, logits, log_z, *xs)
+        return loss.masked_fill(~mask, 0).sum()
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        mask, logits, log_z, *xs = ctx.saved_tensors
+        chunk_size = ctx.vocab_chunk_size
+        grad = torch.zeros_like(logits)
+        grad_log_z = torch.zeros_like(log_z)
+        for v in range(0, logits.size(-1), chunk_size):
+            with torch.enable_grad():
+                log_probs = (logits[:, :, v:v + chunk_size] - log_z).detach().requires_grad_()
+                loss = ctx.loss_fn(log_probs, *[x[:, :, v:v + chunk_size] for x in xs]).sum(-1)
+                grad_chunk, = torch.autograd.grad(loss.masked_fill(~mask, 0).sum(), log_probs)
+            grad[:, :, v:v + chunk_size] = grad_chunk
+            grad_log_z -= grad_chunk.sum(-1, keepdim=True)
+        # gradient through the log-partition function: d(log_z)/d(logits) = softmax(logits)
+        for v in range(0, logits.size(-1), chunk_size):
+            grad[:, :, v:v + chunk_size] += grad_log_z * torch.exp(logits[:, :, v:v + chunk_size] - log_z)
+        return (None, None, None, grad * grad_output) + (None,) * len(xs)
+
+
+def masked_token_sum(loss_fn, mask, logits, *xs, vocab_chunk_size=0):
+    """Sum element-wise losses over the vocabulary and non-padded tokens.
+
+    The vocabulary dimension is reduced first so that padding is masked on
+    `[B, L]` rather than `[B, L, vocab]`. When `vocab_chunk_size` > 0,
+    `loss_fn` is applied to each chunk of the vocabulary in turn and
+    recomputed in backward (see ChunkedTokenSum), so that the full
+    `[B, L, vocab]` intermediate tensors are never materialized at once.
+
+    Args:
+        loss_fn (callable): function mapping chunks of log-probabilities of `logits`
+            and chunks of `xs` to element-wise losses of size `[B, L, vocab_chunk_size]`
+        mask (BoolTensor): `[B, L]` (True for non-padded tokens)
+        logits (FloatTensor): `[B, L, vocab]`
+        xs (FloatTensor): `[B, L, vocab]` (not differentiated)
+        vocab_chunk_size (int): chunk size over the vocabulary dimension
+    Returns:
+        loss_sum (FloatTensor): `[1]`
+
+    """
+    if 0 < vocab_chunk_size < logits.size(-1):
+        return ChunkedTokenSum.apply(loss_fn, vocab_chunk_size, mask, logits,
+                                     *[x.detach() for x in xs])
+    log_probs = logits - torch.logsumexp(logits, dim=-1, keepdim=True)
+    return loss_fn(log_probs, *xs).sum(-1).masked_fill(~mask, 0).sum()
+
+
+def _truncate(logits, ylens):
+    """Make a mask for non-padded tokens and truncate logits to the max length.
+    Logits are upcast to float32 for the reduction over the vocabulary."""
+    mask = make_pad_mask(ylens.to(logits.device))
+    return logits[:, :mask.size(1)].float(), mask
+
+
 def cross_entropy_lsm(logits, ys, lsm_prob, ignore_index, training, normalize_length=False):
     """Compute cross entropy loss for label smoothing of sequence-to-sequence models.
 
@@ -66,7 +154,7 @@ def cross_entropy_lsm(logits, ys, lsm_prob, ignore_index, training, normalize_le
     """
     bs, _, vocab = logits.size()
     ys = ys.view(-1)
-    logits = logits.view((-1, logits.size(2)))
+    logits = logits.view((-1, logits.size(2))).float()  # log-softmax in float32
 
     if lsm_prob == 0 or not training:
         loss = F.cross_entropy(logits, ys,
@@ -75,25 +163,25 @@ def cross_entropy_lsm(logits, ys, lsm_prob, ignore_index, training, normalize_le
         if not normalize_length:
             loss *= (ys != ignore_index).sum() / bs
     else:
-        with torch.no_grad():
-            target_dist = logits.new_zeros(logits.size())
-            target_dist.fill_(lsm_prob / (vocab - 1))
-            mask = (ys == ignore_index)
-            ys_masked = ys.masked_fill(mask, 0)
-            target_dist.scatter_(1, ys_masked.unsqueeze(1), 1 - lsm_prob)
-
-        log_probs = torch.log_softmax(logits, dim=-1)
-        loss_sum = -torch.mul(target_dist, log_probs)
+        # target distribution: (1 - lsm_prob) for the label, lsm_prob / (vocab - 1) for the others
+        # NOTE: the target distribution is folded into the reduction instead of being materialized
+        mask = (ys == ignore_index)
+        ys_masked = ys.masked_fill(mask, 0)
+        log_z = torch.logsumexp(logits, dim=-1)
+        log_probs_sum = logits.sum(-1) - log_z * vocab
+        log_probs_label = logits.gather(1, ys_masked.unsqueeze(1)).squeeze(1) - log_z
+        eps = lsm_prob / (vocab - 1)
+        loss_sum = -(eps * (log_probs_sum - log_probs_label) + (1 - lsm_prob) * log_probs_label)
         n_tokens = len(ys) - mask.sum().item()
         denom = n_tokens if normalize_length else bs
-        loss = loss_sum.masked_fill(mask.unsqueeze(1), 0).sum() / denom
+        loss = loss_sum.masked_fill(mask, 0).sum() / denom
 
         ppl = np.exp(loss.item()) if normalize_length else np.exp(loss.item() * bs / n_tokens)
 
     return loss, ppl
 
 
-def distillation(logits_student, logits_teacher, ylens, temperature=5.0):
+def distillation(logits_student, logits_teacher, ylens, temperature=5.0, vocab_chunk_size=0):
     """Compute cross entropy loss for knowledge distillation of sequence-to-sequence models.
 
     Args:
@@ -101,41 +189,75 @@ def distillation(logits_student, logits_teacher, ylens, temperature=5.0):
         logits_teacher (FloatTensor): `[B, T, vocab]`
         ylens (IntTensor): `[B]`
         temperature (float):
+        vocab_chunk_size (int): chunk size over the vocabulary dimension
     Returns:
         loss_mean (FloatTensor): `[1]`
 
     """
-    bs, _, vocab = logits_student.size()
+    logits_student, mask = _truncate(logits_student, ylens)
+    logits_teacher = logits_teacher[:, :mask.size(1)].detach().float()
+    log_z_teacher = torch.logsumexp(logits_teacher / temperature, dim=-1, keepdim=True)
+
+    def loss_fn(log_probs_student, x_teacher):
+        return -torch.exp(x_teacher / temperature - log_z_teacher) * log_probs_student
+
+    loss_sum = masked_token_sum(loss_fn, mask, logits_student, logits_teacher,
+                                vocab_chunk_size=vocab_chunk_size)
+    return loss_sum / ylens.sum()
 
-    log_probs_student = torch.log_softmax(logits_student, dim=-1)
-    probs_teacher = torch.softmax(logits_teacher / temperature, dim=-1).data
-    loss = -torch.mul(probs_teacher, log_probs_student)
-    loss_mean = np.sum([loss[b, :ylens[b], :].sum() for b in range(bs)]) / ylens.sum()
-    return loss_mean
 
+def distillation_topk(logits_student, topk_ids, topk_logits, ylens, temperature=5.0):
+    """Compute cross entropy loss for knowledge distillation from top-k logits of the teacher.
 
-def kldiv_lsm_ctc(logits, ylens):
+    The teacher distribution is renormalized over its top-k classes, so only
+    the student logits of these classes are gathered besides the normalizer
+    of the student distribution. This is equal to distillation when k is the
+    vocabulary size.
+
+    Args:
+        logits_student (FloatTensor): `[B, T, vocab]`
+        topk_ids (LongTensor): `[B, T, k]`
+        topk_logits (FloatTensor): `[B, T, k]` (logits or log-probabilities of the teacher)
+        ylens (IntTensor): `[B]`
+        temperature (float):
+    Returns:
+        loss_mean (FloatTensor): `[1]`
+
+    """
+    logits_student, mask = _truncate(logits_student, ylens)
+    topk_ids = topk_ids[:, :mask.size(1)].to(logits_student.device)
+    topk_logits = topk_logits[:, :mask.size(1)].to(logits_student.device).detach().float()
+    probs_teacher = torch.softmax(topk_logits / temperature, dim=-1)
+    log_z_student = torch.logsumexp(logits_student, dim=-1, keepdim=True)
+    log_probs_student = logits_student.gather(2, topk_ids) - log_z_student
+    loss = -(probs_teacher * log_probs_student).sum(-1)
+    return loss.masked_fill(~mask, 0).sum() / ylens.sum()
+
+
+def kldiv_lsm_ctc(logits, ylens, vocab_chunk_size=0):
     """Compute KL divergence loss for label smoothing of CTC and Transducer models.
 
     Args:
         logits (FloatTensor): `[B, T, vocab]`
         ylens (IntTensor): `[B]`
+        vocab_chunk_size (int): chunk size over the vocabulary dimension
     Returns:
         loss_mean (FloatTensor): `[1]`
 
     """
-    bs, _, vocab = logits.size()
+    vocab = logits.size(-1)
+    logits, mask = _truncate(logits, ylens)
+    log_uniform = math.log(1 / (vocab - 1))
 
-    log_uniform = logits.new_zeros(logits.size()).fill_(math.log(1 / (vocab - 1)))
-    probs = torch.softmax(logits, dim=-1)
-    log_probs = torch.log_softmax(logits, dim=-1)
-    loss = torch.mul(probs, log_probs - log_uniform)
-    loss_mean = np.sum([loss[b, :ylens[b], :].sum() for b in range(bs)]) / ylens.sum()
-    # assert loss_mean >= 0
-    return loss_mean
+    def loss_fn(log_probs):
+        return torch.exp(log_probs) * (log_probs - log_uniform)
 
+    loss_sum = masked_token_sum(loss_fn, mask, logits, vocab_chunk_size=vocab_chunk_size)
+    # assert loss_sum >= 0
+    return loss_sum / ylens.sum()
 
-def focal_loss(logits, ys, ylens, alpha, gamma):
+
+def focal_loss(logits, ys, ylens, alpha, gamma, vocab_chunk_size=0):
     """Compute focal loss.
 
     Args:
@@ -144,14 +266,15 @@ def focal_loss(logits, ys, ylens, alpha, gamma):
         ylens (IntTensor): `[B]`
         alpha (float):
         gamma (float):
+        vocab_chunk_size (int): chunk size over the vocabulary dimension
     Returns:
         loss_mean (FloatTensor): `[1]`
 
     """
-    bs = ys.size(0)
+    logits, mask = _truncate(logits, ylens)
+
+    def loss_fn(log_probs):
+        return -alpha * torch.mul(torch.pow(1 - torch.exp(log_probs), gamma), log_probs)
 
-    log_probs = torch.log_softmax(logits, dim=-1)
-    probs_inv = -torch.softmax(logits, dim=-1) + 1
-    loss = -alpha * torch.mul(torch.pow(probs_inv, gamma), log_probs)
-    loss_mean = np.sum([loss[b, :ylens[b], :].sum() for b in range(bs)]) / ylens.sum()
-    return loss_mean
+    loss_sum = masked_token_sum(loss_fn, mask, logits, vocab_chunk_size=vocab_chunk_size)
+    return loss_sum / ylens.sum()
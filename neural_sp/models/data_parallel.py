@@ -59,13 +59,35 @@ class CustomDataParallel(DataParallel):
         return gather(losses, output_device, dim=self.dim).mean(), observation_avg
 
 
+class CustomDistributedDataParallel(DDP):
+    """DistributedDataParallel with one process per device.
+
+    Mini-batches are already sharded over processes by the data loader, so
+    inputs are passed to the model as they are. Unused parameters are searched
+    for in every step because only a part of the model is used depending on
+    the task (e.g., `mtl_per_batch`).
+
+    Args:
+        module (torch.nn.Module): model
+        device_id (int): GPU index of the current process (None for CPU)
+
+    """
+
+    def __init__(self, module, device_id=None):
+        super(CustomDistributedDataParallel, self).__init__(
+            module,
+            device_ids=None if device_id is None else [device_id],
+            output_device=device_id,
+            find_unused_parameters=True)
+
+
 class CPUWrapperASR(nn.Module):
     def __init__(self, model):
         super(CPUWrapperASR, self).__init__()
         self.module = model
 
-    def forward(self, batch, task, is_eval=False, teacher=None, teacher_lm=None):
-        return self.module(batch, task, is_eval, teacher, teacher_lm)
+    def forward(self, batch, task, is_eval=False, teacher=None, teacher_lm=None, teacher_store=None):
+        return self.module(batch, task, is_eval, teacher, teacher_lm, teacher_store)
 
 
 class CPUWrapperLM(nn.Module):
@@ -7,20 +7,24 @@
 """Select a language model"""
 
 
-def build_lm(args, save_path=None, wordlm=False, lm_dict_path=None, asr_dict_path=None):
+def build_lm(args, save_path=None, asr_dict_path=None):
     """Select LM class.
 
+    Word-level LMs are fused into char/wp decoding by wrapping them with
+    LookAheadWordLM after loading checkpoints.
+
     Args:
         args ():
         save_path (str):
-        wordlm (bool):
-        lm_dict_path (dict):
-        asr_dict_path (dict):
+        asr_dict_path (str): dictionary of the ASR model (for n-gram LMs)
     Returns:
         lm ():
 
     """
-    if 'gated_conv' in args.lm_type:
+    if args.lm_type == 'ngram':
+        from neural_sp.models.lm.ngram import NgramLM
+        lm = NgramLM(args.arpa, asr_dict_path, n_bits=args.n_bits)
+    elif 'gated_conv' in args.lm_type:
         from neural_sp.models.lm.gated_convlm import GatedConvLM
         lm = GatedConvLM(args, save_path)
     elif args.lm_type == 'transformer':
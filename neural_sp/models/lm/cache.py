@@ -0,0 +1,110 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Neural cache for language models."""
+
+import logging
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class NeuralCache(object):
+    """Neural cache model (Grave et al., 2017) with ring buffers.
+
+    Hidden states (keys) and next tokens of the last `n_caches` steps are kept
+    in fixed-size buffers for each stream, and the cache distribution is
+    computed by attention over them. All steps in a segment are processed at
+    once: each step attends to the previous `n_caches` steps, including those
+    in the same segment.
+
+    Args:
+        n_caches (int): number of cached steps per stream
+
+    """
+
+    def __init__(self, n_caches):
+        assert n_caches > 0
+        self.n_caches = n_caches
+        self.reset()
+
+    def reset(self):
+        self.keys = None  # `[B, n_caches, n_units]`
+        self.ids = None  # `[B, n_caches]`
+        self.positions = None  # `[n_caches]`, step in the stream of each slot (-1 if empty)
+        self.offset = 0  # number of steps seen so far
+        self.attn = None  # attention in the last segment (for visualization)
+
+    def _allocate(self, bs, keys):
+        self.reset()
+        self.keys = keys.new_zeros(bs, self.n_caches, keys.size(2))
+        self.ids = torch.zeros(bs, self.n_caches, dtype=torch.int64, device=keys.device)
+        self.positions = torch.full((self.n_caches,), -1, dtype=torch.int64, device=keys.device)
+
+    def __call__(self, probs, keys, ys_out, theta, lambda_):
+        """Interpolate probabilities with the cache distribution and register new steps.
+
+        Args:
+            probs (FloatTensor): `[B, L, vocab]`, probabilities of the LM
+            keys (FloatTensor): `[B, L, n_units]`, outputs of the LM
+            ys_out (LongTensor): `[B, L]`, next tokens
+            theta (float): smoothing parameter (inverse temperature) of attention
+            lambda_ (float): cache weight
+        Returns:
+            probs (FloatTensor): `[B, L, vocab]`
+
+        """
+        bs, qlen = ys_out.size()
+        if self.keys is None or self.keys.size(0) != bs or self.keys.size(2) != keys.size(2):
+            self._allocate(bs, keys)
+
+        # Candidates are cached steps followed by steps in the current segment
+        keys_all = torch.cat([self.keys, keys], dim=1)  # `[B, n_caches + L, n_units]`
+        ids_all = torch.cat([self.ids, ys_out], dim=1)  # `[B, n_caches + L]`
+        pos_q = torch.arange(qlen, device=keys.device) + self.offset
+        pos_k = torch.cat([self.positions, pos_q])
+        dist = pos_q.unsqueeze(1) - pos_k.unsqueeze(0)
+        mask = (pos_k >= 0).unsqueeze(0) & (dist >= 1) & (dist <= self.n_caches)  # `[L, n_caches + L]`
+        has_cache = mask.any(dim=1)  # `[L]`
+
+        scores = theta * torch.matmul(keys, keys_all.transpose(2, 1))  # `[B, L, n_caches + L]`
+        scores = scores.masked_fill(~mask.unsqueeze(0), float('-inf'))
+        attn = torch.softmax(scores, dim=-1)
+        # NOTE: queries without any cached step (the first step) produce NaN
+        attn = attn.masked_fill(~has_cache.view(1, qlen, 1), 0)
+        self.attn = (attn, ids_all, pos_k)
+
+        cache_probs = torch.zeros_like(probs).scatter_add_(
+            2, ids_all.unsqueeze(1).expand(-1, qlen, -1), attn.to(probs.dtype))
+        weight = lambda_ * has_cache.to(probs.dtype).view(1, qlen, 1)
+        probs = (1 - weight) * probs + weight * cache_probs
+
+        self._register(keys, ys_out)
+        return probs
+
+    def _register(self, keys, ys_out):
+        """Write the last `n_caches` steps to the ring buffers."""
+        qlen = ys_out.size(1)
+        n = min(qlen, self.n_caches)
+        pos = torch.arange(qlen - n, qlen, device=keys.device) + self.offset
+        slots = pos % self.n_caches
+        self.keys.index_copy_(1, slots, keys[:, qlen - n:].to(self.keys.dtype))
+        self.ids.index_copy_(1, slots, ys_out[:, qlen - n:])
+        self.positions.index_copy_(0, slots, pos)
+        self.offset += qlen
+
+    def history(self, b=0):
+        """Attention weights of stream `b` in the last segment.
+
+        Returns:
+            attn (np.ndarray): `[L, n_keys]`, keys in chronological order
+            ids (np.ndarray): `[n_keys]`, token indices of the keys
+
+        """
+        attn, ids_all, pos_k = self.attn
+        order = pos_k.argsort()
+        order = order[pos_k[order] >= 0]
+        return attn[b][:, order].cpu().numpy(), ids_all[b, order].cpu().numpy()
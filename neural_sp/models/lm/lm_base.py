@@ -12,6 +12,7 @@ import torch
 
 from neural_sp.models.base import ModelBase
 from neural_sp.models.criterion import cross_entropy_lsm
+from neural_sp.models.lm.cache import NeuralCache
 from neural_sp.models.torch_utils import compute_accuracy
 from neural_sp.models.torch_utils import np2tensor
 from neural_sp.models.torch_utils import pad_list
@@ -70,35 +71,14 @@ class LMBase(ModelBase):
         if predict_last:
             ys_out = ys_out[:, -1].unsqueeze(1)
             logits = logits[:, -1].unsqueeze(1)
+            out = out[:, -1].unsqueeze(1)
 
         # Compute XE sequence loss
-        if n_caches > 0 and len(self.cache_ids) > 0:
-            assert ys_out.size(1) == 1
-            assert ys_out.size(0) == 1
-            if self.adaptive_softmax is None:
-                probs = torch.softmax(logits, dim=-1)
-            else:
-                probs = self.adaptive_softmax.log_prob(logits).exp()
-            cache_probs = probs.new_zeros(probs.size())
-
-            # Truncate cache
-            self.cache_ids = self.cache_ids[-n_caches:]  # list of `[B, 1]`
-            self.cache_keys = self.cache_keys[-n_caches:]  # list of `[B, 1, n_units]`
-
-            # Compute inner-product over caches
-            cache_attn = torch.softmax(self.cache_theta * torch.matmul(
-                torch.cat(self.cache_keys, dim=1), out.transpose(2, 1)).squeeze(2), dim=1)
-
-            # For visualization
-            if len(self.cache_ids) == n_caches:
-                self.cache_attn += [cache_attn.cpu().numpy()]
-                self.cache_attn = self.cache_attn[-n_caches:]
-
-            # Sum all probabilities
-            for offset, idx in enumerate(self.cache_ids):
-                cache_probs[:, :, idx] += cache_attn[:, offset]
-            probs = (1 - self.cache_lambda) * probs + self.cache_lambda * cache_probs
-            loss = -torch.log(probs[:, :, ys_out[:, -1]])
+        if n_caches > 0:
+            log_probs = self.compute_log_probs(logits, out, ys_out, n_caches)
+            nll = -torch.gather(log_probs, 2, ys_out.unsqueeze(2)).squeeze(2)
+            loss = nll.masked_select(ys_out != self.pad).mean()
+            ppl = np.exp(loss.item())
         else:
             if self.adaptive_softmax is None:
                 loss, ppl = cross_entropy_lsm(logits, ys_out.contiguous(),
@@ -109,11 +89,6 @@ class LMBase(ModelBase):
                                              ys_out.contiguous().view(-1)).loss
                 ppl = np.exp(loss.item())
 
-        if n_caches > 0:
-            # Register to cache
-            self.cache_ids += [ys_out[0, -1].item()]
-            self.cache_keys += [out]
-
         # Compute token-level accuracy in teacher-forcing
         if self.adaptive_softmax is None:
             acc = compute_accuracy(logits, ys_out, pad=self.pad)
@@ -124,6 +99,35 @@ class LMBase(ModelBase):
         observation = {'loss.lm': loss.item(), 'acc.lm': acc, 'ppl.lm': ppl}
         return loss, new_state, observation
 
+    def compute_log_probs(self, logits, out, ys_out, n_caches=0):
+        """Compute log probabilities of next tokens, interpolated with the neural cache.
+
+        Args:
+            logits (FloatTensor): `[B, L, vocab]` (`[B, L, n_units]` with adaptive softmax)
+            out (FloatTensor): `[B, L, n_units]`, keys of the cache
+            ys_out (LongTensor): `[B, L]`, next tokens registered to the cache
+            n_caches (int): number of cached steps (the cache is not used if 0)
+        Returns:
+            log_probs (FloatTensor): `[B, L, vocab]`
+
+        """
+        if self.adaptive_softmax is None:
+            log_probs = torch.log_softmax(logits, dim=-1)
+        else:
+            log_probs = self.adaptive_softmax.log_prob(
+                logits.reshape((-1, logits.size(2)))).view(logits.size(0), logits.size(1), -1)
+        if n_caches == 0:
+            return log_probs
+
+        if self.cache is None or self.cache.n_caches != n_caches:
+            self.cache = NeuralCache(n_caches)
+        probs = self.cache(log_probs.exp(), out, ys_out, self.cache_theta, self.cache_lambda)
+        return torch.log(probs)
+
+    def reset_cache(self):
+        """Clear the neural cache."""
+        self.cache = None
+
     def repackage_state(self, state):
         return state
 
@@ -0,0 +1,391 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Word-level LM fusion for subword-level ASR with look-ahead scores."""
+
+import codecs
+from collections import OrderedDict
+import logging
+import torch
+import torch.nn as nn
+
+from neural_sp.datasets.utils import count_vocab_size
+from neural_sp.models.lm.transformer_xl import TransformerXL
+from neural_sp.models.lm.transformerlm import TransformerLM
+
+logger = logging.getLogger(__name__)
+
+ROOT = 0
+OOV = -1
+SPECIAL_TOKENS = ['<blank>', '<unk>', '<eos>', '<pad>']
+
+
+def load_dict(dict_path):
+    """Load a dictionary file (token and index in each line)."""
+    token2idx = {}
+    with codecs.open(dict_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip() != '':
+                token, idx = line.strip().split(' ')
+                token2idx[token] = int(idx)
+    return token2idx
+
+
+class PrefixTree(object):
+    """Prefix tree over spellings.
+
+    Spellings are sorted so that those under each node occupy a contiguous
+    range `[lo, hi)` in the sorted order, and the spelling ending at a node
+    (if any) is the first one in the range.
+
+    Args:
+        spellings (list): tuples of (spelling, index)
+
+    """
+
+    def __init__(self, spellings):
+        spellings = sorted(spellings)
+        self.order = [idx for _, idx in spellings]
+        self.children = [{}]
+        self.index = [-1]  # index of the spelling ending at each node
+        self.lo = [0]
+        self.hi = [len(spellings)]
+        for i, (spelling, idx) in enumerate(spellings):
+            node = ROOT
+            for c in spelling:
+                child = self.children[node].get(c)
+                if child is None:
+                    child = len(self.children)
+                    self.children[node][c] = child
+                    self.children.append({})
+                    self.index.append(-1)
+                    self.lo.append(i)
+                    self.hi.append(i)
+                node = child
+                self.hi[node] = i + 1
+            self.index[node] = idx
+
+    def __len__(self):
+        return len(self.children)
+
+    def walk(self, node, spelling):
+        """Node reached by `spelling` from `node` (OOV if not found)."""
+        for c in spelling:
+            node = self.children[node].get(c, OOV)
+            if node == OOV:
+                break
+        return node
+
+
+class LookAheadWordLM(nn.Module):
+    """Word-level LM for shallow fusion in subword-level (char or wp) decoding.
+
+    Words in the vocabulary of the word LM are stored in a prefix tree over
+    characters. Within a word, the score of a subword is the log ratio of
+    look-ahead probabilities of the tree nodes after and before it, where the
+    look-ahead probability of a node is the sum of word probabilities under it.
+    Scores of subwords in a word therefore sum up to the word probability,
+    which is given when the word is closed by a word boundary or <eos>.
+    Subwords leaving the tree are scored by <unk> with `oov_penalty`.
+
+    The word LM is run only when a word is closed, once per word history.
+    Word histories are shared across hypotheses: the state of each hypothesis
+    is the index of its word history and the tree node of the current word,
+    and LM states and cumulative word probabilities are cached per history.
+    Transitions of subwords from each tree node are also cached.
+
+    Args:
+        wordlm (LMBase): word-level LM (RNNLM or GatedConvLM)
+        lm_dict_path (str): path to the dictionary of the word LM
+        asr_dict_path (str): path to the dictionary of the ASR model
+        unit (str): char or wp
+        oov_penalty (float): log-scale penalty added to <unk> for OOV words
+        cache_size (int): number of word histories to cache probabilities
+
+    """
+
+    def __init__(self, wordlm, lm_dict_path, asr_dict_path, unit,
+                 oov_penalty=-10., cache_size=256):
+
+        super(LookAheadWordLM, self).__init__()
+
+        assert not isinstance(wordlm, (TransformerLM, TransformerXL)), \
+            'The word LM must decode incrementally with states.'
+        assert cache_size >= 1
+        self.wordlm = wordlm
+        self.oov_penalty = oov_penalty
+        self.cache_size = cache_size
+
+        word2idx = load_dict(lm_dict_path)
+        self.unk_w = word2idx['<unk>']
+        self.eos_w = word2idx['<eos>']
+        self.lexicon = PrefixTree([(w, idx) for w, idx in word2idx.items()
+                                   if w not in SPECIAL_TOKENS])
+
+        token2idx = load_dict(asr_dict_path)
+        self.vocab = count_vocab_size(asr_dict_path)
+        self.eos = token2idx['<eos>']
+        # Subwords starting a word and their spellings
+        if unit == 'wp':
+            boundaries = {idx: t[1:] for t, idx in token2idx.items() if t.startswith('▁')}
+        elif 'char' in unit:
+            boundaries = {token2idx['<space>']: ''}
+        else:
+            raise NotImplementedError(unit)
+        assert len(boundaries) > 0, 'No word boundary in the ASR dictionary.'
+        self.tokens = PrefixTree([(t, idx) for t, idx in token2idx.items()
+                                  if idx not in boundaries and t not in SPECIAL_TOKENS + ['<space>']])
+        bnd_ids = sorted(boundaries.keys())
+        bnd_targets = [self.lexicon.walk(ROOT, boundaries[idx]) for idx in bnd_ids]
+        self._bnd_targets = dict(zip(bnd_ids, bnd_targets))
+
+        self.register_buffer('lo', torch.LongTensor(self.lexicon.lo))
+        self.register_buffer('hi', torch.LongTensor(self.lexicon.hi))
+        self.register_buffer('order', torch.LongTensor(self.lexicon.order))
+        self.register_buffer('bnd_ids', torch.LongTensor(bnd_ids))
+        self.register_buffer('bnd_targets', torch.LongTensor(bnd_targets))
+
+        self._transitions = {}
+        self.reset()
+
+        logger.info('Lexicon: %d words, %d nodes (%d word boundaries in the ASR vocabulary)' % (
+            len(self.lexicon.order), len(self.lexicon), len(bnd_ids)))
+
+        self.eval()
+
+    def reset(self, state=None):
+        """Clear cached word histories at the beginning of an utterance.
+
+        Args:
+            state (LongTensor): `[1, 2]`, state carried over from the previous utterance
+        Returns:
+            state (LongTensor): `[1, 2]`, the same state in the new cache (None if not given)
+
+        """
+        carry_over = None
+        if state is not None:
+            h = state[0, 0].item()
+            self._lookup([h])
+            carry_over = (self._states[self._lm_history(h)], self._cache[self._lm_history(h)])
+        self._histories = [(OOV, OOV)]  # parent and word of each history
+        self._history_ids = {}
+        self._states = {ROOT: None}  # states of the word LM after reading each history
+        self._cache = OrderedDict()  # cumulative word probabilities of each history
+        if carry_over is None:
+            return None
+        # the carried-over history replaces the empty one
+        self._states[ROOT], self._cache[ROOT] = carry_over
+        return torch.stack([state.new_zeros(()), state[0, 1]]).unsqueeze(0)
+
+    def _child(self, h, w):
+        """Index of the word history `h` followed by the word `w`."""
+        key = (h, w)
+        if key not in self._history_ids:
+            self._history_ids[key] = len(self._histories)
+            self._histories.append(key)
+        return self._history_ids[key]
+
+    def _lm_history(self, h):
+        # NOTE: the empty history is read as the beginning of a sentence
+        if h == ROOT and self._states[ROOT] is None:
+            return self._child(ROOT, self.eos_w)
+        return h
+
+    def _close(self, h, n):
+        """Word history after closing the current word at node `n`."""
+        if n == ROOT:
+            return h
+        if n == OOV or self.lexicon.index[n] < 0:
+            return self._child(h, self.unk_w)
+        return self._child(h, self.lexicon.index[n])
+
+    def transitions(self, n):
+        """Transitions of subwords inside a word from node `n`.
+
+        Returns:
+            next_nodes (dict): subword index to the next node
+            token_ids (LongTensor): `[K]`
+            next_node_ids (LongTensor): `[K]`
+
+        """
+        if n not in self._transitions:
+            next_nodes = {}
+            stack = [(ROOT, n)]
+            while stack:
+                t, m = stack.pop()
+                t_children, m_children = self.tokens.children[t], self.lexicon.children[m]
+                for c in (t_children if len(t_children) < len(m_children) else m_children):
+                    if c not in t_children or c not in m_children:
+                        continue
+                    if self.tokens.index[t_children[c]] >= 0:
+                        next_nodes[self.tokens.index[t_children[c]]] = m_children[c]
+                    stack.append((t_children[c], m_children[c]))
+            self._transitions[n] = (next_nodes,
+                                    self.lo.new_tensor(list(next_nodes.keys())),
+                                    self.lo.new_tensor(list(next_nodes.values())))
+        return self._transitions[n]
+
+    def _lookup(self, hs):
+        """Cumulative word probabilities of word histories, running the word LM if not cached."""
+        hs = [self._lm_history(h) for h in hs]
+        missing = [h for h in OrderedDict.fromkeys(hs) if h not in self._cache]
+        if len(missing) > 0:
+            parents = [self._histories[h][0] for h in missing]
+            self._lookup([p for p in OrderedDict.fromkeys(parents) if p not in self._states])
+            # batchfy histories following states of the word LM
+            for group in [[h for h, p in zip(missing, parents) if self._states[p] is None],
+                          [h for h, p in zip(missing, parents) if self._states[p] is not None]]:
+                if len(group) > 0:
+                    self._advance(group)
+        entries = [self._cache[h] for h in hs]
+        for h in hs:
+            self._cache.move_to_end(h)
+        while len(self._cache) > self.cache_size:
+            h = next(iter(self._cache))
+            if h == ROOT:
+                self._cache.move_to_end(h)  # not recomputable after carry-over
+                continue
+            del self._cache[h]
+        return entries
+
+    def _advance(self, hs):
+        ys = self.lo.new_tensor([[self._histories[h][1]] for h in hs])
+        states = [self._states[self._histories[h][0]] for h in hs]
+        _, state, log_probs = self.wordlm.predict(ys, merge_states(states))
+        probs = torch.exp(log_probs[:, -1].double())
+        cum = torch.cat([probs.new_zeros(len(hs), 1), torch.cumsum(probs[:, self.order], dim=1)], dim=1)
+        for j, h in enumerate(hs):
+            self._states[h] = select_state(state, j)
+            self._cache[h] = (cum[j],
+                              log_probs[j, -1, self.eos_w].item(),
+                              log_probs[j, -1, self.unk_w].item() + self.oov_penalty)
+
+    def _log_lookahead(self, cum, nodes):
+        return torch.log((cum[self.hi[nodes]] - cum[self.lo[nodes]]).clamp(min=1e-300)).float()
+
+    def zero_state(self, batch_size):
+        """Initialize the state (empty word history at the root).
+
+        Args:
+            batch_size (int): batch size
+        Returns:
+            state (LongTensor): `[B, 2]`
+
+        """
+        return self.lo.new_zeros(batch_size, 2)
+
+    def step(self, ys, state=None):
+        """Update states with input subwords.
+
+        Args:
+            ys (LongTensor): `[B, L]`
+            state (LongTensor): `[B, 2]`, word history and tree node
+        Returns:
+            lmout (LongTensor): `[B, 1, 2]`, the new state as the input to `score`
+            new_state (LongTensor): `[B, 2]`
+
+        """
+        if state is None:
+            state = self.zero_state(ys.size(0))
+        hs, ns = state[:, 0].tolist(), state[:, 1].tolist()
+        for t in range(ys.size(1)):
+            for b, y in enumerate(ys[:, t].tolist()):
+                if y == self.eos:
+                    hs[b] = self._child(self._close(hs[b], ns[b]), self.eos_w)
+                    ns[b] = ROOT
+                elif y in self._bnd_targets:
+                    hs[b] = self._close(hs[b], ns[b])
+                    ns[b] = self._bnd_targets[y]
+                elif ns[b] != OOV:
+                    ns[b] = self.transitions(ns[b])[0].get(y, OOV)
+        new_state = self.lo.new_tensor([hs, ns]).t()
+        return new_state.unsqueeze(1), new_state
+
+    def score(self, lmout, candidates=None):
+        """Compute log probabilities of candidate subwords.
+
+        Args:
+            lmout (LongTensor): `[B, 2]`, state after `step`
+            candidates (LongTensor): `[B, K]`, subword indices to score.
+                The whole vocabulary is scored if None.
+        Returns:
+            log_probs (FloatTensor): `[B, K]` (`[B, vocab]` if candidates is None)
+
+        """
+        hs, ns = lmout[:, 0].tolist(), lmout[:, 1].tolist()
+        hs_next = [self._close(h, n) for h, n in zip(hs, ns)]
+        entries = self._lookup(hs + hs_next)
+        log_probs = []
+        for b, n in enumerate(ns):
+            cum, _, log_unk = entries[b]
+            log_la = 0. if n == ROOT else self._log_lookahead(cum, n)
+            # inside the word
+            if n == OOV:
+                scores = cum.new_zeros(self.vocab, dtype=torch.float32)
+            else:
+                scores = cum.new_full((self.vocab,), log_unk, dtype=torch.float32) - log_la
+                _, token_ids, next_node_ids = self.transitions(n)
+                if token_ids.numel() > 0:
+                    scores[token_ids] = self._log_lookahead(cum, next_node_ids) - log_la
+            # closing the word
+            if n in [ROOT, OOV]:
+                score_word = 0.
+            elif self.lexicon.index[n] >= 0:
+                lo = self.lexicon.lo[n]
+                score_word = torch.log(cum[lo + 1] - cum[lo]).float() - log_la
+            else:
+                score_word = log_unk - log_la
+            cum_next, log_eos_next, log_unk_next = entries[len(hs) + b]
+            scores[self.eos] = score_word + log_eos_next
+            # opening the next word
+            score_open = torch.where(self.bnd_targets == OOV,
+                                     cum_next.new_full(self.bnd_targets.size(), log_unk_next, dtype=torch.float32),
+                                     self._log_lookahead(cum_next, self.bnd_targets.clamp(min=0)))
+            score_open = score_open.masked_fill(self.bnd_targets == ROOT, 0.)
+            scores[self.bnd_ids] = score_word + score_open
+            log_probs.append(scores)
+        log_probs = torch.stack(log_probs, dim=0)
+        if candidates is not None:
+            log_probs = log_probs.gather(1, candidates)
+        return log_probs
+
+    def predict(self, ys, state=None, mems=None, cache=None, candidates=None):
+        """Precict function for ASR (the same interface as LMBase.predict).
+
+        Args:
+            ys (LongTensor): `[B, L]`
+            state (LongTensor): `[B, 2]`
+            mems: dummy interfance for TransformerXL
+            cache: dummy interfance for TransformerLM/TransformerXL
+            candidates (LongTensor): `[B, K]`, subword indices to score at the last step
+        Returns:
+            lmout (LongTensor): `[B, 1, 2]`
+            new_state (LongTensor): `[B, 2]`
+            log_probs (FloatTensor): `[B, 1, vocab]` (`[B, K]` if candidates is given)
+
+        """
+        lmout, new_state = self.step(ys, state)
+        log_probs = self.score(lmout[:, -1], candidates)
+        if candidates is None:
+            log_probs = log_probs.unsqueeze(1)
+        return lmout, new_state, log_probs
+
+
+def merge_states(states):
+    """Concatenate states of the word LM (RNNLM or GatedConvLM) of size 1."""
+    if states[0] is None:
+        return None
+    if isinstance(states[0], dict):
+        return {k: torch.cat([s[k] for s in states], dim=1) if states[0][k] is not None else None
+                for k in states[0].keys()}
+    return [torch.cat([s[lth] for s in states], dim=0) for lth in range(len(states[0]))]
+
+
+def select_state(state, j):
+    """State of the word LM (RNNLM or GatedConvLM) for the `j`-th sample."""
+    if isinstance(state, dict):
+        return {k: v[:, j:j + 1] if v is not None else None for k, v in state.items()}
+    return [s[j:j + 1] for s in state]
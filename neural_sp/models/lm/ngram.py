@@ -0,0 +1,335 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Back-off n-gram language model for LM fusion."""
+
+import codecs
+import gzip
+import logging
+import math
+import numpy as np
+import torch
+import torch.nn as nn
+
+from neural_sp.datasets.utils import count_vocab_size
+
+logger = logging.getLogger(__name__)
+
+LOG10 = math.log(10)
+
+
+def is_arpa(path):
+    """Whether the path is an ARPA file rather than a checkpoint of neural LMs."""
+    return path.endswith('.arpa') or path.endswith('.arpa.gz')
+
+
+def read_arpa(arpa_path):
+    """Read n-grams in an ARPA file.
+
+    Args:
+        arpa_path (str): path to the ARPA file (gzipped if it ends with .gz)
+    Returns:
+        ngrams (list): for each order, a tuple of
+            words (list): n-grams, each of which is a tuple of words
+            logps (list): log10 probabilities
+            bos (list): log10 back-off weights (0 if not given)
+
+    """
+    ngrams = []
+    order = 0
+    opener = gzip.open if arpa_path.endswith('.gz') else open
+    with opener(arpa_path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line == '':
+                continue
+            if line.startswith('\\'):
+                # \data\, \N-grams: or \end\
+                order = int(line[1:].split('-')[0]) if line.endswith('-grams:') else 0
+                if order > 0:
+                    assert order == len(ngrams) + 1
+                    ngrams.append(([], [], []))
+                continue
+            if order == 0:
+                continue  # counts in the header
+            fields = line.split()
+            words, logps, bos = ngrams[order - 1]
+            words.append(tuple(fields[1:order + 1]))
+            logps.append(float(fields[0]))
+            bos.append(float(fields[order + 1]) if len(fields) > order + 1 else 0.)
+    return ngrams
+
+
+def quantize(values, n_bits):
+    """Quantize values with a codebook of quantiles.
+
+    Args:
+        values (np.ndarray): `[N]`
+        n_bits (int): number of bits per value (<= 8)
+    Returns:
+        codes (np.ndarray): `[N]`, uint8 indices of the codebook
+        codebook (np.ndarray): `[<= 2 ** n_bits]`
+
+    """
+    assert 0 < n_bits <= 8
+    codebook = np.unique(values)
+    if len(codebook) > 2 ** n_bits:
+        codebook = np.unique(np.quantile(values, (np.arange(2 ** n_bits) + 0.5) / 2 ** n_bits))
+    codes = np.searchsorted((codebook[1:] + codebook[:-1]) / 2, values)  # nearest
+    return codes.astype(np.uint8), codebook.astype(np.float32)
+
+
+def _lookup(keys, query):
+    """Positions of `query` in sorted `keys` (-1 if not found)."""
+    if len(keys) == 0:
+        return np.full(len(query), -1, dtype=np.int64)
+    pos = np.minimum(np.searchsorted(keys, query), len(keys) - 1)
+    return np.where(keys[pos] == query, pos, -1)
+
+
+def _searchsorted(keys, query):
+    """Positions to insert `query` into sorted 1-D `keys` (batched over any shape of `query`)."""
+    if hasattr(torch, 'searchsorted'):
+        return torch.searchsorted(keys, query)
+    # NOTE: for torch<1.6, search on CPU with numpy
+    pos = np.searchsorted(keys.cpu().numpy(), query.cpu().numpy())
+    return torch.from_numpy(pos).to(query.device)
+
+
+class NgramLM(nn.Module):
+    """Back-off n-gram LM over array-backed tries for LM fusion.
+
+    N-grams of each order are stored in arrays sorted by keys of
+    `(index of the history in the lower order) * n_words + word` and looked up
+    by binary search, so that lookups are batched over hypotheses with
+    torch.searchsorted (numpy.searchsorted on CPU for torch<1.6).
+    Probabilities and back-off weights of bigrams and higher are quantized to
+    `n_bits` bits unless `n_bits` is 0.
+
+    Token indices follow the ASR dictionary. <eos> is predicted as </s> and
+    read as <s> in contexts. Tokens missing in the ARPA file are scored by the
+    unigram probability of <unk>. Log-probabilities are natural logarithms as
+    in neural LMs.
+
+    The state of each hypothesis is the indices of its last 1, 2, ... and
+    `order - 1` tokens in the tries of each order (-1 if not found).
+
+    Args:
+        arpa_path (str): path to the ARPA file
+        dict_path (str): path to the dictionary of the ASR model
+        n_bits (int): number of bits to quantize probabilities (0 for float32)
+
+    """
+
+    def __init__(self, arpa_path, dict_path, n_bits=8):
+
+        super(NgramLM, self).__init__()
+
+        self.vocab = count_vocab_size(dict_path)
+        self.eos = 2
+        self.bos = self.vocab  # index of <s> used only in contexts
+        self.n_words = self.vocab + 1
+        self.n_bits = n_bits
+
+        word2idx = {}
+        with codecs.open(dict_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip() != '':
+                    token, idx = line.strip().split(' ')
+                    word2idx[token] = int(idx)
+        word2idx['<s>'] = self.bos
+        word2idx['</s>'] = self.eos
+
+        ngrams = read_arpa(arpa_path)
+        self.order = len(ngrams)
+        W = self.n_words
+
+        # Unigrams (indexed by tokens)
+        words, logps, bos = ngrams[0]
+        unigram = dict(zip(words, logps))
+        logp1 = np.full(W, unigram.get(('<unk>',), -99.), dtype=np.float64)
+        bo1 = np.zeros(W, dtype=np.float64)
+        present = np.zeros(W, dtype=bool)
+        for (w,), logp, bo in zip(words, logps, bos):
+            if w in word2idx:
+                logp1[word2idx[w]] = logp
+                bo1[word2idx[w]] = bo
+                present[word2idx[w]] = True
+        self.register_buffer('present', torch.from_numpy(present))
+        self.register_buffer('logp1', torch.from_numpy(logp1 * LOG10).float())
+        self.register_buffer('bo1', torch.from_numpy(bo1 * LOG10).float())
+        self.register_buffer('logp_cb1', None)
+        self.register_buffer('bo_cb1', None)
+        n_dropped = len(words) - int(present.sum())
+
+        keys = [None, None]
+        for k in range(2, self.order + 1):
+            words, logps, bos = ngrams[k - 1]
+            ids = np.array([[word2idx.get(w, -1) for w in ngram] for ngram in words],
+                           dtype=np.int64).reshape(-1, k)
+            # index of the history in the lower order
+            ctx = np.where((ids[:, 0] >= 0) & present[np.maximum(ids[:, 0], 0)], ids[:, 0], -1)
+            for j in range(1, k - 1):
+                valid = (ctx >= 0) & (ids[:, j] >= 0)
+                ctx[valid] = _lookup(keys[j + 1], ctx[valid] * W + ids[valid, j])
+                ctx[~valid] = -1
+            valid = (ctx >= 0) & (ids[:, -1] >= 0)
+            n_dropped += int((~valid).sum())
+            key = ctx[valid] * W + ids[valid, -1]
+            perm = np.argsort(key, kind='stable')
+            keys.append(key[perm])
+            self.register_buffer('keys%d' % k, torch.from_numpy(key[perm]))
+            self._register_values('logp', k, np.array(logps)[valid][perm] * LOG10)
+            if k < self.order:
+                self._register_values('bo', k, np.array(bos)[valid][perm] * LOG10)
+
+        logger.info('Loaded %d-gram LM (%s): %s n-grams, %d dropped (not in the dictionary), %.2f MB' % (
+            self.order, arpa_path, ' '.join([str(len(ng[0])) for ng in ngrams]), n_dropped,
+            self.memory_footprint() / 1024 ** 2))
+
+        self.eval()
+
+    def _register_values(self, name, k, values):
+        if self.n_bits > 0:
+            codes, codebook = quantize(values, self.n_bits)
+            self.register_buffer('%s%d' % (name, k), torch.from_numpy(codes))
+            self.register_buffer('%s_cb%d' % (name, k), torch.from_numpy(codebook))
+        else:
+            self.register_buffer('%s%d' % (name, k), torch.from_numpy(values).float())
+            self.register_buffer('%s_cb%d' % (name, k), None)
+
+    def _values(self, name, k, idx):
+        """Dequantized values of `k`-grams at `idx`."""
+        values = getattr(self, '%s%d' % (name, k))[idx]
+        codebook = getattr(self, '%s_cb%d' % (name, k))
+        return values if codebook is None else codebook[values.long()]
+
+    def memory_footprint(self):
+        """Size of the tries in bytes."""
+        return sum(b.numel() * b.element_size() for b in self.buffers())
+
+    def zero_state(self, batch_size):
+        """Initialize the state (empty context).
+
+        Args:
+            batch_size (int): batch size
+        Returns:
+            state (LongTensor): `[B, order - 1]`
+
+        """
+        return torch.full((batch_size, self.order - 1), -1, dtype=torch.int64,
+                          device=self.logp1.device)
+
+    def step(self, ys, state=None):
+        """Update states with input tokens.
+
+        Args:
+            ys (LongTensor): `[B, L]`
+            state (LongTensor): `[B, order - 1]`
+        Returns:
+            lmout (LongTensor): `[B, 1, order - 1]`, the new state as the input to `score`
+            new_state (LongTensor): `[B, order - 1]`
+
+        """
+        if state is None:
+            state = self.zero_state(ys.size(0))
+        W = self.n_words
+        for t in range(ys.size(1)):
+            y = ys[:, t]
+            y = torch.where(y == self.eos, torch.full_like(y, self.bos), y)
+            new_state = torch.full_like(state, -1)
+            if self.order > 1:
+                new_state[:, 0] = torch.where(self.present[y], y, torch.full_like(y, -1))
+            for j in range(1, self.order - 1):
+                keys = getattr(self, 'keys%d' % (j + 1))
+                if keys.numel() == 0:
+                    break
+                ctx = state[:, j - 1]
+                query = ctx * W + y
+                pos = _searchsorted(keys, query).clamp(max=keys.numel() - 1)
+                found = (ctx >= 0) & (keys[pos] == query)
+                new_state[:, j] = torch.where(found, pos, torch.full_like(pos, -1))
+            state = new_state
+        return state.unsqueeze(1), state
+
+    def score(self, lmout, candidates=None):
+        """Compute log probabilities of candidate tokens.
+
+        Args:
+            lmout (LongTensor): `[B, order - 1]`, state after `step`
+            candidates (LongTensor): `[B, K]`, token indices to score.
+                The whole vocabulary is scored if None.
+        Returns:
+            log_probs (FloatTensor): `[B, K]` (`[B, vocab]` if candidates is None)
+
+        """
+        if candidates is None:
+            return self._score_all(lmout)
+
+        W = self.n_words
+        bs, n_cands = candidates.size()
+        log_probs = self.logp1.new_zeros(bs, n_cands)
+        backoff = self.logp1.new_zeros(bs, n_cands)
+        done = torch.zeros_like(candidates, dtype=torch.bool)
+        for k in range(self.order, 1, -1):
+            keys = getattr(self, 'keys%d' % k)
+            ctx = lmout[:, k - 2].unsqueeze(1)
+            valid = ctx >= 0
+            if keys.numel() > 0:
+                query = ctx * W + candidates
+                pos = _searchsorted(keys, query.contiguous()).clamp(max=keys.numel() - 1)
+                found = valid & (keys[pos] == query) & ~done
+                log_probs = torch.where(found, backoff + self._values('logp', k, pos), log_probs)
+                done = done | found
+            # back off to the lower order
+            bo = self._values('bo', k - 1, ctx.clamp(min=0))
+            backoff = backoff + torch.where(valid & ~done, bo, torch.zeros_like(bo))
+        return torch.where(done, log_probs, backoff + self.logp1[candidates])
+
+    def _score_all(self, lmout):
+        W = self.n_words
+        bs = lmout.size(0)
+        log_probs = self.logp1.unsqueeze(0).repeat(bs, 1)
+        for k in range(2, self.order + 1):
+            keys = getattr(self, 'keys%d' % k)
+            ctx = lmout[:, k - 2]
+            valid = ctx >= 0
+            bo = self._values('bo', k - 1, ctx.clamp(min=0))
+            log_probs = log_probs + torch.where(valid, bo, torch.zeros_like(bo)).unsqueeze(1)
+            if keys.numel() == 0:
+                continue
+            # overwrite n-grams following the context
+            lo = _searchsorted(keys, ctx * W)
+            hi = _searchsorted(keys, (ctx + 1) * W)
+            counts = torch.where(valid, hi - lo, torch.zeros_like(lo))
+            rows = torch.repeat_interleave(torch.arange(bs, device=ctx.device), counts)
+            if rows.numel() == 0:
+                continue
+            starts = torch.cumsum(counts, dim=0) - counts
+            pos = lo[rows] + torch.arange(rows.numel(), device=ctx.device) - starts[rows]
+            log_probs[rows, keys[pos] % W] = self._values('logp', k, pos)
+        return log_probs[:, :self.vocab]
+
+    def predict(self, ys, state=None, mems=None, cache=None, candidates=None):
+        """Precict function for ASR (the same interface as LMBase.predict).
+
+        Args:
+            ys (LongTensor): `[B, L]`
+            state (LongTensor): `[B, order - 1]`
+            mems: dummy interfance for TransformerXL
+            cache: dummy interfance for TransformerLM/TransformerXL
+            candidates (LongTensor): `[B, K]`, token indices to score at the last step
+        Returns:
+            lmout (LongTensor): `[B, 1, order - 1]`
+            new_state (LongTensor): `[B, order - 1]`
+            log_probs (FloatTensor): `[B, 1, vocab]` (`[B, K]` if candidates is given)
+
+        """
+        lmout, new_state = self.step(ys, state)
+        log_probs = self.score(lmout[:, -1], candidates)
+        if candidates is None:
+            log_probs = log_probs.unsqueeze(1)
+        return lmout, new_state, log_probs
@@ -12,6 +12,7 @@ import torch
 import torch.nn as nn
 
 from neural_sp.models.lm.lm_base import LMBase
+from neural_sp.models.lm.rnnlm_infer import RNNLMInference
 from neural_sp.models.modules.glu import LinearGLUBlock
 from neural_sp.models.torch_utils import repeat
 
@@ -47,9 +48,7 @@ class RNNLM(LMBase):
         # for cache
         self.cache_theta = 0.2  # smoothing parameter
         self.cache_lambda = 0.2  # cache weight
-        self.cache_ids = []
-        self.cache_keys = []
-        self.cache_attn = []
+        self.cache = None  # NeuralCache
 
         self.embed = nn.Embedding(self.vocab, args.emb_dim, padding_idx=self.pad)
         self.dropout_embed = nn.Dropout(p=args.dropout_in)
@@ -221,6 +220,45 @@ class RNNLM(LMBase):
 
         return logits, ys_emb, new_state
 
+    def inference_model(self):
+        """Inference-only variant for LM fusion (see RNNLMInference).
+
+        The variant is cached until the LM is set to the training mode.
+
+        Returns:
+            RNNLMInference
+
+        """
+        w = next(self.parameters())
+        model = self.__dict__.get('_inference_model')
+        if model is None or model.table.device != w.device or model.table.dtype != w.dtype:
+            shortlist = self.__dict__.get('_shortlist')
+            model = RNNLMInference(self, shortlist=shortlist.to(w.device) if shortlist is not None else None)
+            # NOTE: not registered as a submodule to exclude it from state_dict
+            self.__dict__['_inference_model'] = model
+        return model
+
+    def set_shortlist(self, shortlist):
+        """Set tokens for the approximate log-normalizer of the inference-only variant.
+
+        Args:
+            shortlist (LongTensor): `[S]`, token indices (e.g., the most frequent tokens).
+                If None, the log-normalizer is computed over the whole vocabulary.
+
+        """
+        self.__dict__['_shortlist'] = shortlist
+        self.__dict__.pop('_inference_model', None)
+
+    def train(self, mode=True):
+        if mode:
+            # parameters will be updated
+            self.__dict__.pop('_inference_model', None)
+        return super(RNNLM, self).train(mode)
+
+    def load_state_dict(self, state_dict, strict=True):
+        self.__dict__.pop('_inference_model', None)
+        return super(RNNLM, self).load_state_dict(state_dict, strict=strict)
+
     def zero_state(self, batch_size):
         """Initialize hidden state.
 
@@ -0,0 +1,256 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Inference-only RNNLM for LM fusion."""
+
+import logging
+import torch
+import torch.nn as nn
+
+logger = logging.getLogger(__name__)
+
+
+class RNNLMInference(nn.Module):
+    """Inference-only variant of RNNLM for LM fusion.
+
+    Parameters of a trained RNNLM are rearranged for step-by-step decoding:
+        - The embedding and the input projection of the first layer (and biases)
+          are folded into a table of gate pre-activations indexed by tokens.
+        - Input and hidden projections of the other layers are fused into a
+          single matrix multiplication per layer.
+        - Only candidate tokens are scored by the output layer if given. The
+          log-normalizer is computed over the whole vocabulary (exact) or over
+          `shortlist` tokens and the candidates (approximation).
+    Dropout is not applied. Adaptive softmax is not supported.
+
+    Args:
+        lm (RNNLM): trained RNNLM
+        shortlist (LongTensor): `[S]`, token indices used for the approximate
+            log-normalizer (e.g., the most frequent tokens)
+
+    """
+
+    def __init__(self, lm, shortlist=None):
+
+        super(RNNLMInference, self).__init__()
+
+        if lm.adaptive_softmax is not None:
+            raise NotImplementedError('Adaptive softmax is not supported.')
+
+        self.rnn_type = lm.rnn_type
+        self.n_units = lm.n_units
+        self.n_layers = lm.n_layers
+        self.n_projs = lm.n_projs
+        self.residual = lm.residual
+        self.vocab = lm.vocab
+        self.eos = lm.eos
+        self.pad = lm.pad
+
+        with torch.no_grad():
+            # Gate pre-activations of the first layer for each token
+            # NOTE: the null context vector for ASR decoder pre-training is zero
+            rnn = lm.rnn[0]
+            w_ih = rnn.weight_ih_l0[:, :lm.emb_dim]
+            table = torch.addmm(rnn.bias_ih_l0, lm.embed.weight, w_ih.t())
+            if self.rnn_type == 'lstm':
+                table += rnn.bias_hh_l0
+            self.register_buffer('table', table.contiguous())  # `[vocab, n_gates * n_units]`
+            self.register_buffer('w_hh0', rnn.weight_hh_l0.t().contiguous())
+            self.register_buffer('b_hh0', rnn.bias_hh_l0.clone())
+
+            for lth in range(1, self.n_layers):
+                rnn = lm.rnn[lth]
+                if self.rnn_type == 'lstm':
+                    w = torch.cat([rnn.weight_ih_l0, rnn.weight_hh_l0], dim=1).t()
+                    b = rnn.bias_ih_l0 + rnn.bias_hh_l0
+                    self.register_buffer('w%d' % lth, w.contiguous())
+                    self.register_buffer('b%d' % lth, b)
+                else:
+                    # NOTE: hidden projections are gated separately in GRU
+                    self.register_buffer('w_ih%d' % lth, rnn.weight_ih_l0.t().contiguous())
+                    self.register_buffer('b_ih%d' % lth, rnn.bias_ih_l0.clone())
+                    self.register_buffer('w_hh%d' % lth, rnn.weight_hh_l0.t().contiguous())
+                    self.register_buffer('b_hh%d' % lth, rnn.bias_hh_l0.clone())
+
+        self.proj = lm.proj if self.n_projs > 0 else None
+        self.glu = lm.glu
+        self.output_proj = lm.output_proj
+        self.output = lm.output
+
+        in_shortlist = None
+        if shortlist is not None:
+            in_shortlist = torch.zeros(self.vocab, dtype=torch.bool, device=shortlist.device)
+            in_shortlist[shortlist] = True
+        self.register_buffer('shortlist', shortlist)
+        self.register_buffer('in_shortlist', in_shortlist)
+
+        self.eval()
+
+    def zero_state(self, batch_size):
+        """Initialize hidden state.
+
+        Args:
+            batch_size (int): batch size
+        Returns:
+            state (dict):
+                hxs (FloatTensor): `[n_layers, B, n_units]`
+                cxs (FloatTensor): `[n_layers, B, n_units]`
+
+        """
+        state = {'hxs': self.table.new_zeros(self.n_layers, batch_size, self.n_units),
+                 'cxs': None}
+        if self.rnn_type == 'lstm':
+            state['cxs'] = self.table.new_zeros(self.n_layers, batch_size, self.n_units)
+        return state
+
+    def _lstm_cell(self, gates, c):
+        i, f, g, o = gates.chunk(4, dim=-1)
+        c = torch.sigmoid(f) * c + torch.sigmoid(i) * torch.tanh(g)
+        h = torch.sigmoid(o) * torch.tanh(c)
+        return h, c
+
+    def _gru_cell(self, gates_i, gates_h, h):
+        i_r, i_z, i_n = gates_i.chunk(3, dim=-1)
+        h_r, h_z, h_n = gates_h.chunk(3, dim=-1)
+        r = torch.sigmoid(i_r + h_r)
+        z = torch.sigmoid(i_z + h_z)
+        n = torch.tanh(i_n + r * h_n)
+        return (1 - z) * n + z * h
+
+    def step(self, ys, state=None):
+        """Update states with input tokens.
+
+        Args:
+            ys (LongTensor): `[B, L]`
+            state (dict):
+                hxs (FloatTensor): `[n_layers, B, n_units]`
+                cxs (FloatTensor): `[n_layers, B, n_units]`
+        Returns:
+            lmout (FloatTensor): `[B, L, n_units]`, outputs before the output layer
+            new_state (dict):
+                hxs (FloatTensor): `[n_layers, B, n_units]`
+                cxs (FloatTensor): `[n_layers, B, n_units]`
+
+        """
+        if state is None:
+            state = self.zero_state(ys.size(0))
+        hxs = list(state['hxs'].unbind(0))
+        cxs = list(state['cxs'].unbind(0)) if self.rnn_type == 'lstm' else None
+
+        outs = []
+        for t in range(ys.size(1)):
+            x = None
+            residual = None
+            for lth in range(self.n_layers):
+                h = hxs[lth]
+                if self.rnn_type == 'lstm':
+                    if lth == 0:
+                        gates = torch.addmm(self.table[ys[:, t]], h, self.w_hh0)
+                    else:
+                        gates = torch.addmm(getattr(self, 'b%d' % lth), torch.cat([x, h], dim=-1),
+                                            getattr(self, 'w%d' % lth))
+                    hxs[lth], cxs[lth] = self._lstm_cell(gates, cxs[lth])
+                else:
+                    if lth == 0:
+                        gates_i = self.table[ys[:, t]]
+                        gates_h = torch.addmm(self.b_hh0, h, self.w_hh0)
+                    else:
+                        gates_i = torch.addmm(getattr(self, 'b_ih%d' % lth), x, getattr(self, 'w_ih%d' % lth))
+                        gates_h = torch.addmm(getattr(self, 'b_hh%d' % lth), h, getattr(self, 'w_hh%d' % lth))
+                    hxs[lth] = self._gru_cell(gates_i, gates_h, h)
+                x = hxs[lth]
+                if self.proj is not None:
+                    x = torch.tanh(self.proj[lth](x))
+                # Residual connection (excluding the raw inputs)
+                if self.residual and lth > 0:
+                    x = x + residual
+                residual = x
+            outs.append(x)
+        out = torch.stack(outs, dim=1)
+
+        if self.glu is not None:
+            if self.residual:
+                residual = out
+            out = self.glu(out)
+            if self.residual:
+                out = out + residual
+        if self.output_proj is not None:
+            out = self.output_proj(out)
+
+        new_state = {'hxs': torch.stack(hxs, dim=0),
+                     'cxs': torch.stack(cxs, dim=0) if self.rnn_type == 'lstm' else None}
+        return out, new_state
+
+    def score(self, lmout, candidates=None):
+        """Compute log probabilities of candidate tokens.
+
+        Args:
+            lmout (FloatTensor): `[B, n_units]`, outputs of `step` at the last step
+            candidates (LongTensor): `[B, K]`, token indices to score.
+                The whole vocabulary is scored if None.
+        Returns:
+            log_probs (FloatTensor): `[B, K]` (`[B, vocab]` if candidates is None)
+
+        """
+        weight, bias = self.output.weight, self.output.bias
+        if candidates is None:
+            return torch.log_softmax(torch.addmm(bias, lmout, weight.t()), dim=-1)
+
+        if self.shortlist is None:
+            logits = torch.addmm(bias, lmout, weight.t())
+            log_norm = torch.logsumexp(logits, dim=-1, keepdim=True)
+            return logits.gather(1, candidates) - log_norm
+
+        logits_cand = torch.bmm(weight[candidates], lmout.unsqueeze(2)).squeeze(2) + bias[candidates]
+        logits_sl = torch.addmm(bias[self.shortlist], lmout, weight[self.shortlist].t())
+        # candidates in the shortlist are counted once
+        log_norm = torch.logsumexp(torch.cat([
+            logits_sl, logits_cand.masked_fill(self.in_shortlist[candidates], float('-inf'))], dim=-1),
+            dim=-1, keepdim=True)
+        return logits_cand - log_norm
+
+    def predict(self, ys, state=None, mems=None, cache=None, candidates=None):
+        """Precict function for ASR (the same interface as LMBase.predict).
+
+        Args:
+            ys (LongTensor): `[B, L]`
+            state (dict):
+                hxs (FloatTensor): `[n_layers, B, n_units]`
+                cxs (FloatTensor): `[n_layers, B, n_units]`
+            mems: dummy interfance for TransformerXL
+            cache: dummy interfance for TransformerLM/TransformerXL
+            candidates (LongTensor): `[B, K]`, token indices to score at the last step
+        Returns:
+            lmout (FloatTensor): `[B, L, n_units]`
+            new_state (dict):
+                hxs (FloatTensor): `[n_layers, B, n_units]`
+                cxs (FloatTensor): `[n_layers, B, n_units]`
+            log_probs (FloatTensor): `[B, 1, vocab]` (`[B, K]` if candidates is given)
+
+        """
+        lmout, new_state = self.step(ys, state)
+        log_probs = self.score(lmout[:, -1], candidates)
+        if candidates is None:
+            log_probs = log_probs.unsqueeze(1)
+        return lmout, new_state, log_probs
+
+    def forward(self, ys, hxs, cxs, candidates):
+        """Tensor-only interface for export (e.g., torch.jit.trace).
+
+        Args:
+            ys (LongTensor): `[B, 1]`
+            hxs (FloatTensor): `[n_layers, B, n_units]`
+            cxs (FloatTensor): `[n_layers, B, n_units]` (ignored for GRU)
+            candidates (LongTensor): `[B, K]`
+        Returns:
+            log_probs (FloatTensor): `[B, K]`
+            hxs (FloatTensor): `[n_layers, B, n_units]`
+            cxs (FloatTensor): `[n_layers, B, n_units]`
+
+        """
+        lmout, state = self.step(ys, {'hxs': hxs, 'cxs': cxs})
+        cxs = state['cxs'] if self.rnn_type == 'lstm' else cxs
+        return self.score(lmout[:, -1], candidates), state['hxs'], cxs
@@ -63,9 +63,7 @@ class TransformerXL(LMBase):
         # for cache
         self.cache_theta = 0.2  # smoothing parameter
         self.cache_lambda = 0.2  # cache weight
-        self.cache_ids = []
-        self.cache_keys = []
-        self.cache_attn = []
+        self.cache = None  # NeuralCache
 
         # positional embedding
         self.pos_emb = XLPositionalEmbedding(self.d_model, args.dropout_in)
@@ -192,6 +190,22 @@ class TransformerXL(LMBase):
 
         return new_mems
 
+    def update_memory_from_cache(self, memory_prev, ys, cache):
+        """Update memory with states cached in incremental decoding.
+
+        Args:
+            memory_prev (list): length `n_layers`, each of which contains `[B, mlen, d_model]`
+            ys (LongTensor): `[B, L]`
+            cache (list): length `n_layers`, each of which contains a FloatTensor `[B, L', d_model]` (`L' <= L`)
+        Returns:
+            new_mems (list): length `n_layers`, each of which contains `[B, mlen, d_model]`
+
+        """
+        ys = ys[:, :cache[0].size(1)]  # tokens without cached states (e.g., the last <eos>) are dropped
+        # inputs to each layer; outputs from the last layer are not used for memory
+        hidden_states = [self.embed(ys.long()) * self.scale] + cache[:-1]
+        return self.update_memory(memory_prev, hidden_states)
+
     def decode(self, ys, state=None, mems=None, cache=None, incremental=False):
         """Decode function.
 
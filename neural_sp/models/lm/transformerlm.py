@@ -57,9 +57,7 @@ class TransformerLM(LMBase):
         # for cache
         self.cache_theta = 0.2  # smoothing parameter
         self.cache_lambda = 0.2  # cache weight
-        self.cache_ids = []
-        self.cache_keys = []
-        self.cache_attn = []
+        self.cache = None  # NeuralCache
 
         self.embed = nn.Embedding(self.vocab, self.d_model, padding_idx=self.pad)
         self.pos_enc = PositionalEncoding(self.d_model, args.dropout_in, args.transformer_pe_type,
@@ -184,7 +182,57 @@ class TransformerLM(LMBase):
                 new_mems.append(cat[:, start_idx:end_idx].detach())  # `[B, self.mem_len, d_model]`
         return new_mems
 
-    def decode(self, ys, state=None, mems=None, cache=None, incremental=False):
+    def truncate_state(self, ys, cache, pos_offset=0):
+        """Truncate the state of the best hypothesis to carry over to the next utterance.
+
+        Only the last `mem_len` tokens and their cached states are kept, so that
+        the next utterance starts from them without re-encoding the history.
+        The cached states depend on the absolute positions of the kept tokens,
+        so positions in the next utterance are offset by the number of dropped
+        tokens. The context is reset when they would run out of positional encodings.
+
+        Args:
+            ys (LongTensor): `[B, L]`
+            cache (list): length `n_layers`, each of which contains a FloatTensor `[B, L', d_model]` (`L' <= L`)
+            pos_offset (int): position of the first token in `ys`
+        Returns:
+            ys (LongTensor): `[B, mem_len]`
+            cache (list): length `n_layers`, each of which contains a FloatTensor `[B, mem_len, d_model]`
+            pos_offset (int): position of the first kept token
+
+        """
+        ylen = cache[0].size(1)  # tokens without cached states (e.g., the last <eos>) are dropped
+        if min(ylen, self.mem_len) == 0:
+            return None
+        start_idx = max(0, ylen - self.mem_len)
+        if self.pos_enc.pe_type == 'add':
+            # NOTE: leave the other half of positions for the next utterance
+            if pos_offset + ylen > self.pos_enc.pe.size(1) // 2:
+                return None
+            pos_offset += start_idx
+        return ys[:, start_idx:ylen], [c[:, start_idx:].detach() for c in cache], pos_offset
+
+    def predict(self, ys, state=None, mems=None, cache=None, pos_offset=0):
+        """Precict function for ASR.
+
+        Args:
+            ys (LongTensor): `[B, L]`
+            state (list): dummy interfance for RNNLM
+            mems (list): length `n_layers`, each of which contains a FloatTensor `[B, mlen, d_model]`
+            cache (list): length `n_layers`, each of which contains a FloatTensor `[B, L-1, d_model]`
+            pos_offset (int): position of the first token in `ys` (see truncate_state)
+        Returns:
+            lmout (FloatTensor): `[B, L, d_model]`, used for LM integration such as cold fusion
+            cache (list): length `n_layers`, each of which contains a FloatTensor `[B, L, d_model]`
+            log_probs (FloatTensor): `[B, L, vocab]`
+
+        """
+        logits, lmout, new_cache = self.decode(ys, state, mems=mems, cache=cache,
+                                               incremental=True, pos_offset=pos_offset)
+        log_probs = torch.log_softmax(logits, dim=-1)
+        return lmout, new_cache, log_probs
+
+    def decode(self, ys, state=None, mems=None, cache=None, incremental=False, pos_offset=0):
         """Decode function.
 
         Args:
@@ -193,6 +241,7 @@ class TransformerLM(LMBase):
             mems (list): length `n_layers`, each of which contains a FloatTensor `[B, mlen, d_model]`
             cache (list): length `L`, each of which contains a FloatTensor `[B, L-1, d_model]`
             incremental (bool): ASR decoding mode
+            pos_offset (int): position of the first token in `ys`
         Returns:
             logits (FloatTensor): `[B, L, vocab]`
             out (FloatTensor): `[B, L, d_model]`
@@ -214,7 +263,7 @@ class TransformerLM(LMBase):
         causal_mask = torch.tril(causal_mask, diagonal=0, out=causal_mask).unsqueeze(0)
         causal_mask = causal_mask.repeat([bs, 1, 1])
 
-        out = self.pos_enc(self.embed(ys.long()))
+        out = self.pos_enc(self.embed(ys.long()), offset=pos_offset)
 
         new_mems = [None] * self.n_layers
         new_cache = [None] * self.n_layers
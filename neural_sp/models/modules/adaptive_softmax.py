@@ -0,0 +1,161 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Adaptive softmax output layer for decoders with a large vocabulary."""
+
+import logging
+import numpy as np
+import torch
+import torch.nn as nn
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveSoftmax(nn.AdaptiveLogSoftmaxWithLoss):
+    """Frequency-clustered adaptive softmax (Grave et al., 2017).
+
+    Token indices are assumed to be sorted in descending order of frequency.
+    Frequent tokens below the first cutoff are predicted by the head together
+    with the clusters, and rare tokens in each cluster by a tail with a reduced
+    dimension. Only the tails of the reference tokens are computed in training.
+
+    Unlike nn.AdaptiveLogSoftmaxWithLoss, forward() returns log-probabilities
+    over the whole vocabulary, so that this layer can replace the linear
+    output layer of a decoder in decoding as is.
+
+    Args:
+        idim (int): dimension of input features
+        vocab (int): vocabulary size
+        cutoffs (str): boundaries of frequency clusters delimited by "_"
+            (vocab // 25 and vocab // 5 if empty, excluding those out of range)
+        div_value (float): dimension of each tail is divided by this value in turn
+
+    """
+
+    def __init__(self, idim, vocab, cutoffs='', div_value=4.0):
+
+        if cutoffs:
+            cutoffs = [int(c) for c in cutoffs.split('_')]
+            if any(c <= 0 or c >= vocab for c in cutoffs) or any(
+                    c_next <= c for c, c_next in zip(cutoffs[:-1], cutoffs[1:])):
+                raise ValueError('Cutoffs of adaptive softmax must be increasing and between 1 and %d, '
+                                 'but got %s.' % (vocab - 1, cutoffs))
+        else:
+            cutoffs = sorted(set(c for c in [vocab // 25, vocab // 5] if 0 < c < vocab))
+            if len(cutoffs) == 0:
+                raise ValueError('Vocabulary size %d is too small for adaptive softmax.' % vocab)
+        super().__init__(idim, vocab, cutoffs=cutoffs, div_value=div_value)
+        logger.info('Adaptive softmax: head %d (+%d clusters), tails %s' % (
+            self.shortlist_size, self.n_clusters,
+            [self.cutoffs[i + 1] - self.cutoffs[i] for i in range(self.n_clusters)]))
+
+    def forward(self, xs):
+        """Compute log-probabilities over the whole vocabulary.
+
+        Args:
+            xs (FloatTensor): `[*, idim]`
+        Returns:
+            log_probs (FloatTensor): `[*, vocab]`
+
+        """
+        log_probs = self.log_prob(xs.reshape(-1, xs.size(-1)))
+        return log_probs.view(*xs.size()[:-1], self.n_classes)
+
+    def loss(self, xs, ys, ignore_index):
+        """Compute cross entropy loss in the same way as cross_entropy_lsm without label smoothing.
+
+        Args:
+            xs (FloatTensor): `[B, L, idim]`
+            ys (LongTensor): Indices of labels. `[B, L]`
+            ignore_index (int): index for padding
+        Returns:
+            loss (FloatTensor): `[1]`, summed over tokens and divided by batch size
+            ppl (float): perplexity
+
+        """
+        mask = ys != ignore_index
+        log_probs = super().forward(xs[mask], ys[mask]).output  # `[n_tokens]`
+        loss = -log_probs.sum() / xs.size(0)
+        ppl = np.exp(-log_probs.mean().item())
+        return loss, ppl
+
+    def argmax(self, xs):
+        """Predict the 1-best token without computing tails if the head is confident.
+
+        Args:
+            xs (FloatTensor): `[*, idim]`
+        Returns:
+            ys (LongTensor): `[*]`
+
+        """
+        return self.predict(xs.reshape(-1, xs.size(-1))).view(xs.size()[:-1])
+
+    def accuracy(self, xs, ys, ignore_index):
+        """Compute teacher-forcing accuracy.
+
+        Args:
+            xs (FloatTensor): `[B, L, idim]`
+            ys (LongTensor): `[B, L]`
+            ignore_index (int): index for padding
+        Returns:
+            acc (float): teacher-forcing accuracy
+
+        """
+        mask = ys != ignore_index
+        with torch.no_grad():
+            ys_pred = self.argmax(xs[mask])
+        return float((ys_pred == ys[mask]).sum()) * 100 / float(mask.sum())
+
+    def topk(self, xs, k):
+        """Select top-k candidates exactly while skipping tails that cannot be selected.
+
+        The log-probability of any token in a cluster is bounded by that of
+        the cluster in the head, so a tail is computed only for inputs whose
+        cluster scores above the k-th best token in the head.
+
+        Args:
+            xs (FloatTensor): `[*, idim]`
+            k (int): number of candidates
+        Returns:
+            topk_log_probs (FloatTensor): `[*, k]`
+            topk_ids (LongTensor): `[*, k]`
+
+        """
+        size = xs.size()[:-1]
+        xs = xs.reshape(-1, xs.size(-1))
+        head_log_probs = torch.log_softmax(self.head(xs), dim=-1)
+        log_probs = head_log_probs.new_full((xs.size(0), self.n_classes), float('-inf'))
+        log_probs[:, :self.shortlist_size] = head_log_probs[:, :self.shortlist_size]
+        if k <= self.shortlist_size:
+            threshold = torch.topk(head_log_probs[:, :self.shortlist_size], k=k, dim=-1)[0][:, -1]
+        else:
+            threshold = head_log_probs.new_full((xs.size(0),), float('-inf'))
+
+        for i in range(self.n_clusters):
+            cluster_log_probs = head_log_probs[:, self.shortlist_size + i]
+            rows = (cluster_log_probs > threshold).nonzero().squeeze(1)
+            if rows.size(0) == 0:
+                continue
+            tail_log_probs = torch.log_softmax(self.tail[i](xs[rows]), dim=-1)
+            log_probs[rows, self.cutoffs[i]:self.cutoffs[i + 1]] = \
+                tail_log_probs + cluster_log_probs[rows].unsqueeze(1)
+
+        topk_log_probs, topk_ids = torch.topk(log_probs, k=k, dim=-1)
+        return topk_log_probs.view(*size, k), topk_ids.view(*size, k)
+
+    def log_prob_topk(self, xs, k):
+        """Compute log-probabilities of the top-k candidates only (see topk).
+
+        Args:
+            xs (FloatTensor): `[*, idim]`
+            k (int): number of candidates
+        Returns:
+            log_probs (FloatTensor): `[*, vocab]`, -inf except for the top-k candidates
+
+        """
+        topk_log_probs, topk_ids = self.topk(xs, k)
+        log_probs = topk_log_probs.new_full(topk_ids.size()[:-1] + (self.n_classes,), float('-inf'))
+        return log_probs.scatter_(-1, topk_ids, topk_log_probs)
@@ -50,13 +50,22 @@ class CIF(nn.Module):
         else:
             logger.info('Parameter initialization is skipped.')
 
+        # for incremental (streaming) firing
+        self.reset()
+
     def reset_parameters(self):
         """Initialize parameters with Xavier uniform distribution."""
         logger.info('===== Initialize %s with Xavier uniform distribution =====' % self.__class__.__name__)
         for n, p in self.named_parameters():
             init_with_xavier_uniform(n, p)
 
-    def forward(self, eouts, elens, ylens=None, mode='parallel'):
+    def reset(self):
+        """Reset states carried over for incremental (streaming) firing."""
+        self.alpha_accum = None
+        self.state = None
+        self.n_fired = None
+
+    def forward(self, eouts, elens, ylens=None, mode='parallel', is_last=False):
         """Forward pass.
 
         Args:
@@ -64,96 +73,119 @@ class CIF(nn.Module):
             elens (IntTensor): `[B]`
             ylens (IntTensor): `[B]`
             mode (str): parallel/incremental
+            is_last (bool): the last chunk in incremental mode.
+                The remaining weights are fired if they are larger than 0.5.
         Returns:
             cv (FloatTensor): `[B, L, enc_dim]`
             alpha (FloatTensor): `[B, T]`
             aws (FloatTensor): `[B, L, T]`
 
+        In the incremental mode, `eouts` is a new chunk of the current streams,
+        and the accumulated weight and the integrated state of the token that has
+        not been fired yet are carried over to the next call until `reset()`.
+        `L` is the maximum number of tokens fired in the chunk, and the number of
+        fired tokens in each stream is stored in `self.n_fired`.
+
         """
         bs, xmax, enc_dim = eouts.size()
+        device = eouts.device
 
         # 1d conv
         conv_feat = self.conv1d(eouts.transpose(2, 1)).transpose(2, 1)  # `[B, T, enc_dim]`
         conv_feat = torch.relu(self.norm(conv_feat))
         alpha = torch.sigmoid(self.proj(conv_feat)).squeeze(2)  # `[B, T]`
 
+        # padding
+        mask = make_pad_mask(elens.to(device))
+        alpha_masked = alpha.masked_fill(mask == 0, 0)
+
         # normalization
         if mode == 'parallel':
-            # padding
             assert ylens is not None
-            device = eouts.device
             ylens = ylens.to(device)
-            mask = make_pad_mask(elens.to(device))
-            alpha = alpha.clone().masked_fill_(mask == 0, 0)
-
-            alpha_norm = alpha / alpha.sum(1, keepdim=True) * ylens.float().unsqueeze(1)
+            alpha_norm = alpha_masked / alpha_masked.sum(1, keepdim=True) * ylens.float().unsqueeze(1)
             ymax = int(ylens.max().item())
+            cv, aws = self.integrate(eouts, alpha_norm, ymax)
+            # skip tokens over the reference length
+            token_mask = make_pad_mask(ylens).unsqueeze(2)  # `[B, L, 1]`
+            cv = cv.masked_fill(token_mask == 0, 0)
+            aws = aws.masked_fill(token_mask == 0, 0)
         elif mode == 'incremental':
-            alpha_norm = alpha  # infernece time
-            ymax = 1
-            if bs > 1:
-                raise NotImplementedError('Batch mode is not supported.')
-                # TODO(hirofumi0810): support batch mode
+            if self.alpha_accum is None:
+                self.alpha_accum = eouts.new_zeros(bs)
+                self.state = eouts.new_zeros(bs, enc_dim)
+            cv, aws = self.integrate_incremental(eouts, alpha_masked, is_last)
         else:
             raise ValueError(mode)
 
-        cv = eouts.new_zeros(bs, ymax + 1, enc_dim)
-        aws = eouts.new_zeros(bs, ymax + 1, xmax)
-        n_tokens = torch.zeros(bs, dtype=torch.int64)
-        state = eouts.new_zeros(bs, self.enc_dim)
-        alpha_accum = eouts.new_zeros(bs)
-        for j in range(xmax):
-            alpha_accum_prev = alpha_accum
-            alpha_accum += alpha_norm[:, j]
-
-            if mode == 'parallel' and (alpha_accum >= self.beta).sum() == 0:
-                # No boundary is located in all utterances in mini-batch
-                # Carry over to the next frame
-                state += alpha_norm[:, j, None] * eouts[:, j]
-                aws[:, n_tokens, j] += alpha_norm[:, j]
-            else:
-                for b in range(bs):
-                    # skip the padding region
-                    if j > elens[b] - 1:
-                        continue
-
-                    # skip all-fired utterance
-                    if mode == 'parallel' and n_tokens[b].item() >= ylens[b]:
-                        continue
-
-                    if alpha_accum[b] < self.beta:
-                        # No boundary is located
-                        # Carry over to the next frame
-                        state[b] += alpha_norm[b, j, None] * eouts[b, j]
-                        aws[b, n_tokens[b], j] += alpha_norm[b, j]
-
-                        # tail handling
-                        if mode == 'incremental' and j == elens[b] - 1:
-                            if alpha_accum[b] >= 0.5:
-                                n_tokens[b] += 1
-                                cv[b, n_tokens[b]] = state[b]
-                            break
-                    else:
-                        # A boundary is located
-                        ak1 = 1 - alpha_accum_prev[b]
-                        ak2 = alpha_norm[b, j] - ak1
-                        cv[b, n_tokens[b]] = state[b] + ak1 * eouts[b, j]
-                        aws[b, n_tokens[b], j] += ak1
-                        n_tokens[b] += 1
-                        # Carry over to the next frame
-                        state[b] = ak2 * eouts[b, j]
-                        alpha_accum[b] = ak2
-                        aws[b, n_tokens[b], j] += ak2
-
-                        if mode == 'incremental':
-                            break
-
-                if mode == 'incremental' and n_tokens[0] >= 1:
-                    break
-                    # TODO(hirofumi0810): support batch mode
-
-        # truncate
-        cv = cv[:, :ymax]
-        aws = aws[:, :ymax]
-
         return cv, alpha, aws
+
+    def integrate(self, eouts, alpha, ymax, alpha_accum=None):
+        """Integrate encoder outputs into token-level representations.
+
+        The weight of the j-th frame to the k-th token is the overlap between
+        `[c_{j-1}, c_j)` and `[k * beta, (k + 1) * beta)`, where `c_j` is the cumulative
+        sum of firing weights. This is equivalent to integrating frame by frame
+        and firing whenever the accumulated weight reaches the threshold.
+
+        Args:
+            eouts (FloatTensor): `[B, T, enc_dim]`
+            alpha (FloatTensor): `[B, T]` (padded frames must be zeros)
+            ymax (int): number of tokens to compute
+            alpha_accum (FloatTensor): `[B]` accumulated weight carried over
+        Returns:
+            cv (FloatTensor): `[B, ymax, enc_dim]`
+            aws (FloatTensor): `[B, ymax, T]`
+
+        """
+        bs = alpha.size(0)
+        if alpha_accum is None:
+            alpha_accum = alpha.new_zeros(bs)
+        csum = alpha_accum.unsqueeze(1) + torch.cumsum(alpha, dim=1)  # `[B, T]`
+        csum_prev = torch.cat([alpha_accum.unsqueeze(1), csum[:, :-1]], dim=1)  # `[B, T]`
+        bd_left = torch.arange(ymax, dtype=alpha.dtype, device=alpha.device).view(1, ymax, 1) * self.beta
+        bd_right = bd_left + self.beta
+        aws = torch.min(csum.unsqueeze(1), bd_right) - torch.max(csum_prev.unsqueeze(1), bd_left)
+        aws = torch.relu(aws)  # `[B, ymax, T]`
+        cv = torch.bmm(aws, eouts)  # `[B, ymax, enc_dim]`
+        return cv, aws
+
+    def integrate_incremental(self, eouts, alpha, is_last=False):
+        """Fire tokens in a new chunk with the carried-over states.
+
+        Args:
+            eouts (FloatTensor): `[B, T, enc_dim]`
+            alpha (FloatTensor): `[B, T]` (padded frames must be zeros)
+            is_last (bool): fire the remaining weights if they are larger than 0.5
+        Returns:
+            cv (FloatTensor): `[B, L, enc_dim]`
+            aws (FloatTensor): `[B, L, T]`
+
+        """
+        bs, _, enc_dim = eouts.size()
+        alpha_accum = self.alpha_accum + alpha.sum(1)
+        n_fired = torch.floor(alpha_accum / self.beta).long()  # `[B]`
+        # NOTE: include the token being integrated
+        ymax = int(n_fired.max().item()) + 1
+        cv, aws = self.integrate(eouts, alpha, ymax, alpha_accum=self.alpha_accum)
+        cv[:, 0] += self.state
+
+        # carry over the token being integrated
+        ids = n_fired.view(bs, 1, 1).expand(bs, 1, enc_dim)
+        self.state = torch.gather(cv, 1, ids).squeeze(1)
+        self.alpha_accum = alpha_accum - n_fired.to(alpha.dtype) * self.beta
+
+        # tail handling
+        if is_last:
+            is_tail = self.alpha_accum >= 0.5
+            n_fired = n_fired + is_tail.long()
+            self.state = self.state.masked_fill(is_tail.unsqueeze(1), 0)
+            self.alpha_accum = self.alpha_accum.masked_fill(is_tail, 0)
+
+        # mask tokens that are not fired yet
+        ymax = int(n_fired.max().item())
+        token_mask = make_pad_mask(n_fired).unsqueeze(2)  # `[B, L, 1]`
+        cv = cv[:, :ymax].masked_fill(token_mask == 0, 0)
+        aws = aws[:, :ymax].masked_fill(token_mask == 0, 0)
+        self.n_fired = n_fired
+        return cv, aws
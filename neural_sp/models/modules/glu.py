@@ -7,6 +7,7 @@
 """Gated Linear Units (GLU) block."""
 
 from collections import OrderedDict
+import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
@@ -45,6 +46,7 @@ class ConvGLUBlock(nn.Module):
 
         super().__init__()
 
+        self.kernel_size = kernel_size
         self.conv_residual = None
         if in_ch != out_ch:
             self.conv_residual = nn.utils.weight_norm(
@@ -63,7 +65,7 @@ class ConvGLUBlock(nn.Module):
                           kernel_size=(kernel_size, 1)), name='weight', dim=0)
             # TODO(hirofumi0810): padding?
             layers['dropout'] = nn.Dropout(p=dropout)
-            layers['glu'] = nn.GLU()
+            layers['glu'] = nn.GLU(dim=1)  # over channels
 
         elif bottlececk_dim > 0:
             layers['conv_in'] = nn.utils.weight_norm(
@@ -73,13 +75,13 @@ class ConvGLUBlock(nn.Module):
             layers['dropout_in'] = nn.Dropout(p=dropout)
             layers['conv_bottleneck'] = nn.utils.weight_norm(
                 nn.Conv2d(in_channels=bottlececk_dim,
-                          out_channels=bottlececk_dim,
+                          out_channels=bottlececk_dim * 2,
                           kernel_size=(kernel_size, 1)), name='weight', dim=0)
             layers['dropout'] = nn.Dropout(p=dropout)
-            layers['glu'] = nn.GLU()
+            layers['glu'] = nn.GLU(dim=1)  # over channels
             layers['conv_out'] = nn.utils.weight_norm(
                 nn.Conv2d(in_channels=bottlececk_dim,
-                          out_channels=out_ch * 2,
+                          out_channels=out_ch,
                           kernel_size=(1, 1)), name='weight', dim=0)
             layers['dropout_out'] = nn.Dropout(p=dropout)
 
@@ -101,3 +103,27 @@ class ConvGLUBlock(nn.Module):
         xs = self.layers(xs)  # `[B, out_ch * 2, T ,1]`
         xs = xs + residual
         return xs
+
+    def forward_incremental(self, xs, cache=None):
+        """Forward pass for new steps, reusing inputs of the past steps.
+
+        Args:
+            xs (FloatTensor): `[B, in_ch, T, feat_dim]`, inputs of new steps
+            cache (FloatTensor): `[B, in_ch, kernel_size - 1, feat_dim]`,
+                last inputs in the receptive field (zero padding if None)
+        Returns:
+            out (FloatTensor): `[B, out_ch, T, feat_dim]`
+            new_cache (FloatTensor): `[B, in_ch, kernel_size - 1, feat_dim]`
+
+        """
+        residual = xs
+        if self.conv_residual is not None:
+            residual = self.dropout_residual(self.conv_residual(residual))
+        if cache is None:
+            xs = self.pad_left(xs)
+        else:
+            xs = torch.cat([cache, xs], dim=2)
+        new_cache = xs[:, :, xs.size(2) - (self.kernel_size - 1):]
+        xs = self.layers(xs)
+        xs = xs + residual
+        return xs, new_cache
@@ -11,7 +11,6 @@
 
 import logging
 import math
-import numpy as np
 import random
 import torch
 import torch.nn as nn
@@ -146,7 +145,7 @@ class MonotonicEnergy(nn.Module):
         if self.r is not None:
             e = e + self.r
         if m is not None:
-            NEG_INF = float(np.finfo(torch.tensor(0, dtype=e.dtype).numpy().dtype).min)
+            NEG_INF = torch.finfo(e.dtype).min
             e = e.masked_fill_(m == 0, NEG_INF)
         e = e.permute(0, 3, 1, 2)  # `[B, H_ma, qlen, klen]`
 
@@ -250,7 +249,7 @@ class ChunkEnergy(nn.Module):
         # e: `[B, qlen, klen, H_ca]`
 
         if m is not None:
-            NEG_INF = float(np.finfo(torch.tensor(0, dtype=e.dtype).numpy().dtype).min)
+            NEG_INF = torch.finfo(e.dtype).min
             e = e.masked_fill_(m == 0, NEG_INF)
         e = e.permute(0, 3, 1, 2)  # `[B, H_ca, qlen, klen]`
 
@@ -378,9 +377,39 @@ class MoChA(nn.Module):
         self.key_prev_tail = None
 
     def register_key_prev_tail(self, key):
-        # for chunkwise attention during streaming decoding
+        """Keep the last `w - 1` frames of `key` for chunkwise attention during streaming decoding.
+
+        The tail is prepended to key/value in the next input segment. `key_prev_tail`
+        is a view of `key` unless `key` is shorter than `w - 1` frames, in which
+        case `key` is appended to the previous tail.
+
+        Args:
+            key (FloatTensor): `[B, klen, kdim]`
+
+        """
+        if self.w <= 1:
+            return
+        key = key.detach()
+        tail = self.key_prev_tail
+        if tail is not None and key.size(1) < self.w - 1 and tail.size(0) == key.size(0):
+            key = torch.cat([tail, key], dim=1)
         self.key_prev_tail = key[:, -(self.w - 1):]
 
+    def _prepend_key_tail(self, x):
+        """Prepend the key tail of the previous input segment to `x`.
+
+        Args:
+            x (FloatTensor): `[B, klen, dim]`
+        Returns:
+            x (FloatTensor): `[B, tail_len + klen, dim]`
+
+        """
+        tail = self.key_prev_tail
+        if tail.size(0) != x.size(0):
+            # NOTE: all hypotheses in beam search share the tail of the first utterance
+            tail = tail[0:1].expand(x.size(0), -1, -1)
+        return torch.cat([tail, x], dim=1)
+
     def recursive(self, e_ma, aw_prev):
         bs, n_heads_ma, qlen, klen = e_ma.size()
         p_choose = torch.sigmoid(add_gaussian_noise(e_ma, self.noise_std))  # `[B, H_ma, qlen, klen]`
@@ -458,23 +487,7 @@ class MoChA(nn.Module):
             alpha = p_choose_i * exclusive_cumprod(1 - p_choose_i)  # `[B, H_ma, 1 (qlen), klen]`
 
         if eps_wait > 0:
-            for b in range(bs):
-                # no boundary until the last frame for all heads
-                if alpha[b].sum() == 0:
-                    continue
-
-                leftmost = alpha[b, :, -1].nonzero()[:, -1].min().item()
-                rightmost = alpha[b, :, -1].nonzero()[:, -1].max().item()
-                for h in range(self.n_heads_ma):
-                    # no bondary at the h-th head
-                    if alpha[b, h, -1].sum().item() == 0:
-                        alpha[b, h, -1, min(rightmost, leftmost + eps_wait)] = 1
-                        continue
-
-                    # surpass acceptable latency
-                    if alpha[b, h, -1].nonzero()[:, -1].min().item() >= leftmost + eps_wait:
-                        alpha[b, h, -1, :] = 0  # reset
-                        alpha[b, h, -1, leftmost + eps_wait] = 1
+            alpha = head_synchronous_boundary(alpha, eps_wait)
 
         return alpha, None
 
@@ -534,14 +547,18 @@ class MoChA(nn.Module):
         else:
             raise ValueError("mode must be 'recursive', 'parallel', or 'hard'.")
 
+        # leftmost/rightmost boundaries over all heads and beams (single device sync)
+        bd_range = None
+        if efficient_decoding and mode == 'hard':
+            bd_range = boundary_range(alpha)
+
         # Compute chunk energy
         beta = None
         if self.chunk_energy is not None:
             bd_leftmost = 0
             bd_rightmost = klen - 1 - self.bd_offset
-            if efficient_decoding and mode == 'hard' and alpha.sum() > 0:
-                bd_leftmost = alpha[:, :, 0].nonzero()[:, -1].min().item()
-                bd_rightmost = alpha[:, :, 0].nonzero()[:, -1].max().item()
+            if efficient_decoding and mode == 'hard' and bd_range is not None:
+                bd_leftmost, bd_rightmost = bd_range
                 if bd_leftmost == bd_rightmost:
                     alpha_masked = alpha_masked[:, :, :, bd_leftmost:bd_leftmost + 1]
                 else:
@@ -549,7 +566,7 @@ class MoChA(nn.Module):
 
             if mode == 'hard':
                 if self.key_prev_tail is not None:
-                    key_ = torch.cat([self.key_prev_tail[0:1].repeat([bs, 1, 1]), key], dim=1)
+                    key_ = self._prepend_key_tail(key)
                 else:
                     key_ = key
                 e_ca = self.chunk_energy(key_, query, mask, cache=cache,
@@ -585,8 +602,8 @@ class MoChA(nn.Module):
 
         # Update after calculating beta
         bd_offset_prev = self.bd_offset
-        if efficient_decoding and mode == 'hard' and alpha.sum() > 0:
-            self.bd_offset += alpha[:, :, 0, self.bd_offset:].nonzero()[:, -1].min().item()
+        if bd_range is not None:
+            self.bd_offset += bd_range[0]
 
         # Compute context vector
         if self.n_heads_ma * self.n_heads_ca > 1:
@@ -600,7 +617,7 @@ class MoChA(nn.Module):
                 cv = torch.bmm(alpha.squeeze(1), value)  # `[B, 1, adim]`
             else:
                 if self.key_prev_tail is not None:
-                    value_ = torch.cat([self.key_prev_tail[0:1].repeat([bs, 1, 1]), value], dim=1)
+                    value_ = key_ if value is key else self._prepend_key_tail(value)
                     cv = torch.bmm(beta.squeeze(1), value_)  # `[B, 1, adim]`
                 else:
                     cv = torch.bmm(beta.squeeze(1), value)  # `[B, 1, adim]`
@@ -657,7 +674,8 @@ def safe_cumprod(x, eps):
             x (FloatTensor): `[B, H, qlen, klen]`
 
     """
-    return torch.exp(exclusive_cumsum(torch.log(torch.clamp(x, min=eps, max=1.0))))
+    # NOTE: always computed in float32 to avoid underflow in mixed precision training
+    return torch.exp(exclusive_cumsum(torch.log(torch.clamp(x.float(), min=eps, max=1.0))))
 
 
 def exclusive_cumsum(x):
@@ -682,6 +700,7 @@ def exclusive_cumprod(x):
             x (FloatTensor): `[B, H, qlen, klen]`
 
     """
+    x = x.float()  # NOTE: always computed in float32 in mixed precision training
     return torch.cumprod(torch.cat([x.new_ones(x.size(0), x.size(1), x.size(2), 1),
                                     x[:, :, :, :-1]], dim=-1), dim=-1)
 
@@ -759,6 +778,47 @@ def efficient_chunkwise_attention(alpha, u, mask, chunk_size, n_heads_chunk,
     return beta.view(bs, -1, qlen, klen)
 
 
+def head_synchronous_boundary(alpha, eps_wait):
+    """Force all monotonic attention heads to detect boundaries within `eps_wait`
+        frames from the leftmost boundary over heads (head-synchronous decoding).
+
+    Args:
+        alpha (FloatTensor): `[B, H_ma, 1, klen]`
+        eps_wait (int): wait time delay
+    Returns:
+        alpha (FloatTensor): `[B, H_ma, 1, klen]`
+
+    """
+    bs, n_heads_mono, qlen, klen = alpha.size()
+    alpha_last = alpha[:, :, -1]  # `[B, H_ma, klen]`
+    has_bd = alpha_last.sum(-1) > 0  # `[B, H_ma]`
+    bd = (alpha_last != 0).float().argmax(-1)  # `[B, H_ma]`
+    leftmost = bd.masked_fill(~has_bd, klen).min(-1, keepdim=True)[0]  # `[B, 1]`
+    rightmost = bd.masked_fill(~has_bd, -1).max(-1, keepdim=True)[0]  # `[B, 1]`
+    # heads with no boundary or surpassing acceptable latency are moved to
+    # `leftmost + eps_wait` (clamped to the rightmost boundary)
+    bd_sync = torch.min(rightmost, leftmost + eps_wait).expand_as(bd)
+    update = (~has_bd | (bd >= leftmost + eps_wait)) & has_bd.any(-1, keepdim=True)
+    alpha_sync = torch.zeros_like(alpha_last).scatter_(-1, bd_sync.clamp(0, klen - 1).unsqueeze(-1), 1)
+    alpha_last = torch.where(update.unsqueeze(-1), alpha_sync, alpha_last)
+    return torch.cat([alpha[:, :, :-1], alpha_last.unsqueeze(2)], dim=2)
+
+
+def boundary_range(alpha):
+    """Compute the leftmost/rightmost boundaries over all heads and beams.
+
+    Args:
+        alpha (FloatTensor): `[B, H_ma, qlen, klen]`
+    Returns:
+        bd_range (tuple): (leftmost, rightmost), None if no boundary is detected
+
+    """
+    pos = alpha[:, :, 0].nonzero()[:, -1]
+    if pos.numel() == 0:
+        return None
+    return tuple(torch.stack([pos.min(), pos.max()]).tolist())
+
+
 def hard_chunkwise_attention(alpha, u, mask, chunk_size, n_heads_chunk,
                              sharpening_factor, share_chunkwise_attention):
     """Compute chunkwise attention over hard attention at test time.
@@ -786,18 +846,18 @@ def hard_chunkwise_attention(alpha, u, mask, chunk_size, n_heads_chunk,
         else:
             u = u.view(bs, n_heads_mono, n_heads_chunk, qlen, klen)
 
-    mask = alpha.clone().byte()  # `[B, H_ma, H_ca, qlen, klen]`
-    for b in range(bs):
-        for h in range(n_heads_mono):
-            if alpha[b, h, 0, 0].sum() > 0:
-                boundary = alpha[b, h, 0, 0].nonzero()[:, -1].min().item()
-                if chunk_size == -1:
-                    # infinite lookback attention
-                    mask[b, h, :, 0, 0:boundary + 1] = 1
-                else:
-                    mask[b, h, :, 0, max(0, boundary - chunk_size + 1):boundary + 1] = 1
-
-    NEG_INF = float(np.finfo(torch.tensor(0, dtype=u.dtype).numpy().dtype).min)
+    # window [boundary - chunk_size + 1, boundary] from the first boundary of each head
+    alpha_0 = alpha[:, :, 0, 0]  # `[B, H_ma, klen]`
+    has_bd = alpha_0.sum(-1, keepdim=True) > 0  # `[B, H_ma, 1]`
+    boundary = (alpha_0 != 0).float().argmax(-1).unsqueeze(-1)  # `[B, H_ma, 1]`
+    pos = torch.arange(klen, device=alpha.device)
+    window = (pos <= boundary) & has_bd
+    if chunk_size != -1:
+        window &= (pos > boundary - chunk_size)
+    mask = alpha != 0  # `[B, H_ma, H_ca, qlen, klen]`
+    mask[:, :, :, 0] |= window.unsqueeze(2)
+
+    NEG_INF = torch.finfo(u.dtype).min
     u = u.masked_fill(mask == 0, NEG_INF)
     beta = torch.softmax(u, dim=-1)
     return beta.view(bs, -1, qlen, klen)
@@ -8,7 +8,6 @@
 
 import logging
 import math
-import numpy as np
 import torch
 import torch.nn as nn
 
@@ -135,7 +134,7 @@ class MultiheadAttentionMechanism(nn.Module):
 
         # Compute attention weights
         if self.mask is not None:
-            NEG_INF = float(np.finfo(torch.tensor(0, dtype=e.dtype).numpy().dtype).min)
+            NEG_INF = torch.finfo(e.dtype).min
             e = e.masked_fill_(self.mask == 0, NEG_INF)  # `[B, qlen, klen, H]`
         aw = torch.softmax(e, dim=2)
         aw = self.dropout_attn(aw)
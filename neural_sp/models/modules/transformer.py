@@ -199,14 +199,14 @@ class TransformerDecoderBlock(nn.Module):
 
         residual = ys
         if self.memory_transformer:
-            if cache is not None:
-                pos_embs = pos_embs[-ys.size(1):]
             if memory is not None and memory.dim() > 1:
                 cat = self.norm1(torch.cat([memory, ys], dim=1))
                 ys = cat[:, memory.size(1):]
             else:
                 ys = self.norm1(ys)
                 cat = ys
+            if cache is not None:
+                pos_embs = pos_embs[-cat.size(1):]
         else:
             ys = self.norm1(ys)  # pre-norm
 
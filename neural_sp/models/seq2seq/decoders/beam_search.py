@@ -15,6 +15,9 @@
 import torch
 # import torch.nn as nn
 
+from neural_sp.models.lm.lookahead_wordlm import LookAheadWordLM
+from neural_sp.models.lm.ngram import NgramLM
+from neural_sp.models.lm.rnnlm import RNNLM
 from neural_sp.models.torch_utils import tensor2np
 
 
@@ -67,12 +70,49 @@ class BeamSearch(object):
     def add_lm_score(self, after_topk=True):
         raise NotImplementedError
 
+    @staticmethod
+    def inference_lm(lm):
+        """Inference-only variant of the LM for LM fusion.
+
+        Args:
+            lm (LMBase): LM
+        Returns:
+            RNNLMInference, NgramLM or LookAheadWordLM (None if not available for the LM)
+
+        """
+        if isinstance(lm, RNNLM) and lm.adaptive_softmax is None:
+            return lm.inference_model()
+        elif isinstance(lm, (NgramLM, LookAheadWordLM)):
+            return lm
+        return None
+
+    @staticmethod
+    def merge_rnnlm_states(hyps):
+        """Concatenate states of RNNLM (or NgramLM) over hypotheses."""
+        states = [beam['lmstate'] for beam in hyps]
+        if states[0] is None:
+            return None
+        if isinstance(states[0], dict):
+            return {'hxs': torch.cat([s['hxs'] for s in states], dim=1),
+                    'cxs': torch.cat([s['cxs'] for s in states], dim=1) if states[0]['cxs'] is not None else None}
+        return torch.cat(states, dim=0)
+
+    @staticmethod
+    def select_rnnlm_state(lmstate, j):
+        """State of RNNLM (or NgramLM) for the `j`-th hypothesis."""
+        if lmstate is None:
+            return None
+        if isinstance(lmstate, dict):
+            return {'hxs': lmstate['hxs'][:, j:j + 1],
+                    'cxs': lmstate['cxs'][:, j:j + 1] if lmstate['cxs'] is not None else None}
+        return lmstate[j:j + 1]
+
     def update_rnnlm_state_batch(self, lm, hyps, y):
         lmout, lmstate, scores_lm = None, None, None
         if lm is not None:
-            if hyps[0]['lmstate'] is not None:
-                lm_hxs = torch.cat([beam['lmstate']['hxs'] for beam in hyps], dim=1)
-                lm_cxs = torch.cat([beam['lmstate']['cxs'] for beam in hyps], dim=1)
-                lmstate = {'hxs': lm_hxs, 'cxs': lm_cxs}
+            lmstate = self.merge_rnnlm_states(hyps)
+            lm_infer = self.inference_lm(lm)
+            if lm_infer is not None:
+                lm = lm_infer
             lmout, lmstate, scores_lm = lm.predict(y, lmstate)
         return lmout, lmstate, scores_lm
@@ -33,6 +33,8 @@ def build_decoder(args, special_symbols, enc_n_units, vocab,
             ffn_activation=args.transformer_ffn_activation,
             vocab=vocab,
             tie_embedding=args.tie_embedding,
+            adaptive_softmax=args.adaptive_softmax,
+            adaptive_softmax_cutoffs=args.adaptive_softmax_cutoffs,
             dropout=args.dropout_dec,
             dropout_emb=args.dropout_emb,
             dropout_att=args.dropout_att,
@@ -61,7 +63,8 @@ def build_decoder(args, special_symbols, enc_n_units, vocab,
             mma_first_layer=args.mocha_first_layer,
             share_chunkwise_attention=args.share_chunkwise_attention,
             external_lm=external_lm,
-            lm_fusion=args.lm_fusion)
+            lm_fusion=args.lm_fusion,
+            loss_vocab_chunk_size=args.loss_vocab_chunk_size)
 
     elif args.dec_type in ['lstm_transducer', 'gru_transducer']:
         from neural_sp.models.seq2seq.decoders.rnn_transducer import RNNTransducer
@@ -83,7 +86,9 @@ def build_decoder(args, special_symbols, enc_n_units, vocab,
             external_lm=external_lm if args.lm_init else None,
             global_weight=global_weight,
             mtl_per_batch=args.mtl_per_batch,
-            param_init=args.param_init)
+            param_init=args.param_init,
+            joint_chunk_size=args.transducer_joint_chunk_size,
+            loss_vocab_chunk_size=args.loss_vocab_chunk_size)
 
     else:
         from neural_sp.models.seq2seq.decoders.las import RNNDecoder
@@ -98,6 +103,8 @@ def build_decoder(args, special_symbols, enc_n_units, vocab,
             emb_dim=args.emb_dim,
             vocab=vocab,
             tie_embedding=args.tie_embedding,
+            adaptive_softmax=args.adaptive_softmax,
+            adaptive_softmax_cutoffs=args.adaptive_softmax_cutoffs,
             attn_type=args.attn_type,
             attn_dim=args.attn_dim,
             attn_sharpening_factor=args.attn_sharpening_factor,
@@ -136,6 +143,7 @@ def build_decoder(args, special_symbols, enc_n_units, vocab,
             gmm_attn_n_mixtures=args.gmm_attn_n_mixtures,
             replace_sos=args.replace_sos,
             distillation_weight=args.distillation_weight,
-            discourse_aware=args.discourse_aware)
+            discourse_aware=args.discourse_aware,
+            loss_vocab_chunk_size=args.loss_vocab_chunk_size)
 
     return decoder
@@ -13,7 +13,10 @@ import torch
 import torch.nn as nn
 
 from neural_sp.models.criterion import kldiv_lsm_ctc
+from neural_sp.models.lm.lookahead_wordlm import LookAheadWordLM
+from neural_sp.models.seq2seq.decoders.beam_search import BeamSearch
 from neural_sp.models.seq2seq.decoders.decoder_base import DecoderBase
+from neural_sp.models.torch_utils import float32_autocast
 from neural_sp.models.torch_utils import make_pad_mask
 from neural_sp.models.torch_utils import np2tensor
 from neural_sp.models.torch_utils import pad_list
@@ -41,6 +44,7 @@ class CTC(DecoderBase):
         fc_list (list):
         param_init (float): parameter initialization method
         backward (bool): flip the output sequence
+        vocab_chunk_size (int): chunk size over the vocabulary for label smoothing
 
     """
 
@@ -53,7 +57,8 @@ class CTC(DecoderBase):
                  lsm_prob=0.,
                  fc_list=None,
                  param_init=0.1,
-                 backward=False):
+                 backward=False,
+                 vocab_chunk_size=0):
 
         super(CTC, self).__init__()
 
@@ -62,6 +67,7 @@ class CTC(DecoderBase):
         self.vocab = vocab
         self.lsm_prob = lsm_prob
         self.bwd = backward
+        self.vocab_chunk_size = vocab_chunk_size
 
         self.space = -1  # TODO(hirofumi): fix later
 
@@ -115,7 +121,8 @@ class CTC(DecoderBase):
 
         # Label smoothing for CTC
         if self.lsm_prob > 0:
-            loss = loss * (1 - self.lsm_prob) + kldiv_lsm_ctc(logits, elens) * self.lsm_prob
+            loss = loss * (1 - self.lsm_prob) + kldiv_lsm_ctc(
+                logits, elens, vocab_chunk_size=self.vocab_chunk_size) * self.lsm_prob
 
         trigger_points = self.forced_align(logits, elens, ys, ylens) if forced_align else None
 
@@ -126,16 +133,19 @@ class CTC(DecoderBase):
         return loss, trigger_points
 
     def loss_fn(self, logits, ys_ctc, elens, ylens):
-        if self.use_warpctc:
-            loss = self.ctc_loss(logits, ys_ctc, elens.cpu(), ylens).to(logits.device)
-            # NOTE: ctc loss has already been normalized by bs
-            # NOTE: index 0 is reserved for blank in warpctc_pytorch
-        else:
-            # Use the deterministic CuDNN implementation of CTC loss to avoid
-            #  [issue#17798](https://github.com/pytorch/pytorch/issues/17798)
-            with torch.backends.cudnn.flags(deterministic=True):
-                loss = self.ctc_loss(logits.log_softmax(2),
-                                     ys_ctc, elens, ylens) / logits.size(1)
+        # NOTE: CTC loss is always computed in float32 in mixed precision training
+        with float32_autocast(logits):
+            logits = logits.float()
+            if self.use_warpctc:
+                loss = self.ctc_loss(logits, ys_ctc, elens.cpu(), ylens).to(logits.device)
+                # NOTE: ctc loss has already been normalized by bs
+                # NOTE: index 0 is reserved for blank in warpctc_pytorch
+            else:
+                # Use the deterministic CuDNN implementation of CTC loss to avoid
+                #  [issue#17798](https://github.com/pytorch/pytorch/issues/17798)
+                with torch.backends.cudnn.flags(deterministic=True):
+                    loss = self.ctc_loss(logits.log_softmax(2),
+                                         ys_ctc, elens, ylens) / logits.size(1)
         return loss
 
     def forced_align(self, logits, elens, ys, ylens):
@@ -266,10 +276,14 @@ class CTC(DecoderBase):
         if lm_second is not None:
             assert lm_weight_second > 0
             lm_second.eval()
+        lm_infer = BeamSearch.inference_lm(lm)
 
         best_hyps = []
         log_probs = torch.log_softmax(self.output(eouts), dim=-1)
         for b in range(bs):
+            if isinstance(lm, LookAheadWordLM):
+                lm.reset()
+
             # Elements in the beam are (prefix, (p_b, p_no_blank))
             # Initialize the beam with the empty sequence, a probability of
             # 1 for ending in blank and zero for ending in non-blank (in log space).
@@ -311,15 +325,20 @@ class CTC(DecoderBase):
                                      'lmstate': beam[i_beam]['lmstate']})
 
                     # Update LM states for shallow fusion
+                    # NOTE: word LMs are applied at word boundaries by LookAheadWordLM
+                    lmstate, scores_lm = None, None
                     if lm is not None:
-                        _, lmstate, lm_log_probs = lm.predict(
-                            eouts.new_zeros(1, 1).fill_(hyp[-1]), beam[i_beam]['lmstate'])
-                    else:
-                        lmstate = None
+                        y = eouts.new_zeros((1, 1), dtype=torch.int64).fill_(hyp[-1])
+                        if lm_infer is not None:
+                            lmout, lmstate = lm_infer.step(y, beam[i_beam]['lmstate'])
+                            scores_lm = lm_infer.score(lmout[:, -1], topk_ids)[0]
+                        else:
+                            _, lmstate, lm_log_probs = lm.predict(y, beam[i_beam]['lmstate'])
+                            scores_lm = lm_log_probs[0, -1, topk_ids[0]]
 
                     # case 2. hyp is extended
                     new_p_b = LOG_0
-                    for c in tensor2np(topk_ids)[0]:
+                    for k, c in enumerate(tensor2np(topk_ids)[0]):
                         p_t = log_probs[b, t, c].item()
 
                         if c == self.blank:
@@ -332,21 +351,18 @@ class CTC(DecoderBase):
                         else:
                             new_p_nb = np.logaddexp(p_b + p_t, p_nb + p_t)
                             # TODO(hirofumi): apply character LM here
-                            if c == self.space:
-                                pass
-                                # TODO(hirofumi): apply word LM here
 
                         score_ctc = np.logaddexp(new_p_b, new_p_nb)
                         score_lp = (len(hyp[1:]) + 1) * lp_weight
+                        new_score_lm = score_lm
                         if lm_weight > 0 and lm is not None:
-                            local_score_lm = lm_log_probs[0, 0, c].item() * lm_weight
-                            score_lm += local_score_lm
+                            new_score_lm += scores_lm[k].item() * lm_weight
                         new_beam.append({'hyp': hyp + [c],
-                                         'score': score_ctc + score_lm + score_lp,
+                                         'score': score_ctc + new_score_lm + score_lp,
                                          'p_b': new_p_b,
                                          'p_nb': new_p_nb,
                                          'score_ctc': score_ctc,
-                                         'score_lm': score_lm,
+                                         'score_lm': new_score_lm,
                                          'score_lp': score_lp,
                                          'lmstate': lmstate})
 
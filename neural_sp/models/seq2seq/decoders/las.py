@@ -14,11 +14,16 @@ import torch.nn as nn
 from neural_sp.evaluators.edit_distance import compute_wer
 from neural_sp.models.criterion import cross_entropy_lsm
 from neural_sp.models.criterion import distillation
+from neural_sp.models.criterion import distillation_topk
 from neural_sp.models.criterion import MBR
 # from neural_sp.models.criterion import minimum_bayes_risk
+from neural_sp.models.lm.gated_convlm import GatedConvLM
+from neural_sp.models.lm.lookahead_wordlm import LookAheadWordLM
+from neural_sp.models.lm.ngram import NgramLM
 from neural_sp.models.lm.rnnlm import RNNLM
 from neural_sp.models.lm.transformerlm import TransformerLM
 from neural_sp.models.lm.transformer_xl import TransformerXL
+from neural_sp.models.modules.adaptive_softmax import AdaptiveSoftmax
 from neural_sp.models.modules.attention import AttentionMechanism
 from neural_sp.models.modules.gmm_attention import GMMAttention
 from neural_sp.models.modules.initialization import init_with_uniform
@@ -61,6 +66,8 @@ class RNNDecoder(DecoderBase):
         emb_dim (int): dimension of embedding in target spaces.
         vocab (int): number of nodes in softmax layer
         tie_embedding (bool): tie parameters of embedding and output layers
+        adaptive_softmax (bool): use adaptive softmax for the output layer
+        adaptive_softmax_cutoffs (str): boundaries of frequency clusters for adaptive softmax (delimited by "_")
         attn_dim (int): dimension of attention space
         attn_sharpening_factor (float): sharpining factor in softmax for attention
         attn_sigmoid_smoothing (bool): replace softmax with sigmoid for attention calculation
@@ -99,12 +106,15 @@ class RNNDecoder(DecoderBase):
         replace_sos (bool): replace <sos> with special tokens
         distil_weight (float): soft label weight for knowledge distillation
         discourse_aware (str): state_carry_over
+        loss_vocab_chunk_size (int): chunk size over the vocabulary to compute losses
+            against soft targets (see criterion.masked_token_sum). 0 disables chunking.
 
     """
 
     def __init__(self, special_symbols,
                  enc_n_units, attn_type, rnn_type, n_units, n_projs, n_layers,
                  bottleneck_dim, emb_dim, vocab, tie_embedding,
+                 adaptive_softmax, adaptive_softmax_cutoffs,
                  attn_dim, attn_sharpening_factor, attn_sigmoid_smoothing,
                  attn_conv_out_channels, attn_conv_kernel_size, attn_n_heads,
                  dropout, dropout_emb, dropout_att,
@@ -117,7 +127,8 @@ class RNNDecoder(DecoderBase):
                  mocha_init_r, mocha_eps, mocha_std, mocha_no_denominator,
                  mocha_1dconv, mocha_decot_lookahead, quantity_loss_weight,
                  latency_metric, latency_loss_weight,
-                 gmm_attn_n_mixtures, replace_sos, distillation_weight, discourse_aware):
+                 gmm_attn_n_mixtures, replace_sos, distillation_weight, discourse_aware,
+                 loss_vocab_chunk_size):
 
         super(RNNDecoder, self).__init__()
 
@@ -143,6 +154,8 @@ class RNNDecoder(DecoderBase):
         self.mtl_per_batch = mtl_per_batch
         self.replace_sos = replace_sos
         self.distil_weight = distillation_weight
+        self.loss_vocab_chunk_size = loss_vocab_chunk_size
+        self.adaptive_softmax = adaptive_softmax
 
         # for mocha and triggered attention
         self.quantity_loss_weight = quantity_loss_weight
@@ -178,7 +191,8 @@ class RNNDecoder(DecoderBase):
                            dropout=dropout,
                            lsm_prob=ctc_lsm_prob,
                            fc_list=ctc_fc_list,
-                           param_init=param_init)
+                           param_init=param_init,
+                           vocab_chunk_size=loss_vocab_chunk_size)
 
         if self.att_weight > 0:
             # Attention layer
@@ -246,7 +260,15 @@ class RNNDecoder(DecoderBase):
             self.embed = nn.Embedding(vocab, emb_dim, padding_idx=self.pad)
             self.dropout_emb = nn.Dropout(p=dropout_emb)
             assert bottleneck_dim > 0, 'bottleneck_dim must be larger than zero.'
-            self.output = nn.Linear(bottleneck_dim, vocab)
+            if adaptive_softmax:
+                if tie_embedding:
+                    raise ValueError('Adaptive softmax cannot be used with the tied flag.')
+                if lsm_prob > 0:
+                    logger.warning('Label smoothing is not applied with adaptive softmax.')
+                # NOTE: self.output returns log-probabilities instead of logits
+                self.output = AdaptiveSoftmax(bottleneck_dim, vocab, cutoffs=adaptive_softmax_cutoffs)
+            else:
+                self.output = nn.Linear(bottleneck_dim, vocab)
             if tie_embedding:
                 if emb_dim != bottleneck_dim:
                     raise ValueError('When using the tied flag, n_units must be equal to emb_dim.')
@@ -386,6 +408,8 @@ class RNNDecoder(DecoderBase):
             dir_name += '_head' + str(args.attn_n_heads)
         if args.tie_embedding:
             dir_name += '_tie'
+        if args.adaptive_softmax:
+            dir_name += '_adaptiveSM'
 
         if args.ctc_weight < 1 and args.ss_prob > 0:
             dir_name += '_ss' + str(args.ss_prob)
@@ -419,7 +443,8 @@ class RNNDecoder(DecoderBase):
             elens (IntTensor): `[B]`
             ys (list): length `B`, each of which contains a list of size `[L]`
             task (str): all/ys*/ys_sub*
-            teacher_logits (FloatTensor): `[B, L, vocab]`
+            teacher_logits (FloatTensor or tuple): `[B, L, vocab]`, or
+                top-k indices `[B, L, k]` and log-probabilities `[B, L, k]` of the teacher
             recog_params (dict): parameters for MBR training
             idx2token ():
             trigger_points (np.ndarray): `[B, L]`
@@ -614,7 +639,8 @@ class RNNDecoder(DecoderBase):
             elens (IntTensor): `[B]`
             ys (list): length `B`, each of which contains a list of size `[L]`
             return_logits (bool): return logits for knowledge distillation
-            teacher_logits (FloatTensor): `[B, L, vocab]`
+            teacher_logits (FloatTensor or tuple): `[B, L, vocab]`, or
+                top-k indices `[B, L, k]` and log-probabilities `[B, L, k]` of the teacher
             ctc_trigger_points (IntTensor): `[B, L]`
             forced_trigger_points (IntTensor): `[B, L]`
         Returns:
@@ -688,7 +714,10 @@ class RNNDecoder(DecoderBase):
                 if self.rnn_type == 'lstm':
                     self.dstate_prev['cxs'] = self.dstate_prev['cxs'][0]
 
-        logits = self.output(torch.cat(logits, dim=1))
+        attn_v = torch.cat(logits, dim=1)
+        logits = None
+        if not self.adaptive_softmax or return_logits or teacher_logits is not None:
+            logits = self.output(attn_v)
 
         # for knowledge distillation
         if return_logits:
@@ -711,7 +740,10 @@ class RNNDecoder(DecoderBase):
         n_heads = aws.size(1)  # mono
 
         # Compute XE sequence loss (+ label smoothing)
-        loss, ppl = cross_entropy_lsm(logits, ys_out, self.lsm_prob, self.pad, self.training)
+        if self.adaptive_softmax:
+            loss, ppl = self.output.loss(attn_v, ys_out, self.pad)
+        else:
+            loss, ppl = cross_entropy_lsm(logits, ys_out, self.lsm_prob, self.pad, self.training)
 
         # Attention padding
         if self.attn_type == 'mocha' or (ctc_trigger_points is not None or forced_trigger_points is not None):
@@ -755,11 +787,18 @@ class RNNDecoder(DecoderBase):
 
         # Knowledge distillation
         if teacher_logits is not None:
-            kl_loss = distillation(logits, teacher_logits, ylens, temperature=5.0)
+            if isinstance(teacher_logits, tuple):
+                kl_loss = distillation_topk(logits, *teacher_logits, ylens, temperature=5.0)
+            else:
+                kl_loss = distillation(logits, teacher_logits, ylens, temperature=5.0,
+                                       vocab_chunk_size=self.loss_vocab_chunk_size)
             loss = loss * (1 - self.distil_weight) + kl_loss * self.distil_weight
 
         # Compute token-level accuracy in teacher-forcing
-        acc = compute_accuracy(logits, ys_out, self.pad)
+        if self.adaptive_softmax:
+            acc = self.output.accuracy(attn_v, ys_out, self.pad)
+        else:
+            acc = compute_accuracy(logits, ys_out, self.pad)
 
         return loss, acc, ppl, loss_quantity, loss_latency
 
@@ -924,7 +963,10 @@ class RNNDecoder(DecoderBase):
             aws_batch += [aw]  # `[B, H, 1, T]`
 
             # Pick up 1-best
-            y = self.output(attn_v).argmax(-1)
+            if self.adaptive_softmax:
+                y = self.output.argmax(attn_v)
+            else:
+                y = self.output(attn_v).argmax(-1)
             hyps_batch += [y]
 
             # Count lengths of hypotheses
@@ -1057,6 +1099,7 @@ class RNNDecoder(DecoderBase):
             assert lm_weight_second_bwd > 0
             lm_second_bwd.eval()
         trfm_lm = isinstance(lm, TransformerLM) or isinstance(lm, TransformerXL)
+        lm_infer = BeamSearch.inference_lm(lm) if self.lm is None else None
 
         if ctc_log_probs is not None:
             assert ctc_weight > 0
@@ -1069,6 +1112,8 @@ class RNNDecoder(DecoderBase):
             self.score.reset()
             dstates = self.zero_state(1)
             lmstate = None
+            lmmemory = None  # for TransformerXL LM
+            lm_pos_offset = 0  # for TransformerLM
             ys = eouts.new_zeros((1, 1), dtype=torch.int64).fill_(self.eos)  # for Transformer(XL) LM
 
             # For joint CTC-Attention decoding
@@ -1092,23 +1137,21 @@ class RNNDecoder(DecoderBase):
                     if asr_state_CO:
                         dstates = self.dstates_final
                     if lm_state_CO:
-                        if isinstance(lm, RNNLM):
+                        if isinstance(lm, (RNNLM, GatedConvLM, NgramLM, LookAheadWordLM)):
                             lmstate = self.lmstate_final
-                        elif isinstance(lm, TransformerLM):
-                            ys_prev = self.lmstate_final
-                            # Re-encode past tokens here
-                            _, lmstate, _ = lm.predict(ys_prev)
+                        elif isinstance(lm, TransformerLM) and self.lmstate_final is not None:
+                            # Start from cached states of past tokens without re-encoding them
+                            ys_prev, lmstate, lm_pos_offset = self.lmstate_final
                             ys = torch.cat([ys_prev, ys], dim=1)
-                        # elif isinstance(lm, TransformerXL):
-                        #     ys_prev = self.lmstate_final
-                        #     # Re-encode past tokens here
-                        #     _, lmstate, _ = lm.predict(ys_prev, mems=self.lmmemory)
-                        #     ys = torch.cat([ys_prev, ys], dim=1)
+                        elif isinstance(lm, TransformerXL):
+                            lmmemory = self.lmmemory
                 else:
                     self.dstates_final = None  # reset
                     self.lmstate_final = None  # reset
                     self.lmmemory = None  # reset
                 self.prev_spk = speakers[b]
+            if isinstance(lm, LookAheadWordLM):
+                lmstate = lm.reset(lmstate)
 
             helper = BeamSearch(beam_width, self.eos, ctc_weight, eouts.device)
 
@@ -1154,30 +1197,43 @@ class RNNDecoder(DecoderBase):
                     else:
                         y_lm = y
 
-                    if i > 0 or (i == 0 and trfm_lm and lm_state_CO and self.lmstate_final is not None):
+                    if hyps[0]['lmstate'] is not None:
                         if isinstance(lm, RNNLM):
                             lmstate = {'hxs': torch.cat([beam['lmstate']['hxs'] for beam in hyps], dim=1),
                                        'cxs': torch.cat([beam['lmstate']['cxs'] for beam in hyps], dim=1)}
+                        elif isinstance(lm, GatedConvLM):
+                            # only the receptive field of each block is kept
+                            lmstate = [torch.cat([beam['lmstate'][lth] for beam in hyps], dim=0)
+                                       for lth in range(len(lm.blocks))]
+                        elif isinstance(lm, (NgramLM, LookAheadWordLM)):
+                            lmstate = torch.cat([beam['lmstate'] for beam in hyps], dim=0)
                         elif trfm_lm:
-                            if isinstance(lm, TransformerLM):
-                                lmstate = [torch.cat([beam['lmstate'][lth] for beam in hyps], dim=0)
-                                           for lth in range(lm.n_layers)]
-                            elif i > 0:
-                                lmstate = [torch.cat([beam['lmstate'][lth] for beam in hyps], dim=0)
-                                           for lth in range(lm.n_layers)]
+                            lmstate = [torch.cat([beam['lmstate'][lth] for beam in hyps], dim=0)
+                                       for lth in range(lm.n_layers)]
 
                     if self.lm is not None:  # cold/deep fusion
                         lmout, lmstate, scores_lm = self.lm.predict(y_lm, lmstate)
+                    elif lm_infer is not None:  # shallow fusion (scored after top-K selection)
+                        lmout, lmstate = lm_infer.step(y_lm, lmstate)
+                    elif isinstance(lm, TransformerLM):  # shallow fusion
+                        lmout, lmstate, scores_lm = lm.predict(y_lm, lmstate,
+                                                               cache=lmstate if cache_states else None,
+                                                               pos_offset=lm_pos_offset)
                     elif lm is not None:  # shallow fusion
                         lmout, lmstate, scores_lm = lm.predict(y_lm, lmstate,
-                                                               mems=self.lmmemory,
+                                                               mems=lmmemory,
                                                                cache=lmstate if cache_states else None)
 
                 # for the main model
                 dstates, cv, aw, attn_v, _, _ = self.decode_step(
                     eouts[b:b + 1, :elens[b]].repeat([cv.size(0), 1, 1]),
                     dstates, cv, self.dropout_emb(self.embed(y)), None, aw, lmout)
-                probs = torch.softmax(self.output(attn_v).squeeze(1) * softmax_smoothing, dim=1)
+                if self.adaptive_softmax and n_models == 1 and softmax_smoothing == 1 and ctc_weight < 1:
+                    # NOTE: the best token other than <eos> is also needed for the EOS threshold
+                    scores_att = self.output.log_prob_topk(attn_v.squeeze(1), max(beam_width, 2))
+                    probs = None
+                else:
+                    probs = torch.softmax(self.output(attn_v).squeeze(1) * softmax_smoothing, dim=1)
 
                 # for the ensemble
                 ensmbl_dstate, ensmbl_cv, ensmbl_aws = [], [], []
@@ -1201,19 +1257,30 @@ class RNNDecoder(DecoderBase):
                     # NOTE: sum in the probability scale (not log-scale)
 
                 # Ensemble
-                scores_att = torch.log(probs / n_models)
+                if probs is not None:
+                    scores_att = torch.log(probs / n_models)
+
+                # Attention scores of all hypotheses
+                total_scores_att_all = scores_att.new_tensor([beam['score_att'] for beam in hyps]).unsqueeze(1) + scores_att
+                total_scores_topk_all, topk_ids_all = torch.topk(
+                    total_scores_att_all * (1 - ctc_weight), k=beam_width, dim=1, largest=True, sorted=True)
+
+                # LM scores of top-K candidates
+                if lm is not None:
+                    if scores_lm is None:
+                        scores_lm = lm_infer.score(lmout[:, -1], topk_ids_all)
+                    else:
+                        scores_lm = scores_lm[:, -1].gather(1, topk_ids_all)
 
                 new_hyps = []
                 for j, beam in enumerate(hyps):
-                    # Attention scores
-                    total_scores_att = beam['score_att'] + scores_att[j:j + 1]
-                    total_scores = total_scores_att * (1 - ctc_weight)
-                    total_scores_topk, topk_ids = torch.topk(
-                        total_scores, k=beam_width, dim=1, largest=True, sorted=True)
+                    total_scores_att = total_scores_att_all[j:j + 1]
+                    total_scores_topk = total_scores_topk_all[j:j + 1].clone()
+                    topk_ids = topk_ids_all[j:j + 1]
 
                     # Add LM score <after> top-K selection
                     if lm is not None:
-                        total_scores_lm = beam['score_lm'] + scores_lm[j, -1, topk_ids[0]]
+                        total_scores_lm = beam['score_lm'] + scores_lm[j]
                         total_scores_topk += total_scores_lm * lm_weight
                     else:
                         total_scores_lm = eouts.new_zeros(beam_width)
@@ -1271,8 +1338,10 @@ class RNNDecoder(DecoderBase):
                             if isinstance(lm, RNNLM) or isinstance(self.lm, RNNLM):
                                 new_lmstate = {'hxs': lmstate['hxs'][:, j:j + 1],
                                                'cxs': lmstate['cxs'][:, j:j + 1]}
-                            elif trfm_lm:
+                            elif trfm_lm or isinstance(lm, GatedConvLM):
                                 new_lmstate = [lmstate_l[j:j + 1] for lmstate_l in lmstate]
+                            elif isinstance(lm, (NgramLM, LookAheadWordLM)):
+                                new_lmstate = lmstate[j:j + 1]
                             else:
                                 raise ValueError
 
@@ -1323,6 +1392,17 @@ class RNNDecoder(DecoderBase):
             # Sort by score
             end_hyps = sorted(end_hyps, key=lambda x: x['score'], reverse=True)
 
+            # Store ASR/LM state for the next utterance
+            self.dstates_final = end_hyps[0]['dstates']
+            if isinstance(lm, (RNNLM, GatedConvLM, NgramLM, LookAheadWordLM)):
+                self.lmstate_final = end_hyps[0]['lmstate']
+            elif isinstance(lm, TransformerLM):
+                self.lmstate_final = lm.truncate_state(
+                    end_hyps[0]['ys'], end_hyps[0]['lmstate'], lm_pos_offset)
+            elif isinstance(lm, TransformerXL):
+                self.lmmemory = lm.update_memory_from_cache(lmmemory, end_hyps[0]['ys'], end_hyps[0]['lmstate'])
+                logger.info('Memory: %d' % self.lmmemory[0].size(1))
+
             if idx2token is not None:
                 if utt_ids is not None:
                     logger.info('Utt-id: %s' % utt_ids[b])
@@ -1375,22 +1455,6 @@ class RNNDecoder(DecoderBase):
                                    else nbest_hyps_idx[b][n] for n in range(nbest)] for b in range(bs)]
                 aws = [[aws[b][n][:, :-1] if eos_flags[b][n] else aws[b][n] for n in range(nbest)] for b in range(bs)]
 
-        # Store ASR/LM state
-        self.dstates_final = end_hyps[0]['dstates']
-        if isinstance(lm, RNNLM):
-            self.lmstate_final = end_hyps[0]['lmstate']
-        elif trfm_lm:
-            if isinstance(lm, TransformerXL):
-                self.lmmemory = lm.update_memory(self.lmmemory, end_hyps[0]['lmstate'])
-                logging.info('Memory: %d' % self.lmmemory[0].size(1))
-            else:
-                ys = end_hyps[0]['ys']
-                # Exclude the last state corresponding to <eos>
-                if ys[0, -1].item() == self.eos:
-                    ys = ys[:, :-1]
-                ys = ys[:, -lm.mem_len:]  # Truncate by BPTT length
-            self.lmstate_final = ys
-
         return nbest_hyps_idx, aws, scores
 
     def beam_search_chunk_sync(self, eouts, params, idx2token,
@@ -1435,12 +1499,14 @@ class RNNDecoder(DecoderBase):
 
         if state_carry_over:
             dstates = self.dstates_final
-            if isinstance(lm, RNNLM):
+            if isinstance(lm, (RNNLM, NgramLM, LookAheadWordLM)):
                 lmstate = self.lmstate_final
 
         end_hyps = []
         hyps_nobd = []
         if hyps is None:
+            if isinstance(lm, LookAheadWordLM):
+                lmstate = lm.reset(lmstate)
             self.n_frames = 0
             self.chunk_size = eouts.size(1)
             hyps = [{'hyp': [self.eos],
@@ -1559,8 +1625,7 @@ class RNNDecoder(DecoderBase):
                          'dstates': {'dstate': (dstates['dstate'][0][:, j:j + 1], dstates['dstate'][1][:, j:j + 1])},
                          'cv': cv[j:j + 1],
                          'aws': beam['aws'] + [aw[j:j + 1]],
-                         'lmstate': {'hxs': lmstate['hxs'][:, j:j + 1],
-                                     'cxs': lmstate['cxs'][:, j:j + 1]} if lmstate is not None else None,
+                         'lmstate': helper.select_rnnlm_state(lmstate, j),
                          'ctc_state': new_ctc_states[k] if self.ctc_prefix_scorer is not None else None,
                          'no_boundary': no_boundary})
 
@@ -4,17 +4,22 @@
 """RNN transducer."""
 
 from collections import OrderedDict
+import inspect
 import logging
 import numpy as np
 import random
 import torch
 import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
 
+from neural_sp.models.lm.lookahead_wordlm import LookAheadWordLM
+from neural_sp.models.lm.ngram import NgramLM
 from neural_sp.models.lm.rnnlm import RNNLM
 from neural_sp.models.seq2seq.decoders.beam_search import BeamSearch
 from neural_sp.models.seq2seq.decoders.ctc import CTC
 from neural_sp.models.seq2seq.decoders.ctc import CTCPrefixScore
 from neural_sp.models.seq2seq.decoders.decoder_base import DecoderBase
+from neural_sp.models.torch_utils import float32_autocast
 from neural_sp.models.torch_utils import np2tensor
 from neural_sp.models.torch_utils import pad_list
 from neural_sp.models.torch_utils import repeat
@@ -28,6 +33,9 @@ LOG_1 = 0
 
 logger = logging.getLogger(__name__)
 
+# NOTE: for torch<1.11, checkpoint does not accept use_reentrant
+CHECKPOINT_KWARGS = {'use_reentrant': False} if 'use_reentrant' in inspect.signature(checkpoint).parameters else {}
+
 
 class RNNTransducer(DecoderBase):
     """RNN transducer.
@@ -55,6 +63,9 @@ class RNNTransducer(DecoderBase):
         global_weight (float): global loss weight for multi-task learning
         mtl_per_batch (bool): change mini-batch per task for multi-task training
         param_init (float): parameter initialization method
+        joint_chunk_size (int): number of utterances per chunk for the memory-efficient joint network
+        loss_vocab_chunk_size (int): chunk size over the vocabulary to compute losses
+            against soft targets (see criterion.masked_token_sum). 0 disables chunking.
 
     """
 
@@ -63,7 +74,8 @@ class RNNTransducer(DecoderBase):
                  bottleneck_dim, emb_dim, vocab,
                  dropout, dropout_emb,
                  ctc_weight, ctc_lsm_prob, ctc_fc_list,
-                 external_lm, global_weight, mtl_per_batch, param_init):
+                 external_lm, global_weight, mtl_per_batch, param_init,
+                 joint_chunk_size, loss_vocab_chunk_size):
 
         super(RNNTransducer, self).__init__()
 
@@ -81,6 +93,7 @@ class RNNTransducer(DecoderBase):
         self.rnnt_weight = global_weight - ctc_weight
         self.ctc_weight = ctc_weight
         self.mtl_per_batch = mtl_per_batch
+        self.joint_chunk_size = joint_chunk_size
 
         # for cache
         self.prev_spk = ''
@@ -95,7 +108,8 @@ class RNNTransducer(DecoderBase):
                            dropout=dropout,
                            lsm_prob=ctc_lsm_prob,
                            fc_list=ctc_fc_list,
-                           param_init=0.1)
+                           param_init=0.1,
+                           vocab_chunk_size=loss_vocab_chunk_size)
 
         if self.rnnt_weight > 0:
             # import warprnnt_pytorch
@@ -149,6 +163,9 @@ class RNNTransducer(DecoderBase):
                                help='number of dimensions of the bottleneck layer before the softmax layer')
             group.add_argument('--emb_dim', type=int, default=512,
                                help='number of dimensions in the embedding layer')
+        group.add_argument('--transducer_joint_chunk_size', type=int, default=0,
+                           help='number of utterances per chunk to compute the joint network and Transducer loss '
+                           'with recomputation in backward (0 computes them over the whole mini-batch at once)')
         return parser
 
     @staticmethod
@@ -239,27 +256,78 @@ class RNNTransducer(DecoderBase):
         ys_emb = self.dropout_emb(self.embed(ys_in))
         dout, _ = self.recurrency(ys_emb, None)
 
-        # Compute output distribution
+        # Compute output distribution and Transducer loss
+        if self.joint_chunk_size > 0:
+            return self.forward_joint_chunkwise(eouts, dout, ys_out, elens, ylens)
         logits = self.joint(eouts, dout)
+        return self.transducer_loss(logits, ys_out, elens, ylens)
+
+    def forward_joint_chunkwise(self, eouts, douts, ys_out, elens, ylens):
+        """Compute RNN-T loss chunk by chunk of utterances.
+
+        The joint network and the loss are merged into one function per chunk
+        whose intermediate outputs are recomputed in backward, so that the
+        `[B, T, L, vocab]` logits of the whole mini-batch are never kept. Each
+        chunk is also truncated to its own maximum lengths to skip padding.
+
+        Args:
+            eouts (FloatTensor): `[B, T, enc_n_units]`
+            douts (FloatTensor): `[B, L + 1, dec_n_units]`
+            ys_out (LongTensor): `[B, L]`
+            elens (IntTensor): `[B]`
+            ylens (IntTensor): `[B]`
+        Returns:
+            loss (FloatTensor): `[1]`
+
+        """
+        def joint_loss(eouts_c, douts_c, ys_out_c, elens_c, ylens_c):
+            return self.transducer_loss(self.joint(eouts_c, douts_c), ys_out_c, elens_c, ylens_c)
+
+        bs = eouts.size(0)
+        loss = 0.
+        for b in range(0, bs, self.joint_chunk_size):
+            elens_c = elens[b:b + self.joint_chunk_size]
+            ylens_c = ylens[b:b + self.joint_chunk_size]
+            xmax, ymax = elens_c.max().item(), ylens_c.max().item()
+            loss_c = checkpoint(joint_loss, eouts[b:b + self.joint_chunk_size, :xmax],
+                                douts[b:b + self.joint_chunk_size, :ymax + 1],
+                                ys_out[b:b + self.joint_chunk_size, :ymax],
+                                elens_c, ylens_c, **CHECKPOINT_KWARGS)
+            # NOTE: Transducer loss is averaged over utterances in each chunk
+            loss = loss + loss_c * elens_c.size(0) / bs
+        return loss
 
-        # Compute Transducer loss
-        log_probs = torch.log_softmax(logits, dim=-1)
-        assert log_probs.size(2) == ys_out.size(1) + 1
-        if self.device_id >= 0:
-            ys_out = ys_out.to(eouts.device)
-            elens = elens.to(eouts.device)
-            ylens = ylens.to(eouts.device)
-            import warp_rnnt
-            loss = warp_rnnt.rnnt_loss(log_probs, ys_out.int(), elens, ylens,
-                                       average_frames=False,
-                                       reduction='mean',
-                                       gather=False)
-        else:
-            import warprnnt_pytorch
-            self.warprnnt_loss = warprnnt_pytorch.RNNTLoss()
-            loss = self.warprnnt_loss(log_probs, ys_out.int(), elens, ylens)
-            # NOTE: Transducer loss has already been normalized by bs
-            # NOTE: index 0 is reserved for blank in warprnnt_pytorch
+    def transducer_loss(self, logits, ys_out, elens, ylens):
+        """Compute Transducer loss averaged over utterances.
+
+        Args:
+            logits (FloatTensor): `[B, T, L + 1, vocab]`
+            ys_out (LongTensor): `[B, L]`
+            elens (IntTensor): `[B]`
+            ylens (IntTensor): `[B]`
+        Returns:
+            loss (FloatTensor): `[1]`
+
+        """
+        # NOTE: Transducer loss is always computed in float32 in mixed precision training
+        with float32_autocast(logits):
+            log_probs = torch.log_softmax(logits.float(), dim=-1)
+            assert log_probs.size(2) == ys_out.size(1) + 1
+            if self.device_id >= 0:
+                ys_out = ys_out.to(logits.device)
+                elens = elens.to(logits.device)
+                ylens = ylens.to(logits.device)
+                import warp_rnnt
+                loss = warp_rnnt.rnnt_loss(log_probs, ys_out.int(), elens, ylens,
+                                           average_frames=False,
+                                           reduction='mean',
+                                           gather=False)
+            else:
+                import warprnnt_pytorch
+                self.warprnnt_loss = warprnnt_pytorch.RNNTLoss()
+                loss = self.warprnnt_loss(log_probs, ys_out.int(), elens, ylens)
+                # NOTE: Transducer loss has already been normalized by bs
+                # NOTE: index 0 is reserved for blank in warprnnt_pytorch
 
         return loss
 
@@ -438,6 +506,7 @@ class RNNTransducer(DecoderBase):
         if lm_second_bwd is not None:
             assert lm_weight_second_bwd > 0
             lm_second_bwd.eval()
+        lm_infer = BeamSearch.inference_lm(lm)
 
         if ctc_log_probs is not None:
             assert ctc_weight > 0
@@ -459,9 +528,14 @@ class RNNTransducer(DecoderBase):
 
             if speakers is not None:
                 if speakers[b] == self.prev_spk:
-                    if lm_state_carry_over and isinstance(lm, RNNLM):
+                    if lm_state_carry_over and isinstance(lm, (RNNLM, NgramLM, LookAheadWordLM)):
                         lmstate = self.lmstate_final
                 self.prev_spk = speakers[b]
+            if isinstance(lm, LookAheadWordLM):
+                lmstate = lm.reset(lmstate)
+            if lm is not None and lmstate is None:
+                # NOTE: states are concatenated over hypotheses including blank ones
+                lmstate = lm.zero_state(1)
 
             helper = BeamSearch(beam_width, self.eos, ctc_weight, eouts.device)
 
@@ -488,27 +562,36 @@ class RNNTransducer(DecoderBase):
                     y[j, 0] = beam['hyp'][-1]
                 lmstate, scores_lm = None, None
                 if lm is not None:
-                    if hyps[0]['lmstate'] is not None:
-                        lm_hxs = torch.cat([beam['lmstate']['hxs'] for beam in hyps], dim=1)
-                        lm_cxs = torch.cat([beam['lmstate']['cxs'] for beam in hyps], dim=1)
-                        lmstate = {'hxs': lm_hxs, 'cxs': lm_cxs}
-                    lmout, lmstate, scores_lm = lm.predict(y, lmstate)
+                    lmstate = helper.merge_rnnlm_states(hyps)
+                    if lm_infer is not None:
+                        lmout, lmstate = lm_infer.step(y, lmstate)
+                    else:
+                        lmout, lmstate, scores_lm = lm.predict(y, lmstate)
+
+                # Transducer scores of all hypotheses
+                total_scores_rnnt_all = scores_rnnt.new_tensor([beam['score_rnnt'] for beam in hyps]).unsqueeze(1) + scores_rnnt
+                total_scores_topk_all, topk_ids_all = torch.topk(
+                    total_scores_rnnt_all * (1 - ctc_weight), k=beam_width, dim=-1, largest=True, sorted=True)
+
+                # LM scores of top-K candidates
+                if lm is not None:
+                    if scores_lm is None:
+                        scores_lm = lm_infer.score(lmout[:, -1], topk_ids_all)
+                    else:
+                        scores_lm = scores_lm[:, -1].gather(1, topk_ids_all)
 
                 new_hyps = []
                 for j, beam in enumerate(hyps):
                     dout = douts[j:j + 1]
                     dstate = beam['dstate']
-                    lmstate = beam['lmstate']
-
-                    # Transducer scores
-                    total_scores_rnnt = beam['score_rnnt'] + scores_rnnt[j:j + 1]
-                    total_scores = total_scores_rnnt * (1 - ctc_weight)
+                    new_lmstate = helper.select_rnnlm_state(lmstate, j)
+                    total_scores_rnnt = total_scores_rnnt_all[j:j + 1]
+                    total_scores_topk = total_scores_topk_all[j:j + 1].clone()
+                    topk_ids = topk_ids_all[j:j + 1]
 
                     # Add LM score <after> top-K selection
-                    total_scores_topk, topk_ids = torch.topk(
-                        total_scores, k=beam_width, dim=-1, largest=True, sorted=True)
                     if lm is not None:
-                        total_scores_lm = beam['score_lm'] + scores_lm[j, -1, topk_ids[0]]
+                        total_scores_lm = beam['score_lm'] + scores_lm[j]
                         total_scores_topk += total_scores_lm * lm_weight
                     else:
                         total_scores_lm = eouts.new_zeros(beam_width)
@@ -548,8 +631,7 @@ class RNNTransducer(DecoderBase):
                         self.state_cache[hyp_str] = {
                             'dout': dout,
                             'dstate': new_dstate,
-                            'lmstate': {'hxs': lmstate['hxs'][:, j:j + 1],
-                                        'cxs': lmstate['cxs'][:, j:j + 1]} if lmstate is not None else None,
+                            'lmstate': new_lmstate,
                         }
 
                         new_hyps.append({'hyp': hyp_ids,
@@ -559,8 +641,7 @@ class RNNTransducer(DecoderBase):
                                          'score_lm': total_scores_lm[k].item(),
                                          'dout': dout,
                                          'dstate': new_dstate,
-                                         'lmstate': {'hxs': lmstate['hxs'][:, j:j + 1],
-                                                     'cxs': lmstate['cxs'][:, j:j + 1]} if lmstate is not None else None,
+                                         'lmstate': new_lmstate,
                                          'ctc_state': new_ctc_states[k] if ctc_prefix_scorer is not None else None})
 
                 # Merge hypotheses having the same token sequences
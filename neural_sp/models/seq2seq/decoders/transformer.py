@@ -16,7 +16,12 @@ import torch
 import torch.nn as nn
 
 from neural_sp.models.criterion import cross_entropy_lsm
+from neural_sp.models.lm.lookahead_wordlm import LookAheadWordLM
+from neural_sp.models.lm.ngram import NgramLM
 from neural_sp.models.lm.rnnlm import RNNLM
+from neural_sp.models.lm.transformer_xl import TransformerXL
+from neural_sp.models.lm.transformerlm import TransformerLM
+from neural_sp.models.modules.adaptive_softmax import AdaptiveSoftmax
 from neural_sp.models.modules.positional_embedding import PositionalEncoding
 from neural_sp.models.modules.transformer import TransformerDecoderBlock
 from neural_sp.models.seq2seq.decoders.beam_search import BeamSearch
@@ -55,6 +60,8 @@ class TransformerDecoder(DecoderBase):
         ffn_activation (str): nonolinear function for PositionwiseFeedForward
         vocab (int): number of nodes in softmax layer
         tie_embedding (bool): tie parameters of embedding and output layers
+        adaptive_softmax (bool): use adaptive softmax for the output layer
+        adaptive_softmax_cutoffs (str): boundaries of frequency clusters for adaptive softmax (delimited by "_")
         dropout (float): dropout probability for linear layers
         dropout_emb (float): dropout probability for embedding layer
         dropout_att (float): dropout probability for attention distributions
@@ -84,6 +91,8 @@ class TransformerDecoder(DecoderBase):
         share_chunkwise_attention (bool): share chunkwise attention in the same layer of MMA
         external_lm (RNNLM): external RNNLM for LM fusion
         lm_fusion (str): type of LM fusion
+        loss_vocab_chunk_size (int): chunk size over the vocabulary to compute losses
+            against soft targets (see criterion.masked_token_sum). 0 disables chunking.
 
     """
 
@@ -91,7 +100,7 @@ class TransformerDecoder(DecoderBase):
                  enc_n_units, attn_type, n_heads, n_layers,
                  d_model, d_ff, ffn_bottleneck_dim,
                  pe_type, layer_norm_eps, ffn_activation,
-                 vocab, tie_embedding,
+                 vocab, tie_embedding, adaptive_softmax, adaptive_softmax_cutoffs,
                  dropout, dropout_emb, dropout_att, dropout_layer, dropout_head,
                  lsm_prob, ctc_weight, ctc_lsm_prob, ctc_fc_list, backward,
                  global_weight, mtl_per_batch, param_init,
@@ -101,7 +110,7 @@ class TransformerDecoder(DecoderBase):
                  mma_quantity_loss_weight, mma_headdiv_loss_weight,
                  latency_metric, latency_loss_weight,
                  mma_first_layer, share_chunkwise_attention,
-                 external_lm, lm_fusion):
+                 external_lm, lm_fusion, loss_vocab_chunk_size):
 
         super(TransformerDecoder, self).__init__()
 
@@ -120,9 +129,11 @@ class TransformerDecoder(DecoderBase):
         self.ctc_weight = ctc_weight
         self.bwd = backward
         self.mtl_per_batch = mtl_per_batch
+        self.adaptive_softmax = adaptive_softmax
 
         self.prev_spk = ''
         self.lmstate_final = None
+        self.lmmemory = None
 
         # for attention plot
         self.aws_dict = {}
@@ -150,7 +161,8 @@ class TransformerDecoder(DecoderBase):
                            lsm_prob=ctc_lsm_prob,
                            fc_list=ctc_fc_list,
                            param_init=0.1,
-                           backward=backward)
+                           backward=backward,
+                           vocab_chunk_size=loss_vocab_chunk_size)
 
         if self.att_weight > 0:
             # token embedding
@@ -174,7 +186,15 @@ class TransformerDecoder(DecoderBase):
                 ffn_bottleneck_dim=ffn_bottleneck_dim,
                 share_chunkwise_attention=share_chunkwise_attention)) for lth in range(n_layers)])
             self.norm_out = nn.LayerNorm(d_model, eps=layer_norm_eps)
-            self.output = nn.Linear(d_model, self.vocab)
+            if adaptive_softmax:
+                if tie_embedding:
+                    raise ValueError('Adaptive softmax cannot be used with the tied flag.')
+                if lsm_prob > 0:
+                    logger.warning('Label smoothing is not applied with adaptive softmax.')
+                # NOTE: self.output returns log-probabilities instead of logits
+                self.output = AdaptiveSoftmax(d_model, self.vocab, cutoffs=adaptive_softmax_cutoffs)
+            else:
+                self.output = nn.Linear(d_model, self.vocab)
             if tie_embedding:
                 self.output.weight = self.embed.weight
 
@@ -291,6 +311,8 @@ class TransformerDecoder(DecoderBase):
             dir_name += '_HD' + str(args.dropout_head)
         if args.tie_embedding:
             dir_name += '_tie'
+        if args.adaptive_softmax:
+            dir_name += '_adaptiveSM'
 
         return dir_name
 
@@ -303,9 +325,12 @@ class TransformerDecoder(DecoderBase):
             nn.init.normal_(self.embed.weight, mean=0., std=self.d_model**-0.5)
             nn.init.constant_(self.embed.weight[self.pad], 0.)
             # output layer
-            nn.init.xavier_uniform_(self.output.weight)
-            # nn.init.normal_(self.output.weight, mean=0., std=self.d_model**-0.5)
-            nn.init.constant_(self.output.bias, 0.)
+            if self.adaptive_softmax:
+                nn.init.xavier_uniform_(self.output.head.weight)
+            else:
+                nn.init.xavier_uniform_(self.output.weight)
+                # nn.init.normal_(self.output.weight, mean=0., std=self.d_model**-0.5)
+                nn.init.constant_(self.output.bias, 0.)
 
     def forward(self, eouts, elens, ys, task='all',
                 teacher_logits=None, recog_params={}, idx2token=None, trigger_points=None):
@@ -432,10 +457,14 @@ class TransformerDecoder(DecoderBase):
                 self.aws_dict['xy_aws_beta_layer%d' % lth] = tensor2np(layer.xy_aws_beta)
                 self.aws_dict['xy_aws_p_choose%d' % lth] = tensor2np(layer.xy_aws_p_choose)
                 self.aws_dict['yy_aws_lm_layer%d' % lth] = tensor2np(layer.yy_aws_lm)
-        logits = self.output(self.norm_out(out))
+        out = self.norm_out(out)
 
         # Compute XE loss (+ label smoothing)
-        loss, ppl = cross_entropy_lsm(logits, ys_out, self.lsm_prob, self.pad, self.training)
+        if self.adaptive_softmax:
+            loss, ppl = self.output.loss(out, ys_out, self.pad)
+        else:
+            logits = self.output(out)
+            loss, ppl = cross_entropy_lsm(logits, ys_out, self.lsm_prob, self.pad, self.training)
 
         # Quantity loss
         losses_auxiliary['loss_quantity'] = 0.
@@ -449,7 +478,10 @@ class TransformerDecoder(DecoderBase):
             losses_auxiliary['loss_quantity'] = torch.mean(torch.abs(n_tokens_pred - n_tokens_ref))
 
         # Compute token-level accuracy in teacher-forcing
-        acc = compute_accuracy(logits, ys_out, self.pad)
+        if self.adaptive_softmax:
+            acc = self.output.accuracy(out, ys_out, self.pad)
+        else:
+            acc = compute_accuracy(logits, ys_out, self.pad)
 
         return loss, acc, ppl, losses_auxiliary
 
@@ -500,7 +532,10 @@ class TransformerDecoder(DecoderBase):
                 cache = new_cache[:]
 
             # Pick up 1-best
-            y = self.output(self.norm_out(out))[:, -1:].argmax(-1)
+            if self.adaptive_softmax:
+                y = self.output.argmax(self.norm_out(out[:, -1:]))
+            else:
+                y = self.output(self.norm_out(out[:, -1:])).argmax(-1)
             hyps_batch += [y]
             xy_aws_layers = torch.stack(xy_aws_layers, dim=2)  # `[B, H, n_layers, 1, T]`
             xy_aws_layers_steps.append(xy_aws_layers)
@@ -618,6 +653,8 @@ class TransformerDecoder(DecoderBase):
             assert lm_weight_second_bwd > 0
             lm_second_bwd.eval()
 
+        trfm_lm = isinstance(lm, (TransformerLM, TransformerXL))
+
         if ctc_log_probs is not None:
             assert ctc_weight > 0
             ctc_log_probs = tensor2np(ctc_log_probs)
@@ -627,7 +664,10 @@ class TransformerDecoder(DecoderBase):
         for b in range(bs):
             # Initialization per utterance
             lmstate = None
+            lmmemory = None  # for TransformerXL LM
+            lm_pos_offset = 0  # for TransformerLM
             ys = eouts.new_zeros((1, 1), dtype=torch.int64).fill_(self.eos)
+            ys_lm = ys  # for Transformer(XL) LM
 
             # For joint CTC-Attention decoding
             ctc_prefix_scorer = None
@@ -639,15 +679,28 @@ class TransformerDecoder(DecoderBase):
 
             if speakers is not None:
                 if speakers[b] == self.prev_spk:
-                    if lm_state_carry_over and isinstance(lm, RNNLM):
-                        lmstate = self.lmstate_final
+                    if lm_state_carry_over:
+                        if isinstance(lm, (RNNLM, NgramLM, LookAheadWordLM)):
+                            lmstate = self.lmstate_final
+                        elif isinstance(lm, TransformerLM) and self.lmstate_final is not None:
+                            # Start from cached states of past tokens without re-encoding them
+                            ys_prev, lmstate, lm_pos_offset = self.lmstate_final
+                            ys_lm = torch.cat([ys_prev, ys_lm], dim=1)
+                        elif isinstance(lm, TransformerXL):
+                            lmmemory = self.lmmemory
+                else:
+                    self.lmstate_final = None  # reset
+                    self.lmmemory = None  # reset
                 self.prev_spk = speakers[b]
+            if isinstance(lm, LookAheadWordLM):
+                lmstate = lm.reset(lmstate)
 
             helper = BeamSearch(beam_width, self.eos, ctc_weight, self.device)
 
             end_hyps = []
             hyps = [{'hyp': [self.eos],
                      'ys': ys,
+                     'ys_lm': ys_lm,
                      'cache': None,
                      'score': 0.,
                      'score_att': 0.,
@@ -677,8 +730,19 @@ class TransformerDecoder(DecoderBase):
                     xy_aws_prev = None
 
                 # Update LM states for shallow fusion
-                y_lm = ys[:, -1:].clone()  # NOTE: this is important
-                _, lmstate, scores_lm = helper.update_rnnlm_state_batch(lm, hyps, y_lm)
+                if trfm_lm:
+                    y_lm = torch.cat([beam['ys_lm'] for beam in hyps], dim=0)
+                    cache_lm = None
+                    if cache_states and hyps[0]['lmstate'] is not None:
+                        cache_lm = [torch.cat([beam['lmstate'][lth] for beam in hyps], dim=0)
+                                    for lth in range(lm.n_layers)]
+                    if isinstance(lm, TransformerLM):
+                        _, lmstate, scores_lm = lm.predict(y_lm, cache=cache_lm, pos_offset=lm_pos_offset)
+                    else:
+                        _, lmstate, scores_lm = lm.predict(y_lm, mems=lmmemory, cache=cache_lm)
+                else:
+                    y_lm = ys[:, -1:].clone()  # NOTE: this is important
+                    _, lmstate, scores_lm = helper.update_rnnlm_state_batch(lm, hyps, y_lm)
 
                 # for the main model
                 causal_mask = eouts.new_ones(i + 1, i + 1).byte()
@@ -703,8 +767,14 @@ class TransformerDecoder(DecoderBase):
                     new_cache[lth] = out
                     if xy_aws is not None:
                         xy_aws_layers.append(xy_aws)
-                logits = self.output(self.norm_out(out))
-                probs = torch.softmax(logits[:, -1] * softmax_smoothing, dim=1)
+                # NOTE: project the last position only to the vocabulary
+                if self.adaptive_softmax and n_models == 1 and softmax_smoothing == 1 and ctc_weight < 1 and lm is None:
+                    # NOTE: the best token other than <eos> is also needed for the EOS threshold
+                    scores_att = self.output.log_prob_topk(self.norm_out(out[:, -1]), max(beam_width, 2))
+                    probs = None
+                else:
+                    logits = self.output(self.norm_out(out[:, -1]))
+                    probs = torch.softmax(logits * softmax_smoothing, dim=1)
                 xy_aws_layers = torch.stack(xy_aws_layers, dim=1)  # `[B, H, n_layers, L, T]`
 
                 # Ensemble initialization
@@ -723,12 +793,13 @@ class TransformerDecoder(DecoderBase):
                         out_e = dec.layers[lth](out_e, causal_mask, eouts_e, None,
                                                 cache=ensmbl_cache[i_e][lth])
                         ensmbl_new_cache[i_e][lth] = out_e
-                    logits_e = dec.output(dec.norm_out(out_e))
-                    probs += torch.softmax(logits_e[:, -1] * softmax_smoothing, dim=1)
+                    logits_e = dec.output(dec.norm_out(out_e[:, -1]))
+                    probs += torch.softmax(logits_e * softmax_smoothing, dim=1)
                     # NOTE: sum in the probability scale (not log-scale)
 
                 # Ensemble
-                scores_att = torch.log(probs / n_models)
+                if probs is not None:
+                    scores_att = torch.log(probs / n_models)
 
                 new_hyps = []
                 for j, beam in enumerate(hyps):
@@ -795,17 +866,18 @@ class TransformerDecoder(DecoderBase):
                             if beam['streamable'] and not streamable_global:
                                 streaming_failed_point = i
 
+                        y_new = eouts.new_zeros((1, 1), dtype=torch.int64).fill_(idx)
                         new_hyps.append(
                             {'hyp': beam['hyp'] + [idx],
-                             'ys': torch.cat([beam['ys'], eouts.new_zeros((1, 1), dtype=torch.int64).fill_(idx)], dim=-1),
+                             'ys': torch.cat([beam['ys'], y_new], dim=-1),
+                             'ys_lm': torch.cat([beam['ys_lm'], y_new], dim=-1) if trfm_lm else None,
                              'cache': [new_cache_l[j:j + 1] for new_cache_l in new_cache] if cache_states else cache,
                              'score': total_score,
                              'score_att': total_scores_att[0, idx].item(),
                              'score_ctc': total_scores_ctc[k].item(),
                              'score_lm': total_scores_lm[0, idx].item(),
                              'aws': new_aws,
-                             'lmstate': {'hxs': lmstate['hxs'][:, j:j + 1],
-                                         'cxs': lmstate['cxs'][:, j:j + 1]} if lmstate is not None else None,
+                             'lmstate': [lmstate_l[j:j + 1] for lmstate_l in lmstate] if trfm_lm else helper.select_rnnlm_state(lmstate, j),
                              'ctc_state': new_ctc_states[k] if ctc_prefix_scorer is not None else None,
                              'ensmbl_cache': [[new_cache_e_l[j:j + 1] for new_cache_e_l in new_cache_e] for new_cache_e in ensmbl_new_cache] if cache_states else None,
                              'streamable': streamable_global,
@@ -839,6 +911,15 @@ class TransformerDecoder(DecoderBase):
             # Sort by score
             end_hyps = sorted(end_hyps, key=lambda x: x['score'], reverse=True)
 
+            # Store LM state for the next utterance
+            if isinstance(lm, (RNNLM, NgramLM, LookAheadWordLM)):
+                self.lmstate_final = end_hyps[0]['lmstate']
+            elif isinstance(lm, TransformerLM):
+                self.lmstate_final = lm.truncate_state(
+                    end_hyps[0]['ys_lm'], end_hyps[0]['lmstate'], lm_pos_offset)
+            elif isinstance(lm, TransformerXL):
+                self.lmmemory = lm.update_memory_from_cache(lmmemory, end_hyps[0]['ys_lm'], end_hyps[0]['lmstate'])
+
             for j in range(len(end_hyps[0]['aws'][1:])):
                 tmp = end_hyps[0]['aws'][j + 1]
                 end_hyps[0]['aws'][j + 1] = tmp.view(1, -1, tmp.size(-2), tmp.size(-1))
@@ -909,8 +990,4 @@ class TransformerDecoder(DecoderBase):
                                    else nbest_hyps_idx[b][n] for n in range(nbest)] for b in range(bs)]
                 aws = [[aws[b][n][:, :-1] if eos_flags[b][n] else aws[b][n] for n in range(nbest)] for b in range(bs)]
 
-        # Store ASR/LM state
-        if isinstance(lm, RNNLM):
-            self.lmstate_final = end_hyps[0]['lmstate']
-
         return nbest_hyps_idx, aws, scores
@@ -404,79 +404,224 @@ class RNNEncoder(EncoderBase):
     def _forward_latency_contolled(self, xs, xlens, N_l, N_r, streaming, task='all'):
         """Streaming encoding for the conventional latency-controlled bidirectional encoder.
 
+        The time loop over chunks is folded into the batch dimension, and layers are
+        processed one by one over all chunks. The backward RNN and the forward RNN over
+        the lookahead (right-context) frames are run over `[B * n_chunks, N_l + N_r]`
+        at once, and only the forward RNN over the current frames carries states over chunks.
+
         Args:
             xs (FloatTensor): `[B, T, n_units]`
         Returns:
             xs (FloatTensor): `[B, T, n_units]`
 
         """
-        bs, xmax, _ = xs.size()
-        n_chunks = math.ceil(xmax / N_l)
+        bs, xmax, idim = xs.size()
+        n_chunks = 1 if streaming else math.ceil(xmax / N_l)
+        W = min(N_l + N_r, xmax) if streaming else N_l + N_r
 
         if streaming:
             xlens = torch.IntTensor(bs).fill_(min(xmax, N_l))
 
-        xs_chunks = []
-        xs_chunks_sub1 = []
-        for chunk_idx, t in enumerate(range(0, N_l * n_chunks, N_l)):
-            xs_chunk = xs[:, t:t + (N_l + N_r)]
-            _N_l = N_l
+        # Split into overlapping chunks: `[B * n_chunks, N_l + N_r, idim]`
+        # NOTE: the last chunks are padded with zeros
+        xs = xs[:, :(n_chunks - 1) * N_l + W]
+        xs_pad = xs.new_zeros(bs, (n_chunks - 1) * N_l + W - xs.size(1), idim)
+        xs_chunks = torch.cat([xs, xs_pad], dim=1).unfold(1, W, N_l).transpose(3, 2)
+        xs_chunks = xs_chunks.contiguous().view(bs * n_chunks, W, idim)
+        clens = [min(W, xmax - t) for t in range(0, N_l * n_chunks, N_l)]
 
-            for lth in range(self.n_layers):
-                self.rnn[lth].flatten_parameters()  # for multi-GPUs
-                self.rnn_bwd[lth].flatten_parameters()  # for multi-GPUs
-                # bwd
-                xs_chunk_bwd = torch.flip(self.rnn_bwd[lth](
-                    torch.flip(xs_chunk, dims=[1]))[0], dims=[1])  # `[B, _N_l+_N_r, n_units]`
-                # fwd
-                if xs_chunk.size(1) <= _N_l:
-                    xs_chunk_fwd, self.hx_fwd[lth] = self.rnn[lth](xs_chunk,
-                                                                   hx=self.hx_fwd[lth])
-                else:
-                    xs_chunk_fwd1, self.hx_fwd[lth] = self.rnn[lth](xs_chunk[:, :_N_l],
-                                                                    hx=self.hx_fwd[lth])
-                    xs_chunk_fwd2, _ = self.rnn[lth](xs_chunk[:, _N_l:],
-                                                     hx=self.hx_fwd[lth])
-                    xs_chunk_fwd = torch.cat([xs_chunk_fwd1, xs_chunk_fwd2], dim=1)  # `[B, _N_l+_N_r, n_units]`
-                    # NOTE: xs_chunk_fwd2 is used for xs_chunk_bwd in the next layer
-                if self.bidir_sum:
-                    xs_chunk = xs_chunk_fwd + xs_chunk_bwd
-                else:
-                    xs_chunk = torch.cat([xs_chunk_fwd, xs_chunk_bwd], dim=-1)
-                xs_chunk = self.dropout(xs_chunk)
+        xs_chunks_sub1 = None
+        for lth in range(self.n_layers):
+            self.rnn[lth].flatten_parameters()  # for multi-GPUs
+            self.rnn_bwd[lth].flatten_parameters()  # for multi-GPUs
+            # bwd
+            xs_chunks_bwd = self._backward_chunks(xs_chunks, clens, bs, self.rnn_bwd[lth])
+            # fwd
+            xs_chunks_fwd = self._forward_chunks(xs_chunks, clens, bs, N_l, lth)
+            if self.bidir_sum:
+                xs_chunks = xs_chunks_fwd + xs_chunks_bwd
+            else:
+                xs_chunks = torch.cat([xs_chunks_fwd, xs_chunks_bwd], dim=-1)
+            xs_chunks = self.dropout(xs_chunks)
 
-                # Pick up outputs in the sub task before the projection layer
-                if lth == self.n_layers_sub1 - 1:
-                    xs_chunk_sub1 = xs_chunk.clone()
-                    if self.bridge_sub1 is not None:
-                        xs_chunk_sub1 = self.bridge_sub1(xs_chunk_sub1)
-                    if task == 'ys_sub1':
-                        return None, xlens, xs_chunk_sub1
+            # Pick up outputs in the sub task before the projection layer
+            if lth == self.n_layers_sub1 - 1:
+                xs_chunks_sub1, clens_sub1 = xs_chunks.clone(), clens
+                if self.bridge_sub1 is not None:
+                    xs_chunks_sub1 = self.bridge_sub1(xs_chunks_sub1)
+                if task == 'ys_sub1':
+                    return None, xlens, self._merge_chunks(xs_chunks_sub1, clens, bs, N_l)
 
-                # Projection layer
-                if self.proj is not None and lth != self.n_layers - 1:
-                    xs_chunk = torch.relu(self.proj[lth](xs_chunk))
-                # Subsampling layer
-                if self.subsample is not None:
-                    xs_chunk, xlens_tmp = self.subsample[lth](xs_chunk, xlens)
-                    if chunk_idx == 0:
-                        xlens = xlens_tmp
-                    _N_l = _N_l // self.subsample[lth].factor
+            # Projection layer
+            if self.proj is not None and lth != self.n_layers - 1:
+                xs_chunks = torch.relu(self.proj[lth](xs_chunks))
+            # Subsampling layer
+            if self.subsample is not None:
+                xs_chunks, clens, xlens = self._subsample_chunks(
+                    xs_chunks, clens, xlens, bs, self.subsample[lth])
+                N_l = N_l // self.subsample[lth].factor
 
-            xs_chunks.append(xs_chunk[:, :_N_l])
-            if self.n_layers_sub1 > 0:
-                xs_chunks_sub1.append(xs_chunk_sub1[:, :_N_l])
+        xs = self._merge_chunks(xs_chunks, clens, bs, N_l)
+        xs_sub1 = None
+        if self.n_layers_sub1 > 0:
+            xs_sub1 = self._merge_chunks(xs_chunks_sub1, clens_sub1, bs, N_l)
 
-            if streaming:
-                break
+        return xs, xlens, xs_sub1
 
-        xs = torch.cat(xs_chunks, dim=1)
-        if self.n_layers_sub1 > 0:
-            xs_sub1 = torch.cat(xs_chunks_sub1, dim=1)
+    def _backward_chunks(self, xs_chunks, clens, bs, rnn):
+        """Run the backward RNN over each chunk from its last valid frame.
+
+        Chunk lengths are shared in the batch and non-increasing over chunks,
+        so chunks having the same length are processed at once.
+
+        Args:
+            xs_chunks (FloatTensor): `[B * n_chunks, W, idim]`
+            clens (list): chunk lengths of length `[n_chunks]`
+            bs (int): batch size
+            rnn (nn.Module): unidirectional RNN
+        Returns:
+            xs_chunks_bwd (FloatTensor): `[B * n_chunks, W, n_units]`
+
+        """
+        n_chunks, W = len(clens), xs_chunks.size(1)
+        if clens[-1] == W:
+            return torch.flip(rnn(torch.flip(xs_chunks, dims=[1]))[0], dims=[1])
+
+        xs_chunks = xs_chunks.view(bs, n_chunks, W, -1)
+        xs_bwd = []
+        for c, c_end, clen in self._chunk_runs(clens):
+            xs_c = xs_chunks[:, c:c_end, :clen].contiguous().view(bs * (c_end - c), clen, -1)
+            xs_c = torch.flip(rnn(torch.flip(xs_c, dims=[1]))[0], dims=[1])
+            if clen < W:
+                xs_c = torch.cat([xs_c, xs_c.new_zeros(xs_c.size(0), W - clen, xs_c.size(2))], dim=1)
+            xs_bwd.append(xs_c.view(bs, c_end - c, W, -1))
+        return torch.cat(xs_bwd, dim=1).view(bs * n_chunks, W, -1)
+
+    def _forward_chunks(self, xs_chunks, clens, bs, N_l, lth):
+        """Run the forward RNN over the current frames with carry-over states and
+            then over the lookahead frames of all chunks in parallel.
+
+        Args:
+            xs_chunks (FloatTensor): `[B * n_chunks, W, idim]`
+            clens (list): chunk lengths of length `[n_chunks]`
+            bs (int): batch size
+            N_l (int): number of current frames in each chunk
+            lth (int): layer index
+        Returns:
+            xs_chunks_fwd (FloatTensor): `[B * n_chunks, W, n_units]`
+
+        """
+        n_chunks = len(clens)
+        W = xs_chunks.size(1)
+        rnn = self.rnn[lth]
+        is_lstm = isinstance(rnn, nn.LSTM)
+        N_c = min(N_l, W)
+        cur_lens = [min(N_c, clen) for clen in clens]
+
+        # current frames: contiguous over chunks `[B, n_chunks * N_c, idim]`
+        xs_cur = xs_chunks[:, :N_c].contiguous().view(bs, n_chunks, N_c, -1)
+        if is_lstm and n_chunks > 1:
+            # states at chunk boundaries are required for the lookahead frames
+            xs_cur_fwd, hs, cs = [], [], []
+            for xs_c, cur_len in zip(torch.unbind(xs_cur, dim=1), cur_lens):
+                xs_c, self.hx_fwd[lth] = rnn(xs_c[:, :cur_len], hx=self.hx_fwd[lth])
+                xs_cur_fwd.append(xs_c)
+                hs.append(self.hx_fwd[lth][0])
+                cs.append(self.hx_fwd[lth][1])
+            xs_cur_fwd = torch.cat(xs_cur_fwd, dim=1)
+            hx_bd = (torch.stack(hs, dim=2), torch.stack(cs, dim=2))  # `[1, B, n_chunks, n_units]`
+        else:
+            xs_cur = xs_cur.view(bs, n_chunks * N_c, -1)[:, :sum(cur_lens)]
+            xs_cur_fwd, self.hx_fwd[lth] = rnn(xs_cur, hx=self.hx_fwd[lth])
+            if is_lstm:
+                hx_bd = (self.hx_fwd[lth][0].unsqueeze(2), self.hx_fwd[lth][1].unsqueeze(2))
+            else:
+                # outputs are states for GRU
+                bd_ids = torch.LongTensor(np.cumsum(cur_lens) - 1).to(xs_cur_fwd.device)
+                hx_bd = xs_cur_fwd.index_select(1, bd_ids).unsqueeze(0)
+        if xs_cur_fwd.size(1) < n_chunks * N_c:
+            xs_cur_fwd = torch.cat([xs_cur_fwd, xs_cur_fwd.new_zeros(
+                bs, n_chunks * N_c - xs_cur_fwd.size(1), xs_cur_fwd.size(2))], dim=1)
+        xs_cur_fwd = xs_cur_fwd.contiguous().view(bs * n_chunks, N_c, -1)
+        if W <= N_c:
+            return xs_cur_fwd
+
+        # lookahead frames: all chunks in parallel
+        if is_lstm:
+            hx_bd = tuple(h.contiguous().view(1, bs * n_chunks, -1) for h in hx_bd)
         else:
-            xs_sub1 = None
+            hx_bd = hx_bd.contiguous().view(1, bs * n_chunks, -1)
+        xs_la_fwd, _ = rnn(xs_chunks[:, N_c:], hx=hx_bd)
+        # NOTE: xs_la_fwd is used for the backward RNN in the next layer
+        return torch.cat([xs_cur_fwd, xs_la_fwd], dim=1)
 
-        return xs, xlens, xs_sub1
+    @staticmethod
+    def _chunk_runs(clens):
+        """Yield (start, end, length) of runs of chunks having the same length."""
+        c = 0
+        while c < len(clens):
+            c_end = c + clens[c:].count(clens[c])
+            yield c, c_end, clens[c]
+            c = c_end
+
+    @staticmethod
+    def _subsample_chunks(xs_chunks, clens, xlens, bs, subsample):
+        """Subsample each chunk within its valid length.
+
+        Chunk lengths are shared in the batch and non-increasing over chunks,
+        so chunks having the same length are subsampled at once.
+
+        Args:
+            xs_chunks (FloatTensor): `[B * n_chunks, W, idim]`
+            clens (list): chunk lengths of length `[n_chunks]`
+            xlens (IntTensor): `[B]`
+            bs (int): batch size
+            subsample (nn.Module): subsampling layer
+        Returns:
+            xs_chunks (FloatTensor): `[B * n_chunks, W', idim']`
+            clens (list): chunk lengths of length `[n_chunks]`
+            xlens (IntTensor): `[B]`
+
+        """
+        n_chunks = len(clens)
+        xs_chunks = xs_chunks.view(bs, n_chunks, xs_chunks.size(1), -1)
+        xs_out, clens_out = [], []
+        for c, c_end, clen in RNNEncoder._chunk_runs(clens):
+            xs_c = xs_chunks[:, c:c_end, :clen].contiguous().view(bs * (c_end - c), clen, -1)
+            lens_c = torch.IntTensor([clen] * (c_end - c))
+            if c == 0:
+                # NOTE: update utterance lengths together
+                xs_c, lens_c = subsample(xs_c, torch.cat([lens_c, xlens.int()]))
+                lens_c, xlens = lens_c[:c_end - c], lens_c[c_end - c:]
+            else:
+                xs_c, lens_c = subsample(xs_c, lens_c)
+            if c == 0:
+                W = xs_c.size(1)
+            elif xs_c.size(1) < W:
+                xs_c = torch.cat([xs_c, xs_c.new_zeros(xs_c.size(0), W - xs_c.size(1), xs_c.size(2))], dim=1)
+            xs_out.append(xs_c.contiguous().view(bs, c_end - c, W, -1))
+            clens_out += lens_c.tolist()
+        xs_chunks = torch.cat(xs_out, dim=1).view(bs * n_chunks, W, -1)
+        return xs_chunks, clens_out, xlens
+
+    @staticmethod
+    def _merge_chunks(xs_chunks, clens, bs, N_l):
+        """Concatenate the current frames in all chunks.
+
+        Args:
+            xs_chunks (FloatTensor): `[B * n_chunks, W, odim]`
+            clens (list): chunk lengths of length `[n_chunks]`
+            bs (int): batch size
+            N_l (int): number of current frames in each chunk
+        Returns:
+            xs (FloatTensor): `[B, T, odim]`
+
+        """
+        n_chunks = len(clens)
+        N_c = min(N_l, xs_chunks.size(1))
+        xmax = (n_chunks - 1) * N_c + min(N_c, clens[-1])
+        xs = xs_chunks[:, :N_c].contiguous().view(bs, n_chunks * N_c, -1)
+        return xs[:, :xmax]
 
     def sub_module(self, xs, xlens, perm_ids_unsort, module='sub1'):
         assert not self.lc_bidir
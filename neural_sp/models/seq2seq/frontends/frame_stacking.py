@@ -7,6 +7,8 @@
 """Frame stacking."""
 
 import numpy as np
+import torch
+import torch.nn.functional as F
 
 
 def stack_frame(feat, n_stacks, n_skips, dtype=np.float32):
@@ -18,7 +20,7 @@ def stack_frame(feat, n_stacks, n_skips, dtype=np.float32):
            arXiv preprint arXiv:1507.06947 (2015).
 
     Args:
-        feat (list): `[T, input_dim]`
+        feat (np.ndarray): `[T, input_dim]`
         n_stacks (int): the number of frames to stack
         n_skips (int): the number of frames to skip
         dtype ():
@@ -33,39 +35,65 @@ def stack_frame(feat, n_stacks, n_skips, dtype=np.float32):
         raise ValueError('n_skips must be less than n_stacks.')
 
     T, input_dim = feat.shape
-    T_new = T // n_skips if T % n_stacks == 0 else (T // n_skips) + 1
-
-    stacked_feat = np.zeros((T_new, input_dim * n_stacks), dtype=dtype)
-    stack_count = 0
-    stack = []
-    for t, frame_t in enumerate(feat):
-        if t == len(feat) - 1:  # final frame
-            # Stack the final frame
-            stack.append(frame_t)
-
-            while stack_count != int(T_new):
-                # Concatenate stacked frames
-                for i in range(len(stack)):
-                    stacked_feat[stack_count][input_dim * i:input_dim * (i + 1)] = stack[i]
-                stack_count += 1
-
-                # Delete some frames to skip
-                for _ in range(n_skips):
-                    if len(stack) != 0:
-                        stack.pop(0)
-
-        elif len(stack) < n_stacks:  # first & middle frames
-            # Stack some frames until stack is filled
-            stack.append(frame_t)
-
-        if len(stack) == n_stacks:
-            # Concatenate stacked frames
-            for i in range(n_stacks):
-                stacked_feat[stack_count][input_dim * i:input_dim * (i + 1)] = stack[i]
-            stack_count += 1
-
-            # Delete some frames to skip
-            for _ in range(n_skips):
-                stack.pop(0)
-
-    return stacked_feat
+    T_new = _n_stacked_frames(T, n_stacks, n_skips)
+
+    # stacked frame k consists of frames [k * n_skips, k * n_skips + n_stacks),
+    # where frames beyond the last one are filled with zeros
+    feat = np.pad(feat, ((0, max(0, (T_new - 1) * n_skips + n_stacks - T)), (0, 0)))
+    windows = sliding_window(feat, n_stacks)[::n_skips]
+    stacked_feat = windows[:T_new].transpose(0, 2, 1).reshape(T_new, input_dim * n_stacks)
+    return stacked_feat.astype(dtype)
+
+
+def sliding_window(feat, window):
+    """Read-only view of sliding windows over the time axis.
+
+    Args:
+        feat (np.ndarray): `[T, input_dim]`
+        window (int): window size
+    Returns:
+        windows (np.ndarray): `[T - window + 1, input_dim, window]`
+
+    """
+    if hasattr(np.lib.stride_tricks, 'sliding_window_view'):
+        return np.lib.stride_tricks.sliding_window_view(feat, window, axis=0)
+    # NOTE: for numpy<1.20
+    T, input_dim = feat.shape
+    return np.lib.stride_tricks.as_strided(
+        feat, shape=(T - window + 1, input_dim, window),
+        strides=(feat.strides[0], feat.strides[1], feat.strides[0]), writeable=False)
+
+
+def stack_frame_batch(xs, xlens, n_stacks, n_skips):
+    """Stack & skip frames of a padded batch on the device.
+        The output is identical to `stack_frame` applied to each utterance.
+
+    Args:
+        xs (FloatTensor): `[B, T, input_dim]` (zero-padded)
+        xlens (IntTensor): `[B]`
+        n_stacks (int): the number of frames to stack
+        n_skips (int): the number of frames to skip
+    Returns:
+        xs (FloatTensor): `[B, T_new, input_dim * n_stacks]`
+        xlens (IntTensor): `[B]`
+
+    """
+    if n_stacks == 1 and n_skips == 1:
+        return xs, xlens
+
+    if n_stacks < n_skips:
+        raise ValueError('n_skips must be less than n_stacks.')
+
+    bs, xmax, input_dim = xs.size()
+    xlens = torch.IntTensor([_n_stacked_frames(xlen, n_stacks, n_skips) for xlen in xlens.tolist()])
+    T_new = xlens.max().item()
+    xs = F.pad(xs, (0, 0, 0, max(0, (T_new - 1) * n_skips + n_stacks - xmax)))
+    xs = xs.unfold(1, n_stacks, n_skips)[:, :T_new]  # `[B, T_new, input_dim, n_stacks]`
+    xs = xs.transpose(3, 2).reshape(bs, T_new, input_dim * n_stacks)
+    mask = torch.arange(T_new, device=xs.device).unsqueeze(0) < xlens.to(xs.device).unsqueeze(1)
+    xs = xs.masked_fill(~mask.unsqueeze(2), 0)
+    return xs, xlens
+
+
+def _n_stacked_frames(T, n_stacks, n_skips):
+    return T // n_skips if T % n_stacks == 0 else (T // n_skips) + 1
@@ -9,7 +9,21 @@
 import torch
 
 
-def add_input_noise(xs, std):
-    noise = torch.normal(torch.zeros(xs.shape[-1]), std).to(xs.device)
-    xs.data += noise
+def add_input_noise(xs, std, xlens=None):
+    """Add Gaussian noise (shared over frames) to input features.
+
+    Args:
+        xs (FloatTensor): `[B, T, F]`
+        std (float): standard deviation of noise
+        xlens (IntTensor): `[B]`, padding frames are left untouched if given
+    Returns:
+        xs (FloatTensor): `[B, T, F]`
+
+    """
+    noise = torch.randn(xs.size(-1), device=xs.device, dtype=xs.dtype) * std
+    if xlens is None:
+        xs.data += noise
+    else:
+        mask = torch.arange(xs.size(1), device=xs.device).unsqueeze(0) < xlens.to(xs.device).unsqueeze(1)
+        xs.data += noise * mask.unsqueeze(2).to(xs.dtype)
     return xs
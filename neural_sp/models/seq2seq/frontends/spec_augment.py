@@ -7,7 +7,7 @@
 """SpecAugment data augmentation."""
 
 import logging
-import numpy as np
+import torch
 
 logger = logging.getLogger(__name__)
 
@@ -20,7 +20,7 @@ class SpecAugment(object):
         T (int): parameter for time masking
         n_freq_masks (int): number of frequency masks
         n_time_masks (int): number of time masks
-        W (int): parameter for time warping
+        W (int): parameter for time warping (disabled when 0)
         p (float): parameter for upperbound of the time mask
         adaptive_number_ratio (float): adaptive multiplicity ratio for time masking
         adaptive_size_ratio (float): adaptive size ratio for time masking
@@ -28,7 +28,7 @@ class SpecAugment(object):
 
     """
 
-    def __init__(self, F, T, n_freq_masks, n_time_masks, p=1.0, W=40,
+    def __init__(self, F, T, n_freq_masks, n_time_masks, p=1.0, W=0,
                  adaptive_number_ratio=0, adaptive_size_ratio=0,
                  max_n_time_masks=20):
 
@@ -96,48 +96,131 @@ class SpecAugment(object):
     def time_mask(self):
         return self._time_mask
 
-    def __call__(self, xs):
-        """
+    def __call__(self, xs, xlens=None):
+        """Apply SpecAugment to each utterance in a padded batch independently.
+
         Args:
             xs (FloatTensor): `[B, T, F]`
+            xlens (IntTensor): `[B]` (on CPU)
         Returns:
             xs (FloatTensor): `[B, T, F]`
 
         """
-        # xs = self.time_warp(xs)
+        if xlens is None:
+            xlens = xs.new_full((xs.size(0),), xs.size(1), dtype=torch.int32)
+        xlens = xlens.to(xs.device).long()
+        if self.W > 0:
+            xs = self.time_warp(xs, xlens)
         xs = self.mask_freq(xs)
-        xs = self.mask_time(xs)
+        xs = self.mask_time(xs, xlens)
         return xs
 
-    def time_warp(xs, W=40):
-        raise NotImplementedError
-
-    def mask_freq(self, xs, replace_with_zero=False):
-        n_bins = xs.size(-1)
-        for i in range(0, self.n_freq_masks):
-            f = int(np.random.uniform(low=0, high=self.F))
-            f_0 = int(np.random.uniform(low=0, high=n_bins - f))
-            xs[:, :, f_0:f_0 + f] = 0
-            assert f_0 <= f_0 + f
-            self._freq_mask = (f_0, f_0 + f)
-        return xs
+    def time_warp(self, xs, xlens):
+        """Warp each utterance along the time axis.
+
+        A center frame `c` is drawn from `[W, xlen - W - 1)` and moved to `c + w`
+        (`w` ~ U[-W, W]). Frames on both sides are linearly stretched.
+
+        Args:
+            xs (FloatTensor): `[B, T, F]`
+            xlens (LongTensor): `[B]`
+        Returns:
+            xs (FloatTensor): `[B, T, F]`
+
+        """
+        bs, xmax = xs.size()[:2]
+        xlens_f = xlens.float()
+        # utterances shorter than 2W + 2 frames are not warped
+        valid = xlens > self.W * 2 + 1
+        c = self.W + torch.floor(torch.rand(bs, device=xs.device) * (xlens_f - self.W * 2 - 1).clamp(min=1))
+        w = torch.floor(torch.rand(bs, device=xs.device) * (self.W * 2 + 1)) - self.W
+        w = w * valid.float()
+        c_warped = (c + w).unsqueeze(1)  # `[B, 1]`
+        c, last = c.unsqueeze(1), (xlens_f - 1).unsqueeze(1)
+
+        # source position of each output frame (the first and last frames are fixed)
+        t = torch.arange(xmax, device=xs.device, dtype=xs.dtype).unsqueeze(0)  # `[1, T]`
+        src_left = t * c / c_warped.clamp(min=1)
+        src_right = c + (t - c_warped) * (last - c) / (last - c_warped).clamp(min=1)
+        src = torch.where(t < c_warped, src_left, src_right)
+        src = src.clamp(min=0).min(last)  # `[B, T]`
+
+        # linear interpolation between adjacent frames
+        src_lo = src.floor()
+        weight = (src - src_lo).unsqueeze(2)
+        src_lo = src_lo.long()
+        src_hi = (src_lo + 1).min(xlens.unsqueeze(1) - 1)
+        offset = torch.arange(bs, device=xs.device).unsqueeze(1) * xmax
+        xs_flat = xs.reshape(bs * xmax, -1)
+        x_lo = xs_flat.index_select(0, (src_lo + offset).view(-1)).view_as(xs)
+        x_hi = xs_flat.index_select(0, (src_hi + offset).view(-1)).view_as(xs)
+        xs_warped = torch.lerp(x_lo, x_hi, weight)
+        mask = (t <= last).unsqueeze(2)  # keep padding as it is
+        return torch.where(mask, xs_warped, xs)
+
+    def mask_freq(self, xs):
+        """Apply `n_freq_masks` frequency masks to each utterance.
+
+        Args:
+            xs (FloatTensor): `[B, T, F]`
+        Returns:
+            xs (FloatTensor): `[B, T, F]`
 
-    def mask_time(self, xs, replace_with_zero=False):
-        n_frames = xs.size(1)
+        """
+        if self.n_freq_masks == 0:
+            return xs
+        bs, _, n_bins = xs.size()
+        f = torch.floor(torch.rand(bs, self.n_freq_masks, device=xs.device) * self.F)
+        f_0 = torch.floor(torch.rand(bs, self.n_freq_masks, device=xs.device) * (n_bins - f))
+        self._freq_mask = (f_0.long(), (f_0 + f).long())
+        mask = _range_mask(f_0, f_0 + f, n_bins)  # `[B, F]`
+        return xs.masked_fill_(mask.unsqueeze(1), 0)
+
+    def mask_time(self, xs, xlens):
+        """Apply time masks to each utterance within its length.
+
+        Args:
+            xs (FloatTensor): `[B, T, F]`
+            xlens (LongTensor): `[B]`
+        Returns:
+            xs (FloatTensor): `[B, T, F]`
+
+        """
+        bs, xmax = xs.size()[:2]
+        xlens_f = xlens.float()
         if self.adaptive_number_ratio > 0:
-            n_masks = int(n_frames * self.adaptive_number_ratio)
-            n_masks = min(n_masks, self.max_n_time_masks)
+            n_masks = (xlens_f * self.adaptive_number_ratio).long().clamp(max=self.max_n_time_masks)
+            max_n_masks = min(int(xmax * self.adaptive_number_ratio), self.max_n_time_masks)
         else:
-            n_masks = self.n_time_masks
+            n_masks = xlens.new_full((bs,), self.n_time_masks)
+            max_n_masks = self.n_time_masks
+        if max_n_masks == 0:
+            return xs
         if self.adaptive_size_ratio > 0:
-            T = self.adaptive_size_ratio * n_frames
+            T = (xlens_f * self.adaptive_size_ratio).unsqueeze(1)
         else:
             T = self.T
-        for i in range(n_masks):
-            t = int(np.random.uniform(low=0, high=T))
-            t = min(t, int(n_frames * self.p))
-            t_0 = int(np.random.uniform(low=0, high=n_frames - t))
-            xs[:, t_0:t_0 + t] = 0
-            assert t_0 <= t_0 + t
-            self._time_mask = (t_0, t_0 + t)
-        return xs
+        t = torch.floor(torch.rand(bs, max_n_masks, device=xs.device) * T)
+        t = t.min(torch.floor(xlens_f * self.p).unsqueeze(1))
+        # disable masks beyond the number of masks for each utterance
+        t *= (torch.arange(max_n_masks, device=xs.device).unsqueeze(0) < n_masks.unsqueeze(1)).float()
+        t_0 = torch.floor(torch.rand(bs, max_n_masks, device=xs.device) * (xlens_f.unsqueeze(1) - t))
+        self._time_mask = (t_0.long(), (t_0 + t).long())
+        mask = _range_mask(t_0, t_0 + t, xmax)  # `[B, T]`
+        return xs.masked_fill_(mask.unsqueeze(2), 0)
+
+
+def _range_mask(start, end, length):
+    """Make a mask covering `[start, end)` of multiple ranges.
+
+    Args:
+        start (FloatTensor): `[B, n_masks]`
+        end (FloatTensor): `[B, n_masks]`
+        length (int): mask length
+    Returns:
+        mask (BoolTensor): `[B, length]`
+
+    """
+    pos = torch.arange(length, device=start.device, dtype=start.dtype).view(1, 1, -1)
+    mask = (pos >= start.unsqueeze(2)) & (pos < end.unsqueeze(2))  # `[B, n_masks, length]`
+    return mask.any(1)
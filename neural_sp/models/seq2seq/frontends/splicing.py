@@ -7,6 +7,9 @@
 """Splice data."""
 
 import numpy as np
+import torch
+
+from neural_sp.models.seq2seq.frontends.frame_stacking import sliding_window
 
 
 def splice(feat, n_splices=1, n_stacks=1, dtype=np.float32):
@@ -32,33 +35,49 @@ def splice(feat, n_splices=1, n_stacks=1, dtype=np.float32):
     if n_splices == 1:
         return feat
 
+    # NOTE: the stacked frames of the i-th spliced frame occupy the slots
+    # [i, i + n_stacks) and overwrite those of the previous ones, so that the
+    # first n_splices slots come from the first stacked frame of each spliced
+    # frame, the next (n_stacks - 1) slots from the last spliced frame, and
+    # the remaining slots are zeros.
     max_xlen, input_dim = feat.shape
     freq = (input_dim // 3) // n_stacks
-    feat_splice = np.zeros((max_xlen, freq * (n_splices * n_stacks) * 3), dtype=dtype)
-
-    for i_time in range(max_xlen):
-        spliced_frames = np.zeros((n_splices * n_stacks, freq, 3))
-        for i_splice in range(0, n_splices, 1):
-            if i_time <= n_splices - 1 and i_splice < n_splices - i_time:
-                # copy the first frame to left side (padding left frames)
-                copy_frame = feat[0]
-            elif max_xlen - n_splices <= i_time and i_time + (i_splice - n_splices) > max_xlen - 1:
-                # copy the last frame to right side (padding right frames)
-                copy_frame = feat[-1]
-            else:
-                copy_frame = feat[i_time + (i_splice - n_splices)]
+    # spliced frames at time t are [t - n_splices, ..., t - 1] (the first frame is replicated)
+    feat = np.pad(feat, ((n_splices, 0), (0, 0)), mode='edge')
+    windows = sliding_window(feat, n_splices)[:max_xlen]
+    windows = windows.reshape(max_xlen, freq, 3, n_stacks, n_splices)
+    feat_splice = np.zeros((max_xlen, freq, n_splices * n_stacks, 3), dtype=dtype)
+    feat_splice[:, :, :n_splices] = windows[:, :, :, 0].transpose(0, 1, 3, 2)
+    feat_splice[:, :, n_splices:n_splices + n_stacks - 1] = windows[:, :, :, 1:, -1].transpose(0, 1, 3, 2)
+    return feat_splice.reshape(max_xlen, -1)
 
-            # `[freq * 3 * n_stacks]` -> `[freq, 3, n_stacks]`
-            copy_frame = copy_frame.reshape((freq, 3, n_stacks))
 
-            # `[freq, 3, n_stacks]` -> `[n_stacks, freq, 3]`
-            copy_frame = np.transpose(copy_frame, (2, 0, 1))
+def splice_batch(xs, xlens, n_splices=1, n_stacks=1):
+    """Splice a padded batch on the device.
+        The output is identical to `splice` applied to each utterance.
 
-            spliced_frames[i_splice: i_splice + n_stacks] = copy_frame
+    Args:
+        xs (FloatTensor): `[B, T, input_dim (freq * 3 * n_stacks)]` (zero-padded)
+        xlens (IntTensor): `[B]`
+        n_splices (int): frames to n_splices
+        n_stacks (int): the number of frames to stack
+    Returns:
+        xs (FloatTensor): `[B, T, freq * (n_splices * n_stacks) * 3]`
 
-        # `[n_splices * n_stacks, freq, 3] -> `[freq, n_splices * n_stacks, 3]`
-        spliced_frames = np.transpose(spliced_frames, (1, 0, 2))
+    """
+    assert xs.size(-1) % 3 == 0
 
-        feat_splice[i_time] = spliced_frames.reshape((freq * (n_splices * n_stacks) * 3))
+    if n_splices == 1:
+        return xs
 
-    return feat_splice
+    bs, xmax, input_dim = xs.size()
+    freq = (input_dim // 3) // n_stacks
+    xs_pad = torch.cat([xs[:, :1].expand(-1, n_splices, -1), xs], dim=1)
+    windows = xs_pad.unfold(1, n_splices, 1)[:, :xmax]  # `[B, T, input_dim, n_splices]`
+    windows = windows.reshape(bs, xmax, freq, 3, n_stacks, n_splices)
+    xs_splice = xs.new_zeros(bs, xmax, freq, n_splices * n_stacks, 3)
+    xs_splice[:, :, :, :n_splices] = windows[:, :, :, :, 0].transpose(4, 3)
+    xs_splice[:, :, :, n_splices:n_splices + n_stacks - 1] = windows[:, :, :, :, 1:, -1].transpose(4, 3)
+    xs_splice = xs_splice.view(bs, xmax, -1)
+    mask = torch.arange(xmax, device=xs.device).unsqueeze(0) < xlens.to(xs.device).unsqueeze(1)
+    return xs_splice.masked_fill_(~mask.unsqueeze(2), 0)
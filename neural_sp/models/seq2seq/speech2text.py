@@ -17,11 +17,11 @@ from neural_sp.models.seq2seq.decoders.build import build_decoder
 from neural_sp.models.seq2seq.decoders.fwd_bwd_attention import fwd_bwd_attention
 from neural_sp.models.seq2seq.decoders.rnn_transducer import RNNTransducer
 from neural_sp.models.seq2seq.encoders.build import build_encoder
-from neural_sp.models.seq2seq.frontends.frame_stacking import stack_frame
+from neural_sp.models.seq2seq.frontends.frame_stacking import stack_frame_batch
 from neural_sp.models.seq2seq.frontends.input_noise import add_input_noise
 from neural_sp.models.seq2seq.frontends.sequence_summary import SequenceSummaryNetwork
 from neural_sp.models.seq2seq.frontends.spec_augment import SpecAugment
-from neural_sp.models.seq2seq.frontends.splicing import splice
+from neural_sp.models.seq2seq.frontends.splicing import splice_batch
 from neural_sp.models.torch_utils import np2tensor
 from neural_sp.models.torch_utils import tensor2np
 from neural_sp.models.torch_utils import pad_list
@@ -95,7 +95,7 @@ class Speech2Text(ModelBase):
         self.n_splices = args.n_splices
         self.weight_noise_std = args.weight_noise_std
         self.specaug = None
-        if args.n_freq_masks > 0 or args.n_time_masks > 0:
+        if args.n_freq_masks > 0 or args.n_time_masks > 0 or args.time_warp_width > 0:
             assert args.n_stacks == 1 and args.n_skips == 1
             assert args.n_splices == 1
             self.specaug = SpecAugment(F=args.freq_width,
@@ -103,6 +103,7 @@ class Speech2Text(ModelBase):
                                        n_freq_masks=args.n_freq_masks,
                                        n_time_masks=args.n_time_masks,
                                        p=args.time_width_upper,
+                                       W=args.time_warp_width,
                                        adaptive_number_ratio=args.adaptive_number_ratio,
                                        adaptive_size_ratio=args.adaptive_size_ratio,
                                        max_n_time_masks=args.max_n_time_masks)
@@ -221,7 +222,7 @@ class Speech2Text(ModelBase):
             if hasattr(self, 'dec_fwd_' + sub):
                 getattr(self, 'dec_fwd_' + sub).reset_session()
 
-    def forward(self, batch, task, is_eval=False, teacher=None, teacher_lm=None):
+    def forward(self, batch, task, is_eval=False, teacher=None, teacher_lm=None, teacher_store=None):
         """Forward pass.
 
         Args:
@@ -238,6 +239,8 @@ class Speech2Text(ModelBase):
                 This should be used in inference model for memory efficiency.
             teacher (Speech2Text): used for knowledge distillation from ASR
             teacher_lm (RNNLM): used for knowledge distillation from LM
+            teacher_store (TopKLogitStore): top-k logits of the teacher cached in advance
+                for knowledge distillation
         Returns:
             loss (FloatTensor): `[1]`
             observation (dict):
@@ -249,11 +252,11 @@ class Speech2Text(ModelBase):
                 loss, observation = self._forward(batch, task)
         else:
             self.train()
-            loss, observation = self._forward(batch, task, teacher, teacher_lm)
+            loss, observation = self._forward(batch, task, teacher, teacher_lm, teacher_store)
 
         return loss, observation
 
-    def _forward(self, batch, task, teacher=None, teacher_lm=None):
+    def _forward(self, batch, task, teacher=None, teacher_lm=None, teacher_store=None):
         # Encode input features
         if self.input_type == 'speech':
             if self.mtl_per_batch:
@@ -269,7 +272,9 @@ class Speech2Text(ModelBase):
         # for the forward decoder in the main task
         if (self.fwd_weight > 0 or (self.bwd_weight == 0 and self.ctc_weight > 0) or self.mbr_training) and task in ['all', 'ys', 'ys.ctc', 'ys.mbr']:
             teacher_logits = None
-            if teacher is not None:
+            if teacher_store is not None:
+                teacher_logits = teacher_store.batch(batch['utt_ids'], self.device)
+            elif teacher is not None:
                 teacher.eval()
                 teacher_logits = teacher.generate_logits(batch)
                 # TODO(hirofumi): label smoothing, scheduled sampling, dropout?
@@ -366,20 +371,20 @@ class Speech2Text(ModelBase):
 
         """
         if self.input_type == 'speech':
+            xlens = torch.IntTensor([len(x) for x in xs])
+            xs = pad_list([np2tensor(x, self.device).float() for x in xs], 0.)
+
             # Frame stacking
             if self.n_stacks > 1:
-                xs = [stack_frame(x, self.n_stacks, self.n_skips) for x in xs]
+                xs, xlens = stack_frame_batch(xs, xlens, self.n_stacks, self.n_skips)
 
             # Splicing
             if self.n_splices > 1:
-                xs = [splice(x, self.n_splices, self.n_stacks) for x in xs]
-
-            xlens = torch.IntTensor([len(x) for x in xs])
-            xs = pad_list([np2tensor(x, self.device).float() for x in xs], 0.)
+                xs = splice_batch(xs, xlens, self.n_splices, self.n_stacks)
 
             # SpecAugment
             if self.specaug is not None and self.training:
-                xs = self.specaug(xs)
+                xs = self.specaug(xs, xlens)
 
             # Weight noise injection
             if self.weight_noise_std > 0 and self.training:
@@ -387,7 +392,7 @@ class Speech2Text(ModelBase):
 
             # Input Gaussian noise injection
             if self.input_noise_std > 0 and self.training:
-                xs = add_input_noise(xs, std=self.input_noise_std)
+                xs = add_input_noise(xs, std=self.input_noise_std, xlens=xlens)
 
             # Sequence summary network
             if self.ssn is not None:
@@ -467,7 +472,24 @@ class Speech2Text(ModelBase):
         if getattr(self, 'dec_fwd_sub2', None) is not None:
             self.dec_fwd_sub2._plot_ctc(mkdir_join(self.save_path, 'ctc_sub2'))
 
-    def decode_streaming(self, xs, params, idx2token, exclude_eos=False, task='ys'):
+    def decode_streaming(self, xs, params, idx2token, exclude_eos=False, task='ys',
+                         profiler=None, session_id=None):
+        """Simulated streaming decoding over a session.
+
+        Args:
+            xs (list): A list of length `[B]`, which contains arrays of size `[T, input_dim]`
+            params (dict): hyper-parameters for decoding
+            idx2token (): converter from index to token
+            exclude_eos (bool): exclude <eos> from hypothesis
+            task (str): ys* or ys_sub*
+            profiler (StreamingLatencyProfiler): record per-chunk time and token emission timing
+            session_id (str): session ID for profiler
+        Returns:
+            best_hyps_id (list): A list of length `[B]`, which contains arrays of size `[L]`
+            aws (list): A list of length `[B]`, which contains arrays of size `[L, T, n_heads]`
+
+        """
+        from neural_sp.evaluators.streaming_latency import StreamingLatencyProfiler
         from neural_sp.models.seq2seq.frontends.streaming import Streaming
 
         # check configurations
@@ -483,6 +505,10 @@ class Speech2Text(ModelBase):
         streaming = Streaming(xs[0], params, self.enc, idx2token)
         chunk_sync = params['recog_chunk_sync']
 
+        if profiler is None:
+            profiler = StreamingLatencyProfiler(enabled=False)
+        profiler.start_session(session_id, len(xs[0]))
+
         hyps = None
         best_hyp_id_stream = []
         is_reset = True  # for the first chunk
@@ -496,22 +522,26 @@ class Speech2Text(ModelBase):
 
             while True:
                 # Encode input features chunk by chunk
-                x_chunk, is_last_chunk, lookback, lookahead = streaming.extract_feature()
-                if is_reset:
-                    self.enc.reset_cache()
-                eout_chunk = self.encode([x_chunk], task,
-                                         streaming=True,
-                                         lookback=lookback,
-                                         lookahead=lookahead)[task]['xs']
+                profiler.start_chunk(streaming.offset, streaming.N_l, streaming.N_r)
+                with profiler.timer('feature'):
+                    x_chunk, is_last_chunk, lookback, lookahead = streaming.extract_feature()
+                with profiler.timer('encode'):
+                    if is_reset:
+                        self.enc.reset_cache()
+                    eout_chunk = self.encode([x_chunk], task,
+                                             streaming=True,
+                                             lookback=lookback,
+                                             lookahead=lookahead)[task]['xs']
                 is_reset = False  # detect the first boundary in the same chunk
 
                 # CTC-based VAD
                 ctc_log_probs_chunk = None
                 if streaming.is_ctc_vad:
-                    ctc_probs_chunk = self.dec_fwd.ctc_probs(eout_chunk)
-                    if params['recog_ctc_weight'] > 0:
-                        ctc_log_probs_chunk = torch.log(ctc_probs_chunk)
-                    is_reset = streaming.ctc_vad(ctc_probs_chunk, stdout=stdout)
+                    with profiler.timer('vad'):
+                        ctc_probs_chunk = self.dec_fwd.ctc_probs(eout_chunk)
+                        if params['recog_ctc_weight'] > 0:
+                            ctc_log_probs_chunk = torch.log(ctc_probs_chunk)
+                        is_reset = streaming.ctc_vad(ctc_probs_chunk, stdout=stdout)
 
                 # Truncate the most right frames
                 if is_reset and not is_last_chunk and streaming.bd_offset >= 0:
@@ -520,11 +550,12 @@ class Speech2Text(ModelBase):
 
                 # Chunk-synchronous attention decoding
                 if chunk_sync:
-                    end_hyps, hyps, aws_seg = self.dec_fwd.beam_search_chunk_sync(
-                        eout_chunk, params, idx2token, lm,
-                        ctc_log_probs=ctc_log_probs_chunk, hyps=hyps,
-                        state_carry_over=False,
-                        ignore_eos=self.enc.enc_type in ['lstm', 'conv_lstm'])
+                    with profiler.timer('decode'):
+                        end_hyps, hyps, aws_seg = self.dec_fwd.beam_search_chunk_sync(
+                            eout_chunk, params, idx2token, lm,
+                            ctc_log_probs=ctc_log_probs_chunk, hyps=hyps,
+                            state_carry_over=False,
+                            ignore_eos=self.enc.enc_type in ['lstm', 'conv_lstm'])
                     merged_hyps = sorted(end_hyps + hyps, key=lambda x: x['score'], reverse=True)
                     best_hyp_id_prefix = np.array(merged_hyps[0]['hyp'][1:])
                     if len(best_hyp_id_prefix) > 0 and best_hyp_id_prefix[-1] == self.eos:
@@ -536,6 +567,7 @@ class Speech2Text(ModelBase):
                         if not is_reset:
                             streaming.bd_offset = eout_chunk.size(1) - 1
                             is_reset = True
+                    profiler.emit(len(best_hyp_id_stream) + len(best_hyp_id_prefix))
                     if len(best_hyp_id_prefix) > 0:
                         # print('\rStreaming (T:%d [frame], offset:%d [frame], blank:%d [frame]): %s' %
                         #       (streaming.offset + eout_chunk.size(1) * streaming.factor,
@@ -547,14 +579,15 @@ class Speech2Text(ModelBase):
                 if is_reset:
                     # Global decoding over the segmented region
                     if not chunk_sync:
-                        eout = torch.cat(streaming.eout_chunks, dim=1)
-                        elens = torch.IntTensor([eout.size(1)])
-                        ctc_log_probs = None
-                        if params['recog_ctc_weight'] > 0:
-                            ctc_log_probs = torch.log(self.dec_fwd.ctc_probs(eout))
-                        nbest_hyps_id_offline = self.dec_fwd.beam_search(
-                            eout, elens, global_params, idx2token, lm, lm_second,
-                            ctc_log_probs=ctc_log_probs)[0]
+                        with profiler.timer('decode'):
+                            eout = torch.cat(streaming.eout_chunks, dim=1)
+                            elens = torch.IntTensor([eout.size(1)])
+                            ctc_log_probs = None
+                            if params['recog_ctc_weight'] > 0:
+                                ctc_log_probs = torch.log(self.dec_fwd.ctc_probs(eout))
+                            nbest_hyps_id_offline = self.dec_fwd.beam_search(
+                                eout, elens, global_params, idx2token, lm, lm_second,
+                                ctc_log_probs=ctc_log_probs)[0]
                         # print('Offline (T:%d [frame]): %s' %
                         #       (streaming.offset + eout_chunk.size(1) * streaming.factor,
                         #        idx2token(nbest_hyps_id_offline[0][0])))
@@ -563,6 +596,7 @@ class Speech2Text(ModelBase):
                     if not chunk_sync:
                         if len(nbest_hyps_id_offline[0][0]) > 0:
                             best_hyp_id_stream.extend(nbest_hyps_id_offline[0][0])
+                        profiler.emit(len(best_hyp_id_stream), is_final=True)
                     else:
                         if len(best_hyp_id_prefix) > 0:
                             best_hyp_id_stream.extend(best_hyp_id_prefix)
@@ -586,13 +620,15 @@ class Speech2Text(ModelBase):
                     streaming.backoff(x_chunk, self.dec_fwd, stdout=stdout)
                 if is_last_chunk:
                     break
+                profiler.end_chunk(next_offset=streaming.offset)
 
             # Global decoding over the last chunk
             if not chunk_sync and len(streaming.eout_chunks) > 0:
-                eout = torch.cat(streaming.eout_chunks, dim=1)
-                elens = torch.IntTensor([eout.size(1)])
-                nbest_hyps_id_offline = self.dec_fwd.beam_search(
-                    eout, elens, global_params, idx2token, lm, lm_second)[0]
+                with profiler.timer('decode'):
+                    eout = torch.cat(streaming.eout_chunks, dim=1)
+                    elens = torch.IntTensor([eout.size(1)])
+                    nbest_hyps_id_offline = self.dec_fwd.beam_search(
+                        eout, elens, global_params, idx2token, lm, lm_second)[0]
                 # print('MoChA: ' + idx2token(nbest_hyps_id_offline[0][0]))
                 # print('*' * 50)
                 if len(nbest_hyps_id_offline[0][0]) > 0:
@@ -601,6 +637,9 @@ class Speech2Text(ModelBase):
             # pick up the best hyp
             if not is_reset and chunk_sync and len(best_hyp_id_prefix) > 0:
                 best_hyp_id_stream.extend(best_hyp_id_prefix)
+            profiler.emit(len(best_hyp_id_stream), is_final=True)
+            profiler.end_chunk()
+            profiler.end_session()
 
             if len(best_hyp_id_stream) > 0:
                 return [np.stack(best_hyp_id_stream, axis=0)], [None]
@@ -10,11 +10,41 @@ import copy
 import numpy as np
 import torch
 
+try:
+    from contextlib import nullcontext
+except ImportError:
+    # NOTE: for python<3.7
+    class nullcontext(object):
+        """Context manager doing nothing (reusable like contextlib.nullcontext)."""
+
+        def __init__(self, enter_result=None):
+            self.enter_result = enter_result
+
+        def __enter__(self):
+            return self.enter_result
+
+        def __exit__(self, *excinfo):
+            pass
+
 
 def repeat(module, n_layers):
     return torch.nn.ModuleList([copy.deepcopy(module) for _ in range(n_layers)])
 
 
+def float32_autocast(x):
+    """Disable autocast so that operations in this context run in float32.
+
+    Args:
+        x (torch.Tensor): tensor on the target device
+    Returns:
+        context manager
+
+    """
+    if not hasattr(torch, 'autocast'):
+        return nullcontext()
+    return torch.autocast(device_type=x.device.type, enabled=False)
+
+
 def tensor2np(x):
     """Convert torch.Tensor to np.ndarray.
 
@@ -142,7 +172,7 @@ def compute_accuracy(logits, ys_ref, pad):
     """
     pad_pred = logits.view(ys_ref.size(0), ys_ref.size(1), logits.size(-1)).argmax(2)
     mask = ys_ref != pad
-    numerator = torch.sum(pad_pred.masked_select(mask) == ys_ref.masked_select(mask))
-    denominator = torch.sum(mask)
+    numerator = ((pad_pred == ys_ref) & mask).sum()
+    denominator = mask.sum()
     acc = float(numerator) * 100 / float(denominator)
     return acc
@@ -0,0 +1,272 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Asynchronous and atomic checkpoint writer."""
+
+from collections import OrderedDict
+from glob import glob
+import inspect
+import logging
+import os
+import shutil
+import threading
+import time
+import torch
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+# files in a sharded checkpoint directory
+SHARD_META = 'checkpoint.pt'
+SHARD_DIR = 'model_state_dict'
+
+# NOTE: for torch<2.1, tensors in a checkpoint file cannot be memory-mapped
+MMAP = 'mmap' in inspect.signature(torch.load).parameters
+
+
+class CheckpointManager(object):
+    """Save checkpoints in the background without blocking training.
+
+    The checkpoint is first copied to CPU memory on the training thread, and
+    then serialized on a background thread to a temporary path, which is
+    renamed to the final path after it is fully written. Old checkpoints are
+    deleted only after the new one has been written successfully. At most one
+    checkpoint is written at a time.
+
+    Args:
+        async_save (bool): serialize checkpoints on a background thread
+        sharded (bool): save parameters in a directory with one file per tensor
+            so that they can be loaded one by one (e.g., for checkpoint averaging)
+
+    """
+
+    def __init__(self, async_save=True, sharded=False):
+        self.async_save = async_save
+        self.sharded = sharded
+        self._thread = None
+        self._error = None
+        self.blocked_time = 0.  # total time [sec] the training loop is blocked
+
+    def save(self, checkpoint, model_path, keep_epochs=None):
+        """Save a checkpoint.
+
+        Args:
+            checkpoint (dict): checkpoint including tensors on any device
+            model_path (str): path to the checkpoint (model.epoch-*)
+            keep_epochs (list): epochs of checkpoints to keep in the same directory.
+                The others are deleted after `checkpoint` is written.
+                If None, no checkpoint is deleted.
+
+        """
+        start_time = time.time()
+        self.wait()
+        checkpoint = snapshot(checkpoint)
+        if keep_epochs is not None:
+            keep_epochs = list(keep_epochs)
+        if self.async_save:
+            self._thread = threading.Thread(target=self._write,
+                                            args=(checkpoint, model_path, keep_epochs))
+            self._thread.start()
+        else:
+            self._write(checkpoint, model_path, keep_epochs)
+        blocked_time = time.time() - start_time
+        self.blocked_time += blocked_time
+        logger.info('Training was blocked for %.3f sec to save a checkpoint (total: %.3f sec)' %
+                    (blocked_time, self.blocked_time))
+
+    def _write(self, checkpoint, model_path, keep_epochs):
+        try:
+            save_checkpoint_file(checkpoint, model_path, sharded=self.sharded)
+            logger.info("=> Saved checkpoint: %s" % model_path)
+            if keep_epochs is not None:
+                remove_old_checkpoints(os.path.dirname(model_path), keep_epochs, exclude=model_path)
+        except Exception as e:
+            logger.error('Failed to save checkpoint %s: %s' % (model_path, e))
+            self._error = e
+
+    def wait(self):
+        """Wait until the checkpoint being written is saved."""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+
+def snapshot(obj):
+    """Copy tensors in `obj` to CPU memory recursively."""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    elif isinstance(obj, dict):
+        obj_copy = obj.__class__((k, snapshot(v)) for k, v in obj.items())
+        # NOTE: state_dict holds versions of modules in `_metadata`
+        if hasattr(obj, '_metadata'):
+            obj_copy._metadata = snapshot(obj._metadata)
+        return obj_copy
+    elif isinstance(obj, (list, tuple)):
+        return obj.__class__(snapshot(v) for v in obj)
+    return obj
+
+
+def save_checkpoint_file(checkpoint, model_path, sharded=False):
+    """Save a checkpoint atomically.
+
+    Args:
+        checkpoint (dict): checkpoint including `model_state_dict`
+        model_path (str): path to the checkpoint
+        sharded (bool): save `model_state_dict` in a directory with one file per tensor
+
+    """
+    if sharded:
+        meta = dict(checkpoint)
+        save_model_state_stream(meta.pop('model_state_dict').items(), model_path, meta)
+        return
+    tmp_path = _tmp_path(model_path)
+    remove_checkpoint(tmp_path)
+    _save_file(checkpoint, tmp_path)
+    # NOTE: a file is replaced atomically, but a directory (sharded layout) must be removed first
+    if os.path.isdir(model_path):
+        remove_checkpoint(model_path)
+    os.replace(tmp_path, model_path)
+
+
+def save_model_state_stream(model_state, model_path, meta={}):
+    """Save parameters one by one in the sharded layout atomically.
+
+    Args:
+        model_state (iterable): pairs of parameter name and tensor.
+            Each tensor is written as soon as it is yielded.
+        model_path (str): path to the checkpoint directory
+        meta (dict): other entries in the checkpoint
+
+    """
+    tmp_path = _tmp_path(model_path)
+    remove_checkpoint(tmp_path)
+    os.makedirs(os.path.join(tmp_path, SHARD_DIR))
+    keys = []
+    for i, (k, v) in enumerate(model_state):
+        _save_file(v, os.path.join(tmp_path, SHARD_DIR, '%05d.pt' % i))
+        keys.append(k)
+    meta = dict(meta)
+    meta['model_state_dict'] = keys
+    _save_file(meta, os.path.join(tmp_path, SHARD_META))
+    remove_checkpoint(model_path)
+    os.replace(tmp_path, model_path)
+
+
+def _tmp_path(model_path):
+    # NOTE: hidden temporary path is not matched by model.epoch-*
+    save_dir, name = os.path.split(model_path)
+    return os.path.join(save_dir, '.' + name + '.tmp')
+
+
+def _save_file(obj, path):
+    with open(path, 'wb') as f:
+        torch.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def load_checkpoint_file(model_path):
+    """Load a checkpoint to CPU memory.
+
+    Args:
+        model_path (str): path to the checkpoint (file or sharded directory)
+    Returns:
+        checkpoint (dict):
+
+    """
+    if not os.path.isdir(model_path):
+        return torch.load(model_path, map_location=lambda storage, loc: storage)
+    checkpoint = torch.load(os.path.join(model_path, SHARD_META), map_location='cpu')
+    checkpoint['model_state_dict'] = OrderedDict(iterate_model_state(model_path))
+    return checkpoint
+
+
+def load_checkpoint_meta(model_path):
+    """Load a checkpoint except for parameters.
+
+    Args:
+        model_path (str): path to the checkpoint (file or sharded directory)
+    Returns:
+        checkpoint (dict): checkpoint without `model_state_dict`
+
+    """
+    if os.path.isdir(model_path):
+        checkpoint = torch.load(os.path.join(model_path, SHARD_META), map_location='cpu')
+    else:
+        checkpoint = _load_lazy(model_path)
+    checkpoint.pop('model_state_dict', None)
+    return checkpoint
+
+
+def iterate_model_state(model_path):
+    """Iterate over parameters in a checkpoint without loading all of them at once.
+
+    NOTE: a checkpoint file is fully loaded at the first iteration unless
+    `is_lazy_loadable` is True.
+
+    Args:
+        model_path (str): path to the checkpoint (file or sharded directory)
+    Yields:
+        key (str): parameter name
+        value (torch.Tensor): parameter on CPU
+
+    """
+    if os.path.isdir(model_path):
+        keys = torch.load(os.path.join(model_path, SHARD_META), map_location='cpu')['model_state_dict']
+        for i, k in enumerate(keys):
+            yield k, torch.load(os.path.join(model_path, SHARD_DIR, '%05d.pt' % i), map_location='cpu')
+        return
+    for k, v in _load_lazy(model_path)['model_state_dict'].items():
+        yield k, v
+
+
+def is_lazy_loadable(model_path):
+    """Check if parameters in a checkpoint can be read one by one.
+
+    Args:
+        model_path (str): path to the checkpoint (file or sharded directory)
+    Returns:
+        bool
+
+    """
+    if os.path.isdir(model_path):
+        return True
+    # NOTE: only the zipfile format (torch>=1.6) can be memory-mapped
+    return MMAP and zipfile.is_zipfile(model_path)
+
+
+def _load_lazy(model_path):
+    if is_lazy_loadable(model_path):
+        # tensors are read from the file lazily
+        return torch.load(model_path, map_location='cpu', mmap=True)
+    return torch.load(model_path, map_location=lambda storage, loc: storage)
+
+
+def remove_checkpoint(model_path):
+    if os.path.isdir(model_path):
+        shutil.rmtree(model_path)
+    elif os.path.exists(model_path):
+        os.remove(model_path)
+
+
+def remove_old_checkpoints(save_dir, keep_epochs, exclude=None):
+    """Delete checkpoints (model.epoch-*) except for those of `keep_epochs`.
+
+    Args:
+        save_dir (str): directory containing checkpoints
+        keep_epochs (list): epochs of checkpoints to keep
+        exclude (str): path to a checkpoint not to be deleted
+
+    """
+    for path in glob(os.path.join(save_dir, 'model.epoch-*')):
+        if 'model.epoch-avg' in path or path == exclude:
+            continue
+        epoch = float(path.split('-')[-1])
+        if epoch not in keep_epochs:
+            remove_checkpoint(path)
@@ -0,0 +1,190 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Utility functions for multi-process distributed training."""
+
+import datetime
+import logging
+import math
+import os
+import socket
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from neural_sp.models.torch_utils import nullcontext
+
+logger = logging.getLogger(__name__)
+
+# NOTE: evaluation is done in the main process only, and the other processes
+# wait for the result. Set a long timeout so that they are not killed meanwhile.
+TIMEOUT = datetime.timedelta(hours=6)
+
+
+def launch(fn, n_procs):
+    """Run `fn` in `n_procs` processes on a single node.
+
+    When processes are already launched by an external launcher (e.g., torchrun),
+    `fn` is called in the current process.
+
+    Args:
+        fn (callable): entry point without arguments (must be picklable)
+        n_procs (int): number of processes
+
+    """
+    if n_procs <= 1 or 'WORLD_SIZE' in os.environ:
+        return fn()
+    os.environ.setdefault('MASTER_ADDR', '127.0.0.1')
+    os.environ.setdefault('MASTER_PORT', str(_find_free_port()))
+    mp.spawn(_worker, args=(fn, n_procs), nprocs=n_procs, join=True)
+
+
+def _worker(rank, fn, world_size):
+    os.environ['RANK'] = str(rank)
+    os.environ['LOCAL_RANK'] = str(rank)
+    os.environ['WORLD_SIZE'] = str(world_size)
+    fn()
+
+
+def _find_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('', 0))
+        return s.getsockname()[1]
+
+
+def init_process_group(n_gpus, backend=None):
+    """Initialize the default process group from environment variables.
+
+    Args:
+        n_gpus (int): number of GPUs per process (0 for CPU)
+        backend (str): nccl/gloo (nccl on GPU and gloo on CPU by default)
+    Returns:
+        rank (int): global rank of the current process
+        world_size (int): number of processes
+        local_rank (int): rank of the current process on the node
+
+    """
+    if 'WORLD_SIZE' not in os.environ:
+        return 0, 1, 0
+    local_rank = int(os.environ.get('LOCAL_RANK', 0))
+    if n_gpus >= 1:
+        torch.cuda.set_device(local_rank)
+    if backend is None:
+        backend = 'nccl' if n_gpus >= 1 else 'gloo'
+    dist.init_process_group(backend, init_method='env://', timeout=TIMEOUT)
+    logger.info('Initialized process group (rank %d/%d, backend: %s)' %
+                (dist.get_rank(), dist.get_world_size(), backend))
+    return dist.get_rank(), dist.get_world_size(), local_rank
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def cleanup():
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+def maybe_no_sync(model, sync):
+    """Skip gradient all-reduce in DistributedDataParallel until `sync` is True.
+
+    Args:
+        model (torch.nn.Module): model (optionally wrapped by DistributedDataParallel)
+        sync (bool): all-reduce gradients in the following backward pass
+    Returns:
+        context manager
+
+    """
+    if sync or not hasattr(model, 'no_sync'):
+        return nullcontext()
+    return model.no_sync()
+
+
+def broadcast_object(obj, src=0):
+    """Broadcast a picklable object from the `src` process to all processes."""
+    if not is_distributed():
+        return obj
+    objs = [obj]
+    dist.broadcast_object_list(objs, src=src)
+    return objs[0]
+
+
+def all_reduce_observation(observation):
+    """Average observed values (loss, accuracy, perplexity etc.) over processes.
+
+    All values are packed into a single tensor to reduce them with one
+    collective call. Values missing in some processes (None/NaN) are excluded
+    from the average.
+
+    Args:
+        observation (dict): values (float or None) per key; keys must be the same over processes
+    Returns:
+        observation (dict): averaged values
+
+    """
+    if not is_distributed():
+        return observation
+    keys = sorted(observation.keys())
+    values = [_valid(observation[k]) for k in keys]
+    return _all_reduce_mean(keys, [v if v is not None else 0. for v in values],
+                            [1. if v is not None else 0. for v in values])
+
+
+class ObservationBuffer(object):
+    """Accumulate observed values over steps and average them over processes at once.
+
+    Calling all_reduce_observation every step adds a blocking collective call
+    to each step. Instead, values are summed in each process, and reduce() is
+    called only when they are reported, at the same step in all processes.
+    Keys must be the same over processes.
+
+    """
+
+    def __init__(self):
+        self._sums = {}
+        self._counts = {}
+
+    def add(self, observation):
+        for k, v in observation.items():
+            v = _valid(v)
+            self._sums[k] = self._sums.get(k, 0.) + (v if v is not None else 0.)
+            self._counts[k] = self._counts.get(k, 0.) + (1. if v is not None else 0.)
+
+    def reduce(self):
+        """Average values accumulated since the last call over steps and processes.
+
+        Returns:
+            observation (dict): averaged values (None if not observed)
+
+        """
+        keys = sorted(self._sums.keys())
+        sums = [self._sums[k] for k in keys]
+        counts = [self._counts[k] for k in keys]
+        self._sums, self._counts = {}, {}
+        if not is_distributed():
+            return {k: (s / n if n > 0 else None) for k, s, n in zip(keys, sums, counts)}
+        return _all_reduce_mean(keys, sums, counts)
+
+
+def _valid(v):
+    return float(v) if v is not None and not math.isnan(float(v)) else None
+
+
+def _all_reduce_mean(keys, sums, counts):
+    """Sum `sums` and `counts` over processes with one collective call and divide them."""
+    buf = torch.tensor([sums, counts], dtype=torch.float64,
+                       device='cuda' if dist.get_backend() == 'nccl' else 'cpu')
+    dist.all_reduce(buf)
+    return {k: (s / n if n > 0 else None) for k, s, n in zip(keys, buf[0].tolist(), buf[1].tolist())}
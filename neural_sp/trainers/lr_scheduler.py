@@ -6,11 +6,11 @@
 
 """Learning rate scheduler."""
 
-from glob import glob
 import logging
 import os
 import torch
 
+from neural_sp.trainers.checkpoint import CheckpointManager
 from neural_sp.trainers.optimizer import set_optimizer
 
 logger = logging.getLogger(__name__)
@@ -41,6 +41,8 @@ class LRScheduler(object):
         factor (float): factor of learning rate for Transformer
         noam (bool): learning rate scheduling for Transformer
         save_checkpoints_topk (int): save top-k checkpoints
+        checkpoint_manager (CheckpointManager): checkpoint writer
+            (checkpoints are saved synchronously by default)
 
     """
 
@@ -48,7 +50,8 @@ class LRScheduler(object):
                  decay_type, decay_start_epoch, decay_rate,
                  decay_patient_n_epochs=0, early_stop_patient_n_epochs=-1, lower_better=True,
                  warmup_start_lr=0, warmup_n_steps=0, peak_lr=1e6,
-                 model_size=0, factor=1, noam=False, save_checkpoints_topk=1):
+                 model_size=0, factor=1, noam=False, save_checkpoints_topk=1,
+                 checkpoint_manager=None):
 
         self.optimizer = optimizer
         self.noam = noam
@@ -83,6 +86,10 @@ class LRScheduler(object):
         assert save_checkpoints_topk >= 1
         self.topk_list = []
 
+        if checkpoint_manager is None:
+            checkpoint_manager = CheckpointManager(async_save=False)
+        self.checkpoint_manager = checkpoint_manager
+
     @property
     def n_steps(self):
         return self._step
@@ -99,9 +106,19 @@ class LRScheduler(object):
     def is_early_stop(self):
         return self.not_improved_n_epochs >= self.early_stop_patient_n_epochs
 
-    def step(self):
+    def step(self, scaler=None):
+        """Update parameters and learning rate.
+
+        Args:
+            scaler (GradScaler): gradient scaler for float16 training
+
+        """
         self._step += 1
-        self.optimizer.step()
+        if scaler is not None:
+            scaler.step(self.optimizer)
+            scaler.update()
+        else:
+            self.optimizer.step()
         if self.noam:
             self._noam_lr()
         else:
@@ -179,7 +196,7 @@ class LRScheduler(object):
                 param_group['lr'] = self.lr
 
     def save_checkpoint(self, model, save_path, remove_old=True, amp=None,
-                        epoch_detail=None):
+                        epoch_detail=None, dataset=None, model_name=None):
         """Save checkpoint.
 
         Args:
@@ -188,22 +205,18 @@ class LRScheduler(object):
             optimizer (LRScheduler): optimizer wrapped by LRScheduler class
             remove_old (bool): if True, all checkpoints
                 worse than the top-k ones are deleted
-            amp ():
+            amp (MixedPrecision): precision policy holding the gradient scaler
             epoch_detail (float): fine-grained epoch (used for MBR training)
+            dataset (ShardedDataset): training set whose position in the corpus is saved
+            model_name (str): file name of the checkpoint (model.epoch-* by default).
+                Checkpoints with other names are not removed by `remove_old`.
 
         """
         if epoch_detail is None:
             epoch_detail = self.n_epochs
-        model_path = os.path.join(save_path, 'model.epoch-' + str(epoch_detail))
-
-        # Remove old checkpoints
-        if remove_old:
-            for path in glob(os.path.join(save_path, 'model.epoch-*')):
-                if 'model.epoch-avg' in path:
-                    continue
-                epoch = int(path.split('-')[-1])
-                if epoch not in [ep for (ep, v) in self.topk_list]:
-                    os.remove(path)
+        if model_name is None:
+            model_name = 'model.epoch-' + str(epoch_detail)
+        model_path = os.path.join(save_path, model_name)
 
         # Save parameters, optimizer, step index etc.
         checkpoint = {
@@ -212,9 +225,13 @@ class LRScheduler(object):
         }
         if amp is not None:
             checkpoint['amp_state_dict'] = amp.state_dict()
-        torch.save(checkpoint, model_path)
+        if dataset is not None:
+            checkpoint['dataset_state_dict'] = dataset.state_dict()
 
-        logger.info("=> Saved checkpoint (epoch:%s): %s" % (str(epoch_detail), model_path))
+        # NOTE: checkpoints worse than the top-k ones are removed after the new one is saved
+        keep_epochs = [ep for (ep, v) in self.topk_list] if remove_old else None
+        self.checkpoint_manager.save(checkpoint, model_path, keep_epochs)
+        logger.info("=> Saving checkpoint (epoch:%s): %s" % (str(epoch_detail), model_path))
 
     def state_dict(self):
         """Returns the state of the scheduler as a :class:`dict`.
@@ -223,7 +240,8 @@ class LRScheduler(object):
         is not the optimizer.
 
         """
-        dict = {key: value for key, value in self.__dict__.items()}
+        dict = {key: value for key, value in self.__dict__.items()
+                if key not in ['optimizer', 'checkpoint_manager']}
         dict['optimizer_state_dict'] = self.optimizer.state_dict()
         return dict
 
@@ -235,7 +253,9 @@ class LRScheduler(object):
                 from a call to :meth:`state_dict`.
 
         """
-        self.__dict__.update({k: v for k, v in state_dict.items() if k != 'optimizer_state_dict'})
+        # NOTE: the optimizer object saved in old checkpoints is not restored
+        self.__dict__.update({k: v for k, v in state_dict.items()
+                              if k not in ['optimizer_state_dict', 'optimizer', 'checkpoint_manager']})
         self.optimizer.load_state_dict(state_dict['optimizer_state_dict'])
 
     def convert_to_sgd(self, model, lr, weight_decay, decay_type, decay_rate):
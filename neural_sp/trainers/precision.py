@@ -0,0 +1,149 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Mixed precision training with native autocast and gradient scaling."""
+
+import logging
+import torch
+
+from neural_sp.models.torch_utils import nullcontext
+
+logger = logging.getLogger(__name__)
+
+TRAIN_DTYPES = {
+    'fp32': torch.float32, 'float32': torch.float32,
+    'fp16': torch.float16, 'float16': torch.float16,
+}
+DTYPE_NAMES = {torch.float32: 'fp32', torch.float16: 'fp16'}
+if hasattr(torch, 'bfloat16'):
+    TRAIN_DTYPES.update({'bf16': torch.bfloat16, 'bfloat16': torch.bfloat16})
+    DTYPE_NAMES[torch.bfloat16] = 'bf16'
+# NOTE: opt levels of NVIDIA apex are kept for configurations of old experiments
+APEX_OPT_LEVELS = {'O0': 'fp32', 'O1': 'fp16', 'O2': 'fp16', 'O3': 'fp16'}
+# NOTE: float64 used to be accepted but trained in float32, which is kept
+LEGACY_DTYPES = {'float64': 'fp32'}
+
+
+def parse_train_dtype(train_dtype):
+    """Convert `--train_dtype` to torch.dtype.
+
+    Args:
+        train_dtype (str): fp32/fp16/bf16 (float32/float16/bfloat16,
+            apex opt levels and float64 are also accepted)
+    Returns:
+        dtype (torch.dtype):
+
+    """
+    if train_dtype in APEX_OPT_LEVELS:
+        logger.warning('apex opt level %s is deprecated, use %s instead.' %
+                       (train_dtype, APEX_OPT_LEVELS[train_dtype]))
+        train_dtype = APEX_OPT_LEVELS[train_dtype]
+    elif train_dtype in LEGACY_DTYPES:
+        logger.warning('%s training is not supported by autocast, %s is used instead.' %
+                       (train_dtype, LEGACY_DTYPES[train_dtype]))
+        train_dtype = LEGACY_DTYPES[train_dtype]
+    if train_dtype not in TRAIN_DTYPES:
+        raise ValueError('train_dtype must be one of %s.' %
+                         (list(TRAIN_DTYPES.keys()) + list(APEX_OPT_LEVELS.keys()) + list(LEGACY_DTYPES.keys())))
+    return TRAIN_DTYPES[train_dtype]
+
+
+def train_dtype_suffix(train_dtype):
+    """Suffix of the model directory name for `--train_dtype`.
+
+    Directory names of old experiments are kept, i.e., apex opt levels are
+    appended as they are, and float16/float32/float64 are not appended.
+
+    Args:
+        train_dtype (str):
+    Returns:
+        suffix (str):
+
+    """
+    if train_dtype in APEX_OPT_LEVELS:
+        return '_' + train_dtype
+    if train_dtype in ['float16', 'float32', 'float64', 'fp32']:
+        return ''
+    return '_' + DTYPE_NAMES[parse_train_dtype(train_dtype)]
+
+
+class MixedPrecision(object):
+    """Precision policy for training.
+
+    The forward pass runs under torch.autocast with `dtype`, and the loss is
+    scaled by GradScaler in float16 training. Numerically sensitive operations
+    (CTC/RNN-T losses, log-softmax over the vocabulary, cumulative products
+    in MoChA) are computed in float32 inside the models.
+
+    Args:
+        train_dtype (str): fp32/fp16/bf16
+        device_type (str): cuda/cpu
+
+    """
+
+    def __init__(self, train_dtype='fp32', device_type='cuda'):
+        self.dtype = parse_train_dtype(train_dtype)
+        self.device_type = device_type
+        self.enabled = self.dtype != torch.float32
+        # loss scaling is necessary only for float16
+        use_scaler = self.dtype == torch.float16
+        if hasattr(torch, 'amp') and hasattr(torch.amp, 'GradScaler'):
+            self.scaler = torch.amp.GradScaler(device_type, enabled=use_scaler)
+        elif hasattr(torch.cuda, 'amp'):
+            self.scaler = torch.cuda.amp.GradScaler(enabled=use_scaler and device_type == 'cuda')
+        else:
+            self.scaler = None
+        if self.enabled and not self._autocast_available():
+            raise ValueError('%s training requires autocast (torch>=1.6 for fp16 on GPU, '
+                             'torch>=1.10 otherwise).' % DTYPE_NAMES[self.dtype])
+        logger.info('Training dtype: %s' % DTYPE_NAMES[self.dtype])
+
+    def _autocast_available(self):
+        if hasattr(torch, 'autocast'):
+            return True
+        # NOTE: torch<1.10 supports float16 on GPU only
+        return hasattr(torch.cuda, 'amp') and self.device_type == 'cuda' and self.dtype == torch.float16
+
+    def autocast(self):
+        """Context manager for the forward pass."""
+        if not self.enabled:
+            return nullcontext()
+        if hasattr(torch, 'autocast'):
+            return torch.autocast(device_type=self.device_type, dtype=self.dtype)
+        return torch.cuda.amp.autocast()
+
+    def _use_scaler(self):
+        return self.scaler is not None and self.scaler.is_enabled()
+
+    def backward(self, loss):
+        if self._use_scaler():
+            loss = self.scaler.scale(loss)
+        loss.backward()
+
+    def unscale_(self, optimizer):
+        """Unscale gradients in-place before gradient clipping."""
+        if self._use_scaler():
+            self.scaler.unscale_(optimizer)
+
+    def step(self, scheduler):
+        """Update parameters. Steps with inf/NaN gradients are skipped in float16 training.
+
+        Args:
+            scheduler (LRScheduler): optimizer wrapped by LRScheduler class
+
+        """
+        scheduler.step(scaler=self.scaler if self._use_scaler() else None)
+
+    def state_dict(self):
+        return self.scaler.state_dict() if self.scaler is not None else {}
+
+    def load_state_dict(self, state_dict):
+        if not self._use_scaler():
+            return
+        if 'scale' not in state_dict:
+            logger.warning('Gradient scaler state is not found (e.g., saved by apex), skipped.')
+            return
+        self.scaler.load_state_dict(state_dict)
@@ -0,0 +1,286 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Opt-in profilers and timing scopes for training."""
+
+from collections import Counter
+from collections import OrderedDict
+from contextlib import contextmanager
+import cProfile
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+import torch
+
+from neural_sp.models.torch_utils import nullcontext
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = ['none', 'sampling', 'torch', 'cprofile']
+
+# timer used by `scope` (None when timing is disabled)
+_timer = None
+_null_scope = nullcontext()
+
+
+def scope(name):
+    """Named timing scope of a training phase.
+
+    This is a no-op unless a PhaseTimer is activated, so that it can be
+    left in the hot path of models.
+
+    Args:
+        name (str): name of the phase (nested scopes are joined with '/')
+    Returns:
+        context manager
+
+    """
+    if _timer is None:
+        return _null_scope
+    return _timer.scope(name)
+
+
+def timed_iter(iterable, name='data'):
+    """Measure time to fetch each element of `iterable` in `scope(name)`."""
+    iterator = iter(iterable)
+    while True:
+        with scope(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+class PhaseTimer(object):
+    """Aggregate wall time per training phase.
+
+    Args:
+        synchronize (bool): synchronize CUDA at the boundaries of scopes
+            so that asynchronous kernels are counted in the phase launching them
+
+    """
+
+    def __init__(self, synchronize=False):
+        self.synchronize = synchronize and torch.cuda.is_available()
+        self.record_function = False  # annotate torch.profiler traces
+        self._stack = []
+        self.reset()
+
+    def reset(self):
+        self.elapsed = OrderedDict()  # name -> total time [sec]
+        self.counts = Counter()
+        self._start_time = time.time()
+
+    @contextmanager
+    def scope(self, name):
+        self._stack.append(name)
+        name = '/'.join(self._stack)
+        record = torch.profiler.record_function(name) if self.record_function else _null_scope
+        if self.synchronize:
+            torch.cuda.synchronize()
+        start_time = time.time()
+        try:
+            with record:
+                yield
+        finally:
+            if self.synchronize:
+                torch.cuda.synchronize()
+            self.elapsed[name] = self.elapsed.get(name, 0.) + time.time() - start_time
+            self.counts[name] += 1
+            self._stack.pop()
+
+    def add_module_scopes(self, model, names):
+        """Measure forward passes of submodules.
+
+        `forward` of each submodule is wrapped in a scope instead of using
+        forward hooks, so that the scope is closed even if it raises an exception.
+
+        Args:
+            model (torch.nn.Module):
+            names (list): dotted paths to submodules (missing ones are skipped).
+                The last component is used as the scope name.
+
+        """
+        for path in names:
+            module = model
+            for name in path.split('.'):
+                module = getattr(module, name, None)
+            if not isinstance(module, torch.nn.Module):
+                continue
+            module.forward = self._scoped_forward(name, module.forward)
+
+    def _scoped_forward(self, name, forward):
+        @functools.wraps(forward)
+        def wrapper(*args, **kwargs):
+            with self.scope(name):
+                return forward(*args, **kwargs)
+        return wrapper
+
+    def report(self):
+        """Log the time breakdown since the last report and reset it."""
+        total = time.time() - self._start_time
+        if total <= 0 or len(self.elapsed) == 0:
+            return
+        lines = ['%-40s %10.1f ms %6.1f%% (x%d)' % (name, t * 1000, t / total * 100, self.counts[name])
+                 for name, t in sorted(self.elapsed.items())]
+        # time outside top-level scopes
+        other = total - sum(t for name, t in self.elapsed.items() if '/' not in name)
+        lines.append('%-40s %10.1f ms %6.1f%%' % ('(other)', other * 1000, other / total * 100))
+        logger.info('Time breakdown (%.2f sec):\n%s' % (total, '\n'.join(lines)))
+        self.reset()
+
+
+class SamplingProfiler(object):
+    """Statistical profiler sampling the call stack of a thread periodically.
+
+    Overhead is proportional to the sampling rate, not to the number of
+    function calls. Samples are saved in the collapsed stack format, which
+    can be converted to a flame graph (e.g., flamegraph.pl or speedscope).
+
+    Args:
+        interval (float): sampling interval [sec]
+        thread_id (int): thread to sample (the current thread by default)
+
+    """
+
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename),
+                                             code.co_firstlineno))
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def dump(self, path):
+        """Save samples in the collapsed stack format."""
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('%s %d\n' % (stack, count))
+
+    def top(self, n=20):
+        """Functions with the most samples (self time)."""
+        self_counts = Counter()
+        for stack, count in self.stacks.items():
+            self_counts[stack.split(';')[-1]] += count
+        return self_counts.most_common(n)
+
+
+class Profiler(object):
+    """Profiler for training selected by --profile.
+
+    Args:
+        mode (str): none/sampling/torch/cprofile
+            sampling: sample the call stack of the training thread (low overhead)
+            torch: record torch.profiler traces over a window of steps
+            cprofile: deterministic profiling of all Python function calls
+        save_path (str): directory to save results
+        timing (bool): aggregate time in named scopes (see `scope`)
+        start_step (int): first step to record in torch mode
+        n_steps (int): number of steps to record in torch mode
+        sampling_interval (float): sampling interval [sec] in sampling mode
+
+    """
+
+    def __init__(self, mode='none', save_path=None, timing=False,
+                 start_step=10, n_steps=5, sampling_interval=0.005):
+        assert mode in PROFILE_MODES, mode
+        self.mode = mode
+        self.save_path = save_path
+        self.start_step = start_step
+        self.n_steps = n_steps
+        self.sampling_interval = sampling_interval
+        self.timer = PhaseTimer(synchronize=True) if timing else None
+        self._profiler = None
+
+    def start(self):
+        global _timer
+        _timer = self.timer
+        if self.mode == 'sampling':
+            self._profiler = SamplingProfiler(self.sampling_interval)
+            self._profiler.start()
+        elif self.mode == 'cprofile':
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        elif self.mode == 'torch':
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self._profiler = torch.profiler.profile(
+                activities=activities,
+                schedule=torch.profiler.schedule(wait=max(0, self.start_step - 1), warmup=1,
+                                                 active=self.n_steps, repeat=1),
+                on_trace_ready=self._on_trace_ready,
+                record_shapes=True)
+            self._profiler.start()
+            if self.timer is not None:
+                self.timer.record_function = True
+        if self.mode != 'none':
+            logger.info('Start profiling (mode: %s)' % self.mode)
+
+    def step(self):
+        """Notify the end of a training step."""
+        if self.mode == 'torch':
+            self._profiler.step()
+
+    def add_module_scopes(self, model, names):
+        """Measure forward passes of submodules in named scopes."""
+        if self.timer is not None:
+            self.timer.add_module_scopes(model, names)
+
+    def report(self):
+        """Log the time breakdown of named scopes."""
+        if self.timer is not None:
+            self.timer.report()
+
+    def _on_trace_ready(self, prof):
+        path = os.path.join(self.save_path, 'train.trace.json')
+        prof.export_chrome_trace(path)
+        logger.info('Saved torch.profiler trace: %s\n%s' % (
+            path, prof.key_averages().table(sort_by='self_cpu_time_total', row_limit=20)))
+
+    def stop(self):
+        global _timer
+        _timer = None
+        if self._profiler is None:
+            return
+        if self.mode == 'sampling':
+            self._profiler.stop()
+            path = os.path.join(self.save_path, 'train.sampling.txt')
+            self._profiler.dump(path)
+            logger.info('Saved stack samples: %s\n%s' % (path, '\n'.join(
+                ['%8d %s' % (count, name) for name, count in self._profiler.top()])))
+        elif self.mode == 'cprofile':
+            self._profiler.disable()
+            self._profiler.dump_stats(os.path.join(self.save_path, 'train.profile'))
+        elif self.mode == 'torch':
+            self._profiler.stop()
+        self._profiler = None
@@ -6,12 +6,18 @@
 
 """Reporter during training."""
 
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+import functools
 from tensorboardX import SummaryWriter
 import os
 import numpy as np
 from matplotlib import pyplot as plt
 import logging
 import matplotlib
+import multiprocessing as mp
+import time
+import torch
 matplotlib.use('Agg')
 
 plt.style.use('ggplot')
@@ -23,19 +29,53 @@ green = '#82b74b'
 logger = logging.getLogger(__name__)
 
 
+def _timed(fn):
+    """Accumulate time spent in `fn` to `Reporter.overhead`."""
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        start_time = time.time()
+        try:
+            return fn(self, *args, **kwargs)
+        finally:
+            self.overhead += time.time() - start_time
+    return wrapper
+
+
 class Reporter(object):
     """"Report loss, accuracy etc. during training.
 
+    Scalars for tensorboard are buffered and written every `flush_steps` steps
+    on a background thread. Tensor values (e.g., gradient norm) are copied to
+    preallocated tensors on the same device, so that they are transferred to
+    CPU only once per flush. Figures and CSV files are rendered in a background
+    process.
+
     Args:
         save_path (str):
+        enabled (bool): if False, nothing is written to `save_path`
+            (for processes other than the main process in distributed training)
+        flush_steps (int): write tensorboard scalars every `flush_steps` steps
+        async_plot (bool): render figures and CSV files in a background process
 
     """
 
-    def __init__(self, save_path):
+    def __init__(self, save_path, enabled=True, flush_steps=100, async_plot=True):
         self.save_path = save_path
+        self.enabled = enabled
+        self.flush_steps = max(1, flush_steps)
+        self.overhead = 0.  # total time [sec] spent in reporting on the training thread
 
         # tensorboard
-        self.tf_writer = SummaryWriter(save_path)
+        self.tf_writer = SummaryWriter(save_path) if enabled else None
+        self._scalars = []  # list of (key, float, step)
+        self._tensor_buffers = {}  # key -> (values (Tensor on device), steps (list))
+        self._tf_executor = ThreadPoolExecutor(max_workers=1) if enabled else None
+
+        # figures and CSV files
+        self._plot_executor = None
+        if enabled and async_plot:
+            self._plot_executor = ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context('spawn'))
+        self._plot_futures = []
 
         # report per step
         self._step = 0
@@ -49,6 +89,7 @@ class Reporter(object):
         self.obsv_eval = []
         self.epochs = []
 
+    @_timed
     def add(self, observation, is_eval=False):
         """Restore values per step.
 
@@ -57,6 +98,8 @@ class Reporter(object):
             is_eval (bool):
 
         """
+        if not self.enabled:
+            return
         for k, v in observation.items():
             if v is None:
                 continue
@@ -78,86 +121,170 @@ class Reporter(object):
                     self.obsv_dev[metric][name] = []
                 self.obsv_dev[metric][name].append(v)
                 logger.info('%s (dev): %.3f' % (k, v))
-                self.add_tensorboard_scalar('dev' + '/' + metric + '/' + name, v)
+                self._add_scalar('dev' + '/' + metric + '/' + name, v)
             else:
                 if name not in self.obsv_train_local[metric].keys():
                     self.obsv_train_local[metric][name] = []
                 self.obsv_train_local[metric][name].append(v)
-                self.add_tensorboard_scalar('train' + '/' + metric + '/' + name, v)
+                self._add_scalar('train' + '/' + metric + '/' + name, v)
 
+    @_timed
     def add_tensorboard_scalar(self, key, value):
-        """Add scalar value to tensorboard."""
-        self.tf_writer.add_scalar(key, value, self._step)
+        """Add scalar value to tensorboard.
+
+        Args:
+            key (str):
+            value (float or torch.Tensor): tensors are not synchronized until flushed
+
+        """
+        if self.enabled:
+            self._add_scalar(key, value)
+
+    def _add_scalar(self, key, value):
+        if not isinstance(value, torch.Tensor):
+            self._scalars.append((key, float(value), self._step))
+            return
+        if key not in self._tensor_buffers:
+            self._tensor_buffers[key] = (torch.zeros(self.flush_steps, dtype=torch.float32,
+                                                     device=value.device), [])
+        values, steps = self._tensor_buffers[key]
+        if len(steps) == self.flush_steps:
+            self.flush()
+        values[len(steps)] = value.detach()
+        steps.append(self._step)
 
+    @_timed
     def add_tensorboard_histogram(self, key, value):
         """Add histogram value to tensorboard."""
-        self.tf_writer.add_histogram(key, value, self._step)
+        if self.enabled:
+            if isinstance(value, torch.Tensor):
+                value = value.detach().cpu()
+            self._tf_executor.submit(self.tf_writer.add_histogram, key, value, self._step)
+
+    def flush(self):
+        """Write buffered scalars to tensorboard on the background thread."""
+        if not self.enabled:
+            return
+        scalars, self._scalars = self._scalars, []
+        for key, (values, steps) in self._tensor_buffers.items():
+            if len(steps) > 0:
+                # NOTE: synchronize with the device only here
+                scalars += [(key, v, step) for v, step in zip(values[:len(steps)].tolist(), steps)]
+                del steps[:]
+        if len(scalars) > 0:
+            self._tf_executor.submit(_write_scalars, self.tf_writer, scalars)
 
+    @_timed
     def step(self, is_eval=False):
         self._step += 1
+        if self._step % self.flush_steps == 0:
+            self.flush()
         if is_eval:
             self.steps.append(self._step)
 
             # reset
             self.obsv_train_local = {'loss': {}, 'acc': {}, 'ppl': {}}
 
+    @_timed
     def epoch(self, metric=None, name='wer'):
         self._epoch += 1
-        if metric is None:
+        if metric is None or not self.enabled:
             return
         self.epochs.append(self._epoch)
 
         # register
         self.obsv_eval.append(metric)
+        self._plot(_plot_epoch, self.save_path, list(self.epochs), list(self.obsv_eval), name)
+
+    @_timed
+    def snapshot(self):
+        if not self.enabled:
+            return
+        self._plot(_plot_snapshot, self.save_path, list(self.steps),
+                   {metric: {k: list(v) for k, v in obsv.items()} for metric, obsv in self.obsv_train.items()},
+                   {metric: {k: list(v) for k, v in obsv.items()} for metric, obsv in self.obsv_dev.items()})
 
+    def _plot(self, fn, *args):
+        if self._plot_executor is None:
+            fn(*args)
+            return
+        # check errors in finished jobs
+        for future in [f for f in self._plot_futures if f.done()]:
+            self._plot_futures.remove(future)
+            if future.exception() is not None:
+                logger.warning('Failed to plot: %s' % future.exception())
+        self._plot_futures.append(self._plot_executor.submit(fn, *args))
+
+    def close(self):
+        if not self.enabled:
+            return
+        self.flush()
+        if self._plot_executor is not None:
+            self._plot_executor.shutdown(wait=True)
+            for future in self._plot_futures:
+                if future.exception() is not None:
+                    logger.warning('Failed to plot: %s' % future.exception())
+        self._tf_executor.shutdown(wait=True)
+        self.tf_writer.close()
+        logger.info('Reporting overhead: %.3f ms/step (total: %.2f sec)' %
+                    (self.overhead / max(1, self._step) * 1000, self.overhead))
+
+
+def _write_scalars(tf_writer, scalars):
+    for key, value, step in scalars:
+        tf_writer.add_scalar(key, value, step)
+
+
+def _plot_epoch(save_path, epochs, obsv_eval, name):
+    plt.clf()
+    upper = 0.1
+    plt.plot(epochs, obsv_eval, orange,
+             label='dev', linestyle='-')
+    plt.xlabel('epoch', fontsize=12)
+    plt.ylabel(name, fontsize=12)
+    if max(obsv_eval) > 1:
+        upper = min(100, max(obsv_eval) + 1)
+    else:
+        upper = min(upper, max(obsv_eval))
+    plt.ylim([0, upper])
+    plt.legend(loc="upper right", fontsize=12)
+    if os.path.isfile(os.path.join(save_path, name + ".png")):
+        os.remove(os.path.join(save_path, name + ".png"))
+    plt.savefig(os.path.join(save_path, name + ".png"))
+
+
+def _plot_snapshot(save_path, steps, obsv_train, obsv_dev):
+    # linestyles = ['solid', 'dashed', 'dotted', 'dashdotdotted']
+    linestyles = ['-', '--', '-.', ':', ':', ':', ':', ':', ':', ':', ':', ':']
+    for metric in obsv_train.keys():
         plt.clf()
         upper = 0.1
-        plt.plot(self.epochs, self.obsv_eval, orange,
-                 label='dev', linestyle='-')
-        plt.xlabel('epoch', fontsize=12)
-        plt.ylabel(name, fontsize=12)
-        if max(self.obsv_eval) > 1:
-            upper = min(100, max(self.obsv_eval) + 1)
-        else:
-            upper = min(upper, max(self.obsv_eval))
+        for i, (k, v) in enumerate(sorted(obsv_train[metric].items())):
+            # skip non-observed values
+            if np.mean(obsv_train[metric][k]) == 0:
+                continue
+
+            plt.plot(steps, obsv_train[metric][k], blue,
+                     label=k + " (train)", linestyle=linestyles[i])
+            plt.plot(steps, obsv_dev[metric][k], orange,
+                     label=k + " (dev)", linestyle=linestyles[i])
+            upper = max(upper, max(obsv_train[metric][k]))
+            upper = max(upper, max(obsv_dev[metric][k]))
+
+            # Save as csv file
+            if os.path.isfile(os.path.join(save_path, metric + '-' + k + ".csv")):
+                os.remove(os.path.join(save_path, metric + '-' + k + ".csv"))
+            loss_graph = np.column_stack(
+                (steps, obsv_train[metric][k], obsv_dev[metric][k]))
+            np.savetxt(os.path.join(save_path, metric + '-' + k + ".csv"), loss_graph, delimiter=",")
+
+        if upper > 1:
+            upper = min(upper + 10, 300)  # for CE, CTC loss
+
+        plt.xlabel('step', fontsize=12)
+        plt.ylabel(metric, fontsize=12)
         plt.ylim([0, upper])
         plt.legend(loc="upper right", fontsize=12)
-        if os.path.isfile(os.path.join(self.save_path, name + ".png")):
-            os.remove(os.path.join(self.save_path, name + ".png"))
-        plt.savefig(os.path.join(self.save_path, name + ".png"))
-
-    def snapshot(self):
-        # linestyles = ['solid', 'dashed', 'dotted', 'dashdotdotted']
-        linestyles = ['-', '--', '-.', ':', ':', ':', ':', ':', ':', ':', ':', ':']
-        for metric in self.obsv_train.keys():
-            plt.clf()
-            upper = 0.1
-            for i, (k, v) in enumerate(sorted(self.obsv_train[metric].items())):
-                # skip non-observed values
-                if np.mean(self.obsv_train[metric][k]) == 0:
-                    continue
-
-                plt.plot(self.steps, self.obsv_train[metric][k], blue,
-                         label=k + " (train)", linestyle=linestyles[i])
-                plt.plot(self.steps, self.obsv_dev[metric][k], orange,
-                         label=k + " (dev)", linestyle=linestyles[i])
-                upper = max(upper, max(self.obsv_train[metric][k]))
-                upper = max(upper, max(self.obsv_dev[metric][k]))
-
-                # Save as csv file
-                if os.path.isfile(os.path.join(self.save_path, metric + '-' + k + ".csv")):
-                    os.remove(os.path.join(self.save_path, metric + '-' + k + ".csv"))
-                loss_graph = np.column_stack(
-                    (self.steps, self.obsv_train[metric][k], self.obsv_dev[metric][k]))
-                np.savetxt(os.path.join(self.save_path, metric + '-' + k + ".csv"), loss_graph, delimiter=",")
-
-            if upper > 1:
-                upper = min(upper + 10, 300)  # for CE, CTC loss
-
-            plt.xlabel('step', fontsize=12)
-            plt.ylabel(metric, fontsize=12)
-            plt.ylim([0, upper])
-            plt.legend(loc="upper right", fontsize=12)
-            if os.path.isfile(os.path.join(self.save_path, metric + ".png")):
-                os.remove(os.path.join(self.save_path, metric + ".png"))
-            plt.savefig(os.path.join(self.save_path, metric + ".png"))
+        if os.path.isfile(os.path.join(save_path, metric + ".png")):
+            os.remove(os.path.join(save_path, metric + ".png"))
+        plt.savefig(os.path.join(save_path, metric + ".png"))
@@ -0,0 +1,92 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark time and peak memory of checkpoint averaging.
+
+"full" loads every checkpoint with torch.load and accumulates the whole
+state dicts (the previous implementation), and "stream" is
+bin/eval_utils.average_model_states. Each method is measured in a separate
+process; peak memory is the increase of the max RSS during averaging.
+Checkpoint files are memory-mapped in "stream", and the mapped pages, which
+are reclaimable page cache, are included in RSS. Use --sharded to measure
+the layout read one tensor at a time.
+
+Usage:
+    python test/benchmarks/bench_average_checkpoints.py --n_params 50 --n_average 5
+"""
+
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import torch
+
+from neural_sp.bin.eval_utils import average_model_states
+from neural_sp.trainers.checkpoint import save_checkpoint_file
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--n_params', type=int, default=50, help='number of parameters [M]')
+parser.add_argument('--n_tensors', type=int, default=100)
+parser.add_argument('--n_average', type=int, default=5)
+parser.add_argument('--sharded', action='store_true')
+parser.add_argument('--worker', type=str, default='', help='(internal) measure a single method')
+parser.add_argument('--save_dir', type=str, default='', help='(internal)')
+args = parser.parse_args()
+
+
+def max_rss():
+    """Max RSS [MB]."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def average_full(checkpoint_paths, checkpoint_avg_path):
+    state_dict_avg = None
+    for path in checkpoint_paths:
+        state_dict = torch.load(path, map_location='cpu')['model_state_dict']
+        if state_dict_avg is None:
+            state_dict_avg = state_dict
+            continue
+        for k, v in state_dict.items():
+            state_dict_avg[k] += v
+    for k in state_dict_avg.keys():
+        state_dict_avg[k] /= len(checkpoint_paths)
+    torch.save({'model_state_dict': state_dict_avg}, checkpoint_avg_path)
+
+
+def measure(method, save_dir):
+    checkpoint_paths = [os.path.join(save_dir, 'model.epoch-%d' % (ep + 1)) for ep in range(args.n_average)]
+    rss = max_rss()
+    start = time.time()
+    if method == 'full':
+        average_full(checkpoint_paths, os.path.join(save_dir, 'model-avg-full'))
+    else:
+        average_model_states(checkpoint_paths, os.path.join(save_dir, 'model-avg-stream'))
+    print('%s: %.3f sec, peak memory +%.1f MB' % (method, time.time() - start, max_rss() - rss))
+
+
+def main():
+    if args.worker:
+        measure(args.worker, args.save_dir)
+        return
+
+    save_dir = tempfile.mkdtemp()
+    size = args.n_params * 1000000 // args.n_tensors
+    for ep in range(args.n_average):
+        state_dict = {'layer%d.weight' % i: torch.randn(size) for i in range(args.n_tensors)}
+        save_checkpoint_file({'model_state_dict': state_dict},
+                             os.path.join(save_dir, 'model.epoch-%d' % (ep + 1)), sharded=args.sharded)
+    del state_dict
+    print('%d checkpoints x %.1f MB' % (args.n_average, args.n_params * 4))
+    methods = ['stream'] if args.sharded else ['full', 'stream']
+    for method in methods:
+        subprocess.run([sys.executable, __file__, '--worker', method, '--save_dir', save_dir,
+                        '--n_average', str(args.n_average)], check=True)
+    shutil.rmtree(save_dir)
+
+
+if __name__ == '__main__':
+    main()
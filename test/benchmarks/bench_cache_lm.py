@@ -0,0 +1,118 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark perplexity evaluation of RNNLM with the neural cache.
+
+"token" feeds the corpus token by token to a cache over Python lists (the
+previous implementation, batch size 1), and "segment" scores BPTT segments
+with the ring-buffer cache in evaluators/ppl.eval_ppl
+(--batch_size 1 and --batch_size streams).
+
+Usage:
+    python test/benchmarks/bench_cache_lm.py --n_tokens 5000 --n_caches 500 --batch_size 32
+"""
+
+import argparse
+import logging
+import numpy as np
+import os
+import shutil
+import tempfile
+import time
+import torch
+
+from neural_sp.datasets.lm import Dataset
+from neural_sp.evaluators.ppl import eval_ppl
+from neural_sp.models.lm.rnnlm import RNNLM
+from neural_sp.models.torch_utils import np2tensor
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--n_tokens', type=int, default=5000)
+parser.add_argument('--vocab', type=int, default=1000)
+parser.add_argument('--bptt', type=int, default=100)
+parser.add_argument('--batch_size', type=int, default=32)
+parser.add_argument('--n_caches', type=int, default=500)
+parser.add_argument('--n_units', type=int, default=256)
+parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+args = parser.parse_args()
+
+
+def make_dataset(save_dir):
+    rng = np.random.RandomState(0)
+    dict_path = os.path.join(save_dir, 'dict.txt')
+    with open(dict_path, 'w') as f:
+        f.write('<unk> 1\n<eos> 2\n<pad> 3\n')
+        for i in range(4, args.vocab):
+            f.write('w%d %d\n' % (i, i))
+    tsv_path = os.path.join(save_dir, 'eval.tsv')
+    n_tokens = 0
+    with open(tsv_path, 'w') as f:
+        f.write('utt_id\tspeaker\tfeat_path\txlen\txdim\ttext\ttoken_id\tylen\tydim\n')
+        while n_tokens < args.n_tokens:
+            ids = rng.randint(4, args.vocab, size=rng.randint(5, 30))
+            f.write('utt%07d\tspk\tdummy\t0\t0\t%s\t%s\t%d\t%d\n' % (
+                n_tokens, ' '.join(['w%d' % t for t in ids]), ' '.join(map(str, ids)), len(ids), args.vocab))
+            n_tokens += len(ids) + 1
+    return Dataset(tsv_path=tsv_path, dict_path=dict_path, unit='word',
+                   batch_size=1, bptt=args.bptt, is_test=True)
+
+
+def build_model():
+    conf = argparse.Namespace(
+        lm_type='lstm', n_units=args.n_units, n_projs=0, n_layers=2, residual=False,
+        use_glu=False, n_units_null_context=0, bottleneck_dim=args.n_units, emb_dim=args.n_units,
+        vocab=args.vocab, dropout_in=0.1, dropout_hidden=0.1, lsm_prob=0.0,
+        param_init=0.1, adaptive_softmax=False, tie_embedding=False)
+    return RNNLM(conf).to(args.device)
+
+
+def eval_ppl_per_token(model, dataset):
+    """Token-by-token evaluation with a cache over Python lists."""
+    stream = dataset.concat_ids.reshape((-1,))
+    cache_keys, cache_ids = [], []
+    total_loss = 0.
+    state = None
+    model.eval()
+    with torch.no_grad():
+        for t in range(len(stream) - 1):
+            ys = np2tensor(stream[t:t + 2], args.device).unsqueeze(0)
+            logits, out, state = model.decode(ys[:, :1], state=state)
+            probs = torch.softmax(logits, dim=-1)
+            if len(cache_ids) > 0:
+                cache_keys = cache_keys[-args.n_caches:]
+                cache_ids = cache_ids[-args.n_caches:]
+                cache_attn = torch.softmax(model.cache_theta * torch.matmul(
+                    torch.cat(cache_keys, dim=1), out.transpose(2, 1)).squeeze(2), dim=1)
+                cache_probs = probs.new_zeros(probs.size())
+                for offset, idx in enumerate(cache_ids):
+                    cache_probs[:, :, idx] += cache_attn[:, offset]
+                probs = (1 - model.cache_lambda) * probs + model.cache_lambda * cache_probs
+            total_loss -= torch.log(probs[0, 0, ys[0, 1]]).item()
+            cache_ids += [ys[0, 1].item()]
+            cache_keys += [out]
+    return np.exp(total_loss / (len(stream) - 1))
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    save_dir = tempfile.mkdtemp()
+    dataset = make_dataset(save_dir)
+    model = build_model()
+
+    start = time.time()
+    ppl = eval_ppl_per_token(model, dataset)
+    elapsed = time.time() - start
+    print('token: PPL %.3f, %.2f sec (%.0f tokens/sec)' % (ppl, elapsed, len(dataset) / elapsed))
+
+    for batch_size in [1, args.batch_size]:
+        start = time.time()
+        ppl, _ = eval_ppl([model], dataset, batch_size=batch_size, bptt=args.bptt,
+                          n_caches=args.n_caches)
+        elapsed = time.time() - start
+        print('segment (batch size %d): PPL %.3f, %.2f sec (%.0f tokens/sec)' % (
+            batch_size, ppl, elapsed, len(dataset) / elapsed))
+    shutil.rmtree(save_dir)
+
+
+if __name__ == '__main__':
+    main()
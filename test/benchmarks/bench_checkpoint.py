@@ -0,0 +1,53 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark time the training loop is blocked on saving checkpoints.
+
+Usage:
+    python test/benchmarks/bench_checkpoint.py --n_params 50 --n_saves 3
+"""
+
+import argparse
+import shutil
+import tempfile
+import time
+import torch
+
+from neural_sp.trainers.checkpoint import CheckpointManager
+from neural_sp.trainers.checkpoint import iterate_model_state
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--n_params', type=int, default=50, help='number of parameters [M]')
+parser.add_argument('--n_tensors', type=int, default=100)
+parser.add_argument('--n_saves', type=int, default=3)
+parser.add_argument('--train_time', type=float, default=1.0,
+                    help='time [sec] of training steps between checkpoints')
+args = parser.parse_args()
+
+
+def main():
+    size = args.n_params * 1000000 // args.n_tensors
+    state_dict = {'layer%d.weight' % i: torch.randn(size) for i in range(args.n_tensors)}
+
+    for async_save, sharded in [(False, False), (True, False), (True, True)]:
+        save_dir = tempfile.mkdtemp()
+        manager = CheckpointManager(async_save=async_save, sharded=sharded)
+        start = time.time()
+        for ep in range(args.n_saves):
+            manager.save({'model_state_dict': state_dict}, '%s/model.epoch-%d' % (save_dir, ep + 1),
+                         keep_epochs=[ep + 1])
+            time.sleep(args.train_time)  # training steps
+        manager.wait()
+        elapsed = time.time() - start - args.train_time * args.n_saves
+
+        start = time.time()
+        for _ in iterate_model_state('%s/model.epoch-%d' % (save_dir, args.n_saves)):
+            pass
+        load_time = time.time() - start
+        shutil.rmtree(save_dir)
+        print('async=%d sharded=%d: blocked %.3f sec/save, overhead %.3f sec/save, load %.3f sec' %
+              (async_save, sharded, manager.blocked_time / args.n_saves, elapsed / args.n_saves, load_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark WER/CER scoring of a decoded evaluation set.
+
+"loop" scores each utterance with the Python DP of the previous
+implementation, "single" calls evaluators/edit_distance.compute_wer per
+utterance, and "batch" scores a batch of utterances at once with
+compute_wer_batch as the evaluators do.
+
+Usage:
+    python test/benchmarks/bench_edit_distance.py --n_utts 2000 --unit char
+"""
+
+import argparse
+import numpy as np
+import time
+
+from neural_sp.evaluators.edit_distance import compute_wer
+from neural_sp.evaluators.edit_distance import compute_wer_batch
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--n_utts', type=int, default=2000)
+parser.add_argument('--batch_size', type=int, default=100)
+parser.add_argument('--unit', type=str, default='char', choices=['word', 'char'])
+parser.add_argument('--error_rate', type=float, default=0.1)
+args = parser.parse_args()
+
+
+def compute_wer_loop(ref, hyp):
+    d = np.zeros((len(ref) + 1) * (len(hyp) + 1), dtype=np.uint16)
+    d = d.reshape((len(ref) + 1, len(hyp) + 1))
+    for i in range(len(ref) + 1):
+        for j in range(len(hyp) + 1):
+            if i == 0:
+                d[0][j] = j
+            elif j == 0:
+                d[i][0] = i
+    for i in range(1, len(ref) + 1):
+        for j in range(1, len(hyp) + 1):
+            if ref[i - 1] == hyp[j - 1]:
+                d[i][j] = d[i - 1][j - 1]
+            else:
+                d[i][j] = min(d[i - 1][j - 1], d[i][j - 1], d[i - 1][j]) + 1
+    return d[len(ref)][len(hyp)]
+
+
+def make_data(rng):
+    max_len = 20 if args.unit == 'word' else 100
+    refs, hyps = [], []
+    for _ in range(args.n_utts):
+        ref = list(rng.randint(0, 1000 if args.unit == 'word' else 50, size=rng.randint(1, max_len)))
+        hyp = [t if rng.rand() > args.error_rate else -1 for t in ref]
+        refs.append(ref)
+        hyps.append(hyp)
+    return refs, hyps
+
+
+def main():
+    refs, hyps = make_data(np.random.RandomState(0))
+    n_tokens = sum(len(ref) for ref in refs)
+
+    start = time.time()
+    errors_loop = sum(compute_wer_loop(ref, hyp) for ref, hyp in zip(refs, hyps))
+    print('loop  : %.3f sec' % (time.time() - start))
+
+    start = time.time()
+    errors_single = sum(compute_wer(ref, hyp)[0] for ref, hyp in zip(refs, hyps)) // 100
+    print('single: %.3f sec' % (time.time() - start))
+
+    start = time.time()
+    errors_batch = 0
+    for i in range(0, len(refs), args.batch_size):
+        errors_batch += compute_wer_batch(refs[i:i + args.batch_size], hyps[i:i + args.batch_size])[0].sum() // 100
+    print('batch : %.3f sec' % (time.time() - start))
+
+    assert errors_loop == errors_single == errors_batch
+    print('error rate: %.2f %% (%d tokens)' % (errors_batch / n_tokens * 100, n_tokens))
+
+
+if __name__ == '__main__':
+    main()
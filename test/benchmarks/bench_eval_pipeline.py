@@ -0,0 +1,99 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark the evaluation loop with and without pipelining.
+
+Decoding is emulated by matrix multiplications in torch (which release the
+GIL as real decoding does), and post-processing detokenizes hypotheses,
+computes WER and CER and writes trn files. "sequential" runs everything on
+the calling thread (n_prefetch=0) and "pipeline" overlaps loading and
+post-processing with decoding.
+
+Usage:
+    python test/benchmarks/bench_eval_pipeline.py --n_utts 2000 --batch_size 50
+"""
+
+import argparse
+import numpy as np
+import os
+import shutil
+import tempfile
+import time
+import torch
+
+from neural_sp.evaluators.pipeline import EvalPipeline
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--n_utts', type=int, default=2000)
+parser.add_argument('--batch_size', type=int, default=50)
+parser.add_argument('--decode_size', type=int, default=512, help='size of matrices in emulated decoding')
+parser.add_argument('--load_time', type=float, default=0.005, help='time to load a mini-batch [sec]')
+args = parser.parse_args()
+
+VOCAB = [chr(ord('a') + i % 26) * (1 + i // 26 % 6) for i in range(1000)]
+
+
+def idx2token(ids):
+    return ' '.join([VOCAB[i] for i in ids])
+
+
+class DataLoader(object):
+
+    def __init__(self):
+        rng = np.random.RandomState(0)
+        self.refs = [rng.randint(0, len(VOCAB), size=rng.randint(5, 30)) for _ in range(args.n_utts)]
+        self.offset = 0
+
+    def __len__(self):
+        return len(self.refs)
+
+    def reset(self, batch_size=None):
+        self.offset = 0
+
+    def next(self, batch_size):
+        time.sleep(args.load_time)
+        refs = self.refs[self.offset:self.offset + batch_size]
+        offset = self.offset
+        self.offset += batch_size
+        batch = {'ys': refs, 'text': [idx2token(ref) for ref in refs],
+                 'utt_ids': ['utt%05d' % (offset + i) for i in range(len(refs))],
+                 'speakers': ['spk'] * len(refs)}
+        return batch, self.offset >= len(self.refs)
+
+
+def decode(refs, x):
+    for _ in range(5):
+        x = torch.tanh(x @ x)
+    return [np.where(np.arange(len(ref)) % 10 == 0, 0, ref) for ref in refs]
+
+
+def measure(n_prefetch):
+    save_dir = tempfile.mkdtemp()
+    dataloader = DataLoader()
+    x = torch.randn(args.decode_size, args.decode_size) / args.decode_size ** 0.5
+
+    def postprocess(batch, hyps_id):
+        refs = batch['text']
+        hyps = [idx2token(hyp) for hyp in hyps_id]
+        pipeline.wer.add([ref.split(' ') for ref in refs], [hyp.split(' ') for hyp in hyps])
+        pipeline.cer.add([list(ref) for ref in refs], [list(hyp) for hyp in hyps])
+        return refs, hyps
+
+    start = time.time()
+    with EvalPipeline(dataloader, args.batch_size, os.path.join(save_dir, 'ref.trn'),
+                      os.path.join(save_dir, 'hyp.trn'), n_prefetch=n_prefetch) as pipeline:
+        for batch in pipeline:
+            pipeline.submit(postprocess, batch, decode(batch['ys'], x))
+    elapsed = time.time() - start
+    shutil.rmtree(save_dir)
+    return elapsed, pipeline.wer.rates()[0], pipeline.cer.rates()[0]
+
+
+def main():
+    for name, n_prefetch in [('sequential', 0), ('pipeline', 1)]:
+        elapsed, wer, cer = measure(n_prefetch)
+        print('%-10s: %.3f sec (WER: %.2f %%, CER: %.2f %%)' % (name, elapsed, wer, cer))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark per-batch time of frame stacking and splicing.
+
+Usage:
+    python test/benchmarks/bench_frontend.py --n_stacks 3 --n_skips 3 --n_splices 5
+"""
+
+import argparse
+import importlib
+import os
+import sys
+import time
+import numpy as np
+import torch
+
+from neural_sp.models.torch_utils import np2tensor
+from neural_sp.models.torch_utils import pad_list
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'frontends'))
+from test_frame_stacking import _stack_frame_ref  # noqa
+from test_splicing import _splice_ref  # noqa
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--batch_size', type=int, default=32)
+parser.add_argument('--xmax', type=int, default=1000)
+parser.add_argument('--input_dim', type=int, default=120)
+parser.add_argument('--n_stacks', type=int, default=3)
+parser.add_argument('--n_skips', type=int, default=3)
+parser.add_argument('--n_splices', type=int, default=5)
+parser.add_argument('--n_steps', type=int, default=5)
+parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+args = parser.parse_args()
+
+
+def per_utterance(xs, stack_fn, splice_fn):
+    xs = [stack_fn(x, args.n_stacks, args.n_skips) for x in xs]
+    xs = [splice_fn(x, args.n_splices, args.n_stacks) for x in xs]
+    return pad_list([np2tensor(x, args.device).float() for x in xs], 0.)
+
+
+def batched(xs, fs, sp):
+    xlens = torch.IntTensor([len(x) for x in xs])
+    xs = pad_list([np2tensor(x, args.device).float() for x in xs], 0.)
+    xs, xlens = fs.stack_frame_batch(xs, xlens, args.n_stacks, args.n_skips)
+    return sp.splice_batch(xs, xlens, args.n_splices, args.n_stacks)
+
+
+def measure(fn):
+    fn()  # warm up
+    start = time.time()
+    for _ in range(args.n_steps):
+        out = fn()
+        if out.is_cuda:
+            torch.cuda.synchronize()
+    return (time.time() - start) / args.n_steps
+
+
+def main():
+    fs = importlib.import_module('neural_sp.models.seq2seq.frontends.frame_stacking')
+    sp = importlib.import_module('neural_sp.models.seq2seq.frontends.splicing')
+    xlens = np.random.randint(args.xmax // 2, args.xmax + 1, args.batch_size)
+    xs = [np.random.randn(xlen, args.input_dim).astype(np.float32) for xlen in xlens]
+
+    ref_time = measure(lambda: per_utterance(xs, _stack_frame_ref, _splice_ref))
+    np_time = measure(lambda: per_utterance(xs, fs.stack_frame, sp.splice))
+    batch_time = measure(lambda: batched(xs, fs, sp))
+    print('reference (loop)    : %.2f ms/batch' % (ref_time * 1000))
+    print('strided (NumPy)     : %.2f ms/batch (%.1fx)' % (np_time * 1000, ref_time / np_time))
+    print('unfold (batch, %s): %.2f ms/batch (%.1fx)' % (args.device, batch_time * 1000, ref_time / batch_time))
+
+
+if __name__ == '__main__':
+    main()
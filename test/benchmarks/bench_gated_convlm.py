@@ -0,0 +1,62 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark incremental decoding of GatedConvLM used for shallow fusion.
+
+"full" reruns all blocks over the whole prefix of every hypothesis at each
+step, and "incremental" computes only the newest step from the receptive
+field buffers of each block.
+
+Usage:
+    python test/benchmarks/bench_gated_convlm.py --lm_type gated_conv_8 --ylen 100 --beam_width 10
+"""
+
+import argparse
+import time
+import torch
+
+from neural_sp.models.lm.gated_convlm import GatedConvLM
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--lm_type', type=str, default='gated_conv_custom')
+parser.add_argument('--n_units', type=int, default=512)
+parser.add_argument('--n_layers', type=int, default=8)
+parser.add_argument('--kernel_size', type=int, default=4)
+parser.add_argument('--vocab', type=int, default=1000)
+parser.add_argument('--ylen', type=int, default=100)
+parser.add_argument('--beam_width', type=int, default=10)
+parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+args = parser.parse_args()
+
+
+def build_model():
+    conf = argparse.Namespace(
+        lm_type=args.lm_type, n_units=args.n_units, n_projs=0, n_layers=args.n_layers,
+        kernel_size=args.kernel_size, emb_dim=args.n_units, vocab=args.vocab,
+        dropout_in=0.1, dropout_hidden=0.1, lsm_prob=0.0, param_init=0.1,
+        adaptive_softmax=False, tie_embedding=False)
+    return GatedConvLM(conf).to(args.device).eval()
+
+
+def main():
+    model = build_model()
+    ys = torch.randint(0, args.vocab, (args.beam_width, args.ylen), device=args.device)
+    with torch.no_grad():
+        start = time.time()
+        for t in range(args.ylen):
+            _, _, log_probs_full = model.predict(ys[:, :t + 1])
+        elapsed_full = time.time() - start
+
+        start = time.time()
+        state = None
+        for t in range(args.ylen):
+            _, state, log_probs = model.predict(ys[:, t:t + 1], state)
+        elapsed_inc = time.time() - start
+
+    diff = (log_probs[:, -1] - log_probs_full[:, -1]).abs().max().item()
+    print('full: %.2f ms/step' % (elapsed_full / args.ylen * 1000))
+    print('incremental: %.2f ms/step (max diff %.2e)' % (elapsed_inc / args.ylen * 1000, diff))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark training throughput of the latency-controlled BLSTM encoder.
+
+Usage:
+    python test/benchmarks/bench_lc_blstm.py --xmax 1600 --chunk_size_left 40 --chunk_size_right 20
+"""
+
+import argparse
+import importlib
+import os
+import sys
+import time
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'encoders'))
+from test_rnn_encoder import _forward_latency_controlled_ref  # noqa
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--enc_type', type=str, default='blstm')
+parser.add_argument('--n_units', type=int, default=320)
+parser.add_argument('--n_layers', type=int, default=5)
+parser.add_argument('--batch_size', type=int, default=16)
+parser.add_argument('--xmax', type=int, default=1600)
+parser.add_argument('--chunk_size_left', type=str, default="40")
+parser.add_argument('--chunk_size_right', type=str, default="20")
+parser.add_argument('--n_steps', type=int, default=5)
+parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+args = parser.parse_args()
+
+
+def make_args():
+    return dict(
+        input_dim=80,
+        enc_type=args.enc_type,
+        n_units=args.n_units,
+        n_projs=0,
+        last_proj_dim=0,
+        n_layers=args.n_layers,
+        n_layers_sub1=0,
+        n_layers_sub2=0,
+        dropout_in=0.1,
+        dropout=0.1,
+        subsample='_'.join(['1'] * args.n_layers),
+        subsample_type='drop',
+        n_stacks=1,
+        n_splices=1,
+        conv_in_channel=1,
+        conv_channels='',
+        conv_kernel_sizes='',
+        conv_strides='',
+        conv_poolings='',
+        conv_batch_norm=False,
+        conv_layer_norm=False,
+        conv_bottleneck_dim=0,
+        bidir_sum_fwd_bwd=False,
+        task_specific_layer=False,
+        param_init=0.1,
+        chunk_size_left=args.chunk_size_left,
+        chunk_size_right=args.chunk_size_right,
+    )
+
+
+def step(enc, fn, xs, xlens):
+    enc.reset_cache()
+    xs_out = fn(xs, xlens)
+    xs_out.sum().backward()
+    if xs.is_cuda:
+        torch.cuda.synchronize()
+
+
+def measure(enc, fn, xs, xlens):
+    step(enc, fn, xs, xlens)  # warm up
+    start = time.time()
+    for _ in range(args.n_steps):
+        step(enc, fn, xs, xlens)
+    return (time.time() - start) / args.n_steps
+
+
+def main():
+    module = importlib.import_module('neural_sp.models.seq2seq.encoders.rnn')
+    enc = module.RNNEncoder(**make_args()).to(args.device)
+    N_l, N_r = enc.chunk_size_left, enc.chunk_size_right
+    xs = torch.randn(args.batch_size, args.xmax, 80, device=args.device)
+    xlens = torch.IntTensor([args.xmax] * args.batch_size)
+
+    t_ref = measure(enc, lambda xs, xlens: _forward_latency_controlled_ref(
+        enc, xs, xlens, N_l, N_r, False)[0], xs, xlens)
+    t_new = measure(enc, lambda xs, xlens: enc._forward_latency_contolled(
+        xs, xlens, N_l, N_r, False)[0], xs, xlens)
+    n_frames = args.batch_size * args.xmax
+    print('chunk-by-chunk: %.3f [sec/step] (%.1f frames/sec)' % (t_ref, n_frames / t_ref))
+    print('batched chunks: %.3f [sec/step] (%.1f frames/sec)' % (t_new, n_frames / t_new))
+    print('speedup: %.2fx' % (t_ref / t_new))
+
+
+if __name__ == '__main__':
+    main()
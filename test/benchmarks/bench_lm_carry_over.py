@@ -0,0 +1,90 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark LM state carry-over across utterances in a session.
+
+At the beginning of each utterance, the LM state for the first token is
+prepared by re-encoding all past tokens in the session ("re-encode", the
+previous behaviour of --recog_lm_state_carry_over for TransformerLM) or
+from the states of the last --mem_len past tokens cached in the previous
+utterance ("carry-over", TransformerLM.truncate_state and
+TransformerXL.update_memory_from_cache). The latency per utterance is
+reported for increasing numbers of past tokens in the session.
+
+Usage:
+    python test/benchmarks/bench_lm_carry_over.py --mem_len 100 --d_model 512 --n_layers 6
+"""
+
+import argparse
+import time
+import torch
+
+from neural_sp.models.lm.transformer_xl import TransformerXL
+from neural_sp.models.lm.transformerlm import TransformerLM
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--vocab', type=int, default=10000)
+parser.add_argument('--d_model', type=int, default=512)
+parser.add_argument('--n_layers', type=int, default=6)
+parser.add_argument('--mem_len', type=int, default=100)
+parser.add_argument('--beam_width', type=int, default=10)
+parser.add_argument('--session_lens', type=str, default='100,500,1000,2000')
+parser.add_argument('--n_trials', type=int, default=3)
+args = parser.parse_args()
+
+
+def build(lm_type):
+    conf = argparse.Namespace(
+        lm_type=lm_type, transformer_attn_type='scaled_dot', transformer_n_heads=8,
+        n_layers=args.n_layers, transformer_d_model=args.d_model, transformer_d_ff=args.d_model * 4,
+        transformer_layer_norm_eps=1e-12, transformer_ffn_activation='relu', transformer_pe_type='add',
+        vocab=args.vocab, dropout_in=0.1, dropout_hidden=0.1, dropout_att=0.1, dropout_layer=0.0,
+        lsm_prob=0.0, transformer_param_init='xavier_uniform', bptt=200, mem_len=0,
+        recog_mem_len=args.mem_len, zero_center_offset=False, adaptive_softmax=False, tie_embedding=False)
+    if lm_type == 'transformer_xl':
+        return TransformerXL(conf).eval()
+    return TransformerLM(conf).eval()
+
+
+def measure(fn):
+    elapsed = []
+    for _ in range(args.n_trials):
+        start = time.time()
+        fn()
+        elapsed.append(time.time() - start)
+    return min(elapsed) * 1000
+
+
+def main():
+    torch.manual_seed(0)
+    lm = build('transformer')
+    lm_xl = build('transformer_xl')
+    eos = torch.full((args.beam_width, 1), lm.eos, dtype=torch.int64)
+    print('%8s %14s %14s %17s' % ('#tokens', 're-encode [ms]', 'carry-over [ms]', 'carry-over XL [ms]'))
+    with torch.no_grad():
+        for session_len in map(int, args.session_lens.split(',')):
+            ys = torch.randint(4, args.vocab, (1, session_len + 1))
+            _, cache, _ = lm.predict(ys)
+            ys_prev, cache_prev, pos_offset = lm.truncate_state(ys, cache)
+            _, cache_xl, _ = lm_xl.predict(ys)
+            mems = lm_xl.update_memory_from_cache(None, ys, cache_xl)
+
+            def reencode():
+                _, state, _ = lm.predict(ys[:, :-1])
+                ys_beam = torch.cat([ys[:, :-1].repeat([args.beam_width, 1]), eos], dim=1)
+                lm.predict(ys_beam, cache=[s.repeat([args.beam_width, 1, 1]) for s in state])
+
+            def carry_over():
+                ys_beam = torch.cat([ys_prev.repeat([args.beam_width, 1]), eos], dim=1)
+                lm.predict(ys_beam, cache=[c.repeat([args.beam_width, 1, 1]) for c in cache_prev],
+                           pos_offset=pos_offset)
+
+            def carry_over_xl():
+                lm_xl.predict(eos, mems=mems)
+
+            print('%8d %14.2f %14.2f %17.2f' % (session_len, measure(reencode), measure(carry_over),
+                                                measure(carry_over_xl)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark data loading for LM training.
+
+"tsv" loads the whole tsv file and concatenates the corpus (datasets/lm.Dataset),
+and "shard" streams mini-batches from memory-mapped token shards
+(datasets/lm_shard.ShardedDataset). Both shuffle per epoch. Time to build the
+dataset, time of reshuffling (reset), throughput of reading mini-batches and
+peak memory allocated in each stage are reported. Epochs end within
+--n_steps for small corpora, so reshuffling is included in reading. Timings
+include the overhead of tracemalloc.
+
+Usage:
+    python test/benchmarks/bench_lm_loader.py --n_tokens 2000000 --batch_size 256 --bptt 200
+"""
+
+import argparse
+import logging
+import numpy as np
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from neural_sp.datasets.lm import Dataset
+from neural_sp.datasets.lm_shard import make_shards
+from neural_sp.datasets.lm_shard import ShardedDataset
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--n_tokens', type=int, default=2000000)
+parser.add_argument('--vocab', type=int, default=10000)
+parser.add_argument('--batch_size', type=int, default=256)
+parser.add_argument('--bptt', type=int, default=200)
+parser.add_argument('--n_steps', type=int, default=200)
+parser.add_argument('--shard_size', type=int, default=1000000)
+parser.add_argument('--n_workers', type=int, default=2)
+args = parser.parse_args()
+
+
+def make_corpus(save_dir):
+    rng = np.random.RandomState(0)
+    dict_path = os.path.join(save_dir, 'dict.txt')
+    with open(dict_path, 'w') as f:
+        f.write('<unk> 1\n<eos> 2\n<pad> 3\n')
+        for i in range(4, args.vocab):
+            f.write('w%d %d\n' % (i, i))
+    tsv_path = os.path.join(save_dir, 'train.tsv')
+    n_tokens = 0
+    with open(tsv_path, 'w') as f:
+        f.write('utt_id\tspeaker\tfeat_path\txlen\txdim\ttext\ttoken_id\tylen\tydim\n')
+        while n_tokens < args.n_tokens:
+            ids = rng.randint(4, args.vocab, size=rng.randint(5, 30))
+            f.write('utt%09d\tspk\tdummy\t0\t0\tdummy\t%s\t%d\t%d\n' % (
+                n_tokens, ' '.join(map(str, ids)), len(ids), args.vocab))
+            n_tokens += len(ids) + 1
+    return tsv_path, dict_path
+
+
+def measure(name, fn):
+    tracemalloc.start()
+    start = time.time()
+    out = fn()
+    elapsed = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print('%-28s: %8.3f sec, peak %8.1f MB' % (name, elapsed, peak / 1024 ** 2))
+    return out
+
+
+def read(dataset):
+    for _ in range(args.n_steps):
+        dataset.next()
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    save_dir = tempfile.mkdtemp()
+    tsv_path, dict_path = make_corpus(save_dir)
+    shard_dir = os.path.join(save_dir, 'shards')
+    measure('shard: make_shards (offline)', lambda: make_shards(
+        tsv_path, dict_path, shard_dir, shard_size=args.shard_size))
+
+    conf = dict(dict_path=dict_path, unit='word', batch_size=args.batch_size,
+                bptt=args.bptt, shuffle=True)
+    dataset = measure('tsv: build', lambda: Dataset(tsv_path=tsv_path, **conf))
+    measure('tsv: reset', dataset.reset)
+    measure('tsv: %d steps' % args.n_steps, lambda: read(dataset))
+
+    dataset = measure('shard: build', lambda: ShardedDataset(shard_dir, **conf))
+    measure('shard: reset', dataset.reset)
+    measure('shard: %d steps' % args.n_steps, lambda: read(dataset))
+    dataset = ShardedDataset(shard_dir, n_workers=args.n_workers, **conf)
+    start = time.time()
+    read(dataset)
+    print('%-28s: %8.3f sec' % ('shard: %d steps (%d workers)' % (args.n_steps, args.n_workers),
+                                time.time() - start))
+    shutil.rmtree(save_dir)
+
+
+if __name__ == '__main__':
+    main()
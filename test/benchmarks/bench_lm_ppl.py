@@ -0,0 +1,89 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark perplexity evaluation of Transformer LMs.
+
+"single" walks the corpus as a single stream (--batch_size 1, the previous
+setting) and "batch" scores --batch_size segments (TransformerXL) or
+windows (TransformerLM) at once with evaluators/ppl.eval_ppl.
+
+Usage:
+    python test/benchmarks/bench_lm_ppl.py --n_tokens 50000 --bptt 200 --batch_size 32
+"""
+
+import argparse
+import logging
+import numpy as np
+import os
+import shutil
+import tempfile
+import time
+import torch
+
+from neural_sp.datasets.lm import Dataset
+from neural_sp.evaluators.ppl import eval_ppl
+from neural_sp.models.lm.transformer_xl import TransformerXL
+from neural_sp.models.lm.transformerlm import TransformerLM
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--n_tokens', type=int, default=50000)
+parser.add_argument('--vocab', type=int, default=1000)
+parser.add_argument('--bptt', type=int, default=200)
+parser.add_argument('--batch_size', type=int, default=32)
+parser.add_argument('--stride', type=int, default=0, help='stride of the sliding window (TransformerLM)')
+parser.add_argument('--d_model', type=int, default=256)
+parser.add_argument('--n_layers', type=int, default=4)
+parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+args = parser.parse_args()
+
+
+def make_dataset(save_dir):
+    rng = np.random.RandomState(0)
+    dict_path = os.path.join(save_dir, 'dict.txt')
+    with open(dict_path, 'w') as f:
+        f.write('<unk> 1\n<eos> 2\n<pad> 3\n')
+        for i in range(4, args.vocab):
+            f.write('w%d %d\n' % (i, i))
+    tsv_path = os.path.join(save_dir, 'eval.tsv')
+    n_tokens = 0
+    with open(tsv_path, 'w') as f:
+        f.write('utt_id\tspeaker\tfeat_path\txlen\txdim\ttext\ttoken_id\tylen\tydim\n')
+        while n_tokens < args.n_tokens:
+            ids = rng.randint(4, args.vocab, size=rng.randint(5, 30))
+            f.write('utt%07d\tspk\tdummy\t0\t0\t%s\t%s\t%d\t%d\n' % (
+                n_tokens, ' '.join(['w%d' % t for t in ids]), ' '.join(map(str, ids)), len(ids), args.vocab))
+            n_tokens += len(ids) + 1
+    return Dataset(tsv_path=tsv_path, dict_path=dict_path, unit='word',
+                   batch_size=1, bptt=args.bptt, is_test=True)
+
+
+def build_model(model_class, mem_len):
+    conf = argparse.Namespace(
+        lm_type='transformer', transformer_n_heads=4, n_layers=args.n_layers,
+        transformer_d_model=args.d_model, transformer_d_ff=args.d_model * 4,
+        transformer_layer_norm_eps=1e-12, transformer_ffn_activation='relu',
+        transformer_pe_type='add', vocab=args.vocab, dropout_in=0.1, dropout_hidden=0.1,
+        dropout_att=0.1, dropout_layer=0.0, lsm_prob=0.0, transformer_param_init='xavier_uniform',
+        mem_len=mem_len, recog_mem_len=0, bptt=args.bptt, zero_center_offset=False,
+        adaptive_softmax=False, tie_embedding=False)
+    return model_class(conf).to(args.device)
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    save_dir = tempfile.mkdtemp()
+    dataset = make_dataset(save_dir)
+    for name, model_class, mem_len in [('TransformerLM', TransformerLM, 0),
+                                       ('TransformerXL', TransformerXL, args.bptt)]:
+        model = build_model(model_class, mem_len)
+        for setting, batch_size in [('single', 1), ('batch', args.batch_size)]:
+            start = time.time()
+            ppl, _ = eval_ppl([model], dataset, batch_size=batch_size, bptt=args.bptt, stride=args.stride)
+            elapsed = time.time() - start
+            print('%s (%s): PPL %.3f, %.2f sec (%.0f tokens/sec)' % (
+                name, setting, ppl, elapsed, len(dataset) / elapsed))
+    shutil.rmtree(save_dir)
+
+
+if __name__ == '__main__':
+    main()
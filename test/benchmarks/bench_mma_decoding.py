@@ -0,0 +1,98 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark decoding throughput (tokens/sec) of the MMA Transformer decoder.
+
+Usage:
+    python test/benchmarks/bench_mma_decoding.py --n_heads_mono 4 --chunk_size 16 --eps_wait 4
+"""
+
+import argparse
+import importlib
+import os
+import sys
+import time
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modules'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'decoders'))
+from test_mocha import _hard_chunkwise_attention_ref  # noqa
+from test_mocha import _head_synchronous_boundary_ref  # noqa
+from test_transformer_decoder import make_args  # noqa
+from test_transformer_decoder import make_decode_params  # noqa
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--n_heads_mono', type=int, default=4)
+parser.add_argument('--n_heads_chunk', type=int, default=1)
+parser.add_argument('--chunk_size', type=int, default=16)
+parser.add_argument('--eps_wait', type=int, default=4)
+parser.add_argument('--n_layers', type=int, default=2)
+parser.add_argument('--d_model', type=int, default=256)
+parser.add_argument('--vocab', type=int, default=1000)
+parser.add_argument('--batch_size', type=int, default=16)
+parser.add_argument('--beam_width', type=int, default=1)
+parser.add_argument('--emax', type=int, default=100)
+parser.add_argument('--n_steps', type=int, default=3)
+parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+args = parser.parse_args()
+
+
+def decode(dec, eouts, elens, params):
+    n_tokens = 0
+    if params['recog_beam_width'] == 1:
+        hyps, _ = dec.greedy(eouts, elens, max_len_ratio=1.0, idx2token=None,
+                             exclude_eos=False, refs_id=None, utt_ids=None, speakers=None)
+        n_tokens = sum(len(h) for h in hyps)
+    else:
+        nbest_hyps, _, _ = dec.beam_search(eouts, elens, params, idx2token=None,
+                                           nbest=1, exclude_eos=False,
+                                           refs_id=None, utt_ids=None, speakers=None)
+        n_tokens = sum(len(h[0]) for h in nbest_hyps)
+    if eouts.is_cuda:
+        torch.cuda.synchronize()
+    return n_tokens
+
+
+def measure(dec, eouts, elens, params):
+    decode(dec, eouts, elens, params)  # warm up
+    n_tokens = 0
+    start = time.time()
+    for _ in range(args.n_steps):
+        n_tokens += decode(dec, eouts, elens, params)
+    return n_tokens / (time.time() - start)
+
+
+def main():
+    torch.manual_seed(0)
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.transformer')
+    dec = module.TransformerDecoder(**make_args(attn_type='mocha', enc_n_units=args.d_model,
+                                                d_model=args.d_model, d_ff=args.d_model * 4,
+                                                n_heads=args.n_heads_mono, n_layers=args.n_layers,
+                                                vocab=args.vocab,
+                                                mma_chunk_size=args.chunk_size,
+                                                mma_n_heads_mono=args.n_heads_mono,
+                                                mma_n_heads_chunk=args.n_heads_chunk,
+                                                mma_init_r=0)).to(args.device)
+    dec.eval()
+    params = make_decode_params(recog_beam_width=args.beam_width,
+                                recog_mma_delay_threshold=args.eps_wait)
+    params['backward'] = False
+    eouts = torch.randn(args.batch_size, args.emax, args.d_model, device=args.device)
+    elens = torch.IntTensor([args.emax] * args.batch_size)
+
+    mocha = importlib.import_module('neural_sp.models.modules.mocha')
+    with torch.no_grad():
+        tps = measure(dec, eouts, elens, params)
+        fns = (mocha.head_synchronous_boundary, mocha.hard_chunkwise_attention)
+        mocha.head_synchronous_boundary = _head_synchronous_boundary_ref
+        mocha.hard_chunkwise_attention = _hard_chunkwise_attention_ref
+        tps_ref = measure(dec, eouts, elens, params)
+        mocha.head_synchronous_boundary, mocha.hard_chunkwise_attention = fns
+
+    print('reference (loop): %.1f tokens/sec' % tps_ref)
+    print('vectorized      : %.1f tokens/sec' % tps)
+    print('speedup         : %.2fx' % (tps / tps_ref))
+
+
+if __name__ == '__main__':
+    main()
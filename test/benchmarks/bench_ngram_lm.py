@@ -0,0 +1,129 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark memory and per-step latency of the n-gram LM for shallow fusion.
+
+A random trigram ARPA file is generated. Memory of the tries with quantized
+and float32 values is compared with Python dictionaries of n-grams (peak
+memory allocated while building them). Per-step latency over all
+hypotheses in a beam is measured for scoring the whole vocabulary ("full")
+and only the top-K candidates of each hypothesis ("candidates"), and
+compared with RNNLM.predict.
+
+Usage:
+    python test/benchmarks/bench_ngram_lm.py --vocab 10000 --n_ngrams 500000 --beam_width 10
+"""
+
+import argparse
+import numpy as np
+import os
+import shutil
+import tempfile
+import time
+import torch
+import tracemalloc
+
+from neural_sp.models.lm.ngram import NgramLM
+from neural_sp.models.lm.ngram import read_arpa
+from neural_sp.models.lm.rnnlm import RNNLM
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--vocab', type=int, default=10000)
+parser.add_argument('--n_ngrams', type=int, default=500000,
+                    help='number of bigrams and trigrams each')
+parser.add_argument('--beam_width', type=int, default=10)
+parser.add_argument('--n_bits', type=int, default=8)
+parser.add_argument('--n_steps', type=int, default=100)
+args = parser.parse_args()
+
+
+def make_lm_files(save_dir):
+    rng = np.random.RandomState(0)
+    dict_path = os.path.join(save_dir, 'dict.txt')
+    with open(dict_path, 'w') as f:
+        f.write('<unk> 1\n<eos> 2\n<pad> 3\n')
+        for i in range(4, args.vocab):
+            f.write('w%d %d\n' % (i, i))
+    words = ['<unk>', '<s>', '</s>'] + ['w%d' % i for i in range(4, args.vocab)]
+    n = len(words)
+    bigrams = np.unique(rng.randint(0, n, size=(args.n_ngrams, 2)), axis=0)
+    trigrams = np.unique(np.concatenate([bigrams[rng.randint(0, len(bigrams), size=args.n_ngrams)],
+                                         rng.randint(0, n, size=(args.n_ngrams, 1))], axis=1), axis=0)
+    arpa_path = os.path.join(save_dir, 'lm.arpa')
+    with open(arpa_path, 'w') as f:
+        f.write('\\data\\\nngram 1=%d\nngram 2=%d\nngram 3=%d\n' % (n, len(bigrams), len(trigrams)))
+        f.write('\n\\1-grams:\n')
+        for w, logp, bo in zip(words, rng.uniform(-6, -1, n), rng.uniform(-1, 0, n)):
+            f.write('%.4f\t%s\t%.4f\n' % (logp, w, bo))
+        f.write('\n\\2-grams:\n')
+        for (i, j), logp, bo in zip(bigrams, rng.uniform(-4, -0.1, len(bigrams)), rng.uniform(-1, 0, len(bigrams))):
+            f.write('%.4f\t%s %s\t%.4f\n' % (logp, words[i], words[j], bo))
+        f.write('\n\\3-grams:\n')
+        for (i, j, k), logp in zip(trigrams, rng.uniform(-3, -0.1, len(trigrams))):
+            f.write('%.4f\t%s %s %s\n' % (logp, words[i], words[j], words[k]))
+        f.write('\n\\end\\\n')
+    return arpa_path, dict_path
+
+
+def dict_memory(arpa_path):
+    ngrams = read_arpa(arpa_path)
+    tracemalloc.start()
+    tables = [{w: (logp, bo) for w, logp, bo in zip(*ngram)} for ngram in ngrams]
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del tables
+    return peak
+
+
+def run(step_fn):
+    ys = torch.randint(4, args.vocab, (args.beam_width, 1))
+    candidates = torch.randint(1, args.vocab, (args.beam_width, args.beam_width))
+    state = None
+    with torch.no_grad():
+        for _ in range(5):
+            state = step_fn(ys, None, candidates)
+        start = time.time()
+        for _ in range(args.n_steps):
+            ys = torch.randint(4, args.vocab, (args.beam_width, 1))
+            state = step_fn(ys, state, candidates)
+    return (time.time() - start) / args.n_steps * 1000
+
+
+def main():
+    save_dir = tempfile.mkdtemp()
+    arpa_path, dict_path = make_lm_files(save_dir)
+
+    lm_q = NgramLM(arpa_path, dict_path, n_bits=args.n_bits)
+    lm = NgramLM(arpa_path, dict_path, n_bits=0)
+    print('memory (%d-bit)  : %8.1f MB' % (args.n_bits, lm_q.memory_footprint() / 1024 ** 2))
+    print('memory (float32): %8.1f MB' % (lm.memory_footprint() / 1024 ** 2))
+    print('memory (dict)   : %8.1f MB' % (dict_memory(arpa_path) / 1024 ** 2))
+
+    def step_ngram(model, use_candidates):
+        def step_fn(ys, state, candidates):
+            _, state, scores_lm = model.predict(ys, state, candidates=candidates if use_candidates else None)
+            if not use_candidates:
+                scores_lm[:, -1].gather(1, candidates)
+            return state
+        return step_fn
+
+    conf = argparse.Namespace(
+        lm_type='lstm', n_units=1024, n_projs=0, n_layers=2, residual=False,
+        use_glu=False, n_units_null_context=0, bottleneck_dim=1024, emb_dim=1024,
+        vocab=args.vocab, dropout_in=0.1, dropout_hidden=0.1, lsm_prob=0.0,
+        param_init=0.1, adaptive_softmax=False, tie_embedding=False)
+    rnnlm = RNNLM(conf).eval()
+
+    def step_rnnlm(ys, state, candidates):
+        _, state, scores_lm = rnnlm.predict(ys, state)
+        scores_lm[:, -1].gather(1, candidates)
+        return state
+
+    print('ngram full      : %.2f ms/step' % run(step_ngram(lm_q, False)))
+    print('ngram candidates: %.2f ms/step' % run(step_ngram(lm_q, True)))
+    print('rnnlm predict   : %.2f ms/step' % run(step_rnnlm))
+    shutil.rmtree(save_dir)
+
+
+if __name__ == '__main__':
+    main()
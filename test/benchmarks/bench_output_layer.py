@@ -0,0 +1,143 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark output layers of ASR decoders for a large vocabulary.
+
+1. Training (forward + backward) of the linear output layer with
+   cross_entropy_lsm ("full") vs. AdaptiveSoftmax.loss ("adaptive") for
+   Zipfian targets, and the size of the largest activation.
+2. Decoding of top-k candidates per beam from full log-probabilities vs.
+   AdaptiveSoftmax.topk, which skips tails that cannot be selected.
+3. The RNN-T joint network over the whole mini-batch vs. chunks of
+   utterances recomputed in backward (--transducer_joint_chunk_size). A
+   proxy loss over the logits is used since the Transducer loss needs
+   warp-transducer; the number of logits kept for backward is reported.
+
+Usage:
+    python test/benchmarks/bench_output_layer.py --vocab 32000 --d_model 512
+"""
+
+import argparse
+import numpy as np
+import time
+import torch
+import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
+
+from neural_sp.models.criterion import cross_entropy_lsm
+from neural_sp.models.modules.adaptive_softmax import AdaptiveSoftmax
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--vocab', type=int, default=32000)
+parser.add_argument('--d_model', type=int, default=512)
+parser.add_argument('--batch_size', type=int, default=16)
+parser.add_argument('--ylen', type=int, default=50)
+parser.add_argument('--xlen', type=int, default=100)
+parser.add_argument('--beam_width', type=int, default=10)
+parser.add_argument('--cutoffs', type=str, default='2000_10000')
+parser.add_argument('--joint_chunk_size', type=int, default=2)
+parser.add_argument('--n_trials', type=int, default=3)
+args = parser.parse_args()
+
+PAD = 3
+
+
+def measure(fn):
+    elapsed = []
+    for _ in range(args.n_trials):
+        start = time.time()
+        fn()
+        elapsed.append(time.time() - start)
+    return min(elapsed) * 1000
+
+
+def zipf_targets(size):
+    ranks = np.arange(1, args.vocab + 1)
+    probs = 1. / ranks
+    ys = np.random.choice(args.vocab, size=size, p=probs / probs.sum())
+    return torch.from_numpy(ys).long()
+
+
+def bench_train():
+    linear = nn.Linear(args.d_model, args.vocab)
+    adaptive = AdaptiveSoftmax(args.d_model, args.vocab, cutoffs=args.cutoffs)
+    xs = torch.randn(args.batch_size, args.ylen, args.d_model, requires_grad=True)
+    ys = zipf_targets((args.batch_size, args.ylen))
+
+    def full():
+        loss, _ = cross_entropy_lsm(linear(xs), ys, 0., PAD, True)
+        loss.backward()
+
+    def adapt():
+        loss, _ = adaptive.loss(xs, ys, PAD)
+        loss.backward()
+
+    n_tokens = args.batch_size * args.ylen
+    n_tail = [((ys >= adaptive.cutoffs[i]) & (ys < adaptive.cutoffs[i + 1])).sum().item()
+              for i in range(adaptive.n_clusters)]
+    act_adaptive = n_tokens * (adaptive.shortlist_size + adaptive.n_clusters) + \
+        sum(n * (adaptive.cutoffs[i + 1] - adaptive.cutoffs[i]) for i, n in enumerate(n_tail))
+    print('[train] full: %.2f ms (%d logits) / adaptive: %.2f ms (%d logits)' % (
+        measure(full), n_tokens * args.vocab, measure(adapt), act_adaptive))
+
+
+def bench_topk():
+    linear = nn.Linear(args.d_model, args.vocab)
+    adaptive = AdaptiveSoftmax(args.d_model, args.vocab, cutoffs=args.cutoffs)
+    xs = torch.randn(args.beam_width, args.d_model)
+    with torch.no_grad():
+        t_full = measure(lambda: [torch.topk(torch.log_softmax(linear(xs), dim=-1), k=args.beam_width)
+                                  for _ in range(100)])
+        t_adaptive_full = measure(lambda: [torch.topk(adaptive(xs), k=args.beam_width)
+                                           for _ in range(100)])
+        t_adaptive_topk = measure(lambda: [adaptive.topk(xs, args.beam_width) for _ in range(100)])
+    print('[topk] full: %.3f ms/step / adaptive (full log-probs): %.3f ms/step / adaptive (topk): %.3f ms/step' % (
+        t_full / 100, t_adaptive_full / 100, t_adaptive_topk / 100))
+
+
+def bench_joint():
+    bottleneck_dim = args.d_model
+    w_enc = nn.Linear(args.d_model, bottleneck_dim)
+    w_dec = nn.Linear(args.d_model, bottleneck_dim, bias=False)
+    output = nn.Linear(bottleneck_dim, args.vocab)
+    elens = torch.randint(args.xlen // 2, args.xlen + 1, (args.batch_size,))
+    ylens = torch.randint(args.ylen // 2, args.ylen + 1, (args.batch_size,))
+    eouts = torch.randn(args.batch_size, elens.max().item(), args.d_model, requires_grad=True)
+    douts = torch.randn(args.batch_size, ylens.max().item() + 1, args.d_model, requires_grad=True)
+
+    def joint_loss(eouts, douts):
+        out = torch.tanh(w_enc(eouts).unsqueeze(2) + w_dec(douts).unsqueeze(1))
+        # proxy of the Transducer loss
+        return torch.log_softmax(output(out), dim=-1)[..., 0].mean()
+
+    def full():
+        joint_loss(eouts, douts).backward()
+
+    def chunkwise():
+        loss = 0.
+        for b in range(0, args.batch_size, args.joint_chunk_size):
+            xmax = elens[b:b + args.joint_chunk_size].max().item()
+            ymax = ylens[b:b + args.joint_chunk_size].max().item()
+            loss = loss + checkpoint(joint_loss, eouts[b:b + args.joint_chunk_size, :xmax],
+                                     douts[b:b + args.joint_chunk_size, :ymax + 1], use_reentrant=False)
+        loss.backward()
+
+    n_full = eouts.size(0) * eouts.size(1) * douts.size(1) * args.vocab
+    chunks = range(0, args.batch_size, args.joint_chunk_size)
+    xmaxs = [elens[b:b + args.joint_chunk_size].max().item() for b in chunks]
+    ymaxs = [ylens[b:b + args.joint_chunk_size].max().item() + 1 for b in chunks]
+    n_chunk = max(x * y for x, y in zip(xmaxs, ymaxs)) * args.joint_chunk_size * args.vocab
+    print('[joint] full: %.2f ms (%d logits) / chunkwise: %.2f ms (%d logits at most)' % (
+        measure(full), n_full, measure(chunkwise), n_chunk))
+
+
+def main():
+    torch.manual_seed(0)
+    np.random.seed(0)
+    bench_train()
+    bench_topk()
+    bench_joint()
+
+
+if __name__ == '__main__':
+    main()
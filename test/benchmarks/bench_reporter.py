@@ -0,0 +1,59 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark per-step overhead of the reporter on the training thread.
+
+"sync" writes every scalar to tensorboard immediately and renders figures on
+the training thread (--flush_steps 1 without --async_plot), and "async"
+buffers scalars and renders figures in a background process.
+
+Usage:
+    python test/benchmarks/bench_reporter.py --n_steps 2000 --print_step 200
+"""
+
+import argparse
+import shutil
+import tempfile
+import time
+import torch
+
+from neural_sp.trainers.reporter import Reporter
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--n_steps', type=int, default=2000)
+parser.add_argument('--print_step', type=int, default=200)
+parser.add_argument('--n_keys', type=int, default=8, help='number of observed values per step')
+parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+args = parser.parse_args()
+
+
+def measure(flush_steps, async_plot):
+    save_path = tempfile.mkdtemp()
+    reporter = Reporter(save_path, flush_steps=flush_steps, async_plot=async_plot)
+    observation = {'loss.task%d' % i: 1. / (i + 1) for i in range(args.n_keys)}
+    total_norm = torch.ones(1, device=args.device).sum()
+    start = time.time()
+    for step in range(args.n_steps):
+        reporter.add(observation)
+        reporter.add_tensorboard_scalar('total_norm', total_norm)
+        reporter.add_tensorboard_scalar('learning_rate', 1e-3)
+        reporter.step()
+        if (step + 1) % args.print_step == 0:
+            reporter.add(observation, is_eval=True)
+            reporter.step(is_eval=True)
+            reporter.snapshot()
+    elapsed = time.time() - start
+    reporter.close()
+    shutil.rmtree(save_path)
+    return reporter.overhead, elapsed
+
+
+def main():
+    for name, flush_steps, async_plot in [('sync', 1, False), ('async', args.print_step, True)]:
+        overhead, elapsed = measure(flush_steps, async_plot)
+        print('%s: %.3f ms/step on the training thread (loop: %.2f sec)' %
+              (name, overhead / args.n_steps * 1000, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark per-step latency of RNNLM for shallow fusion in beam search.
+
+"predict" runs RNNLM.predict over all hypotheses and scores the whole
+vocabulary, "infer" runs RNNLMInference.step and scores only the top-K
+candidates of each hypothesis with the exact log-normalizer, and
+"shortlist" uses the log-normalizer approximated over --shortlist tokens.
+
+Usage:
+    python test/benchmarks/bench_rnnlm_infer.py --vocab 10000 --beam_width 10
+"""
+
+import argparse
+import time
+import torch
+
+from neural_sp.models.lm.rnnlm import RNNLM
+from neural_sp.models.lm.rnnlm_infer import RNNLMInference
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--vocab', type=int, default=10000)
+parser.add_argument('--beam_width', type=int, default=10)
+parser.add_argument('--n_units', type=int, default=1024)
+parser.add_argument('--n_layers', type=int, default=2)
+parser.add_argument('--shortlist', type=int, default=2000)
+parser.add_argument('--n_steps', type=int, default=100)
+parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+args = parser.parse_args()
+
+
+def build_model():
+    conf = argparse.Namespace(
+        lm_type='lstm', n_units=args.n_units, n_projs=0, n_layers=args.n_layers, residual=False,
+        use_glu=False, n_units_null_context=0, bottleneck_dim=args.n_units, emb_dim=args.n_units,
+        vocab=args.vocab, dropout_in=0.1, dropout_hidden=0.1, lsm_prob=0.0,
+        param_init=0.1, adaptive_softmax=False, tie_embedding=False)
+    return RNNLM(conf).to(args.device).eval()
+
+
+def synchronize():
+    if args.device.startswith('cuda'):
+        torch.cuda.synchronize()
+
+
+def run(step_fn):
+    ys = torch.randint(0, args.vocab, (args.beam_width, 1), device=args.device)
+    candidates = torch.randint(0, args.vocab, (args.beam_width, args.beam_width), device=args.device)
+    state = None
+    with torch.no_grad():
+        for _ in range(5):
+            state = step_fn(ys, None, candidates)
+        synchronize()
+        start = time.time()
+        for _ in range(args.n_steps):
+            state = step_fn(ys, state, candidates)
+        synchronize()
+    return (time.time() - start) / args.n_steps * 1000
+
+
+def main():
+    lm = build_model()
+    lm_infer = lm.inference_model()
+    lm_sl = RNNLMInference(lm, shortlist=torch.arange(args.shortlist, device=args.device))
+
+    def step_predict(ys, state, candidates):
+        _, state, scores_lm = lm.predict(ys, state)
+        scores_lm[:, -1].gather(1, candidates)
+        return state
+
+    def step_infer(model):
+        def step_fn(ys, state, candidates):
+            lmout, state = model.step(ys, state)
+            model.score(lmout[:, -1], candidates)
+            return state
+        return step_fn
+
+    print('predict  : %.2f ms/step' % run(step_predict))
+    print('infer    : %.2f ms/step' % run(step_infer(lm_infer)))
+    print('shortlist: %.2f ms/step' % run(step_infer(lm_sl)))
+
+
+if __name__ == '__main__':
+    main()
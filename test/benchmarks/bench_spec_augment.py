@@ -0,0 +1,67 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark throughput of batched SpecAugment.
+
+Usage:
+    python test/benchmarks/bench_spec_augment.py --batch_size 256 --xmax 1600
+"""
+
+import argparse
+import importlib
+import os
+import sys
+import time
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'frontends'))
+from test_spec_augment import _spec_augment_ref  # noqa
+from test_spec_augment import make_args  # noqa
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--batch_size', type=int, default=256)
+parser.add_argument('--xmax', type=int, default=1600)
+parser.add_argument('--input_dim', type=int, default=80)
+parser.add_argument('--n_freq_masks', type=int, default=2)
+parser.add_argument('--n_time_masks', type=int, default=2)
+parser.add_argument('--time_warp_width', type=int, default=40)
+parser.add_argument('--n_steps', type=int, default=20)
+parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+args = parser.parse_args()
+
+
+def measure(fn, xs):
+    fn(xs.clone())  # warm up
+    if xs.is_cuda:
+        torch.cuda.synchronize()
+    start = time.time()
+    for _ in range(args.n_steps):
+        fn(xs.clone())
+    if xs.is_cuda:
+        torch.cuda.synchronize()
+    return (time.time() - start) / args.n_steps
+
+
+def main():
+    module = importlib.import_module('neural_sp.models.seq2seq.frontends.spec_augment')
+    conf = make_args(F=27, T=100, n_freq_masks=args.n_freq_masks, n_time_masks=args.n_time_masks)
+    xs = torch.randn(args.batch_size, args.xmax, args.input_dim, device=args.device)
+    xlens = torch.randint(args.xmax // 2, args.xmax + 1, (args.batch_size,), dtype=torch.int32)
+
+    ref_time = measure(lambda x: _spec_augment_ref(x, conf['F'], conf['T'], conf['n_freq_masks'],
+                                                   conf['n_time_masks'], conf['p']), xs)
+    specaug = module.SpecAugment(**conf)
+    mask_time = measure(lambda x: specaug(x, xlens), xs)
+    specaug = module.SpecAugment(**dict(conf, W=args.time_warp_width))
+    warp_time = measure(lambda x: specaug(x, xlens), xs)
+
+    n_frames = xlens.sum().item()
+    print('reference (batch-shared masks)    : %.2f ms/batch' % (ref_time * 1000))
+    print('per-utterance masks               : %.2f ms/batch (%.1f Mframes/sec)' %
+          (mask_time * 1000, n_frames / mask_time / 1e6))
+    print('per-utterance masks + time warping: %.2f ms/batch (%.1f Mframes/sec)' %
+          (warp_time * 1000, n_frames / warp_time / 1e6))
+
+
+if __name__ == '__main__':
+    main()
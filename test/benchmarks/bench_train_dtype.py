@@ -0,0 +1,112 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark step time and peak memory of training with each --train_dtype.
+
+Each dtype is measured in a separate process so that peak memory is not shared.
+On CPU, peak memory is the increase of the max RSS during training steps.
+
+Usage:
+    python test/benchmarks/bench_train_dtype.py --train_dtypes fp32 bf16 --ctc_weight 0.3
+"""
+
+import argparse
+import importlib
+import numpy as np
+import os
+import resource
+import subprocess
+import sys
+import time
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'decoders'))
+from test_transformer_decoder import make_args  # noqa
+
+from neural_sp.trainers.lr_scheduler import LRScheduler  # noqa
+from neural_sp.trainers.precision import MixedPrecision  # noqa
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--train_dtypes', type=str, nargs='+', default=['fp32', 'bf16'])
+parser.add_argument('--n_layers', type=int, default=4)
+parser.add_argument('--d_model', type=int, default=256)
+parser.add_argument('--vocab', type=int, default=1000)
+parser.add_argument('--ctc_weight', type=float, default=0.3)
+parser.add_argument('--batch_size', type=int, default=16)
+parser.add_argument('--emax', type=int, default=200)
+parser.add_argument('--ymax', type=int, default=50)
+parser.add_argument('--n_steps', type=int, default=5)
+parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+parser.add_argument('--worker', type=str, default='', help='(internal) measure a single dtype')
+args = parser.parse_args()
+
+
+def max_rss():
+    """Max RSS [MB]."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(train_dtype):
+    torch.manual_seed(0)
+    np.random.seed(0)
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.transformer')
+    dec = module.TransformerDecoder(**make_args(enc_n_units=args.d_model,
+                                                d_model=args.d_model, d_ff=args.d_model * 4,
+                                                n_heads=4, n_layers=args.n_layers,
+                                                vocab=args.vocab, ctc_weight=args.ctc_weight,
+                                                ctc_fc_list='')).to(args.device)
+    amp = MixedPrecision(train_dtype, 'cuda' if args.device == 'cuda' else 'cpu')
+    scheduler = LRScheduler(torch.optim.Adam(dec.parameters(), lr=1e-4), 1e-4,
+                            decay_type='always', decay_start_epoch=1, decay_rate=0.5)
+    eouts = torch.randn(args.batch_size, args.emax, args.d_model, device=args.device)
+    elens = torch.IntTensor([args.emax] * args.batch_size)
+    ys = [np.random.randint(4, args.vocab, args.ymax).astype(np.int32) for _ in range(args.batch_size)]
+
+    def step():
+        with amp.autocast():
+            loss, _ = dec(eouts, elens, ys, task='all')
+        amp.backward(loss)
+        amp.unscale_(scheduler.optimizer)
+        torch.nn.utils.clip_grad_norm_(dec.parameters(), 5.0)
+        amp.step(scheduler)
+        scheduler.zero_grad()
+        if args.device == 'cuda':
+            torch.cuda.synchronize()
+        return loss.item()
+
+    rss_base = max_rss()
+    if args.device == 'cuda':
+        torch.cuda.reset_peak_memory_stats()
+    step()  # warm up
+    start = time.time()
+    for _ in range(args.n_steps):
+        loss = step()
+    elapsed = (time.time() - start) / args.n_steps
+    if args.device == 'cuda':
+        peak = torch.cuda.max_memory_allocated() / 1024 ** 2
+    else:
+        peak = max_rss() - rss_base
+    print('%s %.6f %.1f %.4f' % (train_dtype, elapsed, peak, loss))
+
+
+def main():
+    if args.worker:
+        measure(args.worker)
+        return
+
+    results = {}
+    for train_dtype in args.train_dtypes:
+        out = subprocess.run([sys.executable] + sys.argv + ['--worker', train_dtype],
+                             stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+        _, elapsed, peak, loss = out.strip().split('\n')[-1].split()
+        results[train_dtype] = (float(elapsed), float(peak), float(loss))
+
+    ref = results[args.train_dtypes[0]]
+    print('%-6s %12s %14s %10s %10s' % ('dtype', 'step [ms]', 'peak mem [MB]', 'speedup', 'loss'))
+    for train_dtype, (elapsed, peak, loss) in results.items():
+        print('%-6s %12.2f %14.1f %9.2fx %10.4f' %
+              (train_dtype, elapsed * 1000, peak, ref[0] / elapsed, loss))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Benchmark word-level LM fusion into character-level beam search.
+
+Hypotheses in a beam are random sentences of words in the vocabulary of a
+word-level RNNLM, and are fed to LookAheadWordLM character by character.
+Per-step latency and the number of word histories read by the word LM are
+compared with rerunning the word LM over the word history of each
+hypothesis at every step ("naive").
+
+Usage:
+    python test/benchmarks/bench_wordlm_fusion.py --n_words 20000 --beam_width 10
+"""
+
+import argparse
+import numpy as np
+import os
+import shutil
+import tempfile
+import time
+import torch
+
+from neural_sp.models.lm.lookahead_wordlm import LookAheadWordLM
+from neural_sp.models.lm.rnnlm import RNNLM
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--n_words', type=int, default=20000)
+parser.add_argument('--beam_width', type=int, default=10)
+parser.add_argument('--n_units', type=int, default=512)
+parser.add_argument('--n_steps', type=int, default=100)
+args = parser.parse_args()
+
+CHARS = 'abcdefghijklmnopqrstuvwxyz'
+
+
+def make_dicts(save_dir, rng):
+    words = set()
+    while len(words) < args.n_words:
+        words.add(''.join(rng.choice(list(CHARS), size=rng.randint(1, 10))))
+    words = sorted(words)
+    lm_dict_path = os.path.join(save_dir, 'dict_word.txt')
+    with open(lm_dict_path, 'w') as f:
+        f.write('<unk> 1\n<eos> 2\n<pad> 3\n')
+        for i, w in enumerate(words):
+            f.write('%s %d\n' % (w, i + 4))
+    dict_path = os.path.join(save_dir, 'dict.txt')
+    with open(dict_path, 'w') as f:
+        f.write('<unk> 1\n<eos> 2\n<pad> 3\n<space> 4\n')
+        for i, c in enumerate(CHARS):
+            f.write('%s %d\n' % (c, i + 5))
+    return words, lm_dict_path, dict_path
+
+
+def main():
+    rng = np.random.RandomState(0)
+    save_dir = tempfile.mkdtemp()
+    words, lm_dict_path, dict_path = make_dicts(save_dir, rng)
+    conf = argparse.Namespace(
+        lm_type='lstm', n_units=args.n_units, n_projs=0, n_layers=2, residual=False,
+        use_glu=False, n_units_null_context=0, bottleneck_dim=args.n_units, emb_dim=args.n_units,
+        vocab=len(words) + 4, dropout_in=0.1, dropout_hidden=0.1, lsm_prob=0.0,
+        param_init=0.1, adaptive_softmax=False, tie_embedding=False)
+    wordlm = RNNLM(conf).eval()
+    lm = LookAheadWordLM(wordlm, lm_dict_path, dict_path, unit='char')
+
+    # hypotheses share word histories except for the last few words
+    prefix = list(rng.choice(words, size=5))
+    hyps = []
+    for _ in range(args.beam_width):
+        sent = ' '.join(prefix + list(rng.choice(words, size=10)))
+        hyps.append([2] + [4 if c == ' ' else CHARS.index(c) + 5 for c in sent])
+    n_steps = min(args.n_steps, min(len(h) for h in hyps))
+
+    n_reads = []
+    predict = wordlm.predict
+
+    def count(ys, state=None, **kwargs):
+        n_reads.append(ys.size(0))
+        return predict(ys, state, **kwargs)
+    wordlm.predict = count
+
+    with torch.no_grad():
+        state = None
+        start = time.time()
+        for t in range(n_steps):
+            ys = torch.LongTensor([[h[t]] for h in hyps])
+            lmout, state = lm.step(ys, state)
+            lm.score(lmout[:, -1], ys)
+        elapsed = time.time() - start
+    print('lookahead: %.2f ms/step, %d word histories read' % (elapsed / n_steps * 1000, sum(n_reads)))
+
+    # rerun the word LM over the word history of each hypothesis at every step
+    n_reads.clear()
+    with torch.no_grad():
+        start = time.time()
+        for t in range(n_steps):
+            for h in hyps:
+                sent = ''.join(' ' if y == 4 else CHARS[y - 5] for y in h[1:t + 1]).split(' ')
+                ws = [2] + [words.index(w) + 4 if w in words else 1 for w in sent[:-1]]
+                wordlm.predict(torch.LongTensor([ws]), None)
+        elapsed = time.time() - start
+    print('naive    : %.2f ms/step, %d word histories read' % (elapsed / n_steps * 1000, sum(n_reads)))
+    shutil.rmtree(save_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for the streaming dataset over token shards."""
+
+import importlib
+import numpy as np
+import os
+import pytest
+
+
+VOCAB = 50
+
+
+def make_corpus(save_dir, n_utts=300):
+    rng = np.random.RandomState(0)
+    dict_path = os.path.join(save_dir, 'dict.txt')
+    with open(dict_path, 'w') as f:
+        f.write('<unk> 1\n<eos> 2\n<pad> 3\n')
+        for i in range(4, VOCAB):
+            f.write('w%d %d\n' % (i, i))
+    tsv_path = os.path.join(save_dir, 'train.tsv')
+    with open(tsv_path, 'w') as f:
+        f.write('utt_id\tspeaker\tfeat_path\txlen\txdim\ttext\ttoken_id\tylen\tydim\n')
+        for n in range(n_utts):
+            ids = rng.randint(4, VOCAB, size=rng.randint(1, 20))
+            f.write('utt%05d\tspk\tdummy\t0\t0\t%s\t%s\t%d\t%d\n' % (
+                n, ' '.join(['w%d' % t for t in ids]), ' '.join(map(str, ids)), len(ids), VOCAB))
+    return tsv_path, dict_path
+
+
+@pytest.fixture(scope='module')
+def corpus(tmp_path_factory):
+    save_dir = str(tmp_path_factory.mktemp('lm_shard'))
+    tsv_path, dict_path = make_corpus(save_dir)
+    module = importlib.import_module('neural_sp.datasets.lm_shard')
+    shard_dir = os.path.join(save_dir, 'shards')
+    module.make_shards(tsv_path, dict_path, shard_dir, shard_size=500, chunksize=64)
+    return tsv_path, dict_path, shard_dir
+
+
+def build(corpus, **kwargs):
+    module = importlib.import_module('neural_sp.datasets.lm_shard')
+    _, dict_path, shard_dir = corpus
+    args = dict(unit='word', batch_size=4, bptt=10, block_size=50)
+    args.update(kwargs)
+    return module.ShardedDataset(shard_dir, dict_path, **args)
+
+
+def read_epoch(dataset):
+    batches = []
+    while True:
+        ys, is_new_epoch = dataset.next()
+        batches.append(ys)
+        if is_new_epoch:
+            return batches
+
+
+def test_same_as_dataset(corpus):
+    tsv_path, dict_path, _ = corpus
+    module = importlib.import_module('neural_sp.datasets.lm')
+    dataset = module.Dataset(tsv_path, dict_path, unit='word', batch_size=4, bptt=10)
+    dataset_shard = build(corpus)
+    assert len(dataset_shard.shards) > 1
+    assert len(dataset_shard) == len(dataset)
+    batches = read_epoch(dataset)
+    batches_shard = read_epoch(dataset_shard)
+    assert len(batches_shard) == len(batches)
+    for ys_shard, ys in zip(batches_shard, batches):
+        assert np.array_equal(ys_shard, ys)
+    assert dataset_shard.epoch == 1
+
+
+def test_shuffle(corpus):
+    dataset = build(corpus, batch_size=1, bptt=100000)
+    stream = dataset.next()[0]
+    dataset = build(corpus, batch_size=1, bptt=100000, shuffle=True)
+    stream_ep0 = dataset.next()[0]
+    stream_ep1 = dataset.next()[0]
+    assert dataset.epoch == 2
+    # blocks are permuted per epoch
+    assert not np.array_equal(stream_ep0, stream)
+    assert not np.array_equal(stream_ep0, stream_ep1)
+    assert np.array_equal(np.sort(stream_ep0), np.sort(stream))
+    # reproducible
+    dataset = build(corpus, batch_size=1, bptt=100000, shuffle=True)
+    assert np.array_equal(dataset.next()[0], stream_ep0)
+
+
+@pytest.mark.parametrize("world_size", [2, 4])
+def test_distributed(corpus, world_size):
+    batches = read_epoch(build(corpus, shuffle=True))
+    for rank in range(world_size):
+        batches_rank = read_epoch(build(corpus, shuffle=True, rank=rank, world_size=world_size))
+        assert len(batches_rank) == len(batches)
+        for ys_rank, ys in zip(batches_rank, batches):
+            assert np.array_equal(ys_rank, ys[rank::world_size])
+
+
+def test_workers(corpus):
+    dataset = build(corpus, shuffle=True)
+    batches = read_epoch(dataset) + read_epoch(dataset)
+    dataset = build(corpus, shuffle=True, n_workers=2)
+    batches_workers = read_epoch(dataset) + read_epoch(dataset)
+    assert len(batches_workers) == len(batches)
+    for ys_workers, ys in zip(batches_workers, batches):
+        assert np.array_equal(ys_workers, ys)
+
+
+def test_workers_unsupported(corpus, monkeypatch):
+    module = importlib.import_module('neural_sp.datasets.lm_shard')
+    # torch<1.2 without IterableDataset
+    monkeypatch.setattr(module, 'get_worker_info', None)
+    dataset = build(corpus, shuffle=True, n_workers=2)
+    assert dataset.n_workers == 0
+    batches = read_epoch(dataset)
+    batches_ref = read_epoch(build(corpus, shuffle=True))
+    assert len(batches) == len(batches_ref)
+    for ys, ys_ref in zip(batches, batches_ref):
+        assert np.array_equal(ys, ys_ref)
+
+
+@pytest.mark.parametrize("n_workers", [0, 2])
+def test_resume(corpus, n_workers):
+    dataset = build(corpus, shuffle=True)
+    read_epoch(dataset)
+    for _ in range(5):
+        dataset.next()
+    state = dataset.state_dict()
+    batches = read_epoch(dataset)
+
+    dataset_resumed = build(corpus, shuffle=True, n_workers=n_workers)
+    dataset_resumed.load_state_dict(state)
+    assert dataset_resumed.offset == state['offset'] > 0
+    batches_resumed = read_epoch(dataset_resumed)
+    assert len(batches_resumed) == len(batches)
+    for ys_resumed, ys in zip(batches_resumed, batches):
+        assert np.array_equal(ys_resumed, ys)
+
+    # the permutation depends on the seed
+    dataset_seed = build(corpus, shuffle=True, seed=2)
+    dataset_seed.load_state_dict(dict(state, seed=2))
+    assert not all(np.array_equal(ys_seed, ys) for ys_seed, ys in zip(read_epoch(dataset_seed), batches))
@@ -0,0 +1,113 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for the store of top-k teacher logits."""
+
+import argparse
+import importlib
+import numpy as np
+import pytest
+import torch
+
+
+VOCAB = 40
+
+
+def make_store(save_dir, topk, vocab=VOCAB, n_batches=3, batch_size=4):
+    module = importlib.import_module('neural_sp.datasets.teacher_logits')
+    torch.manual_seed(0)
+    writer = module.TopKLogitWriter(save_dir, topk=topk, vocab=vocab)
+    logits_all = {}
+    for n in range(n_batches):
+        ylens = torch.randint(1, 10, (batch_size,))
+        logits = torch.randn(batch_size, ylens.max().item(), vocab) * 3
+        utt_ids = ['utt%03d' % (n * batch_size + b) for b in range(batch_size)]
+        writer.add(utt_ids, logits, ylens.tolist())
+        for b, utt_id in enumerate(utt_ids):
+            logits_all[utt_id] = logits[b, :ylens[b]]
+    # utterances already written are skipped
+    writer.add(['utt000'], torch.randn(1, 3, vocab), [3])
+    writer.close()
+    return module.TopKLogitStore(save_dir), logits_all
+
+
+@pytest.mark.parametrize("topk", [1, 8, VOCAB, VOCAB + 10])
+def test_round_trip(tmp_path, topk):
+    store, logits_all = make_store(str(tmp_path), topk)
+    assert len(store) == len(logits_all)
+    assert store.topk == min(topk, VOCAB)
+    assert store.ids.dtype == np.uint16
+    for utt_id, logits in logits_all.items():
+        assert utt_id in store
+        ids, log_probs = store[utt_id]
+        ref_log_probs, ref_ids = torch.topk(torch.log_softmax(logits, dim=-1), k=store.topk, dim=-1)
+        assert ids.shape == (logits.size(0), store.topk)
+        assert np.array_equal(ids, ref_ids.numpy())
+        assert np.allclose(log_probs, ref_log_probs.numpy(), atol=1e-2)
+    assert 'utt999' not in store
+
+
+def test_batch(tmp_path):
+    store, logits_all = make_store(str(tmp_path), topk=8)
+    utt_ids = ['utt005', 'utt001', 'utt010']
+    topk_ids, topk_log_probs = store.batch(utt_ids, torch.device('cpu'))
+    ylens = [logits_all[utt_id].size(0) for utt_id in utt_ids]
+    assert topk_ids.size() == (3, max(ylens), 8)
+    assert topk_ids.dtype == torch.int64
+    assert topk_log_probs.dtype == torch.float32
+    for b, utt_id in enumerate(utt_ids):
+        ids, log_probs = store[utt_id]
+        assert np.array_equal(topk_ids[b, :ylens[b]].numpy(), ids)
+        assert np.array_equal(topk_log_probs[b, :ylens[b]].numpy(), log_probs.astype(np.float32))
+        assert (topk_ids[b, ylens[b]:] == 0).all()
+
+
+def test_distillation(tmp_path):
+    """Distillation from the store equals the one from full logits when k is the vocabulary size."""
+    criterion = importlib.import_module('neural_sp.models.criterion')
+    store, logits_all = make_store(str(tmp_path), topk=VOCAB)
+    utt_ids = ['utt002', 'utt007', 'utt009']
+    ylens = torch.IntTensor([logits_all[utt_id].size(0) for utt_id in utt_ids])
+    logits_teacher = torch.zeros(len(utt_ids), ylens.max(), VOCAB)
+    for b, utt_id in enumerate(utt_ids):
+        ids, log_probs = store[utt_id]
+        # full logits restored from the fp16 log-probabilities
+        logits_teacher[b, :ylens[b]].scatter_(1, torch.from_numpy(ids.astype(np.int64)),
+                                              torch.from_numpy(log_probs.astype(np.float32)))
+    logits_student = torch.randn(len(utt_ids), ylens.max(), VOCAB)
+    loss = criterion.distillation_topk(logits_student, *store.batch(utt_ids, torch.device('cpu')), ylens)
+    loss_ref = criterion.distillation(logits_student, logits_teacher, ylens)
+    assert torch.allclose(loss, loss_ref, atol=1e-5)
+
+
+def test_lm_teacher(tmp_path):
+    """Top-k logits of the teacher LM are written and read back."""
+    cache = importlib.import_module('neural_sp.bin.asr.cache_teacher_logits')
+    module = importlib.import_module('neural_sp.datasets.teacher_logits')
+    rnnlm = importlib.import_module('neural_sp.models.lm.rnnlm')
+    args = argparse.Namespace(
+        lm_type='lstm', n_units=16, n_projs=0, n_layers=1, residual=False, use_glu=False,
+        n_units_null_context=0, bottleneck_dim=8, emb_dim=8, vocab=VOCAB,
+        dropout_in=0., dropout_hidden=0., lsm_prob=0., param_init=0.1,
+        adaptive_softmax=False, tie_embedding=False)
+    torch.manual_seed(0)
+    lm = rnnlm.RNNLM(args).eval()
+
+    writer = module.TopKLogitWriter(str(tmp_path), topk=8, vocab=VOCAB, teacher='lm')
+    ys = [[5, 6, 7], [8, 9], [10, 11, 12, 13]]
+    with torch.no_grad():
+        logits = cache.generate_lm_logits(lm, ys)
+        writer.add(['utt0', 'utt1', 'utt2'], logits, [len(y) + 1 for y in ys])
+    writer.close()
+    assert logits.size() == (3, 5, VOCAB)
+
+    store = module.TopKLogitStore(str(tmp_path))
+    for b, y in enumerate(ys):
+        with torch.no_grad():
+            ys_in = torch.LongTensor([[lm.eos] + y])
+            logits_ref = lm.decode(ys_in, None)[0][0]
+        ids, log_probs = store['utt%d' % b]
+        ref_log_probs, ref_ids = torch.topk(torch.log_softmax(logits_ref, dim=-1), k=8, dim=-1)
+        assert ids.shape == (len(y) + 1, 8)
+        assert np.array_equal(ids, ref_ids.numpy())
+        assert np.allclose(log_probs, ref_log_probs.numpy(), atol=1e-2)
@@ -6,6 +6,7 @@
 import argparse
 import importlib
 import numpy as np
+import os
 import pytest
 import torch
 
@@ -30,6 +31,8 @@ def make_args(**kwargs):
         emb_dim=8,
         vocab=VOCAB,
         tie_embedding=False,
+        adaptive_softmax=False,
+        adaptive_softmax_cutoffs='',
         attn_dim=16,
         attn_sharpening_factor=1.0,
         attn_sigmoid_smoothing=False,
@@ -67,7 +70,8 @@ def make_args(**kwargs):
         gmm_attn_n_mixtures=1,
         replace_sos=False,
         distillation_weight=0.0,
-        discourse_aware=False
+        discourse_aware=False,
+        loss_vocab_chunk_size=0,
     )
     args.update(kwargs)
     return args
@@ -120,6 +124,8 @@ def make_args(**kwargs):
         ({'tie_embedding': True, 'bottleneck_dim': 16, 'emb_dim': 16}),
         ({'lsm_prob': 0.1}),
         ({'ss_prob': 0.2}),
+        ({'adaptive_softmax': True, 'adaptive_softmax_cutoffs': '4_7'}),
+        ({'adaptive_softmax': True, 'adaptive_softmax_cutoffs': '4_7', 'ss_prob': 0.2}),
         # RNNLM init
         ({'lm_init': True}),
         # LM integration
@@ -172,6 +178,34 @@ def test_forward(args):
     #                 assert not p.requires_grad
 
 
+def test_loss_vocab_chunk_size():
+    batch_size = 4
+    emax = 40
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.las')
+    eouts = torch.randn(batch_size, emax, ENC_N_UNITS)
+    elens = torch.IntTensor([emax] * batch_size)
+    ylens = [4, 5, 3, 7]
+    ys = [np.random.randint(0, VOCAB, ylen).astype(np.int32) for ylen in ylens]
+    teacher_logits = torch.randn(batch_size, max(ylens) + 1, VOCAB)
+
+    # CTC label smoothing and distillation are computed over chunks of the vocabulary
+    losses, grads = [], []
+    for loss_vocab_chunk_size in [0, 3]:
+        args = make_args(ctc_weight=0.5, ctc_lsm_prob=0.1, distillation_weight=0.5,
+                         dropout=0.0, dropout_emb=0.0, dropout_att=0.0,
+                         loss_vocab_chunk_size=loss_vocab_chunk_size)
+        torch.manual_seed(1)
+        dec = module.RNNDecoder(**args)
+        assert dec.ctc.vocab_chunk_size == loss_vocab_chunk_size
+        loss, _ = dec(eouts, elens, ys, task='all', teacher_logits=teacher_logits)
+        loss.backward()
+        losses.append(loss)
+        grads.append([p.grad.clone() for p in dec.parameters() if p.grad is not None])
+    assert torch.allclose(losses[0], losses[1], atol=1e-5)
+    for g, g_ref in zip(grads[1], grads[0]):
+        assert torch.allclose(g, g_ref, atol=1e-5)
+
+
 def make_decode_params(**kwargs):
     args = dict(
         recog_batch_size=1,
@@ -380,3 +414,261 @@ def test_decoding(backward, lm_fusion, params):
             assert isinstance(scores, list)
             assert len(scores) == batch_size
             assert len(scores[0]) == params['nbest']
+
+
+def make_ngram_lm(save_dir):
+    """Bigram LM in the ARPA format and the dictionary."""
+    dict_path = os.path.join(str(save_dir), 'dict.txt')
+    with open(dict_path, 'w') as f:
+        f.write('<unk> 1\n<eos> 2\n<pad> 3\n')
+        for i in range(4, VOCAB):
+            f.write('w%d %d\n' % (i, i))
+    words = ['<s>', '</s>', '<unk>'] + ['w%d' % i for i in range(4, VOCAB)]
+    arpa_path = os.path.join(str(save_dir), 'lm.arpa')
+    with open(arpa_path, 'w') as f:
+        f.write('\\data\\\nngram 1=%d\nngram 2=%d\n\n' % (len(words), len(words) - 1))
+        f.write('\\1-grams:\n')
+        for i, w in enumerate(words):
+            f.write('%.4f\t%s\t%.4f\n' % (-1.0 - 0.1 * i, w, -0.3))
+        f.write('\n\\2-grams:\n')
+        for i, w in enumerate(words[3:]):
+            f.write('%.4f\t%s %s\n' % (-0.5, words[3 + (i + 1) % (len(words) - 3)], w))
+        f.write('-0.2\t<s> w4\n-0.3\tw5 </s>\n')
+        f.write('\n\\end\\\n')
+    module = importlib.import_module('neural_sp.models.lm.ngram')
+    return module.NgramLM(arpa_path, dict_path)
+
+
+def make_wordlm_fusion(save_dir):
+    """Word-level RNNLM fused with character-level decoders."""
+    words = ['a', 'ab', 'bad', 'cab', 'ce', 'dead']
+    lm_dict_path = os.path.join(str(save_dir), 'dict_word.txt')
+    with open(lm_dict_path, 'w') as f:
+        f.write('<unk> 1\n<eos> 2\n<pad> 3\n')
+        for i, w in enumerate(words):
+            f.write('%s %d\n' % (w, i + 4))
+    dict_path = os.path.join(str(save_dir), 'dict.txt')
+    with open(dict_path, 'w') as f:
+        f.write('<unk> 1\n<eos> 2\n<pad> 3\n<space> 4\n')
+        for i, c in enumerate('abcde'):
+            f.write('%s %d\n' % (c, i + 5))
+    args_lm = make_args_rnnlm(vocab=len(words) + 4)
+    module_rnnlm = importlib.import_module('neural_sp.models.lm.rnnlm')
+    wordlm = module_rnnlm.RNNLM(args_lm)
+    module = importlib.import_module('neural_sp.models.lm.lookahead_wordlm')
+    return module.LookAheadWordLM(wordlm, lm_dict_path, dict_path, unit='char')
+
+
+def make_fusion_lm(lm_type, save_dir):
+    """LM for shallow fusion over the vocabulary of the decoders."""
+    if lm_type == 'gated_conv':
+        args_lm = argparse.Namespace(
+            lm_type='gated_conv_custom', n_units=16, n_projs=0, n_layers=2, kernel_size=4,
+            emb_dim=8, vocab=VOCAB, dropout_in=0.1, dropout_hidden=0.1, lsm_prob=0.0,
+            param_init=0.1, adaptive_softmax=False, tie_embedding=False)
+        module = importlib.import_module('neural_sp.models.lm.gated_convlm')
+        lm = module.GatedConvLM(args_lm)
+    elif lm_type == 'ngram':
+        lm = make_ngram_lm(save_dir)
+    elif lm_type == 'wordlm':
+        lm = make_wordlm_fusion(save_dir)
+    return lm.eval()
+
+
+def fuse_full_vocab(lm, lm_type):
+    """Make `lm` score the whole vocabulary from scratch at every step as the reference.
+
+    Returns:
+        n_calls (list): number of calls to the reference
+
+    """
+    n_calls = [0]
+    if lm_type == 'gated_conv':
+        # recompute all blocks over the whole prefix kept in the state
+        def predict(ys, state=None, mems=None, cache=None):
+            n_calls[0] += 1
+            if state is not None:
+                ys = torch.cat([state[0], ys], dim=1)
+            logits, lmout, _ = lm.decode(ys)
+            return lmout[:, -1:], [ys] * len(lm.blocks), torch.log_softmax(logits[:, -1:], dim=-1)
+
+        lm.predict = predict
+    else:
+        score = lm.score
+
+        def score_full(lmout, candidates=None):
+            n_calls[0] += 1
+            return score(lmout) if candidates is None else score(lmout).gather(1, candidates)
+
+        lm.score = score_full
+    return n_calls
+
+
+@pytest.mark.parametrize("lm_type", ['gated_conv', 'ngram', 'wordlm'])
+@pytest.mark.parametrize("lm_state_carry_over", [False, True])
+def test_decoding_lm(tmp_path, lm_type, lm_state_carry_over):
+    args = make_args()
+    params = make_decode_params(recog_beam_width=4, recog_lm_weight=1.0,
+                                recog_lm_state_carry_over=lm_state_carry_over)
+    batch_size = params['recog_batch_size']
+    emax = 40
+    device = "cpu"
+
+    eouts = np.random.randn(batch_size, emax, ENC_N_UNITS).astype(np.float32)
+    elens = torch.IntTensor([len(x) for x in eouts])
+    eouts = pad_list([np2tensor(x, device).float() for x in eouts], 0.)
+
+    lm = make_fusion_lm(lm_type, tmp_path).to(device)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.las')
+    dec = module.RNNDecoder(**args)
+    dec = dec.to(device)
+
+    dec.eval()
+    with torch.no_grad():
+        outs = []
+        for _ in range(2):
+            nbest_hyps, _, scores = dec.beam_search(
+                eouts, elens, params, idx2token=None, lm=lm,
+                nbest=params['nbest'], exclude_eos=params['exclude_eos'],
+                refs_id=None, utt_ids=None, speakers=['spk'] * batch_size)
+            assert len(nbest_hyps) == batch_size
+            outs.append((nbest_hyps, scores))
+
+        # same results as with LM scores over the whole vocabulary
+        n_calls = fuse_full_vocab(lm, lm_type)
+        dec.prev_spk = ''  # reset states carried over
+        for nbest_hyps, scores in outs:
+            nbest_hyps_ref, _, scores_ref = dec.beam_search(
+                eouts, elens, params, idx2token=None, lm=lm,
+                nbest=params['nbest'], exclude_eos=params['exclude_eos'],
+                refs_id=None, utt_ids=None, speakers=['spk'] * batch_size)
+            assert all(np.array_equal(hyps[0], hyps_ref[0]) for hyps, hyps_ref in zip(nbest_hyps, nbest_hyps_ref))
+            assert np.allclose(scores, scores_ref, atol=1e-4)
+        assert n_calls[0] > 0
+
+
+@pytest.mark.parametrize("lm_type", [None, 'rnnlm', 'wordlm'])
+def test_decoding_ctc(tmp_path, lm_type):
+    args = make_args(ctc_weight=0.5)
+    params = make_decode_params(recog_beam_width=4, recog_lm_weight=0.1)
+    batch_size = params['recog_batch_size']
+    emax = 40
+    device = "cpu"
+
+    eouts = np.random.randn(batch_size, emax, ENC_N_UNITS).astype(np.float32)
+    elens = torch.IntTensor([len(x) for x in eouts])
+    eouts = pad_list([np2tensor(x, device).float() for x in eouts], 0.)
+
+    lm = None
+    if lm_type == 'rnnlm':
+        module_rnnlm = importlib.import_module('neural_sp.models.lm.rnnlm')
+        lm = module_rnnlm.RNNLM(make_args_rnnlm()).to(device)
+    elif lm_type == 'wordlm':
+        lm = make_wordlm_fusion(tmp_path).to(device)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.las')
+    dec = module.RNNDecoder(**args)
+    dec = dec.to(device)
+
+    dec.eval()
+    with torch.no_grad():
+        best_hyps = dec.decode_ctc(eouts, elens, params, idx2token=None, lm=lm)
+        assert len(best_hyps) == batch_size
+
+
+def make_transformer_lm(lm_type, mem_len):
+    args_lm = argparse.Namespace(
+        lm_type=lm_type, transformer_attn_type='scaled_dot', transformer_n_heads=4,
+        n_layers=2, transformer_d_model=16, transformer_d_ff=64, transformer_layer_norm_eps=1e-12,
+        transformer_ffn_activation='relu', transformer_pe_type='add', vocab=VOCAB,
+        dropout_in=0.1, dropout_hidden=0.1, dropout_att=0.1, dropout_layer=0.0, lsm_prob=0.0,
+        transformer_param_init='xavier_uniform', bptt=200, mem_len=0, recog_mem_len=mem_len,
+        zero_center_offset=False, adaptive_softmax=False, tie_embedding=False)
+    if lm_type == 'transformer_xl':
+        module = importlib.import_module('neural_sp.models.lm.transformer_xl')
+        return module.TransformerXL(args_lm)
+    module = importlib.import_module('neural_sp.models.lm.transformerlm')
+    return module.TransformerLM(args_lm)
+
+
+@pytest.mark.parametrize("lm_type", ['transformer', 'transformer_xl'])
+@pytest.mark.parametrize("lm_state_carry_over", [False, True])
+def test_decoding_transformer_lm(lm_type, lm_state_carry_over):
+    args = make_args()
+    params = make_decode_params(recog_beam_width=4, recog_lm_weight=0.1,
+                                recog_lm_state_carry_over=lm_state_carry_over)
+    batch_size = params['recog_batch_size']
+    emax = 40
+    mem_len = 5
+    device = "cpu"
+
+    eouts = np.random.randn(batch_size, emax, ENC_N_UNITS).astype(np.float32)
+    elens = torch.IntTensor([len(x) for x in eouts])
+    eouts = pad_list([np2tensor(x, device).float() for x in eouts], 0.)
+
+    lm = make_transformer_lm(lm_type, mem_len).to(device)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.las')
+    dec = module.RNNDecoder(**args)
+    dec = dec.to(device)
+
+    dec.eval()
+    with torch.no_grad():
+        for _ in range(3):
+            nbest_hyps, aws, scores = dec.beam_search(
+                eouts, elens, params, idx2token=None, lm=lm,
+                nbest=params['nbest'], exclude_eos=params['exclude_eos'],
+                refs_id=None, utt_ids=None, speakers=['spk'] * batch_size)
+            assert len(nbest_hyps) == batch_size
+            # states of past tokens are bounded by the memory length
+            if lm_type == 'transformer':
+                assert all(state.size(1) <= mem_len for state in dec.lmstate_final[1])
+            else:
+                assert all(mem.size(1) <= mem_len for mem in dec.lmmemory)
+
+
+@pytest.mark.parametrize("beam_width", [1, 4])
+def test_decoding_adaptive_softmax(beam_width):
+    args = make_args(adaptive_softmax=True, adaptive_softmax_cutoffs='4_7')
+    params = make_decode_params(recog_beam_width=beam_width)
+    batch_size = params['recog_batch_size']
+    emax = 40
+    device = "cpu"
+
+    eouts = np.random.randn(batch_size, emax, ENC_N_UNITS).astype(np.float32)
+    elens = torch.IntTensor([len(x) for x in eouts])
+    eouts = pad_list([np2tensor(x, device).float() for x in eouts], 0.)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.las')
+    dec = module.RNNDecoder(**args)
+    dec = dec.to(device)
+
+    dec.eval()
+    with torch.no_grad():
+        if beam_width == 1:
+            hyps, _ = dec.greedy(eouts, elens, max_len_ratio=1.0, idx2token=None)
+            assert len(hyps) == batch_size
+        else:
+            nbest_hyps, _, scores = dec.beam_search(eouts, elens, params, idx2token=None)
+            assert len(nbest_hyps) == batch_size
+            # scores are accumulated from normalized log-probabilities
+            assert all(s[0] <= 0 for s in scores)
+
+        # same results as with log-probabilities over the whole vocabulary
+        n_calls = [0]
+
+        def full(xs, k=None):
+            n_calls[0] += 1
+            return dec.output(xs) if k is not None else dec.output(xs).argmax(-1)
+
+        dec.output.argmax = full
+        dec.output.log_prob_topk = full
+        if beam_width == 1:
+            hyps_ref, _ = dec.greedy(eouts, elens, max_len_ratio=1.0, idx2token=None)
+            assert all(np.array_equal(hyp, hyp_ref) for hyp, hyp_ref in zip(hyps, hyps_ref))
+        else:
+            nbest_hyps_ref, _, scores_ref = dec.beam_search(eouts, elens, params, idx2token=None)
+            assert all(np.array_equal(hyp, hyp_ref) for hyp, hyp_ref in zip(nbest_hyps[0], nbest_hyps_ref[0]))
+            assert np.allclose(scores[0], scores_ref[0], atol=1e-4)
+        assert n_calls[0] > 0
@@ -12,6 +12,8 @@ import torch
 from neural_sp.models.torch_utils import np2tensor
 from neural_sp.models.torch_utils import pad_list
 
+from test_las_decoder import fuse_full_vocab, make_fusion_lm
+
 
 ENC_N_UNITS = 32
 VOCAB = 10
@@ -37,6 +39,8 @@ def make_args(**kwargs):
         global_weight=1.0,
         mtl_per_batch=False,
         param_init=0.1,
+        joint_chunk_size=0,
+        loss_vocab_chunk_size=0,
     )
     args.update(kwargs)
     return args
@@ -83,6 +87,59 @@ def test_forward(args):
     assert isinstance(observation, dict)
 
 
+def rnnt_loss(log_probs, ys, elens, ylens, blank=0):
+    """Reference Transducer loss averaged over utterances."""
+    losses = []
+    for b in range(log_probs.size(0)):
+        T, U = elens[b].item(), ylens[b].item()
+        alpha = [[None] * (U + 1) for _ in range(T)]
+        for t in range(T):
+            for u in range(U + 1):
+                if t == 0 and u == 0:
+                    alpha[t][u] = log_probs.new_zeros(())
+                    continue
+                paths = []
+                if t > 0:
+                    paths.append(alpha[t - 1][u] + log_probs[b, t - 1, u, blank])
+                if u > 0:
+                    paths.append(alpha[t][u - 1] + log_probs[b, t, u - 1, ys[b, u - 1]])
+                alpha[t][u] = torch.logsumexp(torch.stack(paths), dim=0)
+        losses.append(-(alpha[T - 1][U] + log_probs[b, T - 1, U, blank]))
+    return torch.stack(losses).mean()
+
+
+@pytest.mark.parametrize("joint_chunk_size", [1, 2, 3, 8])
+def test_joint_chunkwise(joint_chunk_size):
+    torch.manual_seed(0)
+    batch_size = 4
+    elens = torch.IntTensor([9, 6, 7, 4])
+    eouts = torch.randn(batch_size, elens.max().item(), ENC_N_UNITS)
+    ylens = [4, 5, 2, 3]
+    ys = [np.random.randint(4, VOCAB, ylen).astype(np.int32) for ylen in ylens]
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.rnn_transducer')
+    losses, grads = [], []
+    for chunk_size in [0, joint_chunk_size]:
+        args = make_args(ctc_weight=0.0, dropout=0.0, dropout_emb=0.0, joint_chunk_size=chunk_size)
+        torch.manual_seed(1)
+        dec = module.RNNTransducer(**args)
+
+        def transducer_loss(logits, ys_out, elens, ylens):
+            return rnnt_loss(torch.log_softmax(logits, dim=-1), ys_out, elens, ylens, blank=dec.blank)
+        dec.transducer_loss = transducer_loss
+
+        eouts_b = eouts.clone().requires_grad_()
+        loss = dec.forward_transducer(eouts_b, elens, ys)
+        loss.backward()
+        losses.append(loss)
+        grads.append([eouts_b.grad] + [p.grad for p in dec.parameters() if p.grad is not None])
+
+    assert torch.allclose(losses[0], losses[1], atol=1e-5)
+    assert len(grads[0]) == len(grads[1])
+    for g_full, g_chunk in zip(*grads):
+        assert torch.allclose(g_full, g_chunk, atol=1e-5)
+
+
 def make_decode_params(**kwargs):
     args = dict(
         recog_batch_size=1,
@@ -203,3 +260,46 @@ def test_decoding(params):
             assert len(nbest_hyps[0]) == params['nbest']
             assert aws is None
             assert scores is None
+
+
+@pytest.mark.parametrize("lm_type", ['ngram', 'wordlm'])
+@pytest.mark.parametrize("lm_state_carry_over", [False, True])
+def test_decoding_lm(tmp_path, lm_type, lm_state_carry_over):
+    args = make_args()
+    params = make_decode_params(recog_beam_width=4, recog_lm_weight=1.0,
+                                recog_lm_state_carry_over=lm_state_carry_over)
+    batch_size = params['recog_batch_size']
+    emax = 40
+    device = "cpu"
+
+    eouts = np.random.randn(batch_size, emax, ENC_N_UNITS).astype(np.float32)
+    elens = torch.IntTensor([len(x) for x in eouts])
+    eouts = pad_list([np2tensor(x, device).float() for x in eouts], 0.)
+
+    lm = make_fusion_lm(lm_type, tmp_path).to(device)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.rnn_transducer')
+    dec = module.RNNTransducer(**args)
+    dec = dec.to(device)
+
+    dec.eval()
+    with torch.no_grad():
+        outs = []
+        for _ in range(2):
+            nbest_hyps, _, _ = dec.beam_search(
+                eouts, elens, params, idx2token=None, lm=lm,
+                nbest=params['nbest'], exclude_eos=False,
+                refs_id=None, utt_ids=None, speakers=['spk'] * batch_size)
+            assert len(nbest_hyps) == batch_size
+            outs.append(nbest_hyps)
+
+        # same results as with LM scores over the whole vocabulary
+        n_calls = fuse_full_vocab(lm, lm_type)
+        dec.prev_spk = ''  # reset states carried over
+        for nbest_hyps in outs:
+            nbest_hyps_ref, _, _ = dec.beam_search(
+                eouts, elens, params, idx2token=None, lm=lm,
+                nbest=params['nbest'], exclude_eos=False,
+                refs_id=None, utt_ids=None, speakers=['spk'] * batch_size)
+            assert all(np.array_equal(hyps[0], hyps_ref[0]) for hyps, hyps_ref in zip(nbest_hyps, nbest_hyps_ref))
+        assert n_calls[0] > 0
@@ -12,6 +12,8 @@ import torch
 from neural_sp.models.torch_utils import np2tensor
 from neural_sp.models.torch_utils import pad_list
 
+from test_las_decoder import fuse_full_vocab, make_fusion_lm
+
 
 ENC_N_UNITS = 16
 VOCAB = 10
@@ -32,6 +34,8 @@ def make_args(**kwargs):
         ffn_activation='relu',
         vocab=VOCAB,
         tie_embedding=False,
+        adaptive_softmax=False,
+        adaptive_softmax_cutoffs='',
         dropout=0.1,
         dropout_emb=0.1,
         dropout_att=0.1,
@@ -62,6 +66,7 @@ def make_args(**kwargs):
         external_lm=None,
         lm_fusion='',
         # lm_init=False,
+        loss_vocab_chunk_size=0,
     )
     args.update(kwargs)
     return args
@@ -102,6 +107,7 @@ def make_args(**kwargs):
         ({'dropout_layer': 0.1}),
         ({'dropout_head': 0.1}),
         ({'tie_embedding': True}),
+        ({'adaptive_softmax': True, 'adaptive_softmax_cutoffs': '4_7'}),
         # CTC
         ({'ctc_weight': 0.5}),
         ({'ctc_weight': 1.0}),
@@ -329,3 +335,144 @@ def test_decoding(backward, params):
             assert isinstance(scores, list)
             assert len(scores) == batch_size
             assert len(scores[0]) == params['nbest']
+
+
+@pytest.mark.parametrize("lm_type", ['ngram', 'wordlm'])
+@pytest.mark.parametrize("lm_state_carry_over", [False, True])
+def test_decoding_lm(tmp_path, lm_type, lm_state_carry_over):
+    args = make_args()
+    params = make_decode_params(recog_beam_width=4, recog_lm_weight=1.0,
+                                recog_lm_state_carry_over=lm_state_carry_over)
+    batch_size = params['recog_batch_size']
+    emax = 40
+    device = "cpu"
+
+    eouts = np.random.randn(batch_size, emax, ENC_N_UNITS).astype(np.float32)
+    elens = torch.IntTensor([len(x) for x in eouts])
+    eouts = pad_list([np2tensor(x, device).float() for x in eouts], 0.)
+
+    lm = make_fusion_lm(lm_type, tmp_path).to(device)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.transformer')
+    dec = module.TransformerDecoder(**args)
+    dec = dec.to(device)
+
+    dec.eval()
+    with torch.no_grad():
+        outs = []
+        for _ in range(2):
+            nbest_hyps, _, scores = dec.beam_search(
+                eouts, elens, params, idx2token=None, lm=lm,
+                nbest=params['nbest'], exclude_eos=params['exclude_eos'],
+                refs_id=None, utt_ids=None, speakers=['spk'] * batch_size)
+            assert len(nbest_hyps) == batch_size
+            outs.append((nbest_hyps, scores))
+
+        # same results as with LM scores over the whole vocabulary
+        n_calls = fuse_full_vocab(lm, lm_type)
+        dec.prev_spk = ''  # reset states carried over
+        for nbest_hyps, scores in outs:
+            nbest_hyps_ref, _, scores_ref = dec.beam_search(
+                eouts, elens, params, idx2token=None, lm=lm,
+                nbest=params['nbest'], exclude_eos=params['exclude_eos'],
+                refs_id=None, utt_ids=None, speakers=['spk'] * batch_size)
+            assert all(np.array_equal(hyps[0], hyps_ref[0]) for hyps, hyps_ref in zip(nbest_hyps, nbest_hyps_ref))
+            assert np.allclose(scores, scores_ref, atol=1e-4)
+        assert n_calls[0] > 0
+
+
+def make_transformer_lm(lm_type, mem_len):
+    args_lm = argparse.Namespace(
+        lm_type=lm_type, transformer_attn_type='scaled_dot', transformer_n_heads=4,
+        n_layers=2, transformer_d_model=16, transformer_d_ff=64, transformer_layer_norm_eps=1e-12,
+        transformer_ffn_activation='relu', transformer_pe_type='add', vocab=VOCAB,
+        dropout_in=0.1, dropout_hidden=0.1, dropout_att=0.1, dropout_layer=0.0, lsm_prob=0.0,
+        transformer_param_init='xavier_uniform', bptt=200, mem_len=0, recog_mem_len=mem_len,
+        zero_center_offset=False, adaptive_softmax=False, tie_embedding=False)
+    if lm_type == 'transformer_xl':
+        module = importlib.import_module('neural_sp.models.lm.transformer_xl')
+        return module.TransformerXL(args_lm)
+    module = importlib.import_module('neural_sp.models.lm.transformerlm')
+    return module.TransformerLM(args_lm)
+
+
+@pytest.mark.parametrize("lm_type", ['transformer', 'transformer_xl'])
+@pytest.mark.parametrize("lm_state_carry_over", [False, True])
+def test_decoding_transformer_lm(lm_type, lm_state_carry_over):
+    args = make_args()
+    params = make_decode_params(recog_beam_width=4, recog_lm_weight=0.1,
+                                recog_lm_state_carry_over=lm_state_carry_over)
+    batch_size = params['recog_batch_size']
+    emax = 40
+    mem_len = 5
+    device = "cpu"
+
+    eouts = np.random.randn(batch_size, emax, ENC_N_UNITS).astype(np.float32)
+    elens = torch.IntTensor([len(x) for x in eouts])
+    eouts = pad_list([np2tensor(x, device).float() for x in eouts], 0.)
+
+    lm = make_transformer_lm(lm_type, mem_len).to(device)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.transformer')
+    dec = module.TransformerDecoder(**args)
+    dec = dec.to(device)
+
+    dec.eval()
+    with torch.no_grad():
+        for _ in range(3):
+            nbest_hyps, aws, scores = dec.beam_search(
+                eouts, elens, params, idx2token=None, lm=lm,
+                nbest=params['nbest'], exclude_eos=params['exclude_eos'],
+                refs_id=None, utt_ids=None, speakers=['spk'] * batch_size)
+            assert len(nbest_hyps) == batch_size
+            # states of past tokens are bounded by the memory length
+            if lm_type == 'transformer':
+                assert all(state.size(1) <= mem_len for state in dec.lmstate_final[1])
+            else:
+                assert all(mem.size(1) <= mem_len for mem in dec.lmmemory)
+
+
+@pytest.mark.parametrize("beam_width", [1, 4])
+def test_decoding_adaptive_softmax(beam_width):
+    args = make_args(adaptive_softmax=True, adaptive_softmax_cutoffs='4_7')
+    params = make_decode_params(recog_beam_width=beam_width)
+    batch_size = params['recog_batch_size']
+    emax = 40
+    device = "cpu"
+
+    eouts = np.random.randn(batch_size, emax, ENC_N_UNITS).astype(np.float32)
+    elens = torch.IntTensor([len(x) for x in eouts])
+    eouts = pad_list([np2tensor(x, device).float() for x in eouts], 0.)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.transformer')
+    dec = module.TransformerDecoder(**args)
+    dec = dec.to(device)
+
+    dec.eval()
+    with torch.no_grad():
+        if beam_width == 1:
+            hyps, _ = dec.greedy(eouts, elens, max_len_ratio=1.0, idx2token=None)
+            assert len(hyps) == batch_size
+        else:
+            nbest_hyps, _, scores = dec.beam_search(eouts, elens, params, idx2token=None)
+            assert len(nbest_hyps) == batch_size
+            # scores are accumulated from normalized log-probabilities
+            assert all(s[0] <= 0 for s in scores)
+
+        # same results as with log-probabilities over the whole vocabulary
+        n_calls = [0]
+
+        def full(xs, k=None):
+            n_calls[0] += 1
+            return dec.output(xs) if k is not None else dec.output(xs).argmax(-1)
+
+        dec.output.argmax = full
+        dec.output.log_prob_topk = full
+        if beam_width == 1:
+            hyps_ref, _ = dec.greedy(eouts, elens, max_len_ratio=1.0, idx2token=None)
+            assert all(np.array_equal(hyp, hyp_ref) for hyp, hyp_ref in zip(hyps, hyps_ref))
+        else:
+            nbest_hyps_ref, _, scores_ref = dec.beam_search(eouts, elens, params, idx2token=None)
+            assert all(np.array_equal(hyp, hyp_ref) for hyp, hyp_ref in zip(nbest_hyps[0], nbest_hyps_ref[0]))
+            assert np.allclose(scores[0], scores_ref[0], atol=1e-4)
+        assert n_calls[0] > 0
@@ -47,6 +47,82 @@ def make_args(**kwargs):
     return args
 
 
+def _forward_latency_controlled_ref(enc, xs, xlens, N_l, N_r, streaming, task='all'):
+    """Chunk-by-chunk counterpart of RNNEncoder._forward_latency_contolled.
+
+    Args:
+        enc (RNNEncoder):
+        xs (FloatTensor): `[B, T, n_units]`
+    Returns:
+        xs (FloatTensor): `[B, T, n_units]`
+
+    """
+    bs, xmax, _ = xs.size()
+    n_chunks = math.ceil(xmax / N_l)
+
+    if streaming:
+        xlens = torch.IntTensor(bs).fill_(min(xmax, N_l))
+
+    xs_chunks = []
+    xs_chunks_sub1 = []
+    for chunk_idx, t in enumerate(range(0, N_l * n_chunks, N_l)):
+        xs_chunk = xs[:, t:t + (N_l + N_r)]
+        _N_l = N_l
+
+        for lth in range(enc.n_layers):
+            enc.rnn[lth].flatten_parameters()  # for multi-GPUs
+            enc.rnn_bwd[lth].flatten_parameters()  # for multi-GPUs
+            # bwd
+            xs_chunk_bwd = torch.flip(enc.rnn_bwd[lth](
+                torch.flip(xs_chunk, dims=[1]))[0], dims=[1])  # `[B, _N_l+_N_r, n_units]`
+            # fwd
+            if xs_chunk.size(1) <= _N_l:
+                xs_chunk_fwd, enc.hx_fwd[lth] = enc.rnn[lth](xs_chunk, hx=enc.hx_fwd[lth])
+            else:
+                xs_chunk_fwd1, enc.hx_fwd[lth] = enc.rnn[lth](xs_chunk[:, :_N_l], hx=enc.hx_fwd[lth])
+                xs_chunk_fwd2, _ = enc.rnn[lth](xs_chunk[:, _N_l:], hx=enc.hx_fwd[lth])
+                xs_chunk_fwd = torch.cat([xs_chunk_fwd1, xs_chunk_fwd2], dim=1)  # `[B, _N_l+_N_r, n_units]`
+                # NOTE: xs_chunk_fwd2 is used for xs_chunk_bwd in the next layer
+            if enc.bidir_sum:
+                xs_chunk = xs_chunk_fwd + xs_chunk_bwd
+            else:
+                xs_chunk = torch.cat([xs_chunk_fwd, xs_chunk_bwd], dim=-1)
+            xs_chunk = enc.dropout(xs_chunk)
+
+            # Pick up outputs in the sub task before the projection layer
+            if lth == enc.n_layers_sub1 - 1:
+                xs_chunk_sub1 = xs_chunk.clone()
+                if enc.bridge_sub1 is not None:
+                    xs_chunk_sub1 = enc.bridge_sub1(xs_chunk_sub1)
+                if task == 'ys_sub1':
+                    return None, xlens, xs_chunk_sub1
+
+            # Projection layer
+            if enc.proj is not None and lth != enc.n_layers - 1:
+                xs_chunk = torch.relu(enc.proj[lth](xs_chunk))
+            # Subsampling layer
+            if enc.subsample is not None:
+                xs_chunk, xlens_tmp = enc.subsample[lth](xs_chunk, xlens)
+                if chunk_idx == 0:
+                    xlens = xlens_tmp
+                _N_l = _N_l // enc.subsample[lth].factor
+
+        xs_chunks.append(xs_chunk[:, :_N_l])
+        if enc.n_layers_sub1 > 0:
+            xs_chunks_sub1.append(xs_chunk_sub1[:, :_N_l])
+
+        if streaming:
+            break
+
+    xs = torch.cat(xs_chunks, dim=1)
+    if enc.n_layers_sub1 > 0:
+        xs_sub1 = torch.cat(xs_chunks_sub1, dim=1)
+    else:
+        xs_sub1 = None
+
+    return xs, xlens, xs_sub1
+
+
 @pytest.mark.parametrize(
     "args",
     [
@@ -194,3 +270,75 @@ def test_forward(args):
             enc_out_dict_sub12 = enc(xs, xlens, task='ys_sub2')
             assert enc_out_dict_sub12['ys_sub2']['xs'].size(0) == batch_size
             assert enc_out_dict_sub12['ys_sub2']['xs'].size(1) == enc_out_dict_sub12['ys_sub2']['xlens'].max()
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'enc_type': 'blstm', 'chunk_size_left': "40", 'chunk_size_right': "40"}),
+        ({'enc_type': 'blstm', 'chunk_size_left': "40", 'chunk_size_right': "20"}),
+        ({'enc_type': 'blstm', 'chunk_size_left': "20", 'chunk_size_right': "40"}),
+        ({'enc_type': 'blstm', 'chunk_size_left': "40", 'chunk_size_right': "0"}),
+        ({'enc_type': 'bgru', 'chunk_size_left': "40", 'chunk_size_right': "20"}),
+        ({'enc_type': 'blstm', 'bidir_sum_fwd_bwd': True, 'n_projs': 8,
+          'chunk_size_left': "40", 'chunk_size_right': "40"}),
+        ({'enc_type': 'blstm', 'n_layers_sub1': 3,
+          'chunk_size_left': "40", 'chunk_size_right': "40"}),
+        ({'enc_type': 'blstm', 'n_layers_sub1': 1, 'subsample': "1_2_1_1",
+          'chunk_size_left': "40", 'chunk_size_right': "20"}),
+        ({'enc_type': 'blstm', 'subsample': "1_2_1_1", 'subsample_type': 'drop',
+          'chunk_size_left': "40", 'chunk_size_right': "20"}),
+        ({'enc_type': 'blstm', 'subsample': "1_2_1_1", 'subsample_type': 'concat',
+          'chunk_size_left': "40", 'chunk_size_right': "20"}),
+        ({'enc_type': 'blstm', 'subsample': "1_2_1_1", 'subsample_type': 'max_pool',
+          'chunk_size_left': "40", 'chunk_size_right': "20"}),
+        ({'enc_type': 'blstm', 'subsample': "1_2_1_1", 'subsample_type': '1dconv',
+          'chunk_size_left': "40", 'chunk_size_right': "20"}),
+        ({'enc_type': 'blstm', 'subsample': "1_2_1_1", 'subsample_type': 'add',
+          'chunk_size_left': "40", 'chunk_size_right': "20"}),
+        ({'enc_type': 'bgru', 'subsample': "1_2_2_1", 'subsample_type': 'max_pool',
+          'chunk_size_left': "40", 'chunk_size_right': "20"}),
+    ]
+)
+def test_forward_latency_controlled_parity(args):
+    args = make_args(**args)
+    args['dropout_in'] = 0.
+    args['dropout'] = 0.
+
+    batch_size = 4
+    xmaxs = [17, 400, 433, 455]
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.seq2seq.encoders.rnn')
+    enc = module.RNNEncoder(**args)
+    enc = enc.to(device)
+    enc.eval()
+    N_l, N_r = enc.chunk_size_left, enc.chunk_size_right
+
+    for xmax in xmaxs:
+        xs = torch.randn(batch_size, xmax, args['input_dim'])
+        xlens = torch.IntTensor([max(1, xmax - i) for i in range(batch_size)])
+
+        for streaming in [False, True]:
+            enc.reset_cache()
+            xs_ref, xlens_ref, xs_sub1_ref = _forward_latency_controlled_ref(
+                enc, xs, xlens, N_l, N_r, streaming)
+            enc.reset_cache()
+            xs_out, xlens_out, xs_sub1 = enc._forward_latency_contolled(
+                xs, xlens, N_l, N_r, streaming)
+            assert xs_out.size() == xs_ref.size()
+            assert torch.allclose(xs_out, xs_ref, atol=1e-5)
+            assert torch.equal(xlens_out, xlens_ref)
+            if xs_sub1_ref is not None:
+                assert torch.allclose(xs_sub1, xs_sub1_ref, atol=1e-5)
+
+        # gradient parity
+        enc.reset_cache()
+        xs_ref = _forward_latency_controlled_ref(enc, xs, xlens, N_l, N_r, False)[0]
+        grads_ref = torch.autograd.grad(xs_ref.pow(2).sum(), list(enc.parameters()), allow_unused=True)
+        enc.reset_cache()
+        xs_out = enc._forward_latency_contolled(xs, xlens, N_l, N_r, False)[0]
+        grads = torch.autograd.grad(xs_out.pow(2).sum(), list(enc.parameters()), allow_unused=True)
+        for g, g_ref in zip(grads, grads_ref):
+            if g_ref is not None:
+                assert torch.allclose(g, g_ref, atol=1e-4)
@@ -0,0 +1,102 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for edit distance."""
+
+import importlib
+import numpy as np
+import pytest
+import random
+
+
+def compute_wer_ref(ref, hyp):
+    """Naive dynamic programming with the same backtracking rule."""
+    d = [[0] * (len(hyp) + 1) for _ in range(len(ref) + 1)]
+    for i in range(len(ref) + 1):
+        d[i][0] = i
+    for j in range(len(hyp) + 1):
+        d[0][j] = j
+    for i in range(1, len(ref) + 1):
+        for j in range(1, len(hyp) + 1):
+            d[i][j] = min(d[i - 1][j - 1] + (ref[i - 1] != hyp[j - 1]), d[i - 1][j] + 1, d[i][j - 1] + 1)
+
+    x, y = len(ref), len(hyp)
+    n_sub, n_ins, n_del = 0, 0, 0
+    while x > 0 or y > 0:
+        if x > 0 and y > 0 and d[x][y] == d[x - 1][y - 1] and ref[x - 1] == hyp[y - 1]:
+            x, y = x - 1, y - 1
+        elif y > 0 and d[x][y] == d[x][y - 1] + 1:
+            n_ins += 1
+            y -= 1
+        elif x > 0 and y > 0 and d[x][y] == d[x - 1][y - 1] + 1:
+            n_sub += 1
+            x, y = x - 1, y - 1
+        else:
+            n_del += 1
+            x -= 1
+    return n_sub, n_ins, n_del
+
+
+def make_pairs(n_pairs, vocab, max_len, seed=0):
+    random.seed(seed)
+    refs, hyps = [], []
+    for _ in range(n_pairs):
+        ref = [random.choice(vocab) for _ in range(random.randint(0, max_len))]
+        if random.random() < 0.5:
+            # hypothesis close to the reference
+            hyp = [t if random.random() < 0.8 else random.choice(vocab) for t in ref]
+            if len(hyp) > 0 and random.random() < 0.5:
+                del hyp[random.randrange(len(hyp))]
+            if random.random() < 0.5:
+                hyp.insert(random.randint(0, len(hyp)), random.choice(vocab))
+        else:
+            hyp = [random.choice(vocab) for _ in range(random.randint(0, max_len))]
+        refs.append(ref)
+        hyps.append(hyp)
+    return refs, hyps
+
+
+@pytest.mark.parametrize(
+    "vocab, max_len, max_cells",
+    [
+        (['a', 'b'], 10, 2 ** 24),  # many ties
+        (['a', 'b', 'c', 'd', 'e'], 30, 2 ** 24),
+        ([str(i) for i in range(100)], 30, 2 ** 24),
+        (['a', 'b', 'c'], 30, 1000),  # split into small chunks
+    ]
+)
+def test_edit_distance_batch(vocab, max_len, max_cells):
+    module = importlib.import_module('neural_sp.evaluators.edit_distance')
+    refs, hyps = make_pairs(500, vocab, max_len)
+    n_sub, n_ins, n_del = module.edit_distance_batch(refs, hyps, max_cells=max_cells)
+    for b in range(len(refs)):
+        assert (n_sub[b], n_ins[b], n_del[b]) == compute_wer_ref(refs[b], hyps[b])
+
+    # the same results one by one
+    for b in range(0, len(refs), 50):
+        assert module.compute_wer(refs[b], hyps[b]) == (
+            (n_sub[b] + n_ins[b] + n_del[b]) * 100, n_sub[b] * 100, n_ins[b] * 100, n_del[b] * 100)
+
+
+def test_compute_wer_batch():
+    module = importlib.import_module('neural_sp.evaluators.edit_distance')
+    refs = ['a b c'.split(' '), 'a b'.split(' '), [], 'a'.split(' ')]
+    hyps = ['a x c d'.split(' '), [], 'a'.split(' '), 'a'.split(' ')]
+    wer, n_sub, n_ins, n_del = module.compute_wer_batch(refs, hyps)
+    assert wer.tolist() == [200, 200, 100, 0]
+    assert n_sub.tolist() == [100, 0, 0, 0]
+    assert n_ins.tolist() == [100, 0, 100, 0]
+    assert n_del.tolist() == [0, 200, 0, 0]
+
+    wer, n_sub, n_ins, n_del = module.compute_wer_batch([], [])
+    assert wer.sum() == 0 and len(n_sub) == 0
+
+
+def test_compute_wer_long():
+    """Distances beyond the range of uint16."""
+    module = importlib.import_module('neural_sp.evaluators.edit_distance')
+    ref = list(np.random.RandomState(0).choice(['a', 'b'], size=70000))
+    wer, n_sub, n_ins, n_del = module.compute_wer(ref, ['c'])
+    assert (wer, n_sub, n_ins, n_del) == (7000000, 100, 0, 6999900)
+    wer, _, _, _ = module.compute_wer(ref, ['c'], normalize=True)
+    assert wer == pytest.approx(100.)
@@ -0,0 +1,176 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for the evaluation pipeline."""
+
+import importlib
+import numpy as np
+import pytest
+import time
+
+VOCAB = ['<blank>', '<unk>', '<eos>', 'a', 'b', 'c', 'd']
+
+
+def idx2token(ids):
+    return ' '.join([VOCAB[i] for i in ids])
+
+
+class DataLoader(object):
+    """Minimal evaluation dataloader."""
+
+    def __init__(self, n_utts, unit='word', corpus='test'):
+        rng = np.random.RandomState(0)
+        self.refs = [[int(i) for i in rng.randint(3, len(VOCAB), size=rng.randint(1, 10))]
+                     for _ in range(n_utts)]
+        self.idx2token = [idx2token]
+        self.corpus = corpus
+        self.set = 'eval'
+        self.unit = unit
+        self.unit_sub1 = None
+        self.offset = 0
+        self.batch_size = 1
+
+    def __len__(self):
+        return len(self.refs)
+
+    def reset(self, batch_size=None):
+        self.offset = 0
+        if batch_size is not None:
+            self.batch_size = batch_size
+
+    def next(self, batch_size=None):
+        indices = list(range(self.offset, min(self.offset + batch_size, len(self.refs))))
+        self.offset += batch_size
+        time.sleep(0.001)
+        batch = {'xs': [np.zeros((10, 4))] * len(indices),
+                 'xlens': [10] * len(indices),
+                 'ys': [self.refs[i] for i in indices],
+                 'text': [idx2token(self.refs[i]) for i in indices],
+                 'utt_ids': ['utt%03d' % i for i in indices],
+                 'speakers': ['spk-%d' % (i % 3) for i in indices]}
+        return batch, self.offset >= len(self.refs)
+
+
+class Model(object):
+    """Hypothesis with substitution, deletion and insertion."""
+
+    save_path = None
+
+    def decode(self, xs, params, refs_id, **kwargs):
+        time.sleep(0.002)
+        hyps = []
+        for ref in refs_id:
+            hyp = list(ref)
+            hyp[0] = 3 if hyp[0] != 3 else 4
+            if len(hyp) > 2:
+                hyp.pop(1)
+            hyp.append(5)
+            hyps.append(np.array(hyp))
+        return hyps, None
+
+    def streamable(self):
+        return False
+
+    def last_success_frame_ratio(self):
+        return 0.5
+
+    def quantity_rate(self):
+        return 1.
+
+    def decode_streaming(self, *args, **kwargs):
+        raise NotImplementedError
+
+
+RECOG_PARAMS = {'recog_batch_size': 4, 'recog_chunk_sync': False, 'recog_resolving_unk': False}
+
+
+def expected_errors(dataloader, char=False):
+    module = importlib.import_module('neural_sp.evaluators.edit_distance')
+    model = Model()
+    refs = [idx2token(ref) for ref in dataloader.refs]
+    hyps = [idx2token(hyp) for hyp in model.decode(None, None, dataloader.refs)[0]]
+    n_err, n_ref = 0, 0
+    for ref, hyp in zip(refs, hyps):
+        ref, hyp = (list(ref), list(hyp)) if char else (ref.split(' '), hyp.split(' '))
+        n_err += module.compute_wer(ref, hyp)[0]
+        n_ref += len(ref)
+    return n_err / n_ref, refs, hyps
+
+
+def read_trn(path):
+    with open(path) as f:
+        return [line.rsplit(' (', 1)[0] for line in f]
+
+
+@pytest.mark.parametrize(
+    "evaluator, metric",
+    [
+        ('word', 'wer'),
+        ('wordpiece', 'wer'),
+        ('wordpiece', 'cer'),
+        ('character', 'wer'),
+        ('character', 'cer'),
+        ('phone', 'per'),
+    ]
+)
+def test_evaluators(tmp_path, evaluator, metric):
+    module = importlib.import_module('neural_sp.evaluators.' + evaluator)
+    dataloader = DataLoader(n_utts=37, unit='char' if evaluator == 'character' else 'word')
+    fn = {'word': 'eval_word', 'wordpiece': 'eval_wordpiece',
+          'character': 'eval_char', 'phone': 'eval_phone'}[evaluator]
+    results = getattr(module, fn)([Model()], dataloader, RECOG_PARAMS, epoch=1,
+                                  recog_dir=str(tmp_path))
+    results = results if isinstance(results, tuple) else (results,)
+    value = results[1] if metric == 'cer' else results[0]
+
+    error_rate, refs, hyps = expected_errors(dataloader, char=metric == 'cer')
+    assert value == pytest.approx(error_rate)
+    # utterances are written in order
+    assert read_trn(str(tmp_path / 'ref.trn')) == refs
+    assert read_trn(str(tmp_path / 'hyp.trn')) == hyps
+    assert dataloader.offset == 0  # reset
+
+
+@pytest.mark.parametrize("n_prefetch", [0, 1, 2])
+def test_pipeline(tmp_path, n_prefetch):
+    module = importlib.import_module('neural_sp.evaluators.pipeline')
+    dataloader = DataLoader(n_utts=10)
+    model = Model()
+
+    def postprocess(batch, hyps_id):
+        refs = batch['text']
+        hyps = [idx2token(hyp) for hyp in hyps_id]
+        pipeline.wer.add([ref.split(' ') for ref in refs], [hyp.split(' ') for hyp in hyps])
+        return refs, hyps
+
+    with module.EvalPipeline(dataloader, 3, str(tmp_path / 'ref.trn'), str(tmp_path / 'hyp.trn'),
+                             n_prefetch=n_prefetch) as pipeline:
+        n_batches = 0
+        for batch in pipeline:
+            pipeline.submit(postprocess, batch, model.decode(None, None, batch['ys'])[0])
+            n_batches += 1
+    assert n_batches == 4
+    assert pipeline.wer.n_ref == sum(len(ref) for ref in dataloader.refs)
+    assert pipeline.wer.rates()[0] == pytest.approx(expected_errors(dataloader)[0])
+
+
+def test_pipeline_error(tmp_path):
+    module = importlib.import_module('neural_sp.evaluators.pipeline')
+    dataloader = DataLoader(n_utts=10)
+
+    def postprocess(batch):
+        raise ValueError('postprocess')
+
+    with pytest.raises(ValueError, match='postprocess'):
+        with module.EvalPipeline(dataloader, 3, str(tmp_path / 'ref.trn'),
+                                 str(tmp_path / 'hyp.trn')) as pipeline:
+            for batch in pipeline:
+                pipeline.submit(postprocess, batch)
+
+    # errors in decoding stop loading
+    with pytest.raises(RuntimeError):
+        with module.EvalPipeline(dataloader, 3, str(tmp_path / 'ref.trn'),
+                                 str(tmp_path / 'hyp.trn')) as pipeline:
+            for batch in pipeline:
+                raise RuntimeError
+    assert dataloader.offset == 0
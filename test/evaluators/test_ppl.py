@@ -0,0 +1,186 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for perplexity evaluation of LMs."""
+
+import argparse
+import importlib
+import numpy as np
+import pytest
+import torch
+
+VOCAB = 30
+
+
+def make_dataset(tmp_path, bptt, n_utts=60):
+    rng = np.random.RandomState(0)
+    dict_path = str(tmp_path / 'dict.txt')
+    with open(dict_path, 'w') as f:
+        f.write('<unk> 1\n<eos> 2\n<pad> 3\n')
+        for i in range(4, VOCAB):
+            f.write('w%d %d\n' % (i, i))
+    tsv_path = str(tmp_path / 'eval.tsv')
+    with open(tsv_path, 'w') as f:
+        f.write('utt_id\tspeaker\tfeat_path\txlen\txdim\ttext\ttoken_id\tylen\tydim\n')
+        for i in range(n_utts):
+            ids = rng.randint(4, VOCAB, size=rng.randint(3, 15))
+            f.write('utt%04d\tspk\tdummy\t0\t0\t%s\t%s\t%d\t%d\n' % (
+                i, ' '.join(['w%d' % t for t in ids]), ' '.join(map(str, ids)), len(ids), VOCAB))
+    module = importlib.import_module('neural_sp.datasets.lm')
+    return module.Dataset(tsv_path=tsv_path, dict_path=dict_path, unit='word',
+                          batch_size=1, bptt=bptt, is_test=True)
+
+
+def build_model(lm_type, **kwargs):
+    args = dict(vocab=VOCAB, dropout_in=0.1, dropout_hidden=0.1, lsm_prob=0.0,
+                adaptive_softmax=False, tie_embedding=False)
+    if lm_type == 'lstm':
+        args.update(lm_type='lstm', n_units=32, n_projs=0, n_layers=2, residual=False,
+                    use_glu=False, n_units_null_context=0, bottleneck_dim=16, emb_dim=16,
+                    param_init=0.1)
+        module, cls = 'rnnlm', 'RNNLM'
+    else:
+        args.update(lm_type='transformer', transformer_n_heads=4, n_layers=2,
+                    transformer_d_model=16, transformer_d_ff=64,
+                    transformer_layer_norm_eps=1e-12, transformer_ffn_activation='relu',
+                    transformer_pe_type='add', dropout_att=0.1, dropout_layer=0.0,
+                    transformer_param_init='xavier_uniform', mem_len=0, recog_mem_len=0,
+                    bptt=10, zero_center_offset=False)
+        module, cls = ('transformer_xl', 'TransformerXL') if lm_type == 'transformer_xl' \
+            else ('transformerlm', 'TransformerLM')
+    args.update(kwargs)
+    torch.manual_seed(1)
+    module = importlib.import_module('neural_sp.models.lm.' + module)
+    return getattr(module, cls)(argparse.Namespace(**args))
+
+
+def eval_ppl_single_stream(model, dataset, bptt):
+    """The previous evaluation walking the corpus as a single stream."""
+    dataset.reset()
+    total_loss, n_tokens = 0, 0
+    state = None
+    while True:
+        ys, is_new_epoch = dataset.next(1, bptt)
+        loss, state = model(ys, state, is_eval=True)[:2]
+        total_loss += loss.item() * (ys.shape[1] - 1)
+        n_tokens += ys.shape[1] - 1
+        if is_new_epoch:
+            break
+    dataset.reset()
+    return np.exp(total_loss / n_tokens)
+
+
+@pytest.mark.parametrize(
+    "lm_type, kwargs",
+    [
+        ('lstm', {}),
+        ('lstm', {'adaptive_softmax': True}),
+        ('transformer', {}),
+        ('transformer', {'mem_len': 10}),
+        ('transformer_xl', {}),
+        ('transformer_xl', {'mem_len': 5}),
+    ]
+)
+def test_eval_ppl(tmp_path, lm_type, kwargs):
+    module = importlib.import_module('neural_sp.evaluators.ppl')
+    bptt = 10
+    dataset = make_dataset(tmp_path, bptt)
+    model = build_model(lm_type, **kwargs)
+    ppl_ref = eval_ppl_single_stream(model, dataset, bptt)
+
+    # single stream
+    ppl, _ = module.eval_ppl([model], dataset, batch_size=1, bptt=bptt)
+    assert ppl == pytest.approx(ppl_ref, rel=1e-5)
+
+    # parallel segments (context is reset at boundaries) or windows
+    ppl, _ = module.eval_ppl([model], dataset, batch_size=8, bptt=bptt)
+    if module.is_stateful(model):
+        assert ppl == pytest.approx(ppl_ref, rel=5e-2)
+    else:
+        assert ppl == pytest.approx(ppl_ref, rel=1e-5)
+
+    # longer context with a smaller stride
+    if not module.is_stateful(model):
+        ppl, _ = module.eval_ppl([model], dataset, batch_size=1, bptt=bptt, stride=3)
+        ppl_batch, _ = module.eval_ppl([model], dataset, batch_size=8, bptt=bptt, stride=3)
+        assert ppl_batch == pytest.approx(ppl, rel=1e-5)
+
+
+def eval_ppl_cache_per_token(model, dataset, n_caches):
+    """Cached PPL walking the corpus token by token as a single stream."""
+    dataset.reset()
+    model.reset_cache()
+    total_loss, n_tokens = 0, 0
+    state = None
+    while True:
+        ys, is_new_epoch = dataset.next(1, 10)
+        for t in range(ys.shape[1] - 1):
+            loss, state = model(ys[:, t:t + 2], state, is_eval=True, n_caches=n_caches)[:2]
+            total_loss += loss.item()
+            n_tokens += 1
+        if is_new_epoch:
+            break
+    dataset.reset()
+    model.reset_cache()
+    return np.exp(total_loss / n_tokens)
+
+
+@pytest.mark.parametrize(
+    "lm_type, kwargs",
+    [
+        ('lstm', {}),
+        ('lstm', {'adaptive_softmax': True}),
+        ('transformer', {'mem_len': 10}),
+        ('transformer_xl', {'mem_len': 5}),
+    ]
+)
+def test_eval_ppl_cache(tmp_path, lm_type, kwargs):
+    module = importlib.import_module('neural_sp.evaluators.ppl')
+    bptt, n_caches = 10, 20
+    dataset = make_dataset(tmp_path, bptt)
+    model = build_model(lm_type, **kwargs)
+    ppl_nocache, _ = module.eval_ppl([model], dataset, batch_size=1, bptt=bptt)
+
+    # no interpolation
+    model.cache_lambda = 0.
+    ppl, _ = module.eval_ppl([model], dataset, batch_size=1, bptt=bptt, n_caches=n_caches)
+    assert ppl == pytest.approx(ppl_nocache, rel=1e-5)
+
+    model.cache_lambda = 0.2
+    ppl, _ = module.eval_ppl([model], dataset, batch_size=1, bptt=bptt, n_caches=n_caches)
+    assert ppl != pytest.approx(ppl_nocache, rel=1e-5)
+    if lm_type == 'lstm':
+        # BPTT segments are identical to token-by-token evaluation for RNNLM
+        assert ppl == pytest.approx(eval_ppl_cache_per_token(model, dataset, n_caches), rel=1e-5)
+
+    # each segment has its own cache
+    ppl_batch, _ = module.eval_ppl([model], dataset, batch_size=8, bptt=bptt, n_caches=n_caches)
+    assert ppl_batch == pytest.approx(ppl, rel=5e-2)
+
+
+@pytest.mark.parametrize("n_tokens, bptt, stride", [(100, 10, 9), (100, 10, 1), (101, 10, 4), (5, 10, 3)])
+def test_sliding_windows(n_tokens, bptt, stride):
+    """Every target is scored once with at least `bptt - stride - 1` tokens of context."""
+    module = importlib.import_module('neural_sp.evaluators.ppl')
+    stream = np.arange(n_tokens) + 10
+    n_scored = np.zeros(n_tokens, dtype=np.int64)
+    for ys, mask in module._sliding_windows(stream, 4, bptt, stride, pad=-1):
+        for b in range(len(ys)):
+            for t in np.where(mask[b])[0]:
+                pos = ys[b, t + 1] - 10
+                n_scored[pos] += 1
+                assert t + 1 >= min(pos, bptt - stride - 1)  # context length
+    assert n_scored[0] == 0
+    assert (n_scored[1:] == 1).all()
+
+
+@pytest.mark.parametrize("n_segments", [1, 3, 8, 200])
+def test_split_segments(n_segments):
+    module = importlib.import_module('neural_sp.evaluators.ppl')
+    stream = np.arange(50) + 10
+    n_scored = np.zeros(50, dtype=np.int64)
+    for ys, mask in module._split_segments(stream, n_segments, 7, pad=-1):
+        assert ys.shape[0] == min(n_segments, 49)
+        n_scored[ys[:, 1:][mask] - 10] += 1
+    assert n_scored[0] == 0
+    assert (n_scored[1:] == 1).all()
@@ -0,0 +1,129 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for the latency profiler of streaming decoding."""
+
+import importlib
+import json
+import os
+import pytest
+
+
+FRAME_SHIFT = 10.
+
+
+class FakeClock(object):
+    """Replace time.time() so that computation time is deterministic."""
+
+    def __init__(self):
+        self.now = 0.
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def module(monkeypatch):
+    module = importlib.import_module('neural_sp.evaluators.streaming_latency')
+    monkeypatch.setattr(module, 'time', FakeClock())
+    return module
+
+
+def run_chunk(module, profiler, offset, n_cur, n_la, compute, n_tokens=None,
+              next_offset=None, is_final=False):
+    """Process a chunk taking `compute` [ms] for encoding."""
+    profiler.start_chunk(offset, n_cur, n_la)
+    with profiler.timer('encode'):
+        module.time.now += compute / 1000
+    if n_tokens is not None:
+        profiler.emit(n_tokens, is_final=is_final)
+    profiler.end_chunk(next_offset=next_offset)
+
+
+def test_real_time(module):
+    """Chunks faster than real time are emitted right after their arrival."""
+    profiler = module.StreamingLatencyProfiler(frame_shift=FRAME_SHIFT)
+    profiler.start_session('utt1', n_frames=100)
+    run_chunk(module, profiler, 0, 40, 10, compute=100, n_tokens=2)
+    run_chunk(module, profiler, 40, 40, 10, compute=100, n_tokens=3)
+    run_chunk(module, profiler, 80, 40, 10, compute=100, n_tokens=5, is_final=True)
+    profiler.end_session()
+
+    s = profiler.sessions[0]
+    assert [c['arrival'] for c in s['chunks']] == [500., 900., 1000.]
+    assert [c['emit_time'] for c in s['chunks']] == pytest.approx([600., 1000., 1100.])
+    assert [c['n_frames'] for c in s['chunks']] == [40, 40, 20]
+    assert [c['rtf'] for c in s['chunks']] == pytest.approx([0.25, 0.25, 0.5])
+    assert [t['chunk_idx'] for t in s['tokens']] == [0, 0, 1, 2, 2]
+    assert [t['delay'] for t in s['tokens']] == pytest.approx([600., 600., 600., 300., 300.])
+    assert s['tokens'][-1]['is_final'] and not s['tokens'][0]['is_final']
+    assert s['first_token_latency'] == pytest.approx(600.)
+    assert s['final_token_latency'] == pytest.approx(100.)
+    assert s['rtf'] == pytest.approx(0.3)
+
+
+def test_queueing(module):
+    """Chunks slower than real time wait for the previous chunk."""
+    profiler = module.StreamingLatencyProfiler(frame_shift=FRAME_SHIFT)
+    profiler.start_session('utt1', n_frames=80)
+    run_chunk(module, profiler, 0, 40, 0, compute=600, n_tokens=1)
+    run_chunk(module, profiler, 40, 40, 0, compute=600, n_tokens=2)
+    profiler.end_session()
+
+    s = profiler.sessions[0]
+    assert [c['emit_time'] for c in s['chunks']] == pytest.approx([1000., 1600.])
+    assert [c['rtf'] for c in s['chunks']] == pytest.approx([1.5, 1.5])
+    assert s['final_token_latency'] == pytest.approx(800.)
+
+
+def test_rewind(module):
+    """Frames after the boundary are not counted twice when the decoder backs off."""
+    profiler = module.StreamingLatencyProfiler(frame_shift=FRAME_SHIFT)
+    profiler.start_session('utt1', n_frames=100)
+    # boundary at the 25th frame of the first chunk
+    run_chunk(module, profiler, 0, 40, 0, compute=100, n_tokens=1, next_offset=25)
+    run_chunk(module, profiler, 25, 40, 0, compute=100, n_tokens=2, next_offset=65)
+    run_chunk(module, profiler, 65, 40, 0, compute=100, n_tokens=3)
+    profiler.end_session()
+
+    chunks = profiler.sessions[0]['chunks']
+    assert [c['offset'] for c in chunks] == [0, 25, 65]
+    assert [c['n_frames'] for c in chunks] == [25, 40, 35]
+    assert [c['n_rewound'] for c in chunks] == [15, 0, 0]
+    assert sum(c['n_frames'] for c in chunks) == 100
+    assert chunks[0]['rtf'] == pytest.approx(0.4)
+    # the second chunk re-reads frames that arrived before the first chunk was done
+    assert chunks[1]['emit_time'] == pytest.approx(max(chunks[0]['emit_time'], 650.) + 100)
+
+
+def test_disabled(module):
+    profiler = module.StreamingLatencyProfiler(enabled=False)
+    profiler.start_session('utt1', n_frames=100)
+    run_chunk(module, profiler, 0, 40, 10, compute=100, n_tokens=2, next_offset=20)
+    profiler.end_session()
+    assert profiler.sessions == []
+
+
+def test_save(module, tmp_path):
+    profiler = module.StreamingLatencyProfiler(frame_shift=FRAME_SHIFT)
+    for utt_id in ['utt1', 'utt2']:
+        profiler.start_session(utt_id, n_frames=80)
+        run_chunk(module, profiler, 0, 40, 0, compute=100, n_tokens=1, next_offset=30)
+        run_chunk(module, profiler, 30, 40, 0, compute=100, n_tokens=2)
+        run_chunk(module, profiler, 70, 40, 0, compute=100, n_tokens=2, is_final=True)
+        profiler.end_session()
+    summary = profiler.save(str(tmp_path))
+
+    assert summary['n_sessions'] == 2
+    assert summary['n_chunks'] == 6
+    assert summary['n_tokens'] == 4
+    with open(os.path.join(str(tmp_path), 'latency.json')) as f:
+        record = json.load(f)
+    assert record['summary'] == pytest.approx(summary)
+    assert [s['session_id'] for s in record['sessions']] == ['utt1', 'utt2']
+    with open(os.path.join(str(tmp_path), 'latency.csv')) as f:
+        lines = f.read().strip().split('\n')
+    header = lines[0].split(',')
+    assert len(lines) == 7
+    assert header[:6] == ['session_id', 'chunk_idx', 'offset', 'n_frames', 'n_rewound', 'end_frame']
+    assert lines[1].split(',')[:5] == ['utt1', '0', '0', '30', '10']
@@ -0,0 +1,95 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for frame stacking."""
+
+import importlib
+import numpy as np
+import pytest
+import torch
+
+from neural_sp.models.torch_utils import np2tensor
+from neural_sp.models.torch_utils import pad_list
+
+
+def _stack_frame_ref(feat, n_stacks, n_skips, dtype=np.float32):
+    """Reference implementation with a list used as a queue."""
+    if n_stacks == 1 and n_skips == 1:
+        return feat
+
+    if n_stacks < n_skips:
+        raise ValueError('n_skips must be less than n_stacks.')
+
+    T, input_dim = feat.shape
+    T_new = T // n_skips if T % n_stacks == 0 else (T // n_skips) + 1
+
+    stacked_feat = np.zeros((T_new, input_dim * n_stacks), dtype=dtype)
+    stack_count = 0
+    stack = []
+    for t, frame_t in enumerate(feat):
+        if t == len(feat) - 1:  # final frame
+            # Stack the final frame
+            stack.append(frame_t)
+
+            while stack_count != int(T_new):
+                # Concatenate stacked frames
+                for i in range(len(stack)):
+                    stacked_feat[stack_count][input_dim * i:input_dim * (i + 1)] = stack[i]
+                stack_count += 1
+
+                # Delete some frames to skip
+                for _ in range(n_skips):
+                    if len(stack) != 0:
+                        stack.pop(0)
+
+        elif len(stack) < n_stacks:  # first & middle frames
+            # Stack some frames until stack is filled
+            stack.append(frame_t)
+
+        if len(stack) == n_stacks:
+            # Concatenate stacked frames
+            for i in range(n_stacks):
+                stacked_feat[stack_count][input_dim * i:input_dim * (i + 1)] = stack[i]
+            stack_count += 1
+
+            # Delete some frames to skip
+            for _ in range(n_skips):
+                stack.pop(0)
+
+    return stacked_feat
+
+
+@pytest.mark.parametrize(
+    "n_stacks, n_skips",
+    [(1, 1), (2, 1), (2, 2), (3, 1), (3, 3), (4, 2), (4, 3), (5, 4)]
+)
+def test_stack_frame(n_stacks, n_skips):
+    module = importlib.import_module('neural_sp.models.seq2seq.frontends.frame_stacking')
+    xlens = [1, 2, 7, 12, 29, 40]
+    xs = [np.random.randn(xlen, 80).astype(np.float32) for xlen in xlens]
+    refs = [_stack_frame_ref(x, n_stacks, n_skips) for x in xs]
+
+    # NumPy (data workers)
+    for x, ref in zip(xs, refs):
+        out = module.stack_frame(x, n_stacks, n_skips)
+        assert out.shape == ref.shape
+        assert np.array_equal(out, ref)
+
+    # padded batch
+    xs = pad_list([np2tensor(x, "cpu").float() for x in xs], 0.)
+    out, out_lens = module.stack_frame_batch(xs, torch.IntTensor(xlens), n_stacks, n_skips)
+    assert out_lens.tolist() == [len(ref) for ref in refs]
+    assert torch.equal(out, pad_list([np2tensor(ref, "cpu") for ref in refs], 0.))
+
+
+@pytest.mark.parametrize("window", [1, 3, 5])
+def test_sliding_window_fallback(monkeypatch, window):
+    module = importlib.import_module('neural_sp.models.seq2seq.frontends.frame_stacking')
+    feat = np.random.randn(12, 8).astype(np.float32)
+    ref = np.stack([feat[t:t + window].T for t in range(12 - window + 1)], axis=0)
+    assert np.array_equal(module.sliding_window(feat, window), ref)
+
+    # numpy<1.20 does not have sliding_window_view
+    monkeypatch.delattr(np.lib.stride_tricks, 'sliding_window_view')
+    assert np.array_equal(module.sliding_window(feat, window), ref)
+    assert np.array_equal(module.stack_frame(feat, window, window), _stack_frame_ref(feat, window, window))
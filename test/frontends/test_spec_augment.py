@@ -0,0 +1,122 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for SpecAugment."""
+
+import importlib
+import numpy as np
+import pytest
+import torch
+
+from neural_sp.models.torch_utils import np2tensor
+from neural_sp.models.torch_utils import pad_list
+
+
+def make_args(**kwargs):
+    args = dict(
+        F=27,
+        T=20,
+        n_freq_masks=2,
+        n_time_masks=2,
+        p=1.0,
+        W=0,
+        adaptive_number_ratio=0,
+        adaptive_size_ratio=0,
+        max_n_time_masks=20,
+    )
+    args.update(kwargs)
+    return args
+
+
+def _spec_augment_ref(xs, F, T, n_freq_masks, n_time_masks, p):
+    """Reference implementation applying the same mask to all utterances in a batch."""
+    n_bins = xs.size(-1)
+    for i in range(n_freq_masks):
+        f = int(np.random.uniform(low=0, high=F))
+        f_0 = int(np.random.uniform(low=0, high=n_bins - f))
+        xs[:, :, f_0:f_0 + f] = 0
+    n_frames = xs.size(1)
+    for i in range(n_time_masks):
+        t = int(np.random.uniform(low=0, high=T))
+        t = min(t, int(n_frames * p))
+        t_0 = int(np.random.uniform(low=0, high=n_frames - t))
+        xs[:, t_0:t_0 + t] = 0
+    return xs
+
+
+def make_inputs(batch_size=8, xmax=100, input_dim=80):
+    xlens = torch.IntTensor([xmax - 3 * b for b in range(batch_size)])
+    xs = [np.random.randn(xlen, input_dim).astype(np.float32) + 10. for xlen in xlens.tolist()]
+    xs = pad_list([np2tensor(x, "cpu").float() for x in xs], 0.)
+    return xs, xlens
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'n_freq_masks': 2, 'n_time_masks': 2}),
+        ({'n_freq_masks': 0, 'n_time_masks': 2}),
+        ({'n_freq_masks': 2, 'n_time_masks': 0}),
+        ({'n_time_masks': 2, 'p': 0.2}),
+        ({'adaptive_number_ratio': 0.04}),
+        ({'adaptive_size_ratio': 0.05}),
+        ({'adaptive_number_ratio': 0.04, 'adaptive_size_ratio': 0.05, 'max_n_time_masks': 2}),
+        ({'W': 5}),
+    ]
+)
+def test_forward(args):
+    args = make_args(**args)
+    xs, xlens = make_inputs()
+
+    module = importlib.import_module('neural_sp.models.seq2seq.frontends.spec_augment')
+    specaug = module.SpecAugment(**args)
+    out = specaug(xs.clone(), xlens)
+    assert out.size() == xs.size()
+
+    for b, xlen in enumerate(xlens.tolist()):
+        # padding is left untouched
+        assert (out[b, xlen:] == 0).all()
+        zero = (out[b, :xlen] == 0)
+        # frequency masks span all frames, time masks span all bins
+        n_freq_masked = zero.all(0).sum().item()
+        n_time_masked = zero.all(1).sum().item()
+        assert n_freq_masked <= args['n_freq_masks'] * args['F']
+        if args['adaptive_number_ratio'] == 0 and args['adaptive_size_ratio'] == 0:
+            assert n_time_masked <= args['n_time_masks'] * min(args['T'], int(xlen * args['p']))
+        if args['adaptive_number_ratio'] > 0:
+            n_masks = min(int(xlen * args['adaptive_number_ratio']), args['max_n_time_masks'])
+            T = xlen * args['adaptive_size_ratio'] if args['adaptive_size_ratio'] > 0 else args['T']
+            assert n_time_masked <= n_masks * T
+        assert (zero == (zero.all(0, keepdim=True) | zero.all(1, keepdim=True))).all()
+
+
+def test_masks_per_utterance():
+    torch.manual_seed(0)
+    args = make_args(n_freq_masks=1, n_time_masks=1)
+    xs, xlens = make_inputs(batch_size=32, xmax=200)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.frontends.spec_augment')
+    specaug = module.SpecAugment(**args)
+    specaug(xs.clone(), xlens)
+    f_0, f_1 = specaug.freq_mask
+    t_0, t_1 = specaug.time_mask
+    assert f_0.size() == (32, 1) and t_0.size() == (32, 1)
+    # masks are sampled independently for each utterance
+    assert len(set(f_0.view(-1).tolist())) > 1
+    assert len(set(t_0.view(-1).tolist())) > 1
+    assert (t_1.view(-1) <= xlens.long()).all()
+
+
+def test_time_warp():
+    torch.manual_seed(0)
+    xs, xlens = make_inputs()
+
+    module = importlib.import_module('neural_sp.models.seq2seq.frontends.spec_augment')
+    specaug = module.SpecAugment(**make_args(W=10))
+    out = specaug.time_warp(xs, xlens.long())
+    assert out.size() == xs.size()
+    for b, xlen in enumerate(xlens.tolist()):
+        # boundary frames are fixed, padding is left untouched
+        assert torch.allclose(out[b, 0], xs[b, 0])
+        assert torch.allclose(out[b, xlen - 1], xs[b, xlen - 1])
+        assert (out[b, xlen:] == 0).all()
@@ -0,0 +1,71 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for splicing."""
+
+import importlib
+import numpy as np
+import pytest
+import torch
+
+from neural_sp.models.torch_utils import np2tensor
+from neural_sp.models.torch_utils import pad_list
+
+
+def _splice_ref(feat, n_splices=1, n_stacks=1, dtype=np.float32):
+    """Reference implementation looping over time steps and splice offsets."""
+    if n_splices == 1:
+        return feat
+
+    max_xlen, input_dim = feat.shape
+    freq = (input_dim // 3) // n_stacks
+    feat_splice = np.zeros((max_xlen, freq * (n_splices * n_stacks) * 3), dtype=dtype)
+
+    for i_time in range(max_xlen):
+        spliced_frames = np.zeros((n_splices * n_stacks, freq, 3))
+        for i_splice in range(0, n_splices, 1):
+            if i_time <= n_splices - 1 and i_splice < n_splices - i_time:
+                # copy the first frame to left side (padding left frames)
+                copy_frame = feat[0]
+            elif max_xlen - n_splices <= i_time and i_time + (i_splice - n_splices) > max_xlen - 1:
+                # copy the last frame to right side (padding right frames)
+                copy_frame = feat[-1]
+            else:
+                copy_frame = feat[i_time + (i_splice - n_splices)]
+
+            # `[freq * 3 * n_stacks]` -> `[freq, 3, n_stacks]`
+            copy_frame = copy_frame.reshape((freq, 3, n_stacks))
+
+            # `[freq, 3, n_stacks]` -> `[n_stacks, freq, 3]`
+            copy_frame = np.transpose(copy_frame, (2, 0, 1))
+
+            spliced_frames[i_splice: i_splice + n_stacks] = copy_frame
+
+        # `[n_splices * n_stacks, freq, 3] -> `[freq, n_splices * n_stacks, 3]`
+        spliced_frames = np.transpose(spliced_frames, (1, 0, 2))
+
+        feat_splice[i_time] = spliced_frames.reshape((freq * (n_splices * n_stacks) * 3))
+
+    return feat_splice
+
+
+@pytest.mark.parametrize(
+    "n_splices, n_stacks",
+    [(1, 1), (3, 1), (5, 1), (11, 1), (3, 2), (5, 3)]
+)
+def test_splice(n_splices, n_stacks):
+    module = importlib.import_module('neural_sp.models.seq2seq.frontends.splicing')
+    xlens = [1, 3, 11, 20]
+    xs = [np.random.randn(xlen, 40 * 3 * n_stacks).astype(np.float32) for xlen in xlens]
+    refs = [_splice_ref(x, n_splices, n_stacks) for x in xs]
+
+    # NumPy (data workers)
+    for x, ref in zip(xs, refs):
+        out = module.splice(x, n_splices, n_stacks)
+        assert out.shape == ref.shape
+        assert np.array_equal(out, ref)
+
+    # padded batch
+    xs = pad_list([np2tensor(x, "cpu").float() for x in xs], 0.)
+    out = module.splice_batch(xs, torch.IntTensor(xlens), n_splices, n_stacks)
+    assert torch.equal(out, pad_list([np2tensor(ref, "cpu") for ref in refs], 0.))
@@ -0,0 +1,68 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for the neural cache of LMs."""
+
+import importlib
+import pytest
+import torch
+
+VOCAB = 20
+N_UNITS = 8
+
+
+def cache_naive(probs, keys, ys_out, n_caches, theta, lambda_):
+    """Token-by-token cache over Python lists for a single stream."""
+    cache_keys, cache_ids = [], []
+    outputs = []
+    for t in range(ys_out.size(0)):
+        p = probs[t].clone()
+        if len(cache_ids) > 0:
+            attn = torch.softmax(theta * torch.stack(cache_keys) @ keys[t], dim=0)
+            cache_probs = torch.zeros_like(p)
+            for offset, idx in enumerate(cache_ids):
+                cache_probs[idx] += attn[offset]
+            p = (1 - lambda_) * p + lambda_ * cache_probs
+        outputs.append(p)
+        cache_keys = (cache_keys + [keys[t]])[-n_caches:]
+        cache_ids = (cache_ids + [ys_out[t].item()])[-n_caches:]
+    return torch.stack(outputs)
+
+
+@pytest.mark.parametrize(
+    "n_caches, seg_lens",
+    [
+        (1, [5, 5]),
+        (4, [10]),
+        (4, [3, 1, 7, 2]),
+        (16, [5, 5, 30]),
+        (100, [20, 20]),
+    ]
+)
+def test_cache(n_caches, seg_lens):
+    module = importlib.import_module('neural_sp.models.lm.cache')
+    torch.manual_seed(0)
+    bs, total = 3, sum(seg_lens)
+    probs = torch.softmax(torch.randn(bs, total, VOCAB), dim=-1)
+    keys = torch.randn(bs, total, N_UNITS)
+    ys_out = torch.randint(0, VOCAB, (bs, total))
+
+    cache = module.NeuralCache(n_caches)
+    outputs = []
+    start = 0
+    for seg_len in seg_lens:
+        end = start + seg_len
+        outputs.append(cache(probs[:, start:end], keys[:, start:end], ys_out[:, start:end],
+                             theta=0.5, lambda_=0.3))
+        start = end
+    outputs = torch.cat(outputs, dim=1)
+    assert torch.allclose(outputs.sum(-1), torch.ones(bs, total), atol=1e-5)
+    for b in range(bs):
+        ref = cache_naive(probs[b], keys[b], ys_out[b], n_caches, theta=0.5, lambda_=0.3)
+        assert torch.allclose(outputs[b], ref, atol=1e-6)
+
+    # the ring buffers keep the last steps
+    attn, key_ids = cache.history(b=0)
+    n_keys = min(n_caches + seg_lens[-1], total)
+    assert attn.shape == (seg_lens[-1], n_keys)
+    assert key_ids.tolist() == ys_out[0, total - n_keys:].tolist()
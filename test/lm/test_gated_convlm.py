@@ -0,0 +1,102 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for GatedConvLM."""
+
+import argparse
+import importlib
+import numpy as np
+import pytest
+import torch
+
+
+VOCAB = 100  # large for adaptive softmax
+
+
+def make_args(**kwargs):
+    args = dict(
+        lm_type='gated_conv_custom',
+        n_units=32,
+        n_projs=0,
+        n_layers=3,
+        kernel_size=4,
+        emb_dim=16,
+        vocab=VOCAB,
+        dropout_in=0.1,
+        dropout_hidden=0.1,
+        lsm_prob=0.0,
+        param_init=0.1,
+        adaptive_softmax=False,
+        tie_embedding=False,
+    )
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+@pytest.mark.parametrize(
+    "args", [
+        ({'n_layers': 1}),
+        ({'n_layers': 3}),
+        ({'kernel_size': 1}),
+        ({'n_projs': 8}),
+        ({'lm_type': 'gated_conv_8B'}),
+        # embedding
+        ({'adaptive_softmax': True}),
+        ({'tie_embedding': True, 'emb_dim': 32}),
+    ]
+)
+def test_forward(args):
+    args = make_args(**args)
+
+    ylens = [4, 5, 3, 7] * 20
+    ys = [np.random.randint(0, VOCAB, ylen).astype(np.int64) for ylen in ylens]
+
+    module = importlib.import_module('neural_sp.models.lm.gated_convlm')
+    lm = module.GatedConvLM(args)
+    loss, state, observation = lm(ys, state=None, n_caches=0)
+    assert loss.item() >= 0
+    assert isinstance(observation, dict)
+
+
+def assert_close(a, b):
+    # NOTE: outputs of deep blocks are large
+    assert (a - b).abs().max().item() <= 1e-5 * max(1., b.abs().max().item())
+
+
+@pytest.mark.parametrize(
+    "args", [
+        ({'n_layers': 3}),
+        ({'kernel_size': 1}),
+        ({'kernel_size': 2, 'n_projs': 8}),
+        ({'lm_type': 'gated_conv_8B'}),
+    ]
+)
+def test_incremental_decode(args):
+    args = make_args(**args)
+    module = importlib.import_module('neural_sp.models.lm.gated_convlm')
+    lm = module.GatedConvLM(args)
+    lm.eval()
+
+    bs, ylen = 4, 9
+    ys = torch.randint(0, VOCAB, (bs, ylen))
+    with torch.no_grad():
+        _, out_full, _ = lm.decode(ys)
+
+        # one step at a time
+        state = None
+        outs = []
+        for t in range(ylen):
+            lmout, state, log_probs = lm.predict(ys[:, t:t + 1], state)
+            outs.append(lmout)
+        assert_close(torch.cat(outs, dim=1), out_full)
+
+        # several steps following the state of a prefix
+        _, state, _ = lm.predict(ys[:, :5])
+        lmout, _, _ = lm.predict(ys[:, 5:], state)
+        assert_close(lmout, out_full[:, 5:])
+
+        # reorder hypotheses
+        index = torch.LongTensor([2, 2, 0])
+        _, state, _ = lm.predict(ys[:, :5])
+        lmout, _, _ = lm.predict(ys[index, 5:], lm.reorder_state(state, index))
+        assert_close(lmout, out_full[index, 5:])
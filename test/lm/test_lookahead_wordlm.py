@@ -0,0 +1,155 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for word-level LM fusion with look-ahead scores."""
+
+import argparse
+import importlib
+import os
+import pytest
+import torch
+
+
+WORDS = ['a', 'ab', 'abc', 'b', 'ba', 'bad', 'cab', 'cc', 'dad']
+CHARS = ['<space>', 'a', 'b', 'c', 'd']
+WPS = ['▁', '▁a', '▁ab', '▁b', '▁c', '▁ca', '▁d', 'a', 'ab', 'b', 'c', 'd', 'ad']
+
+
+def make_dict(path, tokens):
+    with open(path, 'w') as f:
+        f.write('<unk> 1\n<eos> 2\n<pad> 3\n')
+        for i, t in enumerate(tokens):
+            f.write('%s %d\n' % (t, i + 4))
+    return {t: i + 4 for i, t in enumerate(tokens)}
+
+
+def make_wordlm(lm_type):
+    torch.manual_seed(0)
+    if 'gated_conv' in lm_type:
+        args = argparse.Namespace(
+            lm_type=lm_type, n_units=16, n_projs=0, n_layers=2, kernel_size=4,
+            emb_dim=8, vocab=len(WORDS) + 4, dropout_in=0.1, dropout_hidden=0.1, lsm_prob=0.0,
+            param_init=0.1, adaptive_softmax=False, tie_embedding=False)
+        module = importlib.import_module('neural_sp.models.lm.gated_convlm')
+        return module.GatedConvLM(args).eval()
+    args = argparse.Namespace(
+        lm_type=lm_type, n_units=16, n_projs=0, n_layers=2, residual=False,
+        use_glu=False, n_units_null_context=0, bottleneck_dim=16, emb_dim=16,
+        vocab=len(WORDS) + 4, dropout_in=0.1, dropout_hidden=0.1, lsm_prob=0.0,
+        param_init=0.1, adaptive_softmax=False, tie_embedding=False)
+    module = importlib.import_module('neural_sp.models.lm.rnnlm')
+    return module.RNNLM(args).eval()
+
+
+def build(tmp_path, unit='char', lm_type='lstm', **kwargs):
+    word2idx = make_dict(os.path.join(str(tmp_path), 'dict_word.txt'), WORDS)
+    token2idx = make_dict(os.path.join(str(tmp_path), 'dict.txt'), CHARS if unit == 'char' else WPS)
+    module = importlib.import_module('neural_sp.models.lm.lookahead_wordlm')
+    wordlm = make_wordlm(lm_type)
+    lm = module.LookAheadWordLM(wordlm, os.path.join(str(tmp_path), 'dict_word.txt'),
+                                os.path.join(str(tmp_path), 'dict.txt'), unit, oov_penalty=-2., **kwargs)
+    return lm, wordlm, word2idx, token2idx
+
+
+def tokenize(words, unit, token2idx):
+    """Subword indices of a sentence (greedy longest match for wp)."""
+    ids = []
+    for i, w in enumerate(words):
+        if unit == 'char':
+            if i > 0:
+                ids.append(token2idx['<space>'])
+            ids += [token2idx[c] for c in w]
+            continue
+        start = True
+        while len(w) > 0 or start:
+            prefix = '▁' if start else ''
+            n = max(n for n in range(len(w) + 1) if prefix + w[:n] in token2idx)
+            ids.append(token2idx[prefix + w[:n]])
+            w, start = w[n:], False
+    return [2] + ids + [2]
+
+
+def wordlm_score(wordlm, words, word2idx, oov_penalty=-2.):
+    ws = [2] + [word2idx.get(w, 1) for w in words] + [2]
+    score, state = 0., None
+    for t in range(len(ws) - 1):
+        _, state, log_probs = wordlm.predict(torch.LongTensor([[ws[t]]]), state)
+        score += log_probs[0, 0, ws[t + 1]].item() + (oov_penalty if ws[t + 1] == 1 else 0.)
+    return score
+
+
+@pytest.mark.parametrize("unit", ['char', 'wp'])
+@pytest.mark.parametrize("lm_type", ['lstm', 'gru', 'gated_conv_custom'])
+@pytest.mark.parametrize(
+    "words", [
+        ['ab'],
+        ['cab', 'a', 'bad'],
+        ['dad', 'dad', 'b', 'abc'],
+        ['ab', 'ddd', 'cc'],  # OOV word
+        ['abcd', 'ca'],  # OOV words sharing prefixes with words
+    ]
+)
+def test_sentence_score(tmp_path, unit, lm_type, words):
+    lm, wordlm, word2idx, token2idx = build(tmp_path, unit, lm_type)
+    ys = tokenize(words, unit, token2idx)
+    score, state = 0., None
+    with torch.no_grad():
+        for t in range(len(ys) - 1):
+            _, state, log_probs = lm.predict(torch.LongTensor([[ys[t]]]), state)
+            assert log_probs.size() == (1, 1, lm.vocab)
+            score += log_probs[0, 0, ys[t + 1]].item()
+        # scores of subwords sum up to scores of words
+        assert abs(score - wordlm_score(wordlm, words, word2idx)) < 1e-4
+
+
+@pytest.mark.parametrize("unit", ['char', 'wp'])
+def test_candidates(tmp_path, unit):
+    lm, _, _, token2idx = build(tmp_path, unit)
+    hyps = [tokenize(words, unit, token2idx)[:-1] for words in
+            [['ab', 'c'], ['ab', 'cab'], ['dad'], ['ddd', 'b']]]
+    with torch.no_grad():
+        for t in range(1, min(len(h) for h in hyps) + 1):
+            ys = torch.LongTensor([h[:t] for h in hyps])
+            candidates = torch.randint(1, lm.vocab, (len(hyps), 4))
+            _, _, log_probs = lm.predict(ys, None)
+            _, _, log_probs_cands = lm.predict(ys, None, candidates=candidates)
+            assert torch.equal(log_probs_cands, log_probs[:, 0].gather(1, candidates))
+
+
+def test_shared_history(tmp_path):
+    lm, wordlm, _, token2idx = build(tmp_path, 'char')
+    n_calls = []
+    predict = wordlm.predict
+
+    def count(ys, state=None, **kwargs):
+        n_calls.append(ys.size(0))
+        return predict(ys, state, **kwargs)
+    wordlm.predict = count
+
+    # hypotheses sharing the word history "ab cab"
+    hyps = [tokenize(['ab', 'cab', w], 'char', token2idx)[:-1] for w in ['a', 'b', 'ba', 'c']]
+    state = None
+    with torch.no_grad():
+        for t in range(max(len(h) for h in hyps)):
+            ys = torch.LongTensor([[h[min(t, len(h) - 1)]] for h in hyps])
+            lmout, state = lm.step(ys, state)
+            lm.score(lmout[:, -1])
+    # each word history is read by the word LM once
+    assert sum(n_calls) == len(lm._cache)
+    # histories of shared prefixes are read once for all hypotheses
+    assert n_calls[:3] == [1, 1, 1]
+
+
+@pytest.mark.parametrize("cache_size", [1, 256])
+def test_reset(tmp_path, cache_size):
+    lm, _, _, token2idx = build(tmp_path, 'char', cache_size=cache_size)
+    ys = torch.LongTensor([tokenize(['cab', 'ba'], 'char', token2idx)[:-1]])
+    with torch.no_grad():
+        _, state, log_probs = lm.predict(ys)
+        # carry over the state to the next utterance
+        state_co = lm.reset(state)
+        assert state_co[0, 1].item() == state[0, 1].item()
+        _, _, log_probs_co = lm.predict(ys[:, :0], state_co)
+        assert torch.allclose(log_probs_co, log_probs, atol=1e-5)
+        assert lm.reset() is None
+        assert len(lm._cache) == 0
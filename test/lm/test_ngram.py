@@ -0,0 +1,158 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for the back-off n-gram LM."""
+
+import importlib
+import math
+import numpy as np
+import os
+import pytest
+import torch
+
+
+VOCAB = 22  # including blank
+
+
+def make_lm_files(save_dir, order=3, seed=0):
+    """Random prefix-closed ARPA file and a dictionary.
+
+    w21 is in the dictionary but not in the ARPA file, and oov is in the ARPA
+    file but not in the dictionary.
+
+    """
+    rng = np.random.RandomState(seed)
+    dict_path = os.path.join(save_dir, 'dict.txt')
+    with open(dict_path, 'w') as f:
+        f.write('<unk> 1\n<eos> 2\n<pad> 3\n')
+        for i in range(4, VOCAB):
+            f.write('w%d %d\n' % (i, i))
+    words = ['<unk>', '<s>', '</s>', 'oov'] + ['w%d' % i for i in range(4, VOCAB - 1)]
+    ngrams = [{(w,): (round(rng.uniform(-4, -0.5), 4), round(rng.uniform(-1, 0), 4))
+               for w in words}]
+    for k in range(2, order + 1):
+        table = {}
+        for ctx in ngrams[-1]:
+            if ctx[-1] == '</s>':
+                continue
+            for w in rng.choice(words, size=rng.randint(0, 6), replace=False):
+                if w != '<s>':
+                    table[ctx + (w,)] = (round(rng.uniform(-3, -0.1), 4), round(rng.uniform(-1, 0), 4))
+        ngrams.append(table)
+    arpa_path = os.path.join(save_dir, 'lm.arpa')
+    with open(arpa_path, 'w') as f:
+        f.write('\n\\data\\\n')
+        for k, table in enumerate(ngrams):
+            f.write('ngram %d=%d\n' % (k + 1, len(table)))
+        for k, table in enumerate(ngrams):
+            f.write('\n\\%d-grams:\n' % (k + 1))
+            for ngram, (logp, bo) in table.items():
+                if k + 1 < order:
+                    f.write('%.4f\t%s\t%.4f\n' % (logp, ' '.join(ngram), bo))
+                else:
+                    f.write('%.4f\t%s\n' % (logp, ' '.join(ngram)))
+        f.write('\n\\end\\\n')
+    return arpa_path, dict_path, ngrams
+
+
+def reference_logp(ngrams, history, w):
+    """Natural log-probability by the recursive back-off rule."""
+    history = tuple(history[max(0, len(history) - len(ngrams) + 1):]) if len(ngrams) > 1 else ()
+    table = ngrams[len(history)]
+    if history + (w,) in table:
+        return table[history + (w,)][0] * math.log(10)
+    if len(history) == 0:
+        return ngrams[0][('<unk>',)][0] * math.log(10)
+    bo = ngrams[len(history) - 1][history][1] if history in ngrams[len(history) - 1] else 0.
+    return bo * math.log(10) + reference_logp(ngrams, history[1:], w)
+
+
+def idx2word(idx):
+    return {1: '<unk>', 2: '</s>', 3: '<pad>'}.get(idx, 'w%d' % idx)
+
+
+def build_lm(tmp_path, order=3, n_bits=0):
+    module = importlib.import_module('neural_sp.models.lm.ngram')
+    arpa_path, dict_path, ngrams = make_lm_files(str(tmp_path), order=order)
+    return module.NgramLM(arpa_path, dict_path, n_bits=n_bits), ngrams
+
+
+def random_histories(n_hyps, max_len=4, seed=1):
+    rng = np.random.RandomState(seed)
+    # sentences start with <eos> as in decoders
+    return [[2] + list(rng.randint(1, VOCAB, size=rng.randint(0, max_len))) for _ in range(n_hyps)]
+
+
+@pytest.mark.parametrize("order", [1, 2, 3, 4])
+def test_backoff(tmp_path, order):
+    lm, ngrams = build_lm(tmp_path, order=order)
+    assert lm.order == order
+    for history in random_histories(20):
+        ys = torch.LongTensor(history).unsqueeze(0)
+        _, _, log_probs = lm.predict(ys)
+        assert log_probs.size() == (1, 1, VOCAB)
+        # <eos> is read as <s> in contexts
+        words = ['<s>' if y == 2 else idx2word(y) for y in history]
+        for idx in range(1, VOCAB):
+            ref = reference_logp(ngrams, words, idx2word(idx))
+            assert abs(log_probs[0, 0, idx].item() - ref) < 1e-4, (history, idx)
+
+
+@pytest.mark.parametrize("order", [2, 3])
+def test_candidates(tmp_path, order):
+    lm, _ = build_lm(tmp_path, order=order)
+    histories = random_histories(16)
+    state = lm.zero_state(len(histories))
+    # step hypotheses token by token as in beam search
+    for t in range(max(len(h) for h in histories)):
+        ys = torch.LongTensor([[h[min(t, len(h) - 1)]] for h in histories])
+        candidates = torch.randint(1, VOCAB, (len(histories), 5))
+        _, _, log_probs_cands = lm.predict(ys, state, candidates=candidates)
+        _, state, log_probs = lm.predict(ys, state)
+        assert log_probs_cands.size() == (len(histories), 5)
+        assert torch.allclose(log_probs_cands, log_probs[:, 0].gather(1, candidates), atol=1e-5)
+
+
+def test_searchsorted_fallback(tmp_path, monkeypatch):
+    lm, _ = build_lm(tmp_path, order=3)
+    histories = random_histories(16)
+    ys = torch.LongTensor([h[:2] + [h[-1]] * (3 - len(h[:2])) for h in histories])
+    candidates = torch.randint(1, VOCAB, (len(histories), 5))
+    _, state_ref, log_probs_ref = lm.predict(ys)
+    _, _, log_probs_cands_ref = lm.predict(ys, candidates=candidates)
+
+    # NOTE: torch.searchsorted is not available in torch<1.6
+    monkeypatch.delattr(torch, 'searchsorted')
+    _, state, log_probs = lm.predict(ys)
+    _, _, log_probs_cands = lm.predict(ys, candidates=candidates)
+    assert torch.equal(state, state_ref)
+    assert torch.equal(log_probs, log_probs_ref)
+    assert torch.equal(log_probs_cands, log_probs_cands_ref)
+
+
+def test_state(tmp_path):
+    lm, _ = build_lm(tmp_path, order=3)
+    ys = torch.LongTensor([[2, 5, 7, 2, 9]])
+    _, state, log_probs = lm.predict(ys)
+    _, state_bos, log_probs_bos = lm.predict(torch.LongTensor([[2, 9]]))
+    # <eos> resets the context as <s>
+    assert torch.equal(state, state_bos)
+    assert torch.equal(log_probs, log_probs_bos)
+    # incremental steps are the same as the whole sequence
+    state = None
+    for t in range(ys.size(1)):
+        _, state, log_probs_t = lm.predict(ys[:, t:t + 1], state)
+    assert torch.equal(log_probs_t, log_probs)
+
+
+@pytest.mark.parametrize("n_bits", [4, 8])
+def test_quantization(tmp_path, n_bits):
+    lm, _ = build_lm(tmp_path, order=3, n_bits=0)
+    lm_q, _ = build_lm(tmp_path, order=3, n_bits=n_bits)
+    assert lm_q.logp2.dtype == torch.uint8
+    assert lm_q.logp_cb2.numel() <= 2 ** n_bits
+    ys = torch.LongTensor([h[:3] + [1] * (3 - len(h[:3])) for h in random_histories(32)])
+    log_probs = lm.predict(ys)[2]
+    log_probs_q = lm_q.predict(ys)[2]
+    err = (log_probs - log_probs_q).abs().max().item()
+    assert err < (0.1 if n_bits == 8 else 1.0)
@@ -0,0 +1,149 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for the inference-only RNNLM."""
+
+import argparse
+import importlib
+import pytest
+import torch
+
+
+VOCAB = 100
+
+
+def make_args(**kwargs):
+    args = dict(
+        lm_type='lstm',
+        n_units=32,
+        n_projs=0,
+        n_layers=2,
+        residual=False,
+        use_glu=False,
+        n_units_null_context=0,
+        bottleneck_dim=16,
+        emb_dim=16,
+        vocab=VOCAB,
+        dropout_in=0.1,
+        dropout_hidden=0.1,
+        lsm_prob=0.0,
+        param_init=0.1,
+        adaptive_softmax=False,
+        tie_embedding=False,
+    )
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+def build_lm(**kwargs):
+    torch.manual_seed(0)
+    module = importlib.import_module('neural_sp.models.lm.rnnlm')
+    lm = module.RNNLM(make_args(**kwargs))
+    lm.eval()
+    return lm
+
+
+@pytest.mark.parametrize(
+    "args", [
+        ({'lm_type': 'lstm', 'n_layers': 1}),
+        ({'lm_type': 'lstm', 'n_layers': 3}),
+        ({'lm_type': 'gru', 'n_layers': 1}),
+        ({'lm_type': 'gru', 'n_layers': 3}),
+        ({'n_projs': 16}),
+        ({'residual': True, 'n_layers': 3}),
+        ({'n_units_null_context': 16}),
+        ({'use_glu': True, 'residual': True}),
+        ({'tie_embedding': True}),
+    ]
+)
+def test_predict(args):
+    lm = build_lm(**args)
+    lm_infer = lm.inference_model()
+    bs, n_steps = 4, 5
+    ys = torch.randint(0, VOCAB, (bs, n_steps))
+
+    with torch.no_grad():
+        state, state_infer = None, None
+        for t in range(n_steps):
+            lmout, state, log_probs = lm.predict(ys[:, t:t + 1], state)
+            lmout_infer, state_infer, log_probs_infer = lm_infer.predict(ys[:, t:t + 1], state_infer)
+            torch.testing.assert_close(lmout_infer, lmout, rtol=1e-5, atol=1e-5)
+            torch.testing.assert_close(log_probs_infer, log_probs, rtol=1e-5, atol=1e-5)
+            torch.testing.assert_close(state_infer['hxs'], state['hxs'], rtol=1e-5, atol=1e-5)
+            if args.get('lm_type', 'lstm') == 'lstm':
+                torch.testing.assert_close(state_infer['cxs'], state['cxs'], rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize("lm_type", ['lstm', 'gru'])
+def test_score_candidates(lm_type):
+    lm = build_lm(lm_type=lm_type)
+    lm_infer = lm.inference_model()
+    ys = torch.randint(0, VOCAB, (4, 1))
+    candidates = torch.randint(0, VOCAB, (4, 10))
+
+    with torch.no_grad():
+        lmout, _ = lm_infer.step(ys)
+        log_probs = lm_infer.score(lmout[:, -1])
+        # exact log-normalizer
+        torch.testing.assert_close(lm_infer.score(lmout[:, -1], candidates),
+                                   log_probs.gather(1, candidates))
+
+        # shortlist covering the whole vocabulary is also exact
+        module = importlib.import_module('neural_sp.models.lm.rnnlm_infer')
+        lm_sl = module.RNNLMInference(lm, shortlist=torch.arange(VOCAB))
+        torch.testing.assert_close(lm_sl.score(lmout[:, -1], candidates),
+                                   log_probs.gather(1, candidates), rtol=1e-5, atol=1e-5)
+
+        # partial shortlist over-estimates probabilities
+        lm_sl = module.RNNLMInference(lm, shortlist=torch.arange(VOCAB // 2))
+        assert (lm_sl.score(lmout[:, -1], candidates) >= log_probs.gather(1, candidates) - 1e-5).all()
+
+
+def test_export():
+    lm = build_lm()
+    lm_infer = lm.inference_model()
+    ys = torch.randint(0, VOCAB, (4, 1))
+    state = lm_infer.zero_state(4)
+    candidates = torch.randint(0, VOCAB, (4, 10))
+    with torch.no_grad():
+        traced = torch.jit.trace(lm_infer, (ys, state['hxs'], state['cxs'], candidates))
+        for out, ref in zip(traced(ys, state['hxs'], state['cxs'], candidates),
+                            lm_infer(ys, state['hxs'], state['cxs'], candidates)):
+            torch.testing.assert_close(out, ref)
+
+
+def test_cache():
+    lm = build_lm()
+    lm_infer = lm.inference_model()
+    assert lm.inference_model() is lm_infer
+    assert not any('table' in k for k in lm.state_dict().keys())
+
+    # rebuilt after parameters are updated
+    lm.train()
+    lm.eval()
+    assert lm.inference_model() is not lm_infer
+
+
+def test_shortlist(tmp_path):
+    tsv_path = str(tmp_path / 'train.tsv')
+    with open(tsv_path, 'w') as f:
+        f.write('utt_id\ttoken_id\n')
+        f.write('utt1\t5 7 7\n')
+        f.write('utt2\t7\n')
+        f.write('utt3\t\n')
+        f.write('utt4\t3 5 7\n')
+    utils = importlib.import_module('neural_sp.datasets.utils')
+    shortlist = utils.count_frequent_tokens(tsv_path, 2, VOCAB, chunksize=2)
+    assert shortlist.tolist() == [7, 5]
+
+    lm = build_lm()
+    lm_infer = lm.inference_model()
+    assert lm_infer.shortlist is None
+    lm.set_shortlist(torch.from_numpy(shortlist))
+    lm_sl = lm.inference_model()
+    assert lm_sl is not lm_infer
+    assert lm_sl.shortlist.tolist() == [7, 5]
+    # kept after the variant is rebuilt
+    lm.train()
+    lm.eval()
+    assert lm.inference_model().shortlist.tolist() == [7, 5]
@@ -7,6 +7,7 @@ import argparse
 import importlib
 import numpy as np
 import pytest
+import torch
 
 
 VOCAB = 100  # large for adaptive softmax
@@ -82,3 +83,29 @@ def test_forward(args):
     # assert loss.size(0) == 1
     assert loss.item() >= 0
     assert isinstance(observation, dict)
+
+
+def test_update_memory_from_cache():
+    args = make_args(mem_len=5, recog_mem_len=5)
+    module = importlib.import_module('neural_sp.models.lm.transformer_xl')
+    lm = module.TransformerXL(args).eval()
+
+    ys = torch.randint(4, VOCAB, (2, 8))
+    ys_next = torch.randint(4, VOCAB, (2, 6))
+    with torch.no_grad():
+        _, _, mems = lm.decode(ys, incremental=False)
+        cache = None
+        for t in range(ys.size(1)):
+            _, _, cache = lm.decode(ys[:, :t + 1], cache=cache, incremental=True)
+        # the last token without cached states is dropped
+        mems_cache = lm.update_memory_from_cache(None, torch.cat([ys, ys[:, -1:]], dim=1), cache)
+        for m, m_cache in zip(mems, mems_cache):
+            assert m_cache.size(1) == 5
+            assert torch.allclose(m, m_cache, atol=1e-5)
+
+        # incremental decoding with memory
+        logits_ref, _, _ = lm.decode(ys_next, mems=mems, incremental=False)
+        cache = None
+        for t in range(ys_next.size(1)):
+            logits, _, cache = lm.decode(ys_next[:, :t + 1], mems=mems_cache, cache=cache, incremental=True)
+            assert torch.allclose(logits[:, -1], logits_ref[:, t], atol=1e-5)
@@ -7,6 +7,7 @@ import argparse
 import importlib
 import numpy as np
 import pytest
+import torch
 
 
 VOCAB = 100  # large for adaptive softmax
@@ -79,3 +80,45 @@ def test_forward(args):
     # assert loss.size(0) == 1
     assert loss.item() >= 0
     assert isinstance(observation, dict)
+
+
+@pytest.mark.parametrize("mem_len", [0, 5, 20])
+def test_truncate_state(mem_len):
+    args = make_args(recog_mem_len=mem_len)
+    module = importlib.import_module('neural_sp.models.lm.transformerlm')
+    lm = module.TransformerLM(args).eval()
+
+    ys = torch.randint(4, VOCAB, (2, 10))
+    with torch.no_grad():
+        cache = None
+        for t in range(ys.size(1) - 1):
+            _, _, cache = lm.decode(ys[:, :t + 1], cache=cache, incremental=True)
+        # the last token without cached states is dropped
+        state = lm.truncate_state(ys, cache)
+        if mem_len == 0:
+            assert state is None
+            return
+        ys_prev, cache_prev, pos_offset = state
+        n_keep = min(mem_len, ys.size(1) - 1)
+        assert torch.equal(ys_prev, ys[:, -1 - n_keep:-1])
+        assert all(c.size(1) == n_keep for c in cache_prev)
+        assert pos_offset == ys.size(1) - 1 - n_keep
+
+        # the next token is predicted from the cached states
+        eos = ys.new_zeros(2, 1).fill_(lm.eos)
+        ys_next = torch.cat([ys_prev, eos], dim=1)
+        logits, _, cache_next = lm.decode(ys_next, cache=cache_prev, incremental=True, pos_offset=pos_offset)
+        assert all(c.size(1) == n_keep + 1 for c in cache_next)
+        if n_keep == ys.size(1) - 1:
+            logits_ref, _, _ = lm.decode(ys_next, incremental=False)
+            assert torch.allclose(logits[:, -1], logits_ref[:, -1], atol=1e-5)
+        else:
+            # same as attending only to the kept tokens at their original positions
+            ys_full = torch.cat([ys[:, :-1], eos], dim=1)
+            mask = ys.new_ones(2, 1, ys_full.size(1)).byte()
+            mask[:, :, :pos_offset] = 0
+            out = lm.pos_enc(lm.embed(ys_full))
+            for c, layer in zip(cache, lm.layers):
+                out = layer(out, mask, cache=c)
+            logits_ref = lm.output(lm.norm_out(out))
+            assert torch.allclose(logits[:, -1], logits_ref[:, -1], atol=1e-5)
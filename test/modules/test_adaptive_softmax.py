@@ -0,0 +1,86 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for adaptive softmax output layer."""
+
+import importlib
+import pytest
+import torch
+
+
+IDIM = 16
+VOCAB = 100
+PAD = 3
+
+
+def make_layer(cutoffs):
+    torch.manual_seed(0)
+    module = importlib.import_module('neural_sp.models.modules.adaptive_softmax')
+    return module.AdaptiveSoftmax(IDIM, VOCAB, cutoffs=cutoffs)
+
+
+@pytest.mark.parametrize("cutoffs", ['', '10', '10_40', '5_20_60'])
+def test_forward(cutoffs):
+    layer = make_layer(cutoffs)
+    xs = torch.randn(4, 7, IDIM)
+    log_probs = layer(xs)
+    assert log_probs.size() == (4, 7, VOCAB)
+    assert torch.allclose(log_probs.exp().sum(-1), torch.ones(4, 7), atol=1e-5)
+
+
+@pytest.mark.parametrize("cutoffs", ['', '10_40'])
+def test_loss(cutoffs):
+    layer = make_layer(cutoffs)
+    xs = torch.randn(4, 7, IDIM, requires_grad=True)
+    ys = torch.randint(0, VOCAB, (4, 7))
+    ys[1, 5:] = PAD
+    ys[3, 2:] = PAD
+    loss, ppl = layer.loss(xs, ys, PAD)
+    loss.backward()
+
+    # reference with log-probabilities over the whole vocabulary
+    mask = ys != PAD
+    nll = -layer(xs).gather(2, ys.unsqueeze(2)).squeeze(2)[mask]
+    assert torch.allclose(loss, nll.sum() / xs.size(0), atol=1e-5)
+    assert abs(ppl - torch.exp(nll.mean()).item()) < 1e-3 * ppl
+    # no gradient for padded tokens
+    assert (xs.grad[~mask] == 0).all()
+
+    acc = layer.accuracy(xs, ys, PAD)
+    acc_ref = ((layer(xs).argmax(-1) == ys) & mask).sum().item() * 100 / mask.sum().item()
+    assert abs(acc - acc_ref) < 1e-6
+
+
+@pytest.mark.parametrize("cutoffs", ['', '10_40', '5_20_60'])
+@pytest.mark.parametrize("k", [1, 4, 8, 30])
+def test_topk(cutoffs, k):
+    layer = make_layer(cutoffs)
+    # a sharp head prunes more tails
+    xs = torch.randn(6, 5, IDIM) * 3
+    with torch.no_grad():
+        topk_log_probs, topk_ids = layer.topk(xs, k)
+        ref_log_probs, ref_ids = torch.topk(layer(xs), k=k, dim=-1)
+    assert topk_ids.size() == (6, 5, k)
+    assert torch.equal(topk_ids, ref_ids)
+    assert torch.allclose(topk_log_probs, ref_log_probs, atol=1e-5)
+    assert torch.equal(layer.argmax(xs), ref_ids[:, :, 0])
+
+    log_probs = layer.log_prob_topk(xs, k)
+    assert log_probs.size() == (6, 5, VOCAB)
+    assert torch.allclose(log_probs.gather(-1, ref_ids), ref_log_probs, atol=1e-5)
+    assert (log_probs > float('-inf')).sum(-1).eq(k).all()
+
+
+@pytest.mark.parametrize("vocab, cutoffs", [(10, [2]), (30, [1, 6]), (VOCAB, [4, 20])])
+def test_default_cutoffs(vocab, cutoffs):
+    module = importlib.import_module('neural_sp.models.modules.adaptive_softmax')
+    layer = module.AdaptiveSoftmax(IDIM, vocab)
+    assert layer.cutoffs == cutoffs + [vocab]
+
+
+@pytest.mark.parametrize("vocab, cutoffs", [(4, ''), (VOCAB, '0_10'), (VOCAB, '10_100'),
+                                            (VOCAB, '40_10'), (VOCAB, '10_10')])
+def test_invalid_cutoffs(vocab, cutoffs):
+    module = importlib.import_module('neural_sp.models.modules.adaptive_softmax')
+    with pytest.raises(ValueError):
+        module.AdaptiveSoftmax(IDIM, vocab, cutoffs=cutoffs)
@@ -53,6 +53,80 @@ def test_forward_parallel(args):
     assert aws.size() == (batch_size, ymax, xmax)
 
 
+def _integrate_ref(eouts, alpha, elens, ylens, beta):
+    """Reference frame-by-frame implementation of integrate-and-fire."""
+    bs, xmax, enc_dim = eouts.size()
+    ymax = int(ylens.max())
+    cv = [[eouts.new_zeros(enc_dim) for _ in range(ymax)] for _ in range(bs)]
+    aws = [[[eouts.new_zeros(()) for _ in range(xmax)] for _ in range(ymax)] for _ in range(bs)]
+    for b in range(bs):
+        n_tokens = 0
+        alpha_accum = 0
+        state = eouts.new_zeros(enc_dim)
+        for j in range(int(elens[b])):
+            remain = alpha[b, j]
+            while n_tokens < ylens[b] and alpha_accum + remain >= beta:
+                # A boundary is located
+                ak1 = beta - alpha_accum
+                cv[b][n_tokens] = state + ak1 * eouts[b, j]
+                aws[b][n_tokens][j] = aws[b][n_tokens][j] + ak1
+                n_tokens += 1
+                remain = remain - ak1
+                alpha_accum = 0
+                state = eouts.new_zeros(enc_dim)
+            if n_tokens >= ylens[b]:
+                break
+            # Carry over to the next frame
+            state = state + remain * eouts[b, j]
+            aws[b][n_tokens][j] = aws[b][n_tokens][j] + remain
+            alpha_accum = alpha_accum + remain
+        if n_tokens < ylens[b]:
+            cv[b][n_tokens] = state
+    cv = torch.stack([torch.stack(cv_b) for cv_b in cv])
+    aws = torch.stack([torch.stack([torch.stack(aw) for aw in aws_b]) for aws_b in aws])
+    return cv, aws
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'threshold': 1.0}),
+        ({'threshold': 0.9}),
+    ]
+)
+def test_forward_parallel_parity(args):
+    args = make_args(**args)
+
+    batch_size = 4
+    xmax = 40
+    ymax = 7
+    device = "cpu"
+
+    eouts = torch.randn(batch_size, xmax, args['enc_dim'], device=device, requires_grad=True)
+    elens = torch.IntTensor([i for i in range(xmax, xmax - batch_size, -1)])
+    ylens = torch.IntTensor([i for i in range(ymax, ymax - batch_size, -1)])
+
+    module = importlib.import_module('neural_sp.models.modules.cif')
+    cif = module.CIF(**args)
+    cif = cif.to(device)
+
+    cv, alpha, aws = cif(eouts, elens, ylens, mode='parallel')
+    # reference
+    mask = (torch.arange(xmax).unsqueeze(0) < elens.unsqueeze(1).long())
+    alpha_ref = alpha.masked_fill(mask == 0, 0)
+    alpha_ref = alpha_ref / alpha_ref.sum(1, keepdim=True) * ylens.float().unsqueeze(1)
+    cv_ref, aws_ref = _integrate_ref(eouts, alpha_ref, elens, ylens, cif.beta)
+    assert torch.allclose(cv, cv_ref, atol=1e-5)
+    assert torch.allclose(aws, aws_ref, atol=1e-5)
+
+    # gradient parity
+    params = [eouts] + list(cif.parameters())
+    grads = torch.autograd.grad(cv.pow(2).sum() + aws.sum(), params, retain_graph=True)
+    grads_ref = torch.autograd.grad(cv_ref.pow(2).sum() + aws_ref.sum(), params)
+    for g, g_ref in zip(grads, grads_ref):
+        assert torch.allclose(g, g_ref, atol=1e-4)
+
+
 @pytest.mark.parametrize(
     "args",
     [
@@ -63,12 +137,12 @@ def test_forward_parallel(args):
 def test_forward_incremental(args):
     args = make_args(**args)
 
-    batch_size = 1
+    batch_size = 4
     xmax = 40
-    ymax = 5
+    chunk_size = 8
     device = "cpu"
 
-    eouts = torch.FloatTensor(batch_size, xmax, args['enc_dim'], device=device)
+    eouts = torch.randn(batch_size, xmax, args['enc_dim'], device=device)
     elens = torch.IntTensor([len(x) for x in eouts])
 
     module = importlib.import_module('neural_sp.models.modules.cif')
@@ -76,10 +150,55 @@ def test_forward_incremental(args):
     cif = cif.to(device)
     cif.eval()
 
-    for i in range(ymax):
-        out = cif(eouts, elens, mode='incremental')
+    cif.reset()
+    for t in range(0, xmax, chunk_size):
+        eouts_chunk = eouts[:, t:t + chunk_size]
+        out = cif(eouts_chunk, elens.clamp(max=chunk_size), mode='incremental',
+                  is_last=t + chunk_size >= xmax)
         assert len(out) == 3
         cv, alpha, aws = out
-        assert cv.size() == (batch_size, 1, args['enc_dim'])
-        assert alpha.size() == (batch_size, xmax)
-        assert aws.size() == (batch_size, 1, xmax)
+        ymax = cif.n_fired.max().item()
+        assert cv.size() == (batch_size, ymax, args['enc_dim'])
+        assert alpha.size() == (batch_size, eouts_chunk.size(1))
+        assert aws.size() == (batch_size, ymax, eouts_chunk.size(1))
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'threshold': 1.0}),
+        ({'threshold': 0.9}),
+    ]
+)
+def test_integrate_incremental_parity(args):
+    args = make_args(**args)
+
+    batch_size = 4
+    xmax = 40
+    device = "cpu"
+
+    eouts = torch.randn(batch_size, xmax, args['enc_dim'], device=device)
+    alpha = torch.rand(batch_size, xmax, device=device)
+
+    module = importlib.import_module('neural_sp.models.modules.cif')
+    cif = module.CIF(**args)
+    cif = cif.to(device)
+
+    # whole sequence
+    n_fired = torch.floor(alpha.sum(1) / cif.beta).long()
+    cv_all, _ = cif.integrate(eouts, alpha, int(n_fired.max()))
+
+    # chunk by chunk with carried-over states
+    for chunk_size in [1, 3, 8]:
+        cif.reset()
+        cif.alpha_accum = eouts.new_zeros(batch_size)
+        cif.state = eouts.new_zeros(batch_size, args['enc_dim'])
+        cv_stream = [[] for _ in range(batch_size)]
+        for t in range(0, xmax, chunk_size):
+            cv, _ = cif.integrate_incremental(eouts[:, t:t + chunk_size], alpha[:, t:t + chunk_size])
+            for b in range(batch_size):
+                cv_stream[b] += [cv[b, :cif.n_fired[b]]]
+        for b in range(batch_size):
+            cv_b = torch.cat(cv_stream[b], dim=0)
+            assert cv_b.size(0) == n_fired[b]
+            assert torch.allclose(cv_b, cv_all[b, :n_fired[b]], atol=1e-5)
@@ -0,0 +1,189 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for criterions."""
+
+import importlib
+import math
+import pytest
+import torch
+import torch.nn.functional as F
+
+VOCAB = 50
+PAD = 3
+
+
+def _cross_entropy_lsm_ref(logits, ys, lsm_prob, ignore_index, normalize_length=False):
+    """Reference implementation materializing the target distribution."""
+    bs, _, vocab = logits.size()
+    ys = ys.view(-1)
+    logits = logits.view((-1, logits.size(2)))
+    with torch.no_grad():
+        target_dist = logits.new_zeros(logits.size())
+        target_dist.fill_(lsm_prob / (vocab - 1))
+        mask = (ys == ignore_index)
+        ys_masked = ys.masked_fill(mask, 0)
+        target_dist.scatter_(1, ys_masked.unsqueeze(1), 1 - lsm_prob)
+    log_probs = torch.log_softmax(logits, dim=-1)
+    loss_sum = -torch.mul(target_dist, log_probs)
+    n_tokens = len(ys) - mask.sum().item()
+    denom = n_tokens if normalize_length else bs
+    return loss_sum.masked_fill(mask.unsqueeze(1), 0).sum() / denom
+
+
+def _distillation_ref(logits_student, logits_teacher, ylens, temperature=5.0):
+    """Reference implementation with per-utterance reduction."""
+    bs = logits_student.size(0)
+    log_probs_student = torch.log_softmax(logits_student, dim=-1)
+    probs_teacher = torch.softmax(logits_teacher / temperature, dim=-1).data
+    loss = -torch.mul(probs_teacher, log_probs_student)
+    return sum([loss[b, :ylens[b], :].sum() for b in range(bs)]) / ylens.sum()
+
+
+def _kldiv_lsm_ctc_ref(logits, ylens):
+    """Reference implementation with per-utterance reduction."""
+    bs, _, vocab = logits.size()
+    log_uniform = logits.new_zeros(logits.size()).fill_(math.log(1 / (vocab - 1)))
+    probs = torch.softmax(logits, dim=-1)
+    log_probs = torch.log_softmax(logits, dim=-1)
+    loss = torch.mul(probs, log_probs - log_uniform)
+    return sum([loss[b, :ylens[b], :].sum() for b in range(bs)]) / ylens.sum()
+
+
+def _focal_loss_ref(logits, ys, ylens, alpha, gamma):
+    """Reference implementation with per-utterance reduction."""
+    bs = ys.size(0)
+    log_probs = torch.log_softmax(logits, dim=-1)
+    probs_inv = -torch.softmax(logits, dim=-1) + 1
+    loss = -alpha * torch.mul(torch.pow(probs_inv, gamma), log_probs)
+    return sum([loss[b, :ylens[b], :].sum() for b in range(bs)]) / ylens.sum()
+
+
+def make_inputs(batch_size=4, ymax=12):
+    ylens = torch.IntTensor([ymax - 3 * b for b in range(batch_size)])
+    logits = torch.randn(batch_size, ymax, VOCAB, requires_grad=True)
+    ys = torch.randint(4, VOCAB, (batch_size, ymax))
+    for b, ylen in enumerate(ylens.tolist()):
+        ys[b, ylen:] = PAD
+    return logits, ys, ylens
+
+
+def _check_parity(loss, loss_ref, inputs):
+    assert torch.allclose(loss, loss_ref, atol=1e-5)
+    grads = torch.autograd.grad(loss, inputs)
+    grads_ref = torch.autograd.grad(loss_ref, inputs)
+    for g, g_ref in zip(grads, grads_ref):
+        assert torch.allclose(g, g_ref, atol=1e-6)
+
+
+@pytest.mark.parametrize("vocab_chunk_size", [0, 7, VOCAB])
+def test_distillation(vocab_chunk_size):
+    module = importlib.import_module('neural_sp.models.criterion')
+    logits, _, ylens = make_inputs()
+    logits_teacher = torch.randn(logits.size())
+    loss = module.distillation(logits, logits_teacher, ylens, temperature=5.0,
+                               vocab_chunk_size=vocab_chunk_size)
+    loss_ref = _distillation_ref(logits, logits_teacher, ylens, temperature=5.0)
+    _check_parity(loss, loss_ref, [logits])
+
+
+def _saved_tensor_numel(fn, inputs):
+    """Count elements of tensors saved for backward except storages of `inputs`."""
+    input_ptrs = set(x.untyped_storage().data_ptr() for x in inputs)
+    saved = {}
+
+    def pack(x):
+        if x.untyped_storage().data_ptr() not in input_ptrs:
+            saved[x.untyped_storage().data_ptr()] = x.numel()
+        return x
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda x: x):
+        fn()
+    return sum(saved.values())
+
+
+@pytest.mark.skipif(not hasattr(getattr(torch.autograd, 'graph', None), 'saved_tensors_hooks'),
+                    reason='saved_tensors_hooks is not supported')
+@pytest.mark.parametrize("loss", ['distillation', 'kldiv_lsm_ctc', 'focal_loss'])
+def test_vocab_chunk_memory(loss):
+    """Chunking over the vocabulary keeps only per-token statistics for backward."""
+    module = importlib.import_module('neural_sp.models.criterion')
+    logits, ys, ylens = make_inputs()
+    logits_teacher = torch.randn(logits.size())
+    bs, ymax, vocab = logits.size()
+
+    def run(vocab_chunk_size):
+        if loss == 'distillation':
+            return module.distillation(logits, logits_teacher, ylens, vocab_chunk_size=vocab_chunk_size)
+        elif loss == 'kldiv_lsm_ctc':
+            return module.kldiv_lsm_ctc(logits, ylens, vocab_chunk_size=vocab_chunk_size)
+        return module.focal_loss(logits, ys, ylens, alpha=1.0, gamma=2.0, vocab_chunk_size=vocab_chunk_size)
+
+    n_full = _saved_tensor_numel(lambda: run(0), [logits, logits_teacher])
+    n_chunk = _saved_tensor_numel(lambda: run(7), [logits, logits_teacher])
+    assert n_full >= bs * ymax * vocab
+    # log-partition functions, the mask and the denominator
+    assert n_chunk <= 2 * bs * ymax + 1
+    _check_parity(run(7), run(0), [logits])
+
+
+@pytest.mark.parametrize("vocab_chunk_size", [0, 7, VOCAB])
+def test_kldiv_lsm_ctc(vocab_chunk_size):
+    module = importlib.import_module('neural_sp.models.criterion')
+    logits, _, ylens = make_inputs()
+    loss = module.kldiv_lsm_ctc(logits, ylens, vocab_chunk_size=vocab_chunk_size)
+    _check_parity(loss, _kldiv_lsm_ctc_ref(logits, ylens), [logits])
+
+
+@pytest.mark.parametrize("vocab_chunk_size", [0, 7, VOCAB])
+@pytest.mark.parametrize("gamma", [1.0, 2.0])
+def test_focal_loss(vocab_chunk_size, gamma):
+    module = importlib.import_module('neural_sp.models.criterion')
+    logits, ys, ylens = make_inputs()
+    loss = module.focal_loss(logits, ys, ylens, alpha=1.0, gamma=gamma,
+                             vocab_chunk_size=vocab_chunk_size)
+    _check_parity(loss, _focal_loss_ref(logits, ys, ylens, alpha=1.0, gamma=gamma), [logits])
+
+
+@pytest.mark.parametrize("lsm_prob", [0.0, 0.1])
+@pytest.mark.parametrize("normalize_length", [False, True])
+def test_cross_entropy_lsm(lsm_prob, normalize_length):
+    module = importlib.import_module('neural_sp.models.criterion')
+    logits, ys, ylens = make_inputs()
+    loss, ppl = module.cross_entropy_lsm(logits, ys, lsm_prob, PAD, training=True,
+                                         normalize_length=normalize_length)
+    if lsm_prob > 0:
+        loss_ref = _cross_entropy_lsm_ref(logits, ys, lsm_prob, PAD, normalize_length)
+    else:
+        loss_ref = F.cross_entropy(logits.view(-1, VOCAB), ys.view(-1), ignore_index=PAD, reduction='sum')
+        loss_ref = loss_ref / (ylens.sum() if normalize_length else logits.size(0))
+    _check_parity(loss, loss_ref, [logits])
+    assert ppl > 0
+
+
+def test_compute_accuracy():
+    module = importlib.import_module('neural_sp.models.torch_utils')
+    logits, ys, ylens = make_inputs()
+    pred = logits.argmax(-1)
+    ys[:, ::2] = pred[:, ::2]
+    for b, ylen in enumerate(ylens.tolist()):
+        ys[b, ylen:] = PAD
+    mask = ys != PAD
+    acc_ref = float((pred[mask] == ys[mask]).sum()) * 100 / float(mask.sum())
+    assert module.compute_accuracy(logits, ys, PAD) == acc_ref
+
+
+@pytest.mark.parametrize("topk", [1, 8, VOCAB])
+def test_distillation_topk(topk):
+    module = importlib.import_module('neural_sp.models.criterion')
+    logits, _, ylens = make_inputs()
+    logits_teacher = torch.randn(logits.size())
+    topk_logits, topk_ids = torch.topk(torch.log_softmax(logits_teacher, dim=-1), k=topk, dim=-1)
+    topk_logits = topk_logits.half()  # stored in float16
+    loss = module.distillation_topk(logits, topk_ids, topk_logits, ylens, temperature=5.0)
+    # the teacher distribution renormalized over the top-k classes
+    logits_teacher_topk = torch.full(logits.size(), -1e4).scatter(2, topk_ids, topk_logits.float())
+    loss_ref = _distillation_ref(logits, logits_teacher_topk, ylens, temperature=5.0)
+    _check_parity(loss, loss_ref, [logits])
+    if topk == VOCAB:
+        assert torch.allclose(loss, module.distillation(logits, logits_teacher, ylens), atol=1e-3)
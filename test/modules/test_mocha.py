@@ -4,6 +4,7 @@
 """Test for monotonic chunkwise atteniton (MoChA)."""
 
 import importlib
+import numpy as np
 import pytest
 import torch
 
@@ -174,3 +175,138 @@ def test_forward_hard(args):
         if args['chunk_size'] > 1:
             assert beta is not None
             assert beta.size() == (batch_size, args['n_heads_mono'] * args['n_heads_chunk'], 1, klen)
+
+
+def _head_synchronous_boundary_ref(alpha, eps_wait):
+    """Reference implementation of head-synchronous decoding with explicit loops."""
+    alpha = alpha.clone()
+    bs, n_heads_mono = alpha.size()[:2]
+    for b in range(bs):
+        # no boundary until the last frame for all heads
+        if alpha[b].sum() == 0:
+            continue
+
+        leftmost = alpha[b, :, -1].nonzero()[:, -1].min().item()
+        rightmost = alpha[b, :, -1].nonzero()[:, -1].max().item()
+        for h in range(n_heads_mono):
+            # no bondary at the h-th head
+            if alpha[b, h, -1].sum().item() == 0:
+                alpha[b, h, -1, min(rightmost, leftmost + eps_wait)] = 1
+                continue
+
+            # surpass acceptable latency
+            if alpha[b, h, -1].nonzero()[:, -1].min().item() >= leftmost + eps_wait:
+                alpha[b, h, -1, :] = 0  # reset
+                alpha[b, h, -1, leftmost + eps_wait] = 1
+    return alpha
+
+
+def _hard_chunkwise_attention_ref(alpha, u, mask, chunk_size, n_heads_chunk,
+                                  sharpening_factor, share_chunkwise_attention):
+    """Reference implementation of hard chunkwise attention with explicit loops."""
+    bs, n_heads_mono, qlen, klen = alpha.size()
+    alpha = alpha.unsqueeze(2)
+    u = u.unsqueeze(1)
+    if n_heads_chunk > 1:
+        alpha = alpha.repeat([1, 1, n_heads_chunk, 1, 1])
+    if n_heads_mono > 1:
+        if share_chunkwise_attention:
+            u = u.repeat([1, n_heads_mono, 1, 1, 1])
+        else:
+            u = u.view(bs, n_heads_mono, n_heads_chunk, qlen, klen)
+
+    mask = alpha.clone().byte()
+    for b in range(bs):
+        for h in range(n_heads_mono):
+            if alpha[b, h, 0, 0].sum() > 0:
+                boundary = alpha[b, h, 0, 0].nonzero()[:, -1].min().item()
+                if chunk_size == -1:
+                    mask[b, h, :, 0, 0:boundary + 1] = 1
+                else:
+                    mask[b, h, :, 0, max(0, boundary - chunk_size + 1):boundary + 1] = 1
+
+    NEG_INF = float(np.finfo(torch.tensor(0, dtype=u.dtype).numpy().dtype).min)
+    u = u.masked_fill(mask == 0, NEG_INF)
+    beta = torch.softmax(u, dim=-1)
+    return beta.view(bs, -1, qlen, klen)
+
+
+def _random_hard_alpha(batch_size, n_heads_mono, klen, p_no_boundary=0.3):
+    bd = torch.randint(0, klen, (batch_size, n_heads_mono))
+    alpha = torch.zeros(batch_size, n_heads_mono, 1, klen)
+    alpha.scatter_(-1, bd.view(batch_size, n_heads_mono, 1, 1), 1)
+    alpha *= (torch.rand(batch_size, n_heads_mono, 1, 1) > p_no_boundary).float()
+    alpha[0] = 0  # no boundary for all heads
+    return alpha
+
+
+@pytest.mark.parametrize("n_heads_mono", [1, 4, 8])
+@pytest.mark.parametrize("eps_wait", [1, 2, 8])
+def test_head_synchronous_boundary_parity(n_heads_mono, eps_wait):
+    torch.manual_seed(0)
+    module = importlib.import_module('neural_sp.models.modules.mocha')
+    alpha = _random_hard_alpha(16, n_heads_mono, 40)
+    out = module.head_synchronous_boundary(alpha, eps_wait)
+    assert torch.equal(out, _head_synchronous_boundary_ref(alpha, eps_wait))
+
+
+@pytest.mark.parametrize("chunk_size", [4, -1])
+@pytest.mark.parametrize("n_heads_mono, n_heads_chunk", [(1, 1), (4, 1), (1, 4), (4, 4)])
+@pytest.mark.parametrize("share_chunkwise_attention", [True, False])
+def test_hard_chunkwise_attention_parity(chunk_size, n_heads_mono, n_heads_chunk,
+                                         share_chunkwise_attention):
+    torch.manual_seed(0)
+    batch_size, klen = 8, 40
+    module = importlib.import_module('neural_sp.models.modules.mocha')
+    alpha = _random_hard_alpha(batch_size, n_heads_mono, klen)
+    n_heads_u = n_heads_chunk if share_chunkwise_attention else n_heads_mono * n_heads_chunk
+    u = torch.randn(batch_size, n_heads_u, 1, klen)
+    beta = module.hard_chunkwise_attention(alpha, u.clone(), None, chunk_size, n_heads_chunk,
+                                           1.0, share_chunkwise_attention)
+    beta_ref = _hard_chunkwise_attention_ref(alpha, u.clone(), None, chunk_size, n_heads_chunk,
+                                             1.0, share_chunkwise_attention)
+    assert torch.allclose(beta, beta_ref)
+
+
+def test_register_key_prev_tail():
+    args = make_args(chunk_size=4, n_heads_mono=1, n_heads_chunk=1)
+    module = importlib.import_module('neural_sp.models.modules.mocha')
+    mocha = module.MoChA(**args)
+    mocha.eval()
+
+    history = []
+    for seg_len in [5, 1, 2, 6, 1]:
+        key = torch.randn(2, seg_len, args['kdim'])
+        mocha.register_key_prev_tail(key)
+        history.append(key)
+        n_tail = min(args['chunk_size'] - 1, sum(h.size(1) for h in history))
+        # all utterances in the mini-batch are kept
+        assert torch.equal(mocha.key_prev_tail, torch.cat(history, dim=1)[:, -n_tail:])
+
+        # the tail is prepended to the key of the next segment
+        query = torch.randn(2, 1, args['qdim'])
+        with torch.no_grad():
+            cv, alpha, beta, _ = mocha(key, key, query, mask=None, mode='hard')
+        assert beta.size(3) == seg_len + n_tail
+
+    mocha.reset()
+    assert mocha.key_prev_tail is None
+
+
+def test_prepend_key_tail():
+    args = make_args(chunk_size=4, n_heads_mono=1, n_heads_chunk=1)
+    module = importlib.import_module('neural_sp.models.modules.mocha')
+    mocha = module.MoChA(**args)
+    mocha.register_key_prev_tail(torch.randn(2, 5, args['kdim']))
+    tail = mocha.key_prev_tail.clone()
+
+    x1, x2 = torch.randn(2, 3, args['kdim']), torch.randn(2, 3, args['kdim'])
+    out1 = mocha._prepend_key_tail(x1)
+    out2 = mocha._prepend_key_tail(x2)
+    # outputs are not overwritten by the following calls
+    assert torch.equal(out1, torch.cat([tail, x1], dim=1))
+    assert torch.equal(out2, torch.cat([tail, x2], dim=1))
+
+    # hypotheses in beam search share the tail of the first utterance
+    x3 = torch.randn(4, 3, args['kdim'])
+    assert torch.equal(mocha._prepend_key_tail(x3), torch.cat([tail[0:1].expand(4, -1, -1), x3], dim=1))
@@ -0,0 +1,263 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for checkpoint saving."""
+
+import importlib
+import os
+import pytest
+import torch
+
+from neural_sp.trainers.lr_scheduler import LRScheduler
+from neural_sp.trainers.optimizer import set_optimizer
+
+
+class Wrapper(torch.nn.Module):
+    """Mimic CustomDataParallel."""
+
+    def __init__(self, module):
+        super(Wrapper, self).__init__()
+        self.module = module
+
+
+def build_model(seed=1):
+    torch.manual_seed(seed)
+    model = torch.nn.Sequential(torch.nn.Linear(8, 16), torch.nn.BatchNorm1d(16), torch.nn.Linear(16, 4))
+    model(torch.randn(3, 8))  # update running statistics and num_batches_tracked
+    return Wrapper(model)
+
+
+def build_scheduler(model, async_save, sharded, topk=1):
+    module = importlib.import_module('neural_sp.trainers.checkpoint')
+    optimizer = set_optimizer(model, 'adam', 1e-3, 0)
+    return LRScheduler(optimizer, 1e-3, decay_type='always', decay_start_epoch=100, decay_rate=0.5,
+                       save_checkpoints_topk=topk,
+                       checkpoint_manager=module.CheckpointManager(async_save=async_save, sharded=sharded))
+
+
+def assert_state_dict_equal(state_dict, state_dict_ref):
+    assert list(state_dict.keys()) == list(state_dict_ref.keys())
+    for k, v in state_dict_ref.items():
+        assert state_dict[k].dtype == v.dtype, k
+        assert torch.equal(state_dict[k], v), k
+
+
+@pytest.mark.parametrize("async_save", [True, False])
+@pytest.mark.parametrize("sharded", [True, False])
+def test_save_load(tmp_path, async_save, sharded):
+    module = importlib.import_module('neural_sp.trainers.checkpoint')
+    model = build_model()
+    scheduler = build_scheduler(model, async_save, sharded)
+    scheduler.epoch()
+    scheduler.save_checkpoint(model, str(tmp_path))
+    state_dict_ref = {k: v.clone() for k, v in model.module.state_dict().items()}
+
+    # parameters updated during writing must not be saved
+    with torch.no_grad():
+        for p in model.parameters():
+            p.add_(1.)
+    scheduler.checkpoint_manager.wait()
+
+    model_path = str(tmp_path / 'model.epoch-1')
+    assert os.path.isdir(model_path) == sharded
+    assert sorted(os.listdir(str(tmp_path))) == ['model.epoch-1']  # no temporary files
+
+    checkpoint = module.load_checkpoint_file(model_path)
+    assert_state_dict_equal(checkpoint['model_state_dict'], state_dict_ref)
+    assert checkpoint['optimizer_state_dict']['_epoch'] == 1
+    assert dict(module.iterate_model_state(model_path)).keys() == state_dict_ref.keys()
+    assert_state_dict_equal(dict(module.iterate_model_state(model_path)), state_dict_ref)
+
+    # resume
+    train_utils = importlib.import_module('neural_sp.bin.train_utils')
+    model_new = build_model(seed=2)
+    scheduler_new = build_scheduler(model_new, async_save, sharded)
+    train_utils.load_checkpoint(model_path, model_new.module, scheduler_new)
+    assert_state_dict_equal(model_new.module.state_dict(), state_dict_ref)
+    assert scheduler_new.n_epochs == 1
+    assert scheduler_new.checkpoint_manager is not scheduler.checkpoint_manager
+
+
+@pytest.mark.parametrize("async_save", [True, False])
+@pytest.mark.parametrize("sharded", [True, False])
+def test_remove_old_checkpoints(tmp_path, async_save, sharded):
+    model = build_model()
+    scheduler = build_scheduler(model, async_save, sharded, topk=2)
+    # the 1st and 3rd epochs are the best
+    for metric in [1., 3., 2., 4.]:
+        scheduler.epoch(metric)
+        scheduler.save_checkpoint(model, str(tmp_path), remove_old=True)
+        # the latest checkpoint is kept until the next one is saved
+        scheduler.checkpoint_manager.wait()
+        keep = set(['model.epoch-%d' % ep for ep, _ in scheduler.topk_list])
+        keep.add('model.epoch-%d' % scheduler.n_epochs)
+        assert sorted(os.listdir(str(tmp_path))) == sorted(keep)
+    assert scheduler.checkpoint_manager.blocked_time > 0
+
+
+def test_write_error(tmp_path):
+    model = build_model()
+    scheduler = build_scheduler(model, async_save=True, sharded=False)
+    scheduler.epoch()
+    scheduler.save_checkpoint(model, str(tmp_path / 'not_exist'))
+    with pytest.raises(Exception):
+        scheduler.checkpoint_manager.wait()
+    # the error is raised only once
+    scheduler.checkpoint_manager.wait()
+
+
+@pytest.mark.parametrize("sharded", [True, False])
+def test_average_checkpoints(tmp_path, sharded):
+    eval_utils = importlib.import_module('neural_sp.bin.eval_utils')
+    module = importlib.import_module('neural_sp.trainers.checkpoint')
+    state_dicts = []
+    for ep in range(1, 4):
+        model = build_model(seed=ep)
+        state_dicts.append(model.module.state_dict())
+        module.save_checkpoint_file({'model_state_dict': model.module.state_dict()},
+                                    str(tmp_path / ('model.epoch-%d' % ep)), sharded=sharded)
+
+    model = build_model(seed=4).module
+    eval_utils.average_checkpoints(model, str(tmp_path / 'model.epoch-3'), n_average=3)
+    for k, v in model.state_dict().items():
+        if v.is_floating_point():
+            v_ref = sum(state_dict[k] for state_dict in state_dicts) / 3
+            assert torch.allclose(v, v_ref, atol=1e-6), k
+        else:
+            assert torch.equal(v, state_dicts[-1][k]), k
+    assert os.path.exists(str(tmp_path / 'model-avg3'))
+
+
+def test_average_checkpoints_not_lazy(tmp_path, monkeypatch):
+    eval_utils = importlib.import_module('neural_sp.bin.eval_utils')
+    module = importlib.import_module('neural_sp.trainers.checkpoint')
+    checkpoint_paths, state_dicts = [], []
+    for ep in range(1, 4):
+        model = build_model(seed=ep)
+        state_dicts.append(model.module.state_dict())
+        checkpoint_paths.append(str(tmp_path / ('model.epoch-%d' % ep)))
+        module.save_checkpoint_file({'model_state_dict': model.module.state_dict()}, checkpoint_paths[-1])
+
+    # checkpoints are loaded one at a time without memory mapping
+    monkeypatch.setattr(module, 'MMAP', False)
+    n_loaded = []
+
+    def iterate_model_state_logged(model_path):
+        n_loaded.append(0)
+        for k, v in module.iterate_model_state(model_path):
+            n_loaded[-1] += 1
+            assert all(n == len(state_dicts[0]) for n in n_loaded[:-1])
+            yield k, v
+
+    monkeypatch.setattr(eval_utils, 'iterate_model_state', iterate_model_state_logged)
+    avg_path = str(tmp_path / 'model-avg3')
+    eval_utils.average_model_states(checkpoint_paths, avg_path)
+    assert len(n_loaded) == 3
+    for k, v in module.iterate_model_state(avg_path):
+        assert v.dtype == state_dicts[0][k].dtype
+        if v.is_floating_point():
+            v_ref = (sum(state_dict[k].double() for state_dict in state_dicts) / 3).float()
+            assert torch.equal(v, v_ref), k
+        else:
+            assert torch.equal(v, state_dicts[0][k]), k
+
+
+def test_average_checkpoints_cli(tmp_path, monkeypatch):
+    eval_utils = importlib.import_module('neural_sp.bin.eval_utils')
+    cli = importlib.import_module('neural_sp.bin.average_checkpoints')
+    module = importlib.import_module('neural_sp.trainers.checkpoint')
+    model = build_model()
+    scheduler = build_scheduler(model, async_save=False, sharded=False, topk=2)
+    state_dicts = {}
+    # the 1st and 3rd epochs are the best
+    for metric in [1., 3., 2.]:
+        with torch.no_grad():
+            for p in model.parameters():
+                p.add_(torch.randn_like(p))
+        scheduler.epoch(metric)
+        scheduler.save_checkpoint(model, str(tmp_path))
+        state_dicts[scheduler.n_epochs] = {k: v.clone() for k, v in model.module.state_dict().items()}
+
+    avg_path = cli.main(['--recog_model', str(tmp_path / 'model.epoch-1'),
+                         '--recog_n_average', '2', '--use_topk', 'true'])
+    assert module.load_checkpoint_meta(avg_path)['averaged_checkpoints'] == ['model.epoch-1', 'model.epoch-3']
+    state_dict_avg = dict(module.iterate_model_state(avg_path))
+    for k, v in state_dict_avg.items():
+        assert v.dtype == state_dicts[1][k].dtype
+        if v.is_floating_point():
+            v_ref = ((state_dicts[1][k].double() + state_dicts[3][k].double()) / 2).float()
+            assert torch.equal(v, v_ref), k
+
+    # the averaged checkpoint is reused in evaluation only for the same checkpoints
+    average_model_states = eval_utils.average_model_states
+    averaged = []
+
+    def average_model_states_logged(checkpoint_paths, checkpoint_avg_path):
+        averaged.append([os.path.basename(path) for path in checkpoint_paths])
+        average_model_states(checkpoint_paths, checkpoint_avg_path)
+
+    monkeypatch.setattr(eval_utils, 'average_model_states', average_model_states_logged)
+    topk_list = module.load_checkpoint_meta(str(tmp_path / 'model.epoch-3'))['optimizer_state_dict']['topk_list']
+    model_new = build_model(seed=2).module
+    eval_utils.average_checkpoints(model_new, str(tmp_path / 'model.epoch-1'), n_average=2,
+                                   topk_list=topk_list)
+    assert averaged == []
+    assert_state_dict_equal(model_new.state_dict(), state_dict_avg)
+
+    # the same checkpoints in a different order
+    eval_utils.average_checkpoints(model_new, str(tmp_path / 'model.epoch-3'), n_average=2)
+    assert averaged == []
+
+    # the latest checkpoints include the best one but differ from the top-k ones
+    module.save_checkpoint_file({'model_state_dict': state_dicts[2]}, str(tmp_path / 'model.epoch-2'))
+    eval_utils.average_checkpoints(model_new, str(tmp_path / 'model.epoch-3'), n_average=2)
+    assert averaged == [['model.epoch-3', 'model.epoch-2']]
+    assert module.load_checkpoint_meta(avg_path)['averaged_checkpoints'] == ['model.epoch-3', 'model.epoch-2']
+    eval_utils.average_checkpoints(model_new, str(tmp_path / 'model.epoch-3'), n_average=2)
+    assert len(averaged) == 1
+
+
+@pytest.mark.parametrize("sharded", [True, False])
+def test_latest_checkpoint(tmp_path, sharded):
+    module = importlib.import_module('neural_sp.trainers.checkpoint')
+    train_utils = importlib.import_module('neural_sp.bin.train_utils')
+    model = build_model()
+    scheduler = build_scheduler(model, async_save=True, sharded=sharded)
+    for metric in [2., 1.]:
+        # saved in the middle of the epoch
+        scheduler.save_checkpoint(model, str(tmp_path), remove_old=False, model_name='model.latest')
+        scheduler.epoch(metric)
+        scheduler.save_checkpoint(model, str(tmp_path), remove_old=True)
+    scheduler.checkpoint_manager.wait()
+    # the latest checkpoint is not removed
+    assert sorted(os.listdir(str(tmp_path))) == ['model.epoch-2', 'model.latest']
+
+    model_path = str(tmp_path / 'model.latest')
+    assert module.load_checkpoint_meta(model_path)['optimizer_state_dict']['_epoch'] == 1
+    model_new = build_model(seed=2)
+    scheduler_new = build_scheduler(model_new, async_save=True, sharded=sharded)
+    train_utils.load_checkpoint(model_path, model_new.module, scheduler_new)
+    assert_state_dict_equal(model_new.module.state_dict(), model.module.state_dict())
+    assert scheduler_new.n_epochs == 1
+
+
+def test_snapshot_metadata():
+    module = importlib.import_module('neural_sp.trainers.checkpoint')
+    state_dict = build_model().module.state_dict()
+    state_dict_copy = module.snapshot(state_dict)
+    assert state_dict_copy._metadata == state_dict._metadata
+    assert state_dict_copy._metadata is not state_dict._metadata
+    assert_state_dict_equal(state_dict_copy, state_dict)
+
+
+@pytest.mark.parametrize("sharded_prev", [True, False])
+def test_overwrite(tmp_path, sharded_prev):
+    module = importlib.import_module('neural_sp.trainers.checkpoint')
+    model_path = str(tmp_path / 'model.latest')
+    module.save_checkpoint_file({'model_state_dict': build_model(seed=1).module.state_dict()},
+                                model_path, sharded=sharded_prev)
+    state_dict = build_model(seed=2).module.state_dict()
+    module.save_checkpoint_file({'model_state_dict': state_dict}, model_path, sharded=False)
+    assert os.path.isfile(model_path)
+    assert sorted(os.listdir(str(tmp_path))) == ['model.latest']
+    assert_state_dict_equal(module.load_checkpoint_file(model_path)['model_state_dict'], state_dict)
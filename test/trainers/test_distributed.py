@@ -0,0 +1,154 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for distributed training."""
+
+import importlib
+import numpy as np
+import os
+import pandas as pd
+import pytest
+import sys
+import torch
+import torch.multiprocessing as mp
+
+from neural_sp.models.torch_utils import np2tensor
+from neural_sp.models.torch_utils import pad_list
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'decoders'))
+from test_transformer_decoder import ENC_N_UNITS, VOCAB, make_args  # noqa: E402
+
+WORLD_SIZE = 2
+
+
+def make_df(n_utts):
+    xlens = np.random.randint(10, 2000, n_utts)
+    df = pd.DataFrame({'xlen': np.sort(xlens), 'ylen': np.random.randint(1, 100, n_utts)})
+    return df
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'batch_size': 4}),
+        ({'batch_size': 5}),
+        ({'batch_size': 8, 'dynamic_batching': True}),
+        ({'batch_size': 4, 'shuffle_bucket': True}),
+        ({'batch_size': 8, 'dynamic_batching': True, 'shuffle_bucket': True}),
+    ]
+)
+def test_sharded_sampler(args):
+    module = importlib.import_module('neural_sp.datasets.asr')
+    df = make_df(39)
+
+    def build(rank, world_size):
+        kwargs = dict(batch_size=4, dynamic_batching=False, shuffle_bucket=False,
+                      discourse_aware=False, sort_stop_epoch=1e10)
+        kwargs.update(args)
+        return module.CustomBatchSampler(df.copy(), rank=rank, world_size=world_size, **kwargs)
+
+    def sample_epoch(sampler):
+        batches = []
+        is_new_epoch = False
+        while not is_new_epoch:
+            indices, is_new_epoch = sampler.sample_index(None)
+            batches.append(indices)
+        return batches
+
+    batches = sample_epoch(build(0, 1))
+    shards = [sample_epoch(build(rank, WORLD_SIZE)) for rank in range(WORLD_SIZE)]
+    # the same number of steps in all processes
+    for shards_rank in shards:
+        assert len(shards_rank) == len(batches)
+    # every mini-batch is split over processes
+    for i, indices in enumerate(batches):
+        indices_shards = sum([shards_rank[i] for shards_rank in shards], [])
+        if len(indices) < WORLD_SIZE:
+            # utterances are repeated so that every process has at least one
+            assert sorted(set(indices_shards)) == sorted(indices)
+            continue
+        assert sorted(indices_shards) == sorted(indices)
+        sizes = [len(shards_rank[i]) for shards_rank in shards]
+        assert max(sizes) - min(sizes) <= 1
+
+
+def make_batch(batch_size, seed):
+    rng = np.random.RandomState(seed)
+    eouts = rng.randn(batch_size, 20, ENC_N_UNITS).astype(np.float32)
+    elens = torch.IntTensor([len(x) for x in eouts])
+    eouts = pad_list([np2tensor(x).float() for x in eouts], 0.)
+    ys = [rng.randint(4, VOCAB, rng.randint(3, 8)).astype(np.int32) for _ in range(batch_size)]
+    return eouts, elens, ys
+
+
+def build_decoder():
+    torch.manual_seed(1)
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.transformer')
+    return module.TransformerDecoder(**make_args(ctc_weight=0.5, dropout=0., dropout_emb=0.,
+                                                 dropout_att=0.))
+
+
+def accumulate_grads(model, tasks, accum_grad_n_steps, rank=0, world_size=1):
+    """Mimic the training loop in bin/asr/train.py without parameter update."""
+    maybe_no_sync = importlib.import_module('neural_sp.trainers.distributed').maybe_no_sync
+    accum_n_steps = 0
+    for step in range(accum_grad_n_steps):
+        eouts, elens, ys = make_batch(4, seed=step)
+        eouts, elens, ys = eouts[rank::world_size], elens[rank::world_size], ys[rank::world_size]
+        accum_n_steps += 1
+        is_update_step = accum_n_steps >= accum_grad_n_steps
+        for i_task, task in enumerate(tasks):
+            with maybe_no_sync(model, is_update_step and i_task == len(tasks) - 1):
+                loss, _ = model(eouts, elens, ys, task=task)
+                (loss / accum_grad_n_steps).backward()
+    return {n: p.grad.clone() for n, p in model.named_parameters() if p.grad is not None}
+
+
+def _ddp_worker(rank, world_size, tasks, accum_grad_n_steps, save_path):
+    os.environ['RANK'] = str(rank)
+    os.environ['LOCAL_RANK'] = str(rank)
+    os.environ['WORLD_SIZE'] = str(world_size)
+    module = importlib.import_module('neural_sp.trainers.distributed')
+    module.init_process_group(n_gpus=0)
+    data_parallel = importlib.import_module('neural_sp.models.data_parallel')
+    model = data_parallel.CustomDistributedDataParallel(build_decoder())
+    grads = accumulate_grads(model, tasks, accum_grad_n_steps, rank, world_size)
+    grads = {n.replace('module.', '', 1): g for n, g in grads.items()}
+    observation = module.all_reduce_observation({'loss.att': float(rank), 'loss.ctc': None})
+    # accumulated over steps and reduced at once
+    obsv_buffer = module.ObservationBuffer()
+    for step in range(3):
+        obsv_buffer.add({'loss.att': float(rank + step), 'loss.ctc': float(rank) if step == 0 else None,
+                         'acc.att': float('nan')})
+    observation_buffered = obsv_buffer.reduce()
+    torch.save({'grads': grads, 'observation': observation,
+                'observation_buffered': observation_buffered}, save_path + '.%d' % rank)
+    module.cleanup()
+
+
+@pytest.mark.parametrize(
+    "tasks, accum_grad_n_steps",
+    [
+        (['all'], 1),
+        (['all'], 2),
+        (['ys.ctc', 'ys'], 1),
+        (['ys.ctc', 'ys'], 2),
+    ]
+)
+def test_ddp_gradients(tmp_path, tasks, accum_grad_n_steps):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(importlib.import_module(
+        'neural_sp.trainers.distributed')._find_free_port())
+    save_path = str(tmp_path / 'grads')
+    mp.spawn(_ddp_worker, args=(WORLD_SIZE, tasks, accum_grad_n_steps, save_path),
+             nprocs=WORLD_SIZE, join=True)
+
+    grads_ref = accumulate_grads(build_decoder(), tasks, accum_grad_n_steps)
+    for rank in range(WORLD_SIZE):
+        results = torch.load(save_path + '.%d' % rank)
+        grads = results['grads']
+        assert sorted(grads.keys()) == sorted(grads_ref.keys())
+        for n, g in grads.items():
+            assert torch.allclose(g, grads_ref[n], atol=1e-5), n
+        assert results['observation'] == {'loss.att': 0.5, 'loss.ctc': None}
+        assert results['observation_buffered'] == {'loss.att': 1.5, 'loss.ctc': 0.5, 'acc.att': None}
@@ -0,0 +1,139 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for mixed precision training."""
+
+import importlib
+import numpy as np
+import pytest
+import torch
+
+from neural_sp.models.torch_utils import np2tensor
+from neural_sp.models.torch_utils import pad_list
+from neural_sp.trainers.lr_scheduler import LRScheduler
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'decoders'))
+from test_transformer_decoder import ENC_N_UNITS, VOCAB, make_args  # noqa: E402
+
+
+def make_batch(batch_size=4, emax=40):
+    eouts = np.random.randn(batch_size, emax, ENC_N_UNITS).astype(np.float32)
+    elens = torch.IntTensor([len(x) for x in eouts])
+    eouts = pad_list([np2tensor(x, 'cpu').float() for x in eouts], 0.)
+    ylens = [4, 5, 3, 7]
+    ys = [np.random.randint(0, VOCAB, ylen).astype(np.int32) for ylen in ylens]
+    return eouts, elens, ys
+
+
+@pytest.mark.parametrize(
+    "train_dtype, dtype",
+    [
+        ('fp32', torch.float32),
+        ('float32', torch.float32),
+        ('fp16', torch.float16),
+        ('float16', torch.float16),
+        ('bf16', torch.bfloat16),
+        ('O0', torch.float32),
+        ('O1', torch.float16),
+        ('float64', torch.float32),
+    ]
+)
+def test_parse_train_dtype(train_dtype, dtype):
+    module = importlib.import_module('neural_sp.trainers.precision')
+    assert module.parse_train_dtype(train_dtype) == dtype
+
+
+@pytest.mark.parametrize(
+    "train_dtype, suffix",
+    [
+        ('float32', ''),
+        ('fp32', ''),
+        ('float16', ''),
+        ('float64', ''),
+        ('O0', '_O0'),
+        ('O1', '_O1'),
+        ('fp16', '_fp16'),
+        ('bf16', '_bf16'),
+        ('bfloat16', '_bf16'),
+    ]
+)
+def test_train_dtype_suffix(train_dtype, suffix):
+    # directory names of old experiments are kept
+    module = importlib.import_module('neural_sp.trainers.precision')
+    assert module.train_dtype_suffix(train_dtype) == suffix
+
+
+def test_autocast_fallback(monkeypatch):
+    module = importlib.import_module('neural_sp.trainers.precision')
+    # torch<1.10 does not have torch.autocast
+    monkeypatch.delattr(torch, 'autocast')
+    amp = module.MixedPrecision('fp32', 'cpu')
+    for _ in range(2):
+        with amp.autocast():
+            assert torch.matmul(torch.ones(2, 2), torch.ones(2, 2)).dtype == torch.float32
+    with pytest.raises(ValueError):
+        module.MixedPrecision('bf16', 'cpu')
+
+
+@pytest.mark.parametrize(
+    "train_dtype, args",
+    [
+        ('fp32', {'ctc_weight': 0.5}),
+        ('bf16', {'ctc_weight': 0.5}),
+        ('bf16', {'ctc_weight': 0.5, 'lsm_prob': 0.1}),
+        ('bf16', {'ctc_weight': 1.0}),
+        ('bf16', {'attn_type': 'mocha', 'mma_chunk_size': 4, 'mma_n_heads_mono': 4, 'mma_n_heads_chunk': 1}),
+    ]
+)
+def test_train_step(train_dtype, args):
+    torch.manual_seed(1)
+    module = importlib.import_module('neural_sp.trainers.precision')
+    amp = module.MixedPrecision(train_dtype, 'cpu')
+    assert not amp.scaler.is_enabled()
+
+    dec_module = importlib.import_module('neural_sp.models.seq2seq.decoders.transformer')
+    dec = dec_module.TransformerDecoder(**make_args(**args))
+    scheduler = LRScheduler(torch.optim.Adam(dec.parameters(), lr=1e-3), 1e-3,
+                            decay_type='always', decay_start_epoch=1, decay_rate=0.5)
+    params_prev = [p.detach().clone() for p in dec.parameters()]
+
+    eouts, elens, ys = make_batch()
+    with amp.autocast():
+        loss, observation = dec(eouts, elens, ys, task='all')
+    # losses are accumulated in float32 regardless of the training dtype
+    assert loss.dtype == torch.float32
+    assert torch.isfinite(loss).all()
+    amp.backward(loss)
+    amp.unscale_(scheduler.optimizer)
+    for p in dec.parameters():
+        if p.grad is not None:
+            assert p.grad.dtype == torch.float32
+            assert torch.isfinite(p.grad).all()
+    amp.step(scheduler)
+    assert scheduler.n_steps == 1
+    assert any(not torch.equal(p, p_prev) for p, p_prev in zip(dec.parameters(), params_prev))
+
+
+def test_grad_scaler_state():
+    module = importlib.import_module('neural_sp.trainers.precision')
+    amp = module.MixedPrecision('fp16', 'cpu')
+    assert amp.scaler.is_enabled()
+
+    param = torch.nn.Parameter(torch.ones(4))
+    scheduler = LRScheduler(torch.optim.SGD([param], lr=0.1), 0.1,
+                            decay_type='always', decay_start_epoch=1, decay_rate=0.5)
+    # inf gradients: the update is skipped and the loss scale is reduced
+    amp.backward((param * float('inf')).sum())
+    amp.step(scheduler)
+    assert torch.equal(param, torch.ones(4))
+    scale = amp.state_dict()['scale']
+    assert scale < 2. ** 16
+
+    amp_new = module.MixedPrecision('fp16', 'cpu')
+    amp_new.load_state_dict(amp.state_dict())
+    assert amp_new.state_dict()['scale'] == scale
+    # states saved by apex are ignored
+    amp_new.load_state_dict({'loss_scaler0': {'loss_scale': 1.0}})
+    assert amp_new.state_dict()['scale'] == scale
@@ -0,0 +1,124 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for profilers."""
+
+import importlib
+import logging
+import os
+import pytest
+import time
+import torch
+
+
+class Decoder(torch.nn.Module):
+
+    def __init__(self):
+        super(Decoder, self).__init__()
+        self.output = torch.nn.Linear(4, 4)
+        self.ctc = torch.nn.Linear(4, 2)
+
+    def forward(self, eouts):
+        return self.output(eouts).sum() + self.ctc(eouts).sum()
+
+
+def build_model():
+    model = torch.nn.Module()
+    model.enc = torch.nn.Linear(4, 4)
+    model.dec_fwd = Decoder()
+    return model
+
+
+def train_step(model, scope):
+    with scope('data'):
+        xs = torch.randn(2, 4)
+    with scope('forward'):
+        loss = model.dec_fwd(model.enc(xs))
+    with scope('backward'):
+        loss.backward()
+
+
+def test_scope_disabled():
+    module = importlib.import_module('neural_sp.trainers.profiler')
+    # no overhead of timing when disabled
+    assert module.scope('forward') is module.scope('backward')
+    profiler = module.Profiler('none')
+    profiler.start()
+    train_step(build_model(), module.scope)
+    profiler.report()
+    profiler.stop()
+
+
+def test_phase_timer(caplog):
+    module = importlib.import_module('neural_sp.trainers.profiler')
+    model = build_model()
+    profiler = module.Profiler('none', timing=True)
+    profiler.add_module_scopes(model, ['enc', 'dec_fwd', 'dec_fwd.ctc', 'dec_bwd'])
+    profiler.start()
+    for _ in range(3):
+        train_step(model, module.scope)
+    for _ in module.timed_iter(range(4)):
+        pass
+    timer = profiler.timer
+    # NOTE: the last fetch raising StopIteration is also measured
+    assert dict(timer.counts) == {'data': 3 + 5, 'forward': 3, 'forward/enc': 3,
+                                  'forward/dec_fwd': 3, 'forward/dec_fwd/ctc': 3, 'backward': 3}
+    assert timer.elapsed['forward/enc'] <= timer.elapsed['forward']
+    with caplog.at_level(logging.INFO):
+        profiler.report()
+    assert 'Time breakdown' in caplog.text
+    assert len(timer.elapsed) == 0  # reset
+    profiler.stop()
+    assert module.scope('forward') is module._null_scope
+
+
+def test_module_scope_exception():
+    module = importlib.import_module('neural_sp.trainers.profiler')
+    model = build_model()
+    profiler = module.Profiler('none', timing=True)
+    profiler.add_module_scopes(model, ['enc'])
+    profiler.start()
+    with pytest.raises(RuntimeError):
+        with module.scope('forward'):
+            model.enc(torch.randn(2, 3))  # shape mismatch
+    timer = profiler.timer
+    assert timer._stack == []
+    with module.scope('forward'):
+        model.enc(torch.randn(2, 4))
+    assert dict(timer.counts) == {'forward': 2, 'forward/enc': 2}
+    profiler.stop()
+
+
+def busy_wait(duration):
+    start_time = time.time()
+    while time.time() - start_time < duration:
+        pass
+
+
+def test_sampling_profiler(tmp_path):
+    module = importlib.import_module('neural_sp.trainers.profiler')
+    profiler = module.Profiler('sampling', str(tmp_path), sampling_interval=0.001)
+    profiler.start()
+    busy_wait(0.3)
+    profiler.stop()
+    with open(str(tmp_path / 'train.sampling.txt')) as f:
+        stacks = [line.rsplit(' ', 1) for line in f]
+    assert len(stacks) > 0
+    n_busy = sum(int(count) for stack, count in stacks if 'busy_wait' in stack)
+    assert n_busy >= sum(int(count) for _, count in stacks) // 2
+
+
+@pytest.mark.parametrize("mode, filename", [('torch', 'train.trace.json'), ('cprofile', 'train.profile')])
+def test_profiler(tmp_path, mode, filename):
+    module = importlib.import_module('neural_sp.trainers.profiler')
+    model = build_model()
+    profiler = module.Profiler(mode, str(tmp_path), timing=True, start_step=2, n_steps=2)
+    profiler.start()
+    for _ in range(5):
+        train_step(model, module.scope)
+        profiler.step()
+    profiler.stop()
+    assert os.path.isfile(str(tmp_path / filename))
+    if mode == 'torch':
+        with open(str(tmp_path / filename)) as f:
+            assert 'forward' in f.read()  # named scopes are recorded in the trace
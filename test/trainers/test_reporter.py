@@ -0,0 +1,82 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for reporter."""
+
+from glob import glob
+import importlib
+import os
+import pytest
+import struct
+import torch
+
+from tensorboardX.proto import event_pb2
+
+
+def read_scalars(save_path):
+    """Read scalars from tensorboard event files (TFRecord format)."""
+    scalars = {}
+    for path in sorted(glob(os.path.join(save_path, 'events.out.tfevents.*'))):
+        with open(path, 'rb') as f:
+            while True:
+                header = f.read(12)  # length (uint64) and its CRC (uint32)
+                if len(header) < 12:
+                    break
+                length = struct.unpack('<Q', header[:8])[0]
+                event = event_pb2.Event.FromString(f.read(length))
+                f.read(4)  # CRC of data
+                for v in event.summary.value:
+                    scalars.setdefault(v.tag, []).append((event.step, v.simple_value))
+    return scalars
+
+
+def run(reporter, n_steps, print_step):
+    for step in range(n_steps):
+        reporter.add({'loss.att': float(step), 'acc.att': 0.5, 'loss.ctc': None})
+        reporter.add_tensorboard_scalar('total_norm', torch.tensor(float(step * 2)))
+        reporter.add_tensorboard_scalar('learning_rate', 1e-3)
+        reporter.step()
+        if (step + 1) % print_step == 0:
+            reporter.add({'loss.att': 1., 'acc.att': 0.4}, is_eval=True)
+            reporter.step(is_eval=True)
+            reporter.snapshot()
+    reporter.epoch(10., name='wer')
+    reporter.close()
+
+
+@pytest.mark.parametrize(
+    "flush_steps, async_plot",
+    [
+        (1, False),
+        (7, False),
+        (100, True),
+    ]
+)
+def test_reporter(tmp_path, flush_steps, async_plot):
+    module = importlib.import_module('neural_sp.trainers.reporter')
+    save_path = str(tmp_path)
+    n_steps, print_step = 20, 5
+    reporter = module.Reporter(save_path, flush_steps=flush_steps, async_plot=async_plot)
+    run(reporter, n_steps, print_step)
+    assert reporter.overhead > 0
+
+    # every scalar is written with its original step
+    scalars = read_scalars(save_path)
+    assert [v for _, v in scalars['total_norm']] == [float(step * 2) for step in range(n_steps)]
+    assert [step for step, _ in scalars['total_norm']] == \
+        [step + step // print_step for step in range(n_steps)]
+    assert len(scalars['learning_rate']) == n_steps
+    assert len(scalars['train/loss/att']) == n_steps
+    assert len(scalars['dev/loss/att']) == n_steps // print_step
+
+    # figures and CSV files are written before close() returns
+    for name in ['loss.png', 'acc.png', 'loss-att.csv', 'acc-att.csv', 'wer.png']:
+        assert os.path.isfile(os.path.join(save_path, name)), name
+
+
+def test_reporter_disabled(tmp_path):
+    module = importlib.import_module('neural_sp.trainers.reporter')
+    save_path = str(tmp_path / 'not_exist')
+    reporter = module.Reporter(save_path, enabled=False)
+    run(reporter, 10, 5)
+    assert not os.path.exists(save_path)
@@ -0,0 +1,35 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Split a dataset tsv file into memory-mapped token shards for LM training."""
+
+import argparse
+import logging
+
+from neural_sp.datasets.lm_shard import make_shards
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--tsv', type=str,
+                    help='dataset tsv file')
+parser.add_argument('--dict', type=str,
+                    help='dictionary file')
+parser.add_argument('--save_dir', type=str,
+                    help='directory to save shards')
+parser.add_argument('--shard_size', type=int, default=10000000,
+                    help='number of tokens per shard')
+parser.add_argument('--min_n_tokens', type=int, default=1,
+                    help='exclude utterances shorter than this value')
+args = parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    make_shards(args.tsv, args.dict, args.save_dir,
+                shard_size=args.shard_size, min_n_tokens=args.min_n_tokens)
+
+
+if __name__ == '__main__':
+    main()